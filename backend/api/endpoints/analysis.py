@@ -1,27 +1,40 @@
-from fastapi import APIRouter, Body, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Body, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
 from celery.result import AsyncResult
 from backend.tasks.analysis import analyze_question_task, perform_analysis_sync
-from backend.tasks.analysis import analyze_question_task, analyze_single_model_task, perform_analysis_sync, perform_single_model_analysis
-from backend.celery_app import celery_app
+from backend.tasks.analysis import analyze_question_task, analyze_single_model_task, perform_analysis_sync, perform_single_model_analysis, perform_single_model_analysis_async
+from backend.tasks.analysis import analyze_batch_task, perform_batch_analysis_async, resolve_batch_size
+from backend.celery_app import celery_app, send_task_spec
+from backend.services import events
+from backend.services.jobs import job_store
+from backend.services.task_status import status_coalescer
+from backend.services.task_store import task_store
+from backend.services.checkpoints import checkpoint_store, is_completed
+from backend.services.token_budget import submission_estimate, project_completion
+from backend.services.task_queues import QUEUE_INTERACTIVE, QUEUE_PRIORITIES
+from backend.services.fair_scheduler import fair_scheduler, DispatchError
+from backend.services.local_runner import local_runner, QueueFull
+from backend.services.cancellation import cancellation, TaskCancelled, STOPPED_ERROR
 import uuid
 import logging
 import os
 import sys
 import asyncio
+import functools
 from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# In-memory task store for fallback (when Redis/Celery is unavailable)
-MEMORY_TASKS = {}
+# In-process tasks (desktop mode, or Redis/Celery unavailable) live in task_store:
+# bounded, TTL-evicted and persisted to SQLite in desktop mode
 
-# 全局线程池，用于在桌面模式下执行耗时的同步大模型调用，避免阻塞 FastAPI 主循环
-# Global thread pool for executing time-consuming sync LLM calls in desktop mode
-# Increased max_workers to prevent blocking when tasks are retried or multiple models run
+# 全局线程池，仅用于旧版多模型同步分析 (run_analysis_background)
+# Global thread pool for the legacy multi-model sync path. Single model and score analysis
+# run natively on the event loop (LLMService.analyze_question_async), bounded by LLM_ASYNC_CONCURRENCY.
 executor = ThreadPoolExecutor(max_workers=10)
 
 class ModelConfig(BaseModel):
@@ -31,6 +44,12 @@ class ModelConfig(BaseModel):
     model_name: Optional[str] = None
     temperature: Optional[float] = 0.3
     name_label: Optional[str] = None
+    # Skip reading the analysis result cache for this request (results are still stored)
+    bypass_cache: Optional[bool] = False
+    # Selection questions packed per request; None uses the LLM_BATCH_SIZES setting
+    batch_size: Optional[int] = None
+    # name_label of another config in the same request used as hedge backup for slow calls
+    hedge_with: Optional[str] = None
 
     model_config = {'protected_namespaces': ()}
 
@@ -38,6 +57,10 @@ class AnalysisRequest(BaseModel):
     questions: List[Dict[str, Any]]
     configs: List[ModelConfig]
 
+class ResumeRequest(BaseModel):
+    # name_label (or provider) -> API key; checkpoints never store keys
+    api_keys: Dict[str, str]
+
 class RetryRequest(BaseModel):
     question: Dict[str, Any]
     config: ModelConfig
@@ -45,53 +68,227 @@ class RetryRequest(BaseModel):
 async def run_analysis_background(task_id: str, question_data: Dict[str, Any], configs: List[Dict[str, Any]]):
     """Background task wrapper for synchronous analysis (Legacy)"""
     try:
-        if task_id not in MEMORY_TASKS:
-            logger.warning(f"Task {task_id} no longer in MEMORY_TASKS, skipping update.")
+        if not task_store.set_status(task_id, "PROCESSING"):
+            logger.warning(f"Task {task_id} no longer in task store, skipping update.")
             return
-        MEMORY_TASKS[task_id]["status"] = "PROCESSING"
         # 使用线程池运行同步代码
         loop = asyncio.get_event_loop()
         result = await loop.run_in_executor(executor, perform_analysis_sync, question_data, configs)
         
-        if task_id not in MEMORY_TASKS:
-            logger.warning(f"Task {task_id} no longer in MEMORY_TASKS, skipping update.")
-            return
-        MEMORY_TASKS[task_id]["status"] = "SUCCESS"
-        MEMORY_TASKS[task_id]["result"] = result
+        if not task_store.finish(task_id, result):
+            logger.warning(f"Task {task_id} no longer in task store, skipping update.")
     except Exception as e:
         logger.error(f"Background task failed: {e}")
-        if task_id in MEMORY_TASKS:
-            MEMORY_TASKS[task_id]["status"] = "FAILURE"
-            MEMORY_TASKS[task_id]["error"] = str(e)
+        task_store.fail(task_id, str(e))
 
 async def run_single_model_background(task_id: str, question_data: Dict[str, Any], config: Dict[str, Any]):
-    """Background task wrapper for synchronous single model analysis"""
+    """Background task wrapper for single model analysis (native asyncio, desktop mode)"""
     try:
-        if task_id not in MEMORY_TASKS:
-            logger.warning(f"Task {task_id} no longer in MEMORY_TASKS, skipping update.")
+        if not task_store.set_status(task_id, "PROCESSING"):
+            logger.warning(f"Task {task_id} no longer in task store, skipping update.")
             return
-        MEMORY_TASKS[task_id]["status"] = "PROCESSING"
-        # 使用线程池运行同步代码，防止阻塞主循环，从而允许前端轮询请求得到响应
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(executor, perform_single_model_analysis, question_data, config)
+        # 直接在事件循环上运行异步大模型流式调用，不占用线程池，前端轮询仍可及时响应
+        result = await perform_single_model_analysis_async(question_data, config, task_id)
         
-        if task_id not in MEMORY_TASKS:
-            logger.warning(f"Task {task_id} no longer in MEMORY_TASKS, skipping update.")
-            return
-        MEMORY_TASKS[task_id]["status"] = "SUCCESS"
-        MEMORY_TASKS[task_id]["result"] = result
+        if not task_store.finish(task_id, result):
+            logger.warning(f"Task {task_id} no longer in task store, skipping update.")
+    except TaskCancelled:
+        task_store.revoke(task_id, STOPPED_ERROR)
     except Exception as e:
         logger.error(f"Background task failed: {e}")
-        if task_id in MEMORY_TASKS:
-            MEMORY_TASKS[task_id]["status"] = "FAILURE"
-            MEMORY_TASKS[task_id]["error"] = str(e)
+        task_store.fail(task_id, str(e))
+        emitter = events.task_emitter(config, task_id, question_data.get("id"))
+        if emitter:
+            emitter.state("FAILURE", error=str(e))
+
+async def run_batch_background(task_ids: Dict[str, str], questions: List[Dict[str, Any]], config: Dict[str, Any]):
+    """Background task wrapper for a micro-batch of selection questions (desktop mode)"""
+    for tid in task_ids.values():
+        task_store.set_status(tid, "PROCESSING")
+    try:
+        try:
+            results = await perform_batch_analysis_async(questions, config, task_ids)
+        except TaskCancelled:
+            results = {}
+        for q_id, tid in task_ids.items():
+            if q_id not in results:
+                # Stopped by the user
+                task_store.revoke(tid, STOPPED_ERROR)
+            elif not task_store.finish(tid, results[q_id]):
+                logger.warning(f"Task {tid} no longer in task store, skipping update.")
+    except Exception as e:
+        logger.error(f"Background batch task failed: {e}")
+        for q in questions:
+            tid = task_ids.get(str(q.get("id")))
+            task_store.fail(tid, str(e))
+            emitter = events.task_emitter(config, tid, q.get("id"))
+            if emitter:
+                emitter.state("FAILURE", error=str(e))
+
+def _dispatch_celery(job_id: str, batches: List[tuple], singles: List[tuple]) -> tuple:
+    """
+    Hand the job's Celery tasks to the fair scheduler, which sends them in turn with other
+    submissions. Every question keeps its own pre-assigned task id, also inside a batch,
+    so the frontend polls per (question, model) exactly as for single tasks.
+    Returns the (batches, singles) that must run in process instead: none when Celery took
+    the job, those not sent yet if the broker failed part way through.
+    """
+    specs = [
+        {"task": analyze_batch_task.name, "args": [chunk, config, task_ids], "task_id": str(uuid.uuid4()),
+         "task_ids": list(task_ids.values())}
+        for chunk, config, task_ids in batches
+    ] + [
+        {"task": analyze_single_model_task.name, "args": [q, config], "task_id": task_id}
+        for q, config, task_id in singles
+    ]
+    try:
+        fair_scheduler.submit(job_id, specs, send_task_spec)
+        return [], []
+    except DispatchError as e:
+        sent = set(e.sent_task_ids)
+        logger.warning(f"Celery dispatch failed after {len(sent)}/{len(specs)} tasks: {e}. Switching to in-memory fallback.")
+    except Exception as e:
+        sent = set()
+        logger.warning(f"Celery dispatch failed: {e}. Switching to in-memory fallback.")
+    # Tasks already with the broker run there; the rest must not be sent later as well
+    fair_scheduler.discard(job_id)
+    return (
+        [item for item, spec in zip(batches, specs) if spec["task_id"] not in sent],
+        [item for item, spec in zip(singles, specs[len(batches):]) if spec["task_id"] not in sent],
+    )
+
+def _dispatch_in_process(job_id: str, batches: List[tuple], singles: List[tuple]):
+    """Queue the job on the bounded in-process runner; raises HTTP 503 if it does not fit."""
+    items = [
+        (list(task_ids.values()), functools.partial(run_batch_background, task_ids, chunk, config))
+        for chunk, config, task_ids in batches
+    ] + [
+        ([task_id], functools.partial(run_single_model_background, task_id, q, config))
+        for q, config, task_id in singles
+    ]
+    try:
+        local_runner.submit(job_id, items)
+    except QueueFull as e:
+        raise queue_full_error(e)
+    # Started tasks only run once this request yields, so they find their entries
+    for chunk, config, task_ids in batches:
+        # After a restart each question of the batch is re-queued on its own
+        for q in chunk:
+            task_store.create(task_ids[str(q.get("id"))], "analysis_single", [q, config])
+    for q, config, task_id in singles:
+        task_store.create(task_id, "analysis_single", [q, config])
+
+def queue_full_error(e: QueueFull) -> HTTPException:
+    """503 for a submission the in-process queue cannot take, telling the client when to retry."""
+    return HTTPException(
+        status_code=503,
+        detail=f"{e} Please retry in {e.retry_after}s.",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+def _resolve_hedge_configs(config_dicts: List[Dict[str, Any]]):
+    """Attach the backup config named by hedge_with as config["hedge_config"]."""
+    by_label = {(c.get("name_label") or c.get("provider")): dict(c) for c in config_dicts}
+    for config in config_dicts:
+        backup = by_label.get(config.get("hedge_with"))
+        label = config.get("name_label") or config.get("provider")
+        if backup is not None and config.get("hedge_with") != label:
+            config["hedge_config"] = backup
+
+# Unfinished in-process tasks are re-run with this after a restart (see TaskStore.restore)
+task_store.register_runner("analysis_single", run_single_model_background)
+
+def _plan_tasks(questions: List[Dict[str, Any]], config_dicts: List[Dict[str, Any]], done: frozenset = frozenset()):
+    """
+    One task id per (question, model) pair not in `done` ({(question_id, label)}).
+    Returns (tasks_response, batches, singles); selection questions are micro-batched per
+    model when a batch size > 1 is configured.
+    """
+    # Structure: [ { "question_id": "...", "model_tasks": { "Label1": "task_id_1", ... } }, ... ]
+    tasks_response = []
+    batches: List[tuple] = []   # (questions, config, {question_id: task_id})
+    singles: List[tuple] = []   # (question, config, task_id), question by question
+    batched_task_ids: Dict[int, Dict[str, str]] = {}
+    for index, config in enumerate(config_dicts):
+        batch_size = resolve_batch_size(config)
+        if batch_size <= 1:
+            continue
+        label = config.get("name_label") or config.get("provider")
+        selection = [q for q in questions if q.get("type") == "selection" and (str(q.get("id")), label) not in done]
+        batched_task_ids[index] = {}
+        for start in range(0, len(selection), batch_size):
+            chunk = selection[start:start + batch_size]
+            task_ids = {str(q.get("id")): str(uuid.uuid4()) for q in chunk}
+            batches.append((chunk, config, task_ids))
+            batched_task_ids[index].update(task_ids)
+
+    for q in questions:
+        q_id = q.get("id")
+        model_tasks = {}
+        
+        for index, config in enumerate(config_dicts):
+            label = config.get("name_label") or config.get("provider")
+            if (str(q_id), label) in done:
+                continue
+            
+            task_id = batched_task_ids.get(index, {}).get(str(q_id))
+            if not task_id:
+                task_id = str(uuid.uuid4())
+                singles.append((q, config, task_id))
+            model_tasks[label] = task_id
+            
+        if model_tasks:
+            tasks_response.append({
+                "question_id": q_id,
+                "model_tasks": model_tasks
+            })
+    return tasks_response, batches, singles
+
+def _dispatch_job(job_id: str, tasks_response: List[Dict[str, Any]], batches: List[tuple], singles: List[tuple], questions: int) -> Dict[str, Any]:
+    """
+    Dispatch a planned job to Celery or in process and register its progress tracking.
+    Returns the response fields on when it should finish: the projected completion at the
+    providers' TPM/RPM budgets and, in process, the queue in front of it.
+    """
+    # Force fallback to in-process tasks if running in Desktop mode
+    # This avoids blocking on Celery eager execution
+    # Check for RUNNING_DESKTOP env var OR if we are running as a frozen executable (PyInstaller)
+    in_process = os.environ.get("RUNNING_DESKTOP") == "true" or getattr(sys, 'frozen', False)
+    if in_process:
+        logger.info("Desktop mode detected: Using in-process tasks for analysis.")
+        local_batches, local_singles = batches, singles
+    else:
+        local_batches, local_singles = _dispatch_celery(job_id, batches, singles)
+        in_process = bool(local_batches or local_singles)
+    if in_process:
+        _dispatch_in_process(job_id, local_batches, local_singles)
+    
+    job_task_ids = [tid for t in tasks_response for tid in t["model_tasks"].values()]
+    # Submissions resumed from a checkpoint keep recording under the original job
+    checkpoint_id = next((config.get("checkpoint_id") for _, config, _ in batches + singles), None)
+    events.register_job(job_id, job_task_ids, {
+        tid: {"question_id": t["question_id"], "model_label": label, "checkpoint_id": checkpoint_id}
+        for t in tasks_response for label, tid in t["model_tasks"].items()
+    })
+    estimate = submission_estimate(
+        [(config["provider"], config.get("api_key"), q.get("content")) for chunk, config, _ in batches for q in chunk]
+        + [(config["provider"], config.get("api_key"), q.get("content")) for q, config, _ in singles]
+    )
+    job_store.create(job_id, total=len(job_task_ids), questions=questions, estimate=estimate)
+    fields = {"projection": project_completion(estimate, len(job_task_ids), len(job_task_ids))}
+    if in_process:
+        # In process: how many tasks wait in front and roughly how long until they start
+        fields["queue"] = local_runner.queue_info()
+    return fields
 
 @router.post("/analyze")
-async def start_analysis(request: AnalysisRequest, background_tasks: BackgroundTasks):
+async def start_analysis(request: AnalysisRequest):
     """
     Start analysis for a list of questions.
     Dispatches ONE task per model per question to allow real-time partial results.
-    Tries Celery first, falls back to in-memory BackgroundTasks if Redis is down.
+    Tasks are released by the fair scheduler, in turn with other submissions.
+    Tries Celery first, falls back to in-process tasks if Redis is down.
+    Every finished result is checkpointed under the job id (see /analyze/{job_id}/resume).
     """
     questions = request.questions
     configs = request.configs
@@ -99,65 +296,145 @@ async def start_analysis(request: AnalysisRequest, background_tasks: BackgroundT
     if not configs:
         raise HTTPException(status_code=400, detail="No model configurations provided")
     
+    # One job id per submission: progress and partial results of all its tasks are
+    # streamed on /api/analyze/{job_id}/events, aggregated progress is at /api/jobs/{job_id}
+    job_id = str(uuid.uuid4())
+
     # Convert config objects to dicts for Celery/Task
-    config_dicts = [c.model_dump() for c in configs]
+    config_dicts = [dict(c.model_dump(), job_id=job_id) for c in configs]
+    _resolve_hedge_configs(config_dicts)
     
-    # Structure: [ { "question_id": "...", "model_tasks": { "Label1": "task_id_1", ... } }, ... ]
-    tasks_response = []
-    use_fallback = False
-    
-    # Check Redis connection once (simple check)
-    try:
-        # Assuming we can just try dispatching the first task. 
-        # But to be safe, we can try to ping or just rely on exception handling.
-        pass
-    except:
-        pass
+    tasks_response, batches, singles = _plan_tasks(questions, config_dicts)
+    dispatch_info = _dispatch_job(job_id, tasks_response, batches, singles, len(questions))
+    checkpoint_store.save_spec(job_id, questions, config_dicts, tasks_response)
+            
+    response = {"job_id": job_id, "tasks": tasks_response, "message": f"Started analysis tasks for {len(questions)} questions x {len(configs)} models"}
+    response.update(dispatch_info)
+    return response
 
-    # Force fallback to in-memory BackgroundTasks if running in Desktop mode
-    # This avoids blocking on Celery eager execution
-    # Check for RUNNING_DESKTOP env var OR if we are running as a frozen executable (PyInstaller)
-    if os.environ.get("RUNNING_DESKTOP") == "true" or getattr(sys, 'frozen', False):
-        use_fallback = True
-        logger.info("Desktop mode detected: Using in-memory BackgroundTasks for analysis.")
+@router.post("/analyze/{job_id}/resume")
+async def resume_analysis(job_id: str, request: ResumeRequest):
+    """
+    Continue an interrupted submission (API or worker restart): results already checkpointed
+    are returned as they are, and only the (question, model) pairs that are missing or failed
+    are dispatched again, as a new job whose results are still checkpointed under `job_id`.
+    API keys are not stored with the checkpoint, so they are sent again per model label.
+    Pairs still queued in process (re-queued after a restart) are not dispatched twice.
+    This is also how a desktop submission continues after a restart: unless
+    TASK_STORE_PERSIST_API_KEYS is set, its unfinished tasks end as interrupted and are
+    dispatched again here with the keys supplied by the client.
+    """
+    checkpoint = checkpoint_store.load(job_id)
+    if checkpoint is None:
+        raise HTTPException(status_code=404, detail="No checkpoint for this job")
+    spec, stored = checkpoint["spec"], checkpoint["results"]
 
-    for q in questions:
-        q_id = q.get("id")
-        model_tasks = {}
-        
-        for config in config_dicts:
-            label = config.get("name_label") or config.get("provider")
-            
-            task_id = None
-            
-            if not use_fallback:
+    labels = [c.get("name_label") or c.get("provider") for c in spec["configs"]]
+    missing_keys = [label for label in labels if not request.api_keys.get(label)]
+    if missing_keys:
+        raise HTTPException(status_code=400, detail=f"API keys required for: {', '.join(missing_keys)}")
+
+    done = {pair for pair, entry in stored.items() if is_completed(entry)}
+    for t in spec["tasks"]:
+        for label, task_id in t["model_tasks"].items():
+            info = task_store.get(task_id)
+            if info is not None and info.get("status") in ("PENDING", "PROCESSING"):
+                done.add((str(t["question_id"]), label))
+
+    run_id = str(uuid.uuid4())
+    config_dicts = [
+        dict({k: v for k, v in c.items() if k != "hedge_config"}, api_key=request.api_keys[label], job_id=run_id, checkpoint_id=job_id)
+        for c, label in zip(spec["configs"], labels)
+    ]
+    _resolve_hedge_configs(config_dicts)
+    tasks_response, batches, singles = _plan_tasks(spec["questions"], config_dicts, frozenset(done))
+
+    results = [
+        {"question_id": question_id, "model_label": label, "task_id": entry.get("task_id"), "result": entry["result"]}
+        for (question_id, label), entry in stored.items() if is_completed(entry)
+    ]
+    response = {
+        "job_id": run_id if tasks_response else None,
+        "checkpoint_id": job_id,
+        "tasks": tasks_response,
+        "results": results,
+        "message": f"Resumed {sum(len(t['model_tasks']) for t in tasks_response)} tasks, {len(results)} already completed",
+    }
+    if not tasks_response:
+        return response
+
+    response.update(_dispatch_job(run_id, tasks_response, batches, singles, len(spec["questions"])))
+    # Later resumes look at the new task ids (e.g. to skip pairs re-queued in process)
+    redispatched = {str(t["question_id"]): t["model_tasks"] for t in tasks_response}
+    layout = [
+        {"question_id": t["question_id"], "model_tasks": dict(t["model_tasks"], **redispatched.get(str(t["question_id"]), {}))}
+        for t in spec["tasks"]
+    ]
+    checkpoint_store.save_spec(job_id, spec["questions"], config_dicts, layout)
+    return response
+
+@router.get("/analyze/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """
+    Server-Sent Events for one analysis job: task state changes (with the result on SUCCESS),
+    streamed token counts and final_level as soon as it is generated.
+    Fed by Redis pub/sub (Celery workers) or the in-process broadcaster (desktop mode).
+    The stream ends with a "complete" event once every task of the job has finished.
+    """
+    task_ids = events.job_tasks(job_id)
+    if task_ids is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        # Subscribe before reading the snapshot so no state change falls in between
+        queue = events.broadcaster.subscribe(job_id)
+        if events.get_redis() is not None:
+            events.redis_bridge.ensure_started()
+        try:
+            pending = set(task_ids)
+            for event in events.job_snapshot(job_id).values():
+                if event.get("status") in events.TERMINAL_STATUSES:
+                    pending.discard(event["task_id"])
+                yield events.format_sse(event)
+
+            while pending:
+                if await request.is_disconnected():
+                    return
                 try:
-                    # Attempt to dispatch to Celery
-                    task = analyze_single_model_task.delay(q, config)
-                    task_id = task.id
-                except Exception as e:
-                    logger.warning(f"Celery dispatch failed: {e}. Switching to in-memory fallback.")
-                    use_fallback = True
-            
-            if use_fallback:
-                task_id = str(uuid.uuid4())
-                MEMORY_TASKS[task_id] = {"status": "PENDING"}
-                background_tasks.add_task(run_single_model_background, task_id, q, config)
-            
-            model_tasks[label] = task_id
-            
-        tasks_response.append({
-            "question_id": q_id,
-            "model_tasks": model_tasks
-        })
-            
-    return {"tasks": tasks_response, "message": f"Started analysis tasks for {len(questions)} questions x {len(configs)} models"}
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event.get("type") == "state" and event.get("status") in events.TERMINAL_STATUSES:
+                    pending.discard(event["task_id"])
+                yield events.format_sse(event)
+
+            yield events.format_sse({"type": "complete", "job_id": job_id})
+        finally:
+            events.broadcaster.unsubscribe(job_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, cursor: int = 0):
+    """
+    Progress of a whole submission in one round trip, plus the results finished since
+    `cursor`. Pass back the returned cursor on the next poll to only receive new results.
+    """
+    job = job_store.get(job_id, cursor)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @router.get("/tasks/{task_id}")
 async def get_task_status(task_id: str):
-    # Check memory tasks first
-    if task_id in MEMORY_TASKS:
-        task_info = MEMORY_TASKS[task_id]
+    # Check in-process tasks first
+    task_info = task_store.get(task_id)
+    if task_info is not None:
         status = task_info.get("status")
         response = {
             "task_id": task_id,
@@ -198,14 +475,16 @@ async def get_task_status(task_id: str):
 async def get_tasks_status(task_ids: List[str] = Body(...)):
     """
     Batch check status for multiple tasks.
+    In-memory tasks are answered directly; all Celery tasks are read with one bulk
+    lookup, shared by identical polls arriving within TASK_STATUS_CACHE_TTL.
     """
     results = {}
+    celery_ids = []
     
-    # optimize by grouping checks if possible, but for now simple loop is better than N http requests
     for task_id in task_ids:
-        # Check memory tasks first
-        if task_id in MEMORY_TASKS:
-            task_info = MEMORY_TASKS[task_id]
+        # Check in-process tasks first
+        task_info = task_store.get(task_id)
+        if task_info is not None:
             status = task_info.get("status")
             res = {
                 "task_id": task_id,
@@ -216,79 +495,60 @@ async def get_tasks_status(task_ids: List[str] = Body(...)):
             elif status == "FAILURE":
                  res["error"] = task_info.get("error")
             results[task_id] = res
-            continue
+        else:
+            celery_ids.append(task_id)
 
-        # Fallback to Celery check
-        try:
-            task_result = AsyncResult(task_id, app=celery_app)
-            status = task_result.status
-            
-            res = {
-                "task_id": task_id,
-                "status": status,
-            }
-            
-            if task_result.ready():
-                res["result"] = task_result.result
-                if status == 'SUCCESS':
-                     res["status"] = 'SUCCESS'
-            elif task_result.failed():
-                res["error"] = str(task_result.result)
-                res["status"] = 'FAILURE'
-                
-            results[task_id] = res
-        except Exception as e:
-            logger.error(f"Error checking task {task_id}: {e}")
-            results[task_id] = {"task_id": task_id, "status": "PENDING"}
+    if celery_ids:
+        results.update(await status_coalescer.get(celery_app, celery_ids))
             
     return results
 
 @router.post("/tasks/stop")
 async def stop_tasks(task_ids: List[str] = Body(...)):
     """
-    Revoke (stop) a list of tasks and clear memory store.
-    Also clears any pending tasks in the Celery queue.
+    Stop the given tasks (the caller's submission) and nothing else.
+    Running streams see the cancellation flag between two chunks, close the connection and
+    free their slot; queued tasks are dropped or end as REVOKED without calling the model.
+    Tasks that never started are reported REVOKED here, so their job still finishes.
+    Other users' queued and running work is left alone.
     """
-    logger.info(f"Stopping tasks: received {len(task_ids)} IDs. Purging queue and clearing memory...")
-    
-    # 1. 清理内存任务状态，将正在运行的任务标记为失败，但不使用 clear() 以免引起线程冲突
-    mem_count = 0
-    for tid in list(MEMORY_TASKS.keys()):
-        if MEMORY_TASKS[tid].get("status") in ["PENDING", "PROCESSING"]:
-            MEMORY_TASKS[tid]["status"] = "FAILURE"
-            MEMORY_TASKS[tid]["error"] = "User stopped analysis"
-            mem_count += 1
-    
-    # 不再执行 MEMORY_TASKS.clear()，让旧任务自然保留（或者后续可以加个定时清理机制）
-    logger.info(f"Marked {mem_count} memory tasks as stopped")
+    logger.info(f"Stopping {len(task_ids)} tasks")
+
+    # 1. 设置取消标记：运行中的流式请求在下一个数据块时自行中止，排队中的任务开始时直接结束
+    cancellation.cancel(task_ids)
+
+    # 2. 丢弃公平调度器中这些任务尚未派发的部分，并将内存任务标记为已终止
+    held_count = fair_scheduler.discard(task_ids=task_ids) + local_runner.discard(task_ids=task_ids)
+    mem_count = task_store.stop(task_ids, STOPPED_ERROR)
+    logger.info(f"Dropped {held_count} undispatched tasks, stopped {mem_count} in-process tasks")
 
-    # 2. Revoke specific running/pending Celery tasks
-    count = 0
-    for tid in task_ids:
+    # 3. Revoke queued Celery messages of these tasks only (no purge, no killing of workers)
+    celery_ids = [tid for tid in task_ids if tid not in task_store]
+    if celery_ids:
         try:
-            # terminate=True kills the worker process executing the task
-            celery_app.control.revoke(tid, terminate=True)
-            count += 1
+            celery_app.control.revoke(celery_ids)
         except Exception as e:
-            logger.error(f"Failed to revoke task {tid}: {e}")
-            
-    # 3. Purge the entire queue to remove any queued but not-yet-started tasks
-    try:
-        purged_count = celery_app.control.purge()
-        logger.info(f"Purged {purged_count} tasks from Celery queue")
-    except Exception as e:
-        logger.error(f"Failed to purge Celery queue: {e}")
-            
-    return {"message": f"Stopped {count} Celery tasks, cleared {mem_count} memory tasks and purged queue"}
+            logger.error(f"Failed to revoke Celery tasks: {e}")
+
+    # 4. 从未开始的任务不会自行上报终止状态：在此发布 REVOKED，任务进度与事件流才能结束
+    unstarted = events.revoke_unstarted(task_ids, STOPPED_ERROR)
+    logger.info(f"Reported {unstarted} stopped tasks that never started as REVOKED")
+
+    return {
+        "message": f"Stopped {len(task_ids)} tasks ({held_count} not yet dispatched, {mem_count} in-process)",
+        "stopped": len(task_ids),
+    }
 
 @router.post("/analyze/retry")
-async def retry_analysis(request: RetryRequest, background_tasks: BackgroundTasks):
+async def retry_analysis(request: RetryRequest):
     """
     Retry analysis for a single question and model.
     """
     question = request.question
     config = request.config.model_dump()
     config["is_retry"] = True # Mark as retry
+    # Someone is waiting on this one question: overtake queued bulk analysis (Celery and in process)
+    config["queue"] = QUEUE_INTERACTIVE
     
     label = config.get("name_label") or config.get("provider")
     task_id = None
@@ -301,7 +561,9 @@ async def retry_analysis(request: RetryRequest, background_tasks: BackgroundTask
     if not use_fallback:
         try:
             # Attempt to dispatch to Celery
-            task = analyze_single_model_task.delay(question, config)
+            task = analyze_single_model_task.apply_async(
+                args=[question, config], queue=QUEUE_INTERACTIVE, priority=QUEUE_PRIORITIES[QUEUE_INTERACTIVE]
+            )
             task_id = task.id
         except Exception as e:
             logger.warning(f"Celery dispatch failed: {e}. Switching to in-memory fallback.")
@@ -309,8 +571,16 @@ async def retry_analysis(request: RetryRequest, background_tasks: BackgroundTask
     
     if use_fallback:
         task_id = str(uuid.uuid4())
-        MEMORY_TASKS[task_id] = {"status": "PENDING"}
-        background_tasks.add_task(run_single_model_background, task_id, question, config)
+        try:
+            # A retry is not part of a submitted job: it is queued as a job of its own
+            local_runner.submit(
+                task_id,
+                [([task_id], functools.partial(run_single_model_background, task_id, question, config))],
+                priority=QUEUE_PRIORITIES[QUEUE_INTERACTIVE],
+            )
+        except QueueFull as e:
+            raise queue_full_error(e)
+        task_store.create(task_id, "analysis_single", [question, config])
         
     return {
         "question_id": question.get("id"),
@@ -0,0 +1,94 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from backend.services.cache import analysis_cache
+from backend.services.prompts import prompt_registry
+from backend.services.rate_limiter import rate_limiter
+from backend.services.hedging import hedge_stats, latency_tracker
+from backend.services.telemetry import telemetry
+from backend.services.task_status import status_coalescer
+from backend.services.task_store import task_store
+from backend.services.fair_scheduler import fair_scheduler
+from backend.services.local_runner import local_runner
+from backend.services.single_flight import single_flight
+from backend.services.token_budget import token_estimator
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    """
+    LLM call telemetry in Prometheus text format: queue wait, time to first token,
+    generation time, tokens/s, parse and grading validation histograms per provider/model,
+    plus request and token counters. Aggregated across workers through Redis when available.
+    """
+    return PlainTextResponse(telemetry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@router.get("/metrics/cache")
+async def get_cache_metrics():
+    """
+    Hit/miss counters and size of the analysis result cache (this process).
+    """
+    return analysis_cache.stats()
+
+@router.get("/metrics/prompts")
+async def get_prompt_metrics():
+    """
+    Loaded rubric versions and prompt / cached-prompt token totals reported by providers.
+    """
+    return prompt_registry.stats()
+
+@router.get("/metrics/limiter")
+async def get_limiter_metrics():
+    """
+    Current AIMD concurrency window, in-flight requests and queue waits per (provider, key hash).
+    """
+    return rate_limiter.stats()
+
+@router.get("/metrics/hedging")
+async def get_hedging_metrics():
+    """
+    Hedge rate / win rate and the learned latency percentiles per provider and model.
+    """
+    return {"hedging": hedge_stats.stats(), "latency": latency_tracker.stats()}
+
+@router.get("/metrics/task-status")
+async def get_task_status_metrics():
+    """
+    Bulk status lookups actually sent to the result backend vs polls served from the coalescing cache.
+    """
+    return status_coalescer.stats()
+
+@router.get("/metrics/tasks")
+async def get_task_store_metrics():
+    """
+    Size, evictions and restart recovery counters of the in-process task store (desktop mode).
+    """
+    return task_store.stats()
+
+@router.get("/metrics/fair")
+async def get_fair_scheduler_metrics():
+    """
+    Submissions waiting in the fair scheduler, tasks held back / in flight and the configured caps.
+    """
+    return fair_scheduler.stats()
+
+@router.get("/metrics/runner")
+async def get_local_runner_metrics():
+    """
+    Workers, queue depth per priority and estimated wait of the in-process job runner (desktop mode).
+    """
+    return local_runner.stats()
+
+@router.get("/metrics/single-flight")
+async def get_single_flight_metrics():
+    """
+    Provider calls made by leaders vs duplicate analyses served from an in-flight call (this process).
+    """
+    return single_flight.stats()
+
+@router.get("/metrics/tokens")
+async def get_token_budget_metrics():
+    """
+    Configured TPM/RPM budgets and the learned characters-per-token and output sizes used to estimate requests.
+    """
+    return token_estimator.stats()
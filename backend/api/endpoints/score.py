@@ -7,44 +7,45 @@ import os
 import sys
 import uuid
 import asyncio
+import functools
 from typing import Dict, Any, List
-from fastapi import APIRouter, File, UploadFile, HTTPException, Form, BackgroundTasks
+from fastapi import APIRouter, File, UploadFile, HTTPException, Form
 from pydantic import BaseModel
 from backend.services.llm import LLMService
-from backend.tasks.score import analyze_score_task, perform_score_analysis_sync
-from backend.api.endpoints.analysis import ModelConfig, MEMORY_TASKS, executor
+from backend.tasks.score import analyze_score_task, perform_score_analysis_async
+from backend.api.endpoints.analysis import ModelConfig, queue_full_error
+from backend.services.local_runner import local_runner, QueueFull
+from backend.services.task_queues import QUEUE_SCORE, QUEUE_PRIORITIES
+from backend.services.task_store import task_store
+from backend.services.cancellation import TaskCancelled, STOPPED_ERROR
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 # --- Helper for Desktop Mode ---
 async def run_score_analysis_background(task_id: str, score_data: Any, question_data: Any, mode: str, config: Any, group_name: str = None):
-    """在后台线程池中运行成绩分析任务"""
+    """在事件循环上直接运行成绩分析任务 (异步大模型调用)"""
     try:
-        if task_id not in MEMORY_TASKS:
-            logger.warning(f"Task {task_id} no longer in MEMORY_TASKS, skipping update.")
+        if not task_store.set_status(task_id, "PROCESSING"):
+            logger.warning(f"Task {task_id} no longer in task store, skipping update.")
             return
-        MEMORY_TASKS[task_id]["status"] = "PROCESSING"
         
-        # 核心：使用线程池运行同步分析逻辑
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(executor, perform_score_analysis_sync, score_data, question_data, mode, config)
+        # 核心：异步分析逻辑，不再占用线程池
+        result = await perform_score_analysis_async(score_data, question_data, mode, config, task_id)
         
-        if task_id not in MEMORY_TASKS:
-            logger.warning(f"Task {task_id} no longer in MEMORY_TASKS, skipping update.")
-            return
-            
         # 如果是班级模式的分组分析，提取对应的结果
         if mode == 'class' and group_name and isinstance(result, dict) and group_name in result:
             result = result[group_name]
             
-        MEMORY_TASKS[task_id]["status"] = "SUCCESS"
-        MEMORY_TASKS[task_id]["result"] = result
+        if not task_store.finish(task_id, result):
+            logger.warning(f"Task {task_id} no longer in task store, skipping update.")
+    except TaskCancelled:
+        task_store.revoke(task_id, STOPPED_ERROR)
     except Exception as e:
         logger.error(f"Score analysis background task failed: {e}")
-        if task_id in MEMORY_TASKS:
-            MEMORY_TASKS[task_id]["status"] = "FAILURE"
-            MEMORY_TASKS[task_id]["error"] = str(e)
+        task_store.fail(task_id, str(e))
+
+task_store.register_runner("score", run_score_analysis_background)
 
 class VariantRequest(BaseModel):
     question_content: str
@@ -690,7 +691,7 @@ def upload_score_data(
         raise HTTPException(status_code=500, detail=f"Failed to process file: {str(e)}")
 
 @router.post("/score/analyze")
-async def analyze_score(request: ScoreAnalysisRequest, background_tasks: BackgroundTasks):
+async def analyze_score(request: ScoreAnalysisRequest):
     """
     Start analysis for score data.
     """
@@ -710,7 +711,9 @@ async def analyze_score(request: ScoreAnalysisRequest, background_tasks: Backgro
     use_fallback = os.environ.get("RUNNING_DESKTOP") == "true" or getattr(sys, 'frozen', False)
     
     if use_fallback:
-        logger.info("Desktop mode detected in Score Analysis: Using in-memory BackgroundTasks.")
+        logger.info("Desktop mode detected in Score Analysis: Using the in-process job runner.")
+    # (task_id, run_score_analysis_background args) queued together once all tasks are known
+    local_tasks = []
     
     try:
         if mode == 'class':
@@ -743,8 +746,7 @@ async def analyze_score(request: ScoreAnalysisRequest, background_tasks: Backgro
 
                 if use_fallback:
                     task_id = f"score_class_{uuid.uuid4()}"
-                    MEMORY_TASKS[task_id] = {"status": "PENDING"}
-                    background_tasks.add_task(run_score_analysis_background, task_id, group_score_data, q_context_list, mode, config, g_name)
+                    local_tasks.append((task_id, [group_score_data, q_context_list, mode, config, g_name]))
                     tasks_response.append({"id": g_name, "task_id": task_id})
                 else:
                     # 服务器模式：使用 Celery
@@ -758,15 +760,25 @@ async def analyze_score(request: ScoreAnalysisRequest, background_tasks: Backgro
                 
                 if use_fallback:
                     task_id = f"score_student_{uuid.uuid4()}"
-                    MEMORY_TASKS[task_id] = {"status": "PENDING"}
-                    background_tasks.add_task(run_score_analysis_background, task_id, row, q_context_list, mode, config)
+                    local_tasks.append((task_id, [row, q_context_list, mode, config]))
                     tasks_response.append({"id": str(student_id), "task_id": task_id})
                 else:
                     task = analyze_score_task.delay(row, q_context_list, mode, config)
                     tasks_response.append({"id": str(student_id), "task_id": task.id})
+
+        if local_tasks:
+            local_runner.submit(
+                f"score_{uuid.uuid4()}",
+                [([task_id], functools.partial(run_score_analysis_background, task_id, *args)) for task_id, args in local_tasks],
+                priority=QUEUE_PRIORITIES[QUEUE_SCORE],
+            )
+            for task_id, args in local_tasks:
+                task_store.create(task_id, "score", args)
                 
         return {"tasks": tasks_response, "message": f"Started {len(tasks_response)} analysis tasks"}
         
+    except QueueFull as e:
+        raise queue_full_error(e)
     except Exception as e:
         logger.error(f"Failed to start analysis: {e}")
         raise HTTPException(status_code=500, detail=str(e))
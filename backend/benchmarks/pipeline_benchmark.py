@@ -0,0 +1,333 @@
+"""
+End-to-end throughput benchmark for the analysis pipeline.
+
+Runs a synthetic paper through the real stack against the local mock LLM provider:
+upload (DocumentParser / QuestionSplitter) -> /api/analyze fan-out -> /api/tasks/status polling.
+Both execution modes are supported:
+
+    desktop  API with RUNNING_DESKTOP=true (in-process task store + background tasks)
+    celery   API + Celery worker(s) on a local Redis
+
+Results (throughput, p50/p95/p99 per-question latency, peak RSS, status requests) are
+written as JSON so runs of different versions can be compared.
+
+    python -m backend.benchmarks.pipeline_benchmark --mode desktop --mode celery \\
+        --questions 40 --models 3 --ttft 0.5 --tps 80 --output bench.json
+"""
+from typing import Dict, Any, List, Optional
+import argparse
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import requests
+from docx import Document
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# --- Synthetic paper ---
+
+def build_paper(selection: int, big: int, sub_questions: int = 3) -> bytes:
+    """A .docx exam paper shaped like the real ones (numbered selection + multi-part questions)."""
+    doc = Document()
+    doc.add_heading("化学模拟试卷（基准测试）", 0)
+    number = 1
+    for i in range(selection):
+        doc.add_paragraph(f"{number}. 下列关于物质性质的说法正确的是（ ）第{i}题")
+        for option in "ABCD":
+            doc.add_paragraph(f"{option}. 选项{option}{i}")
+        number += 1
+    for i in range(big):
+        doc.add_paragraph(f"{number}. (14分) 某研究小组进行综合实验探究，题干背景信息第{i}题。")
+        for j in range(1, sub_questions + 1):
+            doc.add_paragraph(f"({j}) 第{j}小问：写出相关反应的化学方程式并说明理由。")
+        number += 1
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+# --- Process helpers ---
+
+def free_port() -> int:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for_http(url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except urllib.error.HTTPError:
+            return  # Server is up (e.g. 404/405)
+        except Exception:
+            time.sleep(0.1)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def process_tree(pid: int) -> List[int]:
+    """pid plus all its descendants (Linux /proc)."""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    result, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        result.append(current)
+        stack.extend(children.get(current, []))
+    return result
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """Sum of VmHWM (peak resident set) over a process tree, in MB. None where /proc is missing."""
+    total_kb = 0
+    found = False
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total_kb += int(line.split()[1])
+                        found = True
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1) if found else None
+
+
+def start_process(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        args, cwd=PROJECT_ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def stop_process(proc: Optional[subprocess.Popen]):
+    if proc is None or proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+def redis_available(url: str) -> bool:
+    try:
+        import redis
+        redis.Redis.from_url(url, socket_connect_timeout=1).ping()
+        return True
+    except Exception:
+        return False
+
+
+# --- Benchmark run ---
+
+def run_client(api_url: str, paper: bytes, args) -> Dict[str, Any]:
+    session = requests.Session()
+
+    upload_start = time.time()
+    response = session.post(
+        f"{api_url}/upload",
+        files={"file": ("bench.docx", paper, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")},
+        data={"mode": "sub_question"},
+    )
+    response.raise_for_status()
+    questions = response.json()
+    upload_seconds = time.time() - upload_start
+
+    configs = [
+        {
+            "provider": "mock",
+            "api_key": f"bench-key-{i}",
+            "base_url": args.mock_url,
+            "name_label": f"mock-{i}",
+            "bypass_cache": True,
+        }
+        for i in range(args.models)
+    ]
+
+    submit_time = time.time()
+    response = session.post(f"{api_url}/analyze", json={"questions": questions, "configs": configs})
+    response.raise_for_status()
+    dispatch_seconds = time.time() - submit_time
+
+    task_question = {}
+    for entry in response.json()["tasks"]:
+        for task_id in entry["model_tasks"].values():
+            task_question[task_id] = entry["question_id"]
+
+    pending = set(task_question)
+    finished_at: Dict[str, float] = {}
+    errors = 0
+    status_requests = 0
+    status_ids = 0
+    deadline = submit_time + args.timeout
+    while pending and time.time() < deadline:
+        time.sleep(args.poll_interval)
+        ids = sorted(pending)
+        status_requests += 1
+        status_ids += len(ids)
+        statuses = session.post(f"{api_url}/tasks/status", json=ids).json()
+        now = time.time()
+        for task_id, status in statuses.items():
+            if status.get("status") in ("SUCCESS", "FAILURE", "REVOKED"):
+                pending.discard(task_id)
+                finished_at[task_id] = now
+                result = (status.get("result") or {}).get("result") or {}
+                if status.get("status") != "SUCCESS" or "error" in result:
+                    errors += 1
+    total_seconds = time.time() - submit_time
+
+    # A question is done when its last model finished
+    question_done: Dict[Any, float] = {}
+    for task_id, done in finished_at.items():
+        qid = task_question[task_id]
+        question_done[qid] = max(question_done.get(qid, 0), done)
+    latencies = [done - submit_time for qid, done in question_done.items()
+                 if all(t in finished_at for t, q in task_question.items() if q == qid)]
+
+    return {
+        "questions": len(questions),
+        "tasks": len(task_question),
+        "completed_tasks": len(finished_at),
+        "timed_out_tasks": len(pending),
+        "error_tasks": errors,
+        "upload_seconds": round(upload_seconds, 3),
+        "dispatch_seconds": round(dispatch_seconds, 3),
+        "total_seconds": round(total_seconds, 3),
+        "questions_per_minute": round(len(latencies) / total_seconds * 60, 2) if total_seconds else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "status_requests": status_requests,
+        "status_ids_requested": status_ids,
+    }
+
+
+def run_mode(mode: str, paper: bytes, args) -> Dict[str, Any]:
+    env = dict(os.environ)
+    env.update(dict(item.split("=", 1) for item in args.set))
+    env["PYTHONPATH"] = PROJECT_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    api_port = free_port()
+    api_url = f"http://127.0.0.1:{api_port}/api"
+    api_proc = worker_proc = None
+
+    if mode == "desktop":
+        env["RUNNING_DESKTOP"] = "true"
+    else:
+        env.pop("RUNNING_DESKTOP", None)
+        if not redis_available(env.get("REDIS_URL", "redis://127.0.0.1:6379/0")):
+            return {"mode": mode, "skipped": "Redis not reachable"}
+
+    try:
+        if mode == "celery":
+            worker_proc = start_process(
+                [sys.executable, "-m", "celery", "-A", "backend.celery_app", "worker",
+                 f"--pool={args.pool}", f"--concurrency={args.workers}", "--loglevel=warning"],
+                env,
+            )
+        api_proc = start_process(
+            [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", str(api_port), "--log-level", "warning"],
+            env,
+        )
+        wait_for_http(f"{api_url}/metrics")
+        if worker_proc is not None:
+            time.sleep(args.worker_warmup)
+
+        result = run_client(api_url, paper, args)
+        result["mode"] = mode
+        result["peak_rss_mb"] = {"api": peak_rss_mb(api_proc.pid)}
+        if worker_proc is not None:
+            result["peak_rss_mb"]["workers"] = peak_rss_mb(worker_proc.pid)
+        return result
+    finally:
+        stop_process(api_proc)
+        stop_process(worker_proc)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Analysis pipeline throughput benchmark")
+    parser.add_argument("--mode", action="append", choices=["desktop", "celery"], help="repeatable; default: both")
+    parser.add_argument("--questions", type=int, default=40, help="selection questions in the synthetic paper")
+    parser.add_argument("--big-questions", type=int, default=5, help="multi-part questions in the synthetic paper")
+    parser.add_argument("--models", type=int, default=3, help="model configs per question")
+    parser.add_argument("--workers", type=int, default=4, help="Celery worker concurrency")
+    parser.add_argument("--pool", default="prefork", help="Celery pool implementation")
+    parser.add_argument("--worker-warmup", type=float, default=3.0, help="seconds to let Celery workers start")
+    parser.add_argument("--ttft", type=float, default=0.5, help="mock time to first token (s)")
+    parser.add_argument("--tps", type=float, default=80, help="mock tokens per second")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="status poll interval (s)")
+    parser.add_argument("--timeout", type=float, default=900, help="give up after this many seconds")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="extra env for API / workers")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    mock_port = free_port()
+    args.mock_url = f"http://127.0.0.1:{mock_port}/v1"
+    mock_proc = start_process(
+        [sys.executable, "-m", "backend.services.mock_llm", "--port", str(mock_port),
+         "--ttft", str(args.ttft), "--tps", str(args.tps),
+         "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate), "--seed", "1"],
+        dict(os.environ, PYTHONPATH=PROJECT_ROOT),
+    )
+    try:
+        wait_for_http(f"{args.mock_url}/models")
+        paper = build_paper(args.questions, args.big_questions)
+        runs = [run_mode(mode, paper, args) for mode in (args.mode or ["desktop", "celery"])]
+    finally:
+        stop_process(mock_proc)
+
+    report = {
+        "benchmark": "analysis_pipeline",
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "mock_url")},
+        "runs": runs,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
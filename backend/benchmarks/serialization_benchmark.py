@@ -0,0 +1,123 @@
+"""
+Bytes per exam of Celery task messages and stored results, "json" vs "compact-json".
+
+Builds the messages an exam really produces (one analyze_single_model_task per question
+and model, one analyze_score_task per student with the whole question context) and the
+results stored in the result backend, encodes them with both serializers and reports the
+totals. Message bodies cross the network to Redis and back to a worker; results are
+written to Redis and read again on every status poll until the task is collected.
+
+    python -m backend.benchmarks.serialization_benchmark --questions 40 --models 3 --students 45
+"""
+from typing import Dict, Any, List, Optional
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import time
+import uuid
+
+from kombu.serialization import dumps as kombu_dumps
+
+from backend.benchmarks.pipeline_benchmark import git_revision
+from backend.services.mock_llm import build_question_result
+from backend.services.serialization import SERIALIZER_NAME
+
+
+def build_exam(questions: int, models: int, students: int) -> Dict[str, Any]:
+    from backend.api.endpoints.score import format_question_data
+    from backend.tasks.analysis import _wrap_single_model_result
+
+    paper = [
+        {"id": str(i + 1), "type": "selection" if i % 3 else "sub_question",
+         "content": f"{i + 1}. 某研究小组探究反应条件对化学平衡的影响，下列说法正确的是（ ）第{i}题\n"
+                    "A. 升高温度平衡正向移动\nB. 增大压强反应速率不变\nC. 加入催化剂平衡常数增大\nD. 减小浓度平衡逆向移动"}
+        for i in range(questions)
+    ]
+    configs = [
+        {"provider": "deepseek", "api_key": f"sk-bench-{m}", "base_url": None, "model_name": None, "temperature": 0.3,
+         "name_label": f"model-{m}", "bypass_cache": False, "batch_size": None, "hedge_with": None,
+         "job_id": str(uuid.uuid4())}
+        for m in range(models)
+    ]
+    analysis_args, analysis_results = [], []
+    for q in paper:
+        result = build_question_result(q["content"])
+        q["meta"] = result["meta"]
+        q["comprehensive_rating"] = result["comprehensive_rating"]
+        for config in configs:
+            analysis_args.append([q, config])
+            analysis_results.append(_wrap_single_model_result(config, dict(result, duration=3.2)))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        context = format_question_data(paper)
+    score_args = [
+        [{"student_id": f"学生{s}", **{q["id"]: (s * 7 + int(q["id"])) % 6 for q in paper}}, context, "student", configs[0]]
+        for s in range(students)
+    ]
+    score_results = [
+        {"summary": "模拟学情分析", "markdown_report": "# 智能学情分析报告\n\n## 整体评估\n\n" + "模拟分析内容。" * 60}
+        for _ in range(students)
+    ]
+    return {"analysis_args": analysis_args, "analysis_results": analysis_results,
+            "score_args": score_args, "score_results": score_results}
+
+
+def message_bytes(args: List[Any], serializer: str) -> int:
+    """Body of a task message (protocol 2: args, kwargs, embed) as published to the broker."""
+    body = (args, {}, {"callbacks": None, "errbacks": None, "chain": None, "chord": None})
+    return len(kombu_dumps(body, serializer=serializer)[2])
+
+
+def result_bytes(result: Any, serializer: str) -> int:
+    """celery-task-meta-* value written by the result backend."""
+    meta = {"status": "SUCCESS", "result": result, "traceback": None, "children": [],
+            "date_done": datetime.datetime.utcnow().isoformat(), "task_id": str(uuid.uuid4())}
+    data = kombu_dumps(meta, serializer=serializer)[2]
+    return len(data.encode("utf-8") if isinstance(data, str) else data)
+
+
+def measure(exam: Dict[str, Any], serializer: str) -> Dict[str, int]:
+    sizes = {
+        "analysis_messages": sum(message_bytes(a, serializer) for a in exam["analysis_args"]),
+        "analysis_results": sum(result_bytes(r, serializer) for r in exam["analysis_results"]),
+        "score_messages": sum(message_bytes(a, serializer) for a in exam["score_args"]),
+        "score_results": sum(result_bytes(r, serializer) for r in exam["score_results"]),
+    }
+    sizes["total"] = sum(sizes.values())
+    return sizes
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Celery payload bytes per exam")
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--models", type=int, default=3)
+    parser.add_argument("--students", type=int, default=45, help="score analysis tasks (student mode)")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    from backend.celery_app import celery_app  # noqa: F401  registers the compact serializer
+    exam = build_exam(args.questions, args.models, args.students)
+    sizes = {name: measure(exam, name) for name in ("json", SERIALIZER_NAME)}
+    report = {
+        "benchmark": "celery_serialization",
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": vars(args),
+        "bytes": sizes,
+        "reduction": {
+            key: round(1 - sizes[SERIALIZER_NAME][key] / sizes["json"][key], 3) if sizes["json"][key] else None
+            for key in sizes["json"]
+        },
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Concurrency benchmark for one Celery worker process.
+
+Starts the mock LLM provider and, for every --pool / --concurrency combination, one
+in-process Celery worker on an in-memory broker, then sends `concurrency * rounds`
+analysis tasks at once and measures how many of them actually stream at the same time.
+No Redis is needed: the point is the worker's own capacity, not the broker.
+
+    python -m backend.benchmarks.worker_benchmark --pool solo --pool threads \\
+        --concurrency 1 --concurrency 8 --concurrency 32 --concurrency 64 --ttft 0.5 --tps 80
+
+For each run it reports tasks/s, the peak and average number of tasks in progress
+(Little's law: throughput x mean task time), p50/p95 task latency and peak RSS.
+"""
+from typing import Dict, Any, List, Optional
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import uuid
+
+from backend.benchmarks.pipeline_benchmark import (
+    PROJECT_ROOT, free_port, wait_for_http, start_process, stop_process, percentile, peak_rss_mb, git_revision,
+)
+
+
+class InFlight:
+    """Tasks between task_prerun and task_postrun in this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.started: Dict[str, float] = {}
+        self.durations: List[float] = []
+
+    def start(self, task_id: str):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.started[task_id] = time.time()
+
+    def finish(self, task_id: str):
+        with self.lock:
+            self.active -= 1
+            started = self.started.pop(task_id, None)
+            if started is not None:
+                self.durations.append(time.time() - started)
+
+
+def configure_app(celery_app):
+    """In-memory broker and results, no Redis: every shared state falls back to the process."""
+    from backend.config import settings
+    settings.REDIS_URL = ""
+    settings.LLM_PREWARM_PROVIDERS = ""
+    celery_app.conf.update(
+        broker_url="memory://",
+        result_backend="cache+memory://",
+        broker_transport_options={"polling_interval": 0.05},
+        task_acks_late=True,
+        worker_prefetch_multiplier=1,
+    )
+
+
+def run_pool(pool: str, concurrency: int, args) -> Dict[str, Any]:
+    from celery.contrib.testing.worker import start_worker
+    from celery.signals import task_prerun, task_postrun
+    from backend.celery_app import celery_app
+    from backend.tasks.analysis import analyze_single_model_task
+
+    if pool == "gevent":
+        try:
+            import gevent  # noqa: F401
+        except ImportError:
+            return {"pool": pool, "concurrency": concurrency, "skipped": "gevent not installed"}
+
+    tracker = InFlight()
+    on_start = lambda task_id=None, **kwargs: tracker.start(task_id)
+    on_finish = lambda task_id=None, **kwargs: tracker.finish(task_id)
+    task_prerun.connect(on_start, weak=False)
+    task_postrun.connect(on_finish, weak=False)
+
+    tasks = concurrency * args.rounds
+    run_id = uuid.uuid4().hex[:8]
+    try:
+        with start_worker(celery_app, pool=pool, concurrency=concurrency, perform_ping_check=False,
+                          loglevel="WARNING", shutdown_timeout=30):
+            submit_time = time.time()
+            results = []
+            for i in range(tasks):
+                question = {"id": f"q{i}", "content": f"基准测试第{i}题（{run_id}）：下列说法正确的是（ ）", "type": "selection"}
+                config = {
+                    "provider": "mock",
+                    # One key per concurrent slot: the adaptive limiter window of a single key must not be the bottleneck
+                    "api_key": f"bench-key-{i % max(concurrency, 1)}",
+                    "base_url": args.mock_url,
+                    "name_label": "mock",
+                    "bypass_cache": True,
+                }
+                results.append(analyze_single_model_task.delay(question, config))
+            completed = errors = 0
+            for result in results:
+                value = result.get(timeout=args.timeout, propagate=False)
+                completed += 1
+                if not isinstance(value, dict) or "error" in (value.get("result") or {}):
+                    errors += 1
+            total_seconds = time.time() - submit_time
+    finally:
+        task_prerun.disconnect(on_start)
+        task_postrun.disconnect(on_finish)
+
+    mean_task = sum(tracker.durations) / len(tracker.durations) if tracker.durations else None
+    throughput = completed / total_seconds if total_seconds else None
+    return {
+        "pool": pool,
+        "concurrency": concurrency,
+        "tasks": tasks,
+        "completed_tasks": completed,
+        "error_tasks": errors,
+        "total_seconds": round(total_seconds, 3),
+        "tasks_per_second": round(throughput, 2) if throughput else None,
+        "peak_in_progress": tracker.peak,
+        # Little's law: average number of analyses in progress over the run
+        "avg_in_progress": round(throughput * mean_task, 1) if throughput and mean_task else None,
+        "task_seconds_p50": percentile(tracker.durations, 50),
+        "task_seconds_p95": percentile(tracker.durations, 95),
+        "peak_rss_mb": peak_rss_mb(os.getpid()),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Concurrent analyses per Celery worker process")
+    parser.add_argument("--pool", action="append", choices=["solo", "threads", "gevent"], help="repeatable; default: solo and threads")
+    parser.add_argument("--concurrency", action="append", type=int, help="repeatable; default: 1, 8, 32, 64")
+    parser.add_argument("--rounds", type=int, default=3, help="tasks sent per run = concurrency x rounds")
+    parser.add_argument("--ttft", type=float, default=0.5, help="mock time to first token (s)")
+    parser.add_argument("--tps", type=float, default=80, help="mock tokens per second")
+    parser.add_argument("--timeout", type=float, default=600, help="give up on a task after this many seconds")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    mock_port = free_port()
+    args.mock_url = f"http://127.0.0.1:{mock_port}/v1"
+    mock_proc = start_process(
+        [sys.executable, "-m", "backend.services.mock_llm", "--port", str(mock_port),
+         "--ttft", str(args.ttft), "--tps", str(args.tps), "--seed", "1"],
+        dict(os.environ, PYTHONPATH=PROJECT_ROOT),
+    )
+    try:
+        wait_for_http(f"{args.mock_url}/models")
+        from backend.celery_app import celery_app
+        configure_app(celery_app)
+        # solo runs one task at a time whatever the concurrency
+        plan = list(dict.fromkeys(
+            (pool, 1 if pool == "solo" else concurrency)
+            for pool in args.pool or ["solo", "threads"]
+            for concurrency in args.concurrency or [1, 8, 32, 64]
+        ))
+        runs = [run_pool(pool, concurrency, args) for pool, concurrency in plan]
+    finally:
+        stop_process(mock_proc)
+
+    report = {
+        "benchmark": "worker_concurrency",
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "mock_url")},
+        "runs": runs,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,7 @@
 from celery import Celery
+from celery import states
+from celery.signals import worker_init, worker_process_init, task_postrun, task_revoked
+from kombu import Exchange, Queue
 import sys
 
 # Debug: Print sys.path
@@ -6,6 +9,9 @@ print(f"DEBUG Celery: sys.path: {sys.path}")
 
 # Use absolute import for backend package structure
 from backend.config import settings
+from backend.services.fair_scheduler import fair_scheduler, job_of
+from backend.services.serialization import SERIALIZER_NAME, register_compact_serializer
+from backend.services.task_queues import QUEUE_ORDER, QUEUE_INTERACTIVE, QUEUE_SCORE, QUEUE_BULK, QUEUE_PRIORITIES
 
 celery_app = Celery(
     "worker",
@@ -14,15 +20,77 @@ celery_app = Celery(
     include=["backend.tasks.analysis", "backend.tasks.score"]
 )
 
+# Compact, compressed task arguments and results; plain JSON stays accepted, so messages queued
+# and results stored before the switch (or by workers still on CELERY_SERIALIZER=json) are still read
+register_compact_serializer()
+
 celery_app.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
+    task_serializer=settings.CELERY_SERIALIZER,
+    accept_content=[SERIALIZER_NAME, "json"],
+    result_serializer=settings.CELERY_SERIALIZER,
+    result_accept_content=[SERIALIZER_NAME, "json"],
     timezone="Asia/Shanghai",
     enable_utc=True,
     broker_connection_retry_on_startup=True,
-    # Task routing can be added here if needed
+    # Retries (interactive), score analysis and whole-paper analysis (bulk) get their own
+    # queues, so one click on "retry" does not wait behind hundreds of queued exam tasks.
+    # Retries are sent to the interactive queue explicitly: they run the same task as bulk.
+    task_queues=[Queue(name, Exchange(name), routing_key=name) for name in QUEUE_ORDER],
+    task_default_queue=QUEUE_BULK,
+    task_default_priority=QUEUE_PRIORITIES[QUEUE_BULK],
+    task_routes={
+        "backend.tasks.analysis.*": {"queue": QUEUE_BULK, "priority": QUEUE_PRIORITIES[QUEUE_BULK]},
+        "backend.tasks.score.*": {"queue": QUEUE_SCORE, "priority": QUEUE_PRIORITIES[QUEUE_SCORE]},
+    },
+    # A worker consuming several queues (-Q interactive,score,bulk) drains them in that order
+    # instead of round robin; priority_steps keeps per-message priorities within a queue.
+    # Unacknowledged tasks (acks_late below) are re-delivered after visibility_timeout
+    broker_transport_options={
+        "queue_order_strategy": "priority",
+        "priority_steps": list(range(len(QUEUE_ORDER))),
+        "visibility_timeout": settings.CELERY_VISIBILITY_TIMEOUT,
+    },
+    # Do not reserve bulk tasks ahead of an interactive one that arrives a moment later
+    worker_prefetch_multiplier=1,
+    # I/O-bound worker: many concurrent LLM streams per process instead of one (--pool=solo).
+    # start.sh passes the same values on the command line, which gevent/eventlet need for
+    # monkey patching; these cover workers started without --pool / --concurrency.
+    worker_pool=settings.CELERY_WORKER_POOL,
+    worker_concurrency=settings.CELERY_WORKER_CONCURRENCY,
+    # With dozens of streams in flight per process, a crashed worker must not lose them:
+    # acknowledge after the task finished, re-deliver if the worker process is lost
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
 )
 
 # Auto-discover tasks in packages
 celery_app.autodiscover_tasks(["backend.tasks"])
+
+@worker_init.connect
+@worker_process_init.connect
+def init_llm_client_pool(**kwargs):
+    """
+    Each worker process gets its own connection pools (sockets must not be shared
+    across fork), then opens keep-alive connections before the first task arrives.
+    worker_init covers --pool=solo, where no child processes are forked.
+    """
+    from backend.services.client_pool import client_registry
+    client_registry.reset()
+    client_registry.prewarm()
+
+def send_task_spec(spec):
+    """Send a task queued by the fair scheduler ({"task", "args", "task_id"}); routing as usual."""
+    celery_app.send_task(spec["task"], args=spec["args"], task_id=spec["task_id"])
+
+@task_postrun.connect
+def release_fair_slot(task_id=None, args=None, state=None, **kwargs):
+    """A finished analysis task hands its slot to the next submission in turn (not on retry)."""
+    job_id = job_of(args)
+    if job_id and state != states.RETRY:
+        fair_scheduler.release(job_id, send_task_spec)
+
+@task_revoked.connect
+def release_revoked_fair_slot(request=None, **kwargs):
+    job_id = job_of(getattr(request, "args", None))
+    if job_id:
+        fair_scheduler.release(job_id, send_task_spec)
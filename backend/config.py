@@ -24,6 +24,127 @@ class Settings:
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
     CELERY_BROKER_URL: str = os.getenv("CELERY_BROKER_URL", "redis://127.0.0.1:6379/0")
     CELERY_RESULT_BACKEND: str = os.getenv("CELERY_RESULT_BACKEND", "redis://127.0.0.1:6379/0")
+    # Identical concurrent /api/tasks/status polls within this many seconds share one backend lookup
+    TASK_STATUS_CACHE_TTL: float = float(os.getenv("TASK_STATUS_CACHE_TTL", "0.5"))
+    # Worker pool: LLM tasks mostly wait on the network, so one process runs many of them at once
+    # 工作进程池："threads"（默认，无需额外依赖）、"gevent"/"eventlet"（需安装对应库）或 "solo"/"prefork"
+    CELERY_WORKER_POOL: str = os.getenv("CELERY_WORKER_POOL", "threads")
+    # Concurrent tasks (streams) per worker process; keep LLM_MAX_CONNECTIONS at least this high
+    CELERY_WORKER_CONCURRENCY: int = int(os.getenv("CELERY_WORKER_CONCURRENCY", "32"))
+    # Tasks are acknowledged after they finish and re-delivered if the worker dies; a task not
+    # acknowledged within this time is handed to another worker, so it must exceed the longest task
+    CELERY_VISIBILITY_TIMEOUT: int = int(os.getenv("CELERY_VISIBILITY_TIMEOUT", "7200"))
+    # Task arguments and results: "compact-json" (compact UTF-8 JSON, zlib above the threshold) or "json"
+    # 任务参数与结果使用紧凑 JSON，超过阈值的负载再经 zlib 压缩，降低 Redis 内存与网络流量；旧的 JSON 消息仍可读取
+    CELERY_SERIALIZER: str = os.getenv("CELERY_SERIALIZER", "compact-json")
+    # Payloads of at least this many bytes are compressed (0 = never)
+    CELERY_COMPRESSION_THRESHOLD: int = int(os.getenv("CELERY_COMPRESSION_THRESHOLD", "1024"))
+    CELERY_COMPRESSION_LEVEL: int = int(os.getenv("CELERY_COMPRESSION_LEVEL", "6"))
+
+    # LLM Client Pool Settings
+    # 每个 (provider, base_url, api_key, timeout) 复用同一个 OpenAI 客户端及其 keep-alive 连接池
+    LLM_CLIENT_CACHE_SIZE: int = int(os.getenv("LLM_CLIENT_CACHE_SIZE", "32"))
+    # Connection pool size per base_url, should cover Celery concurrency / executor threads
+    LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "32"))
+    LLM_KEEPALIVE_EXPIRY: float = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+    # Comma separated providers whose connections are opened when a worker process starts
+    LLM_PREWARM_PROVIDERS: str = os.getenv("LLM_PREWARM_PROVIDERS", "deepseek")
+    # Micro-batching of selection questions: "provider:K,..." (K <= 1 disables batching for that provider)
+    # 将 K 道选择题打包进一次请求，共享同一份评分标准前缀
+    LLM_BATCH_SIZES: str = os.getenv("LLM_BATCH_SIZES", "")
+    # Max concurrent LLM streams driven directly on the asyncio event loop (desktop mode)
+    LLM_ASYNC_CONCURRENCY: int = int(os.getenv("LLM_ASYNC_CONCURRENCY", "200"))
+    # Replies cut off by max_tokens (finish_reason == "length") are continued instead of regenerated
+    # 输出被 max_tokens 截断时，将已生成内容回传给模型续写并拼接，最多续写的轮数（0 表示关闭）
+    LLM_MAX_CONTINUATIONS: int = int(os.getenv("LLM_MAX_CONTINUATIONS", "2"))
+
+    # Adaptive Rate Limiter Settings
+    # 按 (provider, api_key) 自适应限流：成功时并发窗口加性增长，遇到 429/5xx 时减半
+    LLM_LIMITER_ENABLED: bool = os.getenv("LLM_LIMITER_ENABLED", "true").lower() == "true"
+    LLM_LIMITER_INITIAL_CONCURRENCY: float = float(os.getenv("LLM_LIMITER_INITIAL_CONCURRENCY", "8"))
+    LLM_LIMITER_MIN_CONCURRENCY: float = float(os.getenv("LLM_LIMITER_MIN_CONCURRENCY", "1"))
+    LLM_LIMITER_MAX_CONCURRENCY: float = float(os.getenv("LLM_LIMITER_MAX_CONCURRENCY", "64"))
+    # Requests per minute per provider: "provider:RPM,..." (missing provider means unlimited)
+    LLM_LIMITER_RPM: str = os.getenv("LLM_LIMITER_RPM", "")
+    # Tokens per minute per provider (prompt + completion): "provider:TPM,..." (missing provider means unlimited)
+    # 按服务商配额的每分钟 token 数放行请求：按评分标准长度、题目长度与历史输出长度预估每个请求的 token 数
+    LLM_LIMITER_TPM: str = os.getenv("LLM_LIMITER_TPM", "")
+    # A lease not released within this time (crashed worker) no longer counts as in flight
+    LLM_LIMITER_LEASE_TTL: int = int(os.getenv("LLM_LIMITER_LEASE_TTL", "1900"))
+    LLM_LIMITER_ACQUIRE_TIMEOUT: float = float(os.getenv("LLM_LIMITER_ACQUIRE_TIMEOUT", "600"))
+    # Several 429s from the same burst only halve the window once
+    LLM_LIMITER_DECREASE_COOLDOWN: float = float(os.getenv("LLM_LIMITER_DECREASE_COOLDOWN", "2"))
+
+    # Mock Provider Settings
+    # provider="mock" 指向本地 OpenAI 兼容模拟服务 (python -m backend.services.mock_llm)，用于离线压测
+    MOCK_LLM_BASE_URL: str = os.getenv("MOCK_LLM_BASE_URL", "http://127.0.0.1:8900/v1")
+
+    # Hedged Requests Settings
+    # 某个模型的请求耗时超过其近期耗时的百分位数时，向指定的备用模型发送同一请求，取先返回的有效结果
+    LLM_HEDGE_ENABLED: bool = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+    LLM_HEDGE_PERCENTILE: float = float(os.getenv("LLM_HEDGE_PERCENTILE", "90"))
+    # No hedging until this many calls of a provider/model have been observed
+    LLM_HEDGE_MIN_SAMPLES: int = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+    LLM_HEDGE_MIN_DELAY: float = float(os.getenv("LLM_HEDGE_MIN_DELAY", "15"))
+    LLM_HEDGE_WINDOW: int = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+    # 同步路径 (Celery 线程) 的主请求与备用请求共用的线程数，默认每个 Celery 线程两个
+    LLM_HEDGE_MAX_WORKERS: int = int(os.getenv("LLM_HEDGE_MAX_WORKERS", "64"))
+
+    # Analysis Result Cache Settings
+    # 内存 LRU -> Redis -> SQLite (桌面模式) 三级缓存，避免重复上传的试卷再次调用大模型
+    ANALYSIS_CACHE_ENABLED: bool = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+    ANALYSIS_CACHE_TTL: int = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+    ANALYSIS_CACHE_MAX_ENTRIES: int = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "2000"))
+    ANALYSIS_CACHE_MAX_BYTES: int = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    # Empty means: SQLite tier only in desktop mode, stored under data/cache
+    ANALYSIS_CACHE_SQLITE_PATH: str = os.getenv("ANALYSIS_CACHE_SQLITE_PATH", "")
+    ANALYSIS_CACHE_SQLITE_MAX_BYTES: int = int(os.getenv("ANALYSIS_CACHE_SQLITE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+    # In-flight Request Coalescing (single-flight)
+    # 同一题目、模型、温度与评分标准版本的并发请求只调用一次大模型，其余请求等待并共享结果（跨 Worker 通过 Redis 锁交接）
+    SINGLE_FLIGHT_ENABLED: bool = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+    # Leader lock TTL in Redis, refreshed by a heartbeat: a crashed leader is replaced after this long
+    SINGLE_FLIGHT_LOCK_TTL: float = float(os.getenv("SINGLE_FLIGHT_LOCK_TTL", "30"))
+    # Followers give up waiting and call the provider themselves after this long
+    SINGLE_FLIGHT_WAIT_TIMEOUT: float = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "900"))
+    SINGLE_FLIGHT_POLL_INTERVAL: float = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", "0.25"))
+
+    # In-process Task Store Settings (desktop mode / Celery unavailable)
+    # 桌面模式任务状态：限制条目数与内存占用，已完成任务按 TTL 淘汰，可持久化到 SQLite 以便重启后恢复
+    TASK_STORE_MAX_ENTRIES: int = int(os.getenv("TASK_STORE_MAX_ENTRIES", "5000"))
+    TASK_STORE_MAX_BYTES: int = int(os.getenv("TASK_STORE_MAX_BYTES", str(128 * 1024 * 1024)))
+    # Finished tasks are dropped from memory after this many seconds
+    TASK_STORE_TTL: int = int(os.getenv("TASK_STORE_TTL", str(6 * 3600)))
+    # Empty means: SQLite persistence only in desktop mode, stored under data/tasks
+    TASK_STORE_SQLITE_PATH: str = os.getenv("TASK_STORE_SQLITE_PATH", "")
+    TASK_STORE_SQLITE_TTL: int = int(os.getenv("TASK_STORE_SQLITE_TTL", str(3 * 24 * 3600)))
+    # API keys are stripped from persisted task specs unless enabled; without them unfinished
+    # tasks cannot be re-queued after a restart and are reported as interrupted instead.
+    # 默认不保存密钥：重启后客户端通过 POST /api/analyze/{job_id}/resume 重新提供密钥继续未完成的分析
+    TASK_STORE_PERSIST_API_KEYS: bool = os.getenv("TASK_STORE_PERSIST_API_KEYS", "false").lower() == "true"
+
+    # Submission Checkpoint Settings
+    # 每道题×每个模型完成即按提交保存结果（不保存 API Key），重启后可续跑，只重新分析缺失或失败的部分
+    CHECKPOINT_TTL: int = int(os.getenv("CHECKPOINT_TTL", str(7 * 24 * 3600)))
+    # Empty means: Redis when available, otherwise SQLite in desktop mode, stored under data/checkpoints
+    CHECKPOINT_SQLITE_PATH: str = os.getenv("CHECKPOINT_SQLITE_PATH", "")
+
+    # Fair Scheduling Settings
+    # 多位老师同时提交时，各次提交轮流派发任务，避免第一份大试卷占满队列
+    # Dispatched but unfinished analysis tasks across all submissions (0 = no limit)
+    FAIR_MAX_IN_FLIGHT: int = int(os.getenv("FAIR_MAX_IN_FLIGHT", "64"))
+    # Dispatched but unfinished analysis tasks of one submission (0 = no limit)
+    FAIR_JOB_MAX_IN_FLIGHT: int = int(os.getenv("FAIR_JOB_MAX_IN_FLIGHT", "32"))
+
+    # In-process Job Runner Settings (desktop mode / Celery unavailable)
+    # 桌面模式任务执行器：限制同时运行的任务数与排队长度，按优先级派发，关闭时等待运行中的任务完成
+    # Tasks running at once (0 = derived from CPU count, LLM_ASYNC_CONCURRENCY and LLM_LIMITER_MAX_CONCURRENCY)
+    LOCAL_WORKERS: int = int(os.getenv("LOCAL_WORKERS", "0"))
+    # Queued tasks beyond this are rejected with 503 + Retry-After (0 = no limit)
+    LOCAL_QUEUE_MAX_SIZE: int = int(os.getenv("LOCAL_QUEUE_MAX_SIZE", "5000"))
+    # Seconds to wait for running tasks when the app closes; the rest is re-queued on the next start
+    LOCAL_SHUTDOWN_TIMEOUT: float = float(os.getenv("LOCAL_SHUTDOWN_TIMEOUT", "30"))
 
     # History Settings
     HISTORY_DIR: str = os.path.join(BASE_DIR, "data", "history")
@@ -31,6 +152,19 @@ class Settings:
 
 settings = Settings()
 
+def is_desktop_mode() -> bool:
+    """Desktop mode: RUNNING_DESKTOP env var OR running as a frozen executable (PyInstaller)"""
+    return os.environ.get("RUNNING_DESKTOP") == "true" or getattr(sys, 'frozen', False)
+
+def parse_provider_map(value: str) -> dict:
+    """Parse a "provider:N,provider:N" setting into {provider: N}, ignoring malformed items."""
+    result = {}
+    for item in (value or "").split(","):
+        provider, _, number = item.partition(":")
+        if provider.strip() and number.strip().isdigit():
+            result[provider.strip()] = int(number)
+    return result
+
 # Ensure directories exist
 try:
     os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
@@ -92,6 +92,11 @@ async def startup_event():
     logger = logging.getLogger(__name__)
     logger.info(f"Starting up {settings.PROJECT_NAME}...")
 
+    # Tasks finished before a restart stay retrievable; unfinished ones are re-queued
+    from backend.services.task_store import task_store
+    from backend.services.local_runner import local_runner
+    task_store.restore(dispatch=lambda task_id, factory: local_runner.submit("restored", [([task_id], factory)], bounded=False))
+
     # Automatically open browser in desktop mode or frozen executable
     if os.environ.get("RUNNING_DESKTOP") == "true" or getattr(sys, 'frozen', False):
         import webbrowser
@@ -103,3 +108,10 @@ async def startup_event():
         
         logger.info("Desktop mode detected: Scheduling browser auto-open...")
         Timer(1.5, open_browser).start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Let running in-process analysis finish; queued tasks stay PENDING in the task store
+    # and are re-queued on the next start
+    from backend.services.local_runner import local_runner
+    await local_runner.shutdown()
@@ -0,0 +1,244 @@
+from typing import Dict, Any, Optional, Callable
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+from backend.config import settings
+from backend.services.redis_client import get_redis, redis_call
+from backend.services.sqlite_file import SQLiteFile, default_sqlite_path
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "analysis-cache:"
+
+SQLITE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS analysis_cache ("
+    "key TEXT PRIMARY KEY, payload TEXT NOT NULL, size INTEGER NOT NULL, "
+    "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_cache_accessed ON analysis_cache(accessed_at)",
+]
+
+
+def normalize_content(content: str) -> str:
+    """Normalize question text so that whitespace/full-width differences do not change the key."""
+    text = unicodedata.normalize("NFKC", content or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_cache_key(content: str, mode: str, rubric_version: str, provider: str, model_name: str, temperature: float) -> str:
+    """Content-addressed key for one analysis result."""
+    parts = [
+        normalize_content(content),
+        mode or "",
+        rubric_version or "",
+        provider or "",
+        model_name or "",
+        f"{float(temperature if temperature is not None else 0.3):.3f}",
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Tiered cache for LLM analysis results:
+    1. in-process LRU (bounded by entry count and bytes)
+    2. Redis (shared between API and Celery workers)
+    3. optional on-disk SQLite file (desktop mode, survives restarts)
+
+    A hit in a lower tier is promoted to the tiers above it.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = None,
+        max_bytes: int = None,
+        ttl: int = None,
+        sqlite_path: Optional[str] = None,
+        sqlite_max_bytes: int = None,
+        redis_getter: Callable = get_redis,
+    ):
+        self.max_entries = max_entries or settings.ANALYSIS_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or settings.ANALYSIS_CACHE_MAX_BYTES
+        self.ttl = ttl or settings.ANALYSIS_CACHE_TTL
+        self.sqlite_path = sqlite_path
+        self.sqlite_max_bytes = sqlite_max_bytes or settings.ANALYSIS_CACHE_SQLITE_MAX_BYTES
+        self._redis_getter = redis_getter
+
+        # key -> (expires_at, size, payload_json)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._sqlite = SQLiteFile(sqlite_path, SQLITE_SCHEMA, "Analysis cache") if sqlite_path else None
+
+        self.counters = {
+            "memory_hits": 0,
+            "redis_hits": 0,
+            "sqlite_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+        }
+
+    # --- Public API ---
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        payload = self._memory_get(key)
+        if payload is not None:
+            self._count("memory_hits")
+            return json.loads(payload)
+
+        payload, ttl_left = self._redis_get(key)
+        if payload is not None:
+            self._count("redis_hits")
+            self._memory_set(key, payload, ttl_left or self.ttl)
+            return json.loads(payload)
+
+        payload, ttl_left = self._sqlite_get(key)
+        if payload is not None:
+            self._count("sqlite_hits")
+            self._memory_set(key, payload, ttl_left)
+            self._redis_set(key, payload, ttl_left)
+            return json.loads(payload)
+
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: Dict[str, Any], ttl: int = None):
+        ttl = ttl or self.ttl
+        try:
+            payload = json.dumps(value, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Analysis result not cacheable: {e}")
+            return
+        self._count("sets")
+        self._memory_set(key, payload, ttl)
+        self._redis_set(key, payload, ttl)
+        self._sqlite_set(key, payload, ttl)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+        hits = stats["memory_hits"] + stats["redis_hits"] + stats["sqlite_hits"]
+        total = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / total, 4) if total else 0.0
+        stats["sqlite_enabled"] = bool(self.sqlite_path)
+        return stats
+
+    # --- Tier 1: in-process LRU ---
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, size, payload = entry
+            if expires_at < time.time():
+                del self._memory[key]
+                self._memory_bytes -= size
+                return None
+            self._memory.move_to_end(key)
+            return payload
+
+    def _memory_set(self, key: str, payload: str, ttl: float):
+        size = len(payload.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= old[1]
+            self._memory[key] = (time.time() + ttl, size, payload)
+            self._memory_bytes += size
+            while self._memory and (len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes):
+                _, (_, old_size, _) = self._memory.popitem(last=False)
+                self._memory_bytes -= old_size
+                self.counters["evictions"] += 1
+
+    # --- Tier 2: Redis ---
+
+    def _redis_get(self, key: str):
+        def get(client):
+            pipe = client.pipeline()
+            pipe.get(REDIS_KEY_PREFIX + key)
+            pipe.ttl(REDIS_KEY_PREFIX + key)
+            payload, ttl_left = pipe.execute()
+            if payload is None:
+                return None, None
+            return payload.decode("utf-8"), (ttl_left if ttl_left and ttl_left > 0 else None)
+
+        found, entry = redis_call(self._redis_getter, get, "read analysis cache")
+        return entry if found else (None, None)
+
+    def _redis_set(self, key: str, payload: str, ttl: float):
+        redis_call(
+            self._redis_getter,
+            lambda client: client.setex(REDIS_KEY_PREFIX + key, int(max(ttl, 1)), payload),
+            "write analysis cache",
+        )
+
+    # --- Tier 3: SQLite (desktop) ---
+
+    def _sqlite_get(self, key: str):
+        if not self._sqlite:
+            return None, None
+
+        def get(conn):
+            now = time.time()
+            row = conn.execute(
+                "SELECT payload, expires_at FROM analysis_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, None
+            if row[1] < now:
+                conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                return None, None
+            conn.execute("UPDATE analysis_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0], row[1] - now
+
+        return self._sqlite.run(get, default=(None, None), action="read")
+
+    def _sqlite_set(self, key: str, payload: str, ttl: float):
+        if not self._sqlite:
+            return
+
+        def put(conn):
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, payload, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload.encode("utf-8")), now + ttl, now)
+            )
+            conn.execute("DELETE FROM analysis_cache WHERE expires_at < ?", (now,))
+            # Size-based eviction: drop least recently used rows until under budget
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM analysis_cache").fetchone()[0]
+            while total > self.sqlite_max_bytes:
+                row = conn.execute(
+                    "SELECT key, size FROM analysis_cache ORDER BY accessed_at ASC LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    break
+                conn.execute("DELETE FROM analysis_cache WHERE key = ?", (row[0],))
+                total -= row[1]
+                self._count("evictions")
+
+        self._sqlite.run(put)
+
+
+analysis_cache = AnalysisCache(
+    sqlite_path=default_sqlite_path(settings.ANALYSIS_CACHE_SQLITE_PATH, "cache", "analysis_cache.sqlite3")
+)
@@ -0,0 +1,97 @@
+from typing import Callable, Iterable, List
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+from backend.services.hedging import StreamCancelled
+from backend.services.redis_client import get_redis, mark_redis_failed
+
+logger = logging.getLogger(__name__)
+
+CANCEL_KEY_PREFIX = "cancel:"
+CANCEL_TTL = 24 * 3600
+
+# A streaming task looks at the flags at most this often
+CHECK_INTERVAL = 0.5
+
+# Task ids remembered by the in-process registry (desktop mode / Redis down)
+MAX_LOCAL_CANCELLED = 20000
+
+STOPPED_ERROR = "User stopped analysis"
+
+
+class TaskCancelled(StreamCancelled):
+    """The user stopped this task: it ends as REVOKED instead of being retried or reported as failed."""
+
+
+class CancellationRegistry:
+    """
+    Cancellation flags of individual tasks, set by /api/tasks/stop for the caller's tasks only.
+
+    Running tasks poll the flags between stream chunks (LLMService.is_cancelled), close the
+    HTTP stream and give their limiter slot back; tasks still queued see the flag when they
+    start and end without calling the model. Flags live in Redis so Celery workers see them,
+    and in process for desktop mode.
+    """
+
+    def __init__(self, redis_getter=get_redis):
+        self._redis_getter = redis_getter
+        self._lock = threading.Lock()
+        self._local: "OrderedDict[str, None]" = OrderedDict()
+
+    def cancel(self, task_ids: Iterable[str]) -> int:
+        task_ids = [tid for tid in task_ids if tid]
+        with self._lock:
+            for tid in task_ids:
+                self._local[tid] = None
+                self._local.move_to_end(tid)
+            while len(self._local) > MAX_LOCAL_CANCELLED:
+                self._local.popitem(last=False)
+        client = self._redis_getter()
+        if client is not None and task_ids:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for tid in task_ids:
+                    pipe.set(CANCEL_KEY_PREFIX + tid, 1, ex=CANCEL_TTL)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Failed to store cancellation flags in Redis: {e}")
+                mark_redis_failed()
+        return len(task_ids)
+
+    def is_cancelled(self, task_ids: List[str]) -> bool:
+        """True when every given task was stopped (a batch runs on as long as one question is wanted)."""
+        task_ids = [tid for tid in task_ids if tid]
+        if not task_ids:
+            return False
+        with self._lock:
+            remaining = [tid for tid in task_ids if tid not in self._local]
+        if not remaining:
+            return True
+        client = self._redis_getter()
+        if client is None:
+            return False
+        try:
+            return client.exists(*[CANCEL_KEY_PREFIX + tid for tid in remaining]) == len(remaining)
+        except Exception as e:
+            logger.warning(f"Failed to read cancellation flags from Redis: {e}")
+            mark_redis_failed()
+            return False
+
+    def checker(self, task_ids: List[str], interval: float = CHECK_INTERVAL) -> Callable[[], bool]:
+        """Callable for LLMService.is_cancelled: looks the flags up at most every `interval` seconds."""
+        state = {"checked_at": float("-inf"), "cancelled": False}
+
+        def cancelled() -> bool:
+            if not state["cancelled"]:
+                now = time.monotonic()
+                if now - state["checked_at"] >= interval:
+                    state["checked_at"] = now
+                    state["cancelled"] = self.is_cancelled(task_ids)
+            return state["cancelled"]
+
+        return cancelled
+
+
+cancellation = CancellationRegistry()
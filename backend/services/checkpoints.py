@@ -0,0 +1,202 @@
+from typing import Dict, Any, Optional, List, Callable, Tuple
+from collections import OrderedDict
+import json
+import threading
+import time
+
+from backend.config import settings
+from backend.services.redis_client import get_redis, redis_call
+from backend.services.sqlite_file import SQLiteFile, default_sqlite_path
+from backend.services.task_store import strip_secrets
+
+REDIS_KEY_PREFIX = "checkpoint:"
+SPEC_KEY_SUFFIX = ":spec"
+RESULTS_KEY_SUFFIX = ":results"
+
+SQLITE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS checkpoint_specs ("
+    "submission_id TEXT PRIMARY KEY, spec TEXT NOT NULL, updated_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS checkpoint_results ("
+    "submission_id TEXT NOT NULL, pair TEXT NOT NULL, entry TEXT NOT NULL, updated_at REAL NOT NULL, "
+    "PRIMARY KEY (submission_id, pair))",
+]
+
+# Submissions remembered by the in-process store (Redis down outside desktop mode)
+MAX_LOCAL_SUBMISSIONS = 200
+
+
+def _pair_field(question_id: Any, model_label: str) -> str:
+    return json.dumps([str(question_id), model_label], ensure_ascii=False)
+
+
+def is_completed(entry: Optional[Dict[str, Any]]) -> bool:
+    """True for a pair that finished with a usable analysis (not an error result)."""
+    return bool(entry) and entry.get("status") == "SUCCESS"
+
+
+class CheckpointStore:
+    """
+    Durable record of an analysis submission: its spec (questions, model configs without
+    API keys, task layout) and every (question, model) result as soon as it finishes.
+
+    Lets an exam interrupted by an API or worker restart be resumed: only the pairs without
+    a successful result are dispatched again. Stored in Redis (shared by the API and Celery
+    workers), in a SQLite file in desktop mode, or in process as a last resort.
+    A success is never overwritten by a later failure of the same pair.
+    """
+
+    def __init__(self, ttl: int = None, sqlite_path: Optional[str] = None, redis_getter: Callable = get_redis):
+        self.ttl = ttl or settings.CHECKPOINT_TTL
+        self.sqlite_path = sqlite_path
+        self._redis_getter = redis_getter
+        self._lock = threading.Lock()
+        self._sqlite = SQLiteFile(sqlite_path, SQLITE_SCHEMA, "Checkpoint") if sqlite_path else None
+        # submission_id -> {"spec": ..., "results": {field: entry}}
+        self._local: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    # --- Public API ---
+
+    def save_spec(self, submission_id: str, questions: List[Dict[str, Any]], configs: List[Dict[str, Any]],
+                  tasks: List[Dict[str, Any]]):
+        """Store (or replace, after a resume) what the submission consists of. API keys are never written."""
+        spec = {
+            "questions": questions,
+            "configs": strip_secrets(configs),
+            "tasks": tasks,
+            "saved_at": round(time.time(), 3),
+        }
+        payload = json.dumps(spec, ensure_ascii=False, default=str)
+
+        def save(client):
+            key = REDIS_KEY_PREFIX + submission_id
+            pipe = client.pipeline()
+            pipe.set(key + SPEC_KEY_SUFFIX, payload, ex=self.ttl)
+            pipe.expire(key + RESULTS_KEY_SUFFIX, self.ttl)
+            pipe.execute()
+
+        if redis_call(self._redis_getter, save, f"save checkpoint {submission_id}")[0]:
+            return
+        if self._sqlite:
+            self._sqlite_write(
+                "INSERT OR REPLACE INTO checkpoint_specs (submission_id, spec, updated_at) VALUES (?, ?, ?)",
+                (submission_id, payload, time.time())
+            )
+            return
+        with self._lock:
+            self._local_submission(submission_id)["spec"] = json.loads(payload)
+
+    def record(self, submission_id: str, question_id: Any, model_label: str, task_id: str, status: str,
+               result: Any = None, error: str = None):
+        """Checkpoint one finished pair; an analysis that came back as an error result counts as failed."""
+        inner = result.get("result") if isinstance(result, dict) else None
+        if status == "SUCCESS" and isinstance(inner, dict) and "error" in inner:
+            status, error = "FAILURE", str(inner["error"])
+        entry = {"status": status, "task_id": task_id, "finished_at": round(time.time(), 3)}
+        if status == "SUCCESS":
+            entry["result"] = result
+        elif error is not None:
+            entry["error"] = error
+        field = _pair_field(question_id, model_label)
+        payload = json.dumps(entry, ensure_ascii=False, default=str)
+        success = status == "SUCCESS"
+
+        def save(client):
+            key = REDIS_KEY_PREFIX + submission_id + RESULTS_KEY_SUFFIX
+            pipe = client.pipeline()
+            if success:
+                pipe.hset(key, field, payload)
+            else:
+                pipe.hsetnx(key, field, payload)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+        if redis_call(self._redis_getter, save, f"checkpoint {submission_id}")[0]:
+            return
+        if self._sqlite:
+            self._sqlite_write(
+                ("INSERT OR REPLACE" if success else "INSERT OR IGNORE") +
+                " INTO checkpoint_results (submission_id, pair, entry, updated_at) VALUES (?, ?, ?, ?)",
+                (submission_id, field, payload, time.time())
+            )
+            return
+        with self._lock:
+            results = self._local_submission(submission_id)["results"]
+            if success or field not in results:
+                results[field] = json.loads(payload)
+
+    def load(self, submission_id: str) -> Optional[Dict[str, Any]]:
+        """{"spec", "results": {(question_id, model_label): entry}} or None for an unknown submission."""
+        raw = self._load_raw(submission_id)
+        if raw is None:
+            return None
+        spec, results = raw
+        return {
+            "spec": spec,
+            "results": {tuple(json.loads(field)): entry for field, entry in results.items()},
+        }
+
+    # --- Internals ---
+
+    def _load_raw(self, submission_id: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        def load(client):
+            key = REDIS_KEY_PREFIX + submission_id
+            pipe = client.pipeline(transaction=False)
+            pipe.get(key + SPEC_KEY_SUFFIX)
+            pipe.hgetall(key + RESULTS_KEY_SUFFIX)
+            spec, results = pipe.execute()
+            if spec is None:
+                return None
+            return json.loads(spec), {
+                (k.decode("utf-8") if isinstance(k, bytes) else k): json.loads(v) for k, v in results.items()
+            }
+
+        found, raw = redis_call(self._redis_getter, load, f"read checkpoint {submission_id}")
+        if found:
+            return raw
+        if self._sqlite:
+            return self._sqlite_load(submission_id)
+        with self._lock:
+            submission = self._local.get(submission_id)
+            if submission is None or submission["spec"] is None:
+                return None
+            return json.loads(json.dumps(submission["spec"])), dict(submission["results"])
+
+    def _local_submission(self, submission_id: str) -> Dict[str, Any]:
+        # Caller holds the lock
+        submission = self._local.get(submission_id)
+        if submission is None:
+            submission = self._local[submission_id] = {"spec": None, "results": {}}
+            while len(self._local) > MAX_LOCAL_SUBMISSIONS:
+                self._local.popitem(last=False)
+        return submission
+
+    # --- SQLite persistence ---
+
+    def _sqlite_write(self, sql: str, params: tuple):
+        def write(conn):
+            conn.execute(sql, params)
+            expired = time.time() - self.ttl
+            conn.execute("DELETE FROM checkpoint_specs WHERE updated_at < ?", (expired,))
+            conn.execute("DELETE FROM checkpoint_results WHERE updated_at < ?", (expired,))
+
+        self._sqlite.run(write)
+
+    def _sqlite_load(self, submission_id: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        def load(conn):
+            spec = conn.execute(
+                "SELECT spec FROM checkpoint_specs WHERE submission_id = ? AND updated_at >= ?",
+                (submission_id, time.time() - self.ttl)
+            ).fetchone()
+            if spec is None:
+                return None
+            rows = conn.execute(
+                "SELECT pair, entry FROM checkpoint_results WHERE submission_id = ?", (submission_id,)
+            ).fetchall()
+            return json.loads(spec[0]), {pair: json.loads(entry) for pair, entry in rows}
+
+        return self._sqlite.run(load, action="read")
+
+
+checkpoint_store = CheckpointStore(
+    sqlite_path=default_sqlite_path(settings.CHECKPOINT_SQLITE_PATH, "checkpoints", "checkpoints.sqlite3")
+)
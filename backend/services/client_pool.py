@@ -0,0 +1,298 @@
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+from backend.config import settings
+from backend.services.task_queues import DEFAULT_PRIORITY
+
+logger = logging.getLogger(__name__)
+
+# Default Base URLs
+DEFAULT_BASE_URLS = {
+    "deepseek": "https://api.deepseek.com/v1",
+    "doubao": "https://ark.cn-beijing.volces.com/api/v3",
+    "qwen": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+    "kimi": "https://api.moonshot.cn/v1",
+    "zhipu": "https://open.bigmodel.cn/api/paas/v4",
+    # Local stub server for offline load testing (backend/services/mock_llm.py)
+    "mock": settings.MOCK_LLM_BASE_URL,
+}
+
+# Configure retries
+# User requirement: 3 retries for Doubao (and likely others)
+DEFAULT_MAX_RETRIES = 3
+
+
+def client_max_retries() -> int:
+    """
+    Retries done inside the OpenAI client. With the adaptive limiter enabled, LLMService
+    retries itself so 429/5xx responses are seen by the limiter instead of being hidden.
+    """
+    return 0 if settings.LLM_LIMITER_ENABLED else DEFAULT_MAX_RETRIES
+
+
+def resolve_base_url(provider: str, base_url: Optional[str] = None) -> str:
+    """
+    Resolve the final base URL for a provider.
+    Uses the user supplied base_url if available, otherwise falls back to the provider map.
+    """
+    final_base_url = base_url if base_url else DEFAULT_BASE_URLS.get(provider)
+
+    if not final_base_url:
+        # Default or fallback
+        final_base_url = "https://api.deepseek.com/v1"
+
+    # Sanitize Base URL: Remove /chat/completions if present
+    # This allows users to paste the full endpoint URL without breaking the OpenAI client
+    if final_base_url.endswith("/chat/completions"):
+        final_base_url = final_base_url.replace("/chat/completions", "")
+
+    return final_base_url.rstrip("/")
+
+
+class LLMClientRegistry:
+    """
+    Process-wide registry of OpenAI clients.
+
+    Clients are keyed by (provider, resolved base_url, api_key, timeout) and kept in a
+    bounded LRU. All clients that talk to the same base_url share one httpx connection
+    pool, so TLS sessions stay open across questions, models and students. Pools live
+    until reset(), there is one per base_url in use.
+    """
+
+    def __init__(self, max_clients: int = None):
+        self.max_clients = max_clients or settings.LLM_CLIENT_CACHE_SIZE
+        self._clients: "OrderedDict[Tuple[str, str, str, float], OpenAI]" = OrderedDict()
+        self._http_pools: Dict[str, httpx.Client] = {}
+        # Async clients are bound to the event loop that created their pool
+        self._async_clients: "OrderedDict[tuple, AsyncOpenAI]" = OrderedDict()
+        self._async_pools: Dict[tuple, httpx.AsyncClient] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _pool_limits(self, max_connections: int = None) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=max_connections or settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+        )
+
+    def _build_http_pool(self) -> httpx.Client:
+        return DefaultHttpxClient(limits=self._pool_limits())
+
+    def _get_http_pool(self, base_url: str) -> httpx.Client:
+        # Caller must hold self._lock
+        pool = self._http_pools.get(base_url)
+        if pool is None:
+            pool = self._build_http_pool()
+            self._http_pools[base_url] = pool
+        return pool
+
+    def get_client(self, provider: str, api_key: str, base_url: Optional[str] = None, timeout: float = 1800.0) -> OpenAI:
+        final_base_url = resolve_base_url(provider, base_url)
+        key = (provider, final_base_url, api_key, float(timeout))
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return client
+
+            self.misses += 1
+            client = OpenAI(
+                api_key=api_key,
+                base_url=final_base_url,
+                timeout=timeout,
+                max_retries=client_max_retries(),
+                http_client=self._get_http_pool(final_base_url),
+            )
+            self._clients[key] = client
+
+            # Evict least recently used clients. Only the registry entry is dropped: an evicted
+            # client may still be streaming in another thread (or be held by an LLMService), so
+            # the shared http pool stays open for it and for the next client of that base_url.
+            # Pools are closed by reset().
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+
+            return client
+
+    def get_async_client(self, provider: str, api_key: str, base_url: Optional[str] = None, timeout: float = 1800.0) -> AsyncOpenAI:
+        """
+        AsyncOpenAI counterpart of get_client. Must be called from a running event loop.
+        The async pool is sized for LLM_ASYNC_CONCURRENCY concurrent streams.
+        """
+        loop = asyncio.get_running_loop()
+        final_base_url = resolve_base_url(provider, base_url)
+        key = (provider, final_base_url, api_key, float(timeout), loop)
+        pool_key = (final_base_url, loop)
+
+        with self._lock:
+            client = self._async_clients.get(key)
+            if client is not None:
+                self._async_clients.move_to_end(key)
+                self.hits += 1
+                return client
+
+            self.misses += 1
+            pool = self._async_pools.get(pool_key)
+            if pool is None:
+                max_conn = max(settings.LLM_MAX_CONNECTIONS, settings.LLM_ASYNC_CONCURRENCY)
+                pool = DefaultAsyncHttpxClient(limits=self._pool_limits(max_conn))
+                self._async_pools[pool_key] = pool
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=final_base_url,
+                timeout=timeout,
+                max_retries=client_max_retries(),
+                http_client=pool,
+            )
+            self._async_clients[key] = client
+
+            # Drop clients whose loop has been closed, then enforce the LRU bound
+            for old_key in [k for k in self._async_clients if k[4].is_closed()]:
+                del self._async_clients[old_key]
+            while len(self._async_clients) > self.max_clients:
+                self._async_clients.popitem(last=False)
+            live_pools = {(k[1], k[4]) for k in self._async_clients}
+            for old_pool_key in [k for k in self._async_pools if k not in live_pools]:
+                # Unreferenced pools are left for GC; closing needs their (possibly closed) loop
+                del self._async_pools[old_pool_key]
+
+            return client
+
+    def prewarm(self, providers: Optional[list] = None, timeout: float = 5.0) -> int:
+        """
+        Open keep-alive connections to the given providers so the first real
+        request skips the TCP/TLS handshake. Returns the number of warmed pools.
+        """
+        if providers is None:
+            providers = [p.strip() for p in settings.LLM_PREWARM_PROVIDERS.split(",") if p.strip()]
+
+        warmed = 0
+        for provider in providers:
+            base_url = resolve_base_url(provider)
+            with self._lock:
+                pool = self._get_http_pool(base_url)
+            try:
+                # Any response (usually 401 without a key) means the connection is established
+                pool.get(f"{base_url}/models", timeout=timeout)
+                warmed += 1
+            except Exception as e:
+                logger.warning(f"Prewarm failed for {provider} ({base_url}): {e}")
+        logger.info(f"LLM client registry prewarmed {warmed}/{len(providers)} providers")
+        return warmed
+
+    def reset(self):
+        """Drop all clients and pools, e.g. after a fork where sockets must not be shared."""
+        with self._lock:
+            for pool in self._http_pools.values():
+                try:
+                    pool.close()
+                except Exception:
+                    pass
+            self._clients.clear()
+            self._http_pools.clear()
+            self._async_clients.clear()
+            self._async_pools.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "pools": len(self._http_pools),
+                "async_clients": len(self._async_clients),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+client_registry = LLMClientRegistry()
+
+
+class PrioritySemaphore:
+    """
+    asyncio semaphore that hands freed slots to the most urgent waiter (lowest priority value,
+    FIFO within a priority), so an interactive retry does not queue behind a whole exam.
+    `async with sem` acquires with the default (bulk) priority, `async with sem.slot(p)` with p.
+    """
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters = []  # heap of (priority, sequence, future)
+        self._sequence = itertools.count()
+
+    def locked(self) -> bool:
+        return self._value == 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    async def acquire(self, priority: int = DEFAULT_PRIORITY) -> bool:
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return True
+        entry = (priority, next(self._sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, entry)
+        try:
+            await entry[2]
+        except asyncio.CancelledError:
+            if entry[2].done() and not entry[2].cancelled():
+                # The slot was handed over just before the cancellation: pass it on
+                self.release()
+            elif entry in self._waiters:
+                # Otherwise release() may already have popped (and skipped) the cancelled entry
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+        return True
+
+    def release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(True)
+                return
+        self._value += 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = DEFAULT_PRIORITY):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+_async_semaphores: Dict[asyncio.AbstractEventLoop, PrioritySemaphore] = {}
+
+
+def get_async_semaphore() -> PrioritySemaphore:
+    """Per-event-loop semaphore bounding concurrent async LLM streams."""
+    loop = asyncio.get_running_loop()
+    sem = _async_semaphores.get(loop)
+    if sem is None:
+        for old_loop in [l for l in _async_semaphores if l.is_closed()]:
+            del _async_semaphores[old_loop]
+        sem = PrioritySemaphore(settings.LLM_ASYNC_CONCURRENCY)
+        _async_semaphores[loop] = sem
+    return sem
@@ -0,0 +1,301 @@
+from typing import Dict, Any, Optional, List
+import asyncio
+import functools
+import json
+import logging
+import threading
+import time
+
+import redis
+
+from backend.config import settings
+from backend.services.jobs import job_store
+from backend.services.checkpoints import checkpoint_store
+from backend.services.redis_client import get_redis, redis_call
+from backend.services.sqlite_file import run_off_loop
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "job-events:"
+# Per-job hash task_id -> last state event, so late subscribers start from the current state
+STATE_KEY_SUFFIX = ":state"
+TASKS_KEY_SUFFIX = ":tasks"
+# Per-task key -> job, question and model of the task (see revoke_unstarted)
+TASK_KEY_PREFIX = "job-task:"
+JOB_TTL = 24 * 3600
+
+TERMINAL_STATUSES = {"SUCCESS", "FAILURE", "REVOKED"}
+
+# Jobs remembered by the in-process broadcaster
+MAX_LOCAL_JOBS = 200
+
+# Minimum interval between two progress events of the same task
+PROGRESS_INTERVAL = 1.0
+
+
+class EventBroadcaster:
+    """
+    In-process fan-out of job events to asyncio subscribers (one queue per SSE connection).
+    publish() may be called from any thread. Also keeps the task list and the last state
+    event per task, which is the only store in desktop mode.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # job_id -> list of (loop, queue)
+        self._subscribers: Dict[str, List[tuple]] = {}
+        self._tasks: Dict[str, List[str]] = {}
+        self._states: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._task_info: Dict[str, Dict[str, Any]] = {}
+
+    def register_job(self, job_id: str, task_ids: List[str], task_info: Optional[Dict[str, Dict[str, Any]]] = None):
+        with self._lock:
+            self._tasks.setdefault(job_id, []).extend(task_ids)
+            self._states.setdefault(job_id, {})
+            self._task_info.update(task_info or {})
+            # Forget the oldest jobs (dicts keep insertion order)
+            while len(self._tasks) > MAX_LOCAL_JOBS:
+                old_job = next(iter(self._tasks))
+                for task_id in self._tasks.pop(old_job):
+                    self._task_info.pop(task_id, None)
+                self._states.pop(old_job, None)
+
+    def task_info(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {tid: self._task_info[tid] for tid in task_ids if tid in self._task_info}
+
+    def job_tasks(self, job_id: str) -> Optional[List[str]]:
+        with self._lock:
+            tasks = self._tasks.get(job_id)
+            return list(tasks) if tasks is not None else None
+
+    def snapshot(self, job_id: str) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self._states.get(job_id, {}))
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(job_id, []).append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = [s for s in self._subscribers.get(job_id, []) if s[1] is not queue]
+            if subscribers:
+                self._subscribers[job_id] = subscribers
+            else:
+                self._subscribers.pop(job_id, None)
+
+    def publish(self, job_id: str, event: Dict[str, Any]):
+        with self._lock:
+            if event.get("type") == "state":
+                self._states.setdefault(job_id, {})[event["task_id"]] = event
+            subscribers = list(self._subscribers.get(job_id, []))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                # Subscriber loop already closed
+                self.unsubscribe(job_id, queue)
+
+
+broadcaster = EventBroadcaster()
+
+
+class _RedisBridge:
+    """
+    Forwards events published by Celery workers (Redis pub/sub) to the local broadcaster.
+    Runs in one daemon thread per API process, started by the first SSE subscriber.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="job-events-bridge", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                # Dedicated connection without socket_timeout: pub/sub blocks between messages
+                client = redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=1)
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(CHANNEL_PREFIX + "*")
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if not message:
+                        continue
+                    channel = message["channel"].decode("utf-8")
+                    job_id = channel[len(CHANNEL_PREFIX):]
+                    broadcaster.publish(job_id, json.loads(message["data"]))
+            except Exception as e:
+                logger.warning(f"Job event bridge lost Redis ({e}), reconnecting in 5s")
+                time.sleep(5)
+
+
+redis_bridge = _RedisBridge()
+
+
+# --- Publishing side (API process, Celery workers, desktop background tasks) ---
+
+def register_job(job_id: str, task_ids: List[str], task_info: Optional[Dict[str, Dict[str, Any]]] = None):
+    """
+    Record which tasks belong to a job so the event stream knows when it is finished.
+    task_info: task_id -> {"question_id", "model_label", "checkpoint_id"}, so that a task
+    stopped before it started can still report for it (revoke_unstarted).
+    """
+    task_info = {tid: dict(info, job_id=job_id) for tid, info in (task_info or {}).items()}
+    broadcaster.register_job(job_id, task_ids, task_info)
+
+    def save(client):
+        key = CHANNEL_PREFIX + job_id + TASKS_KEY_SUFFIX
+        pipe = client.pipeline()
+        pipe.rpush(key, *task_ids)
+        pipe.expire(key, JOB_TTL)
+        for tid, info in task_info.items():
+            pipe.set(TASK_KEY_PREFIX + tid, json.dumps(info, ensure_ascii=False), ex=JOB_TTL)
+        pipe.execute()
+
+    redis_call(get_redis, save, f"register job {job_id}")
+
+
+def publish(job_id: Optional[str], event: Dict[str, Any]):
+    """Publish one event: via Redis pub/sub when available, otherwise in-process."""
+    if not job_id:
+        return
+
+    def send(client):
+        payload = json.dumps(event, ensure_ascii=False)
+        pipe = client.pipeline()
+        if event.get("type") == "state":
+            state_key = CHANNEL_PREFIX + job_id + STATE_KEY_SUFFIX
+            pipe.hset(state_key, event["task_id"], payload)
+            pipe.expire(state_key, JOB_TTL)
+        pipe.publish(CHANNEL_PREFIX + job_id, payload)
+        pipe.execute()
+
+    if not redis_call(get_redis, send, "publish job event")[0]:
+        broadcaster.publish(job_id, event)
+
+
+def job_tasks(job_id: str) -> Optional[List[str]]:
+    tasks = broadcaster.job_tasks(job_id)
+    if tasks is not None:
+        return tasks
+    _, tasks = redis_call(get_redis, lambda client: client.lrange(CHANNEL_PREFIX + job_id + TASKS_KEY_SUFFIX, 0, -1),
+                          f"read job {job_id}")
+    return [t.decode("utf-8") for t in tasks] if tasks else None
+
+
+def job_snapshot(job_id: str) -> Dict[str, Dict[str, Any]]:
+    """Last state event per task of a job."""
+    found, raw = redis_call(get_redis, lambda client: client.hgetall(CHANNEL_PREFIX + job_id + STATE_KEY_SUFFIX),
+                            f"read job {job_id} state")
+    if not found:
+        return broadcaster.snapshot(job_id)
+    return {k.decode("utf-8"): json.loads(v) for k, v in raw.items()}
+
+
+def _task_info(task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    found = broadcaster.task_info(task_ids)
+    missing = [tid for tid in task_ids if tid not in found]
+    if missing:
+        ok, raw = redis_call(get_redis, lambda client: client.mget([TASK_KEY_PREFIX + tid for tid in missing]), "read job tasks")
+        if ok:
+            found.update((tid, json.loads(info)) for tid, info in zip(missing, raw) if info)
+    return found
+
+
+def revoke_unstarted(task_ids: List[str], error: str) -> int:
+    """
+    End as REVOKED the stopped tasks of a job that never started: dropped before dispatch or
+    revoked before a worker took them, they publish no state of their own, so the job would
+    never finish. Tasks that started (any state event) report their own end. Returns the count.
+    """
+    info = _task_info(list(task_ids))
+    by_job: Dict[str, List[str]] = {}
+    for tid, entry in info.items():
+        by_job.setdefault(entry["job_id"], []).append(tid)
+    revoked = 0
+    for job_id, tids in by_job.items():
+        started = job_snapshot(job_id)
+        for tid in tids:
+            if tid in started:
+                continue
+            entry = info[tid]
+            emitter = TaskEventEmitter(job_id, tid, entry.get("question_id"), entry.get("model_label"), entry.get("checkpoint_id"))
+            emitter.state("REVOKED", error=error)
+            revoked += 1
+    return revoked
+
+
+class TaskEventEmitter:
+    """Publishes the events of one (question, model) task of a job."""
+
+    def __init__(self, job_id: str, task_id: str, question_id: Any = None, model_label: str = None,
+                 checkpoint_id: Optional[str] = None):
+        self.job_id = job_id
+        self.task_id = task_id
+        self.question_id = question_id
+        self.model_label = model_label
+        # Submission the result is checkpointed under (the original job when resumed)
+        self.checkpoint_id = checkpoint_id or job_id
+        self._last_progress = 0.0
+
+    def _event(self, event_type: str, **fields) -> Dict[str, Any]:
+        event = {
+            "type": event_type,
+            "job_id": self.job_id,
+            "task_id": self.task_id,
+            "question_id": self.question_id,
+            "model_label": self.model_label,
+            "ts": round(time.time(), 3),
+        }
+        event.update(fields)
+        return event
+
+    def state(self, status: str, result: Any = None, error: str = None):
+        fields = {"status": status}
+        if result is not None:
+            fields["result"] = result
+        if error is not None:
+            fields["error"] = error
+        if status in TERMINAL_STATUSES:
+            entry = {"question_id": self.question_id, "model_label": self.model_label}
+            entry.update((k, v) for k, v in fields.items() if k != "status")
+            # In process the stores may write to SQLite: keep that off the event loop
+            run_off_loop(functools.partial(self._record, status, entry, result, error))
+        publish(self.job_id, self._event("state", **fields))
+
+    def _record(self, status: str, entry: Dict[str, Any], result: Any, error: Optional[str]):
+        job_store.record(self.job_id, self.task_id, status, entry)
+        checkpoint_store.record(self.checkpoint_id, self.question_id, self.model_label, self.task_id, status, result, error)
+
+    def progress(self, tokens: int, force: bool = False):
+        """Tokens (stream chunks) generated so far, throttled to one event per PROGRESS_INTERVAL."""
+        now = time.time()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        publish(self.job_id, self._event("progress", tokens=tokens))
+
+    def partial(self, path, value: Any):
+        publish(self.job_id, self._event("partial", field=".".join(path), value=value))
+
+
+def task_emitter(config: Dict[str, Any], task_id: Optional[str], question_id: Any = None) -> Optional[TaskEventEmitter]:
+    """Emitter for a task, or None when the request is not part of an event-streamed job."""
+    if not config.get("job_id") or not task_id:
+        return None
+    label = config.get("name_label") or config.get("provider")
+    return TaskEventEmitter(config["job_id"], task_id, question_id, label, config.get("checkpoint_id"))
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
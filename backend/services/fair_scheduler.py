@@ -0,0 +1,281 @@
+from typing import Dict, Any, Optional, List, Callable, Iterable
+import json
+import logging
+import threading
+
+from backend.config import settings
+from backend.services.redis_client import get_redis, mark_redis_failed
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "fair:"
+RING_KEY = KEY_PREFIX + "ring"
+TOTAL_KEY = KEY_PREFIX + "in_flight"
+STATE_TTL = 24 * 3600
+
+# Shared by the scripts below. The ring lists the active jobs; every step rotates it
+# (tail to head) and hands one pending task of that job to the caller, until the total
+# cap is reached or a full turn finds nothing dispatchable (job capped or empty).
+# Jobs without pending and in-flight tasks leave the ring.
+FILL_FUNCTION = """
+local function fill(prefix, job_cap, total_cap, ttl)
+    local total = tonumber(redis.call('GET', KEYS[2]) or '0')
+    local dispatched = {}
+    local jobs = redis.call('LLEN', KEYS[1])
+    local idle = 0
+    while (total_cap <= 0 or total < total_cap) and idle < jobs do
+        local job = redis.call('RPOPLPUSH', KEYS[1], KEYS[1])
+        local pending_key = prefix .. job .. ':pending'
+        local in_flight_key = prefix .. job .. ':in_flight'
+        local in_flight = tonumber(redis.call('GET', in_flight_key) or '0')
+        if redis.call('LLEN', pending_key) == 0 then
+            if in_flight <= 0 then
+                redis.call('LREM', KEYS[1], 1, job)
+                redis.call('DEL', in_flight_key)
+                jobs = jobs - 1
+            else
+                idle = idle + 1
+            end
+        elseif job_cap > 0 and in_flight >= job_cap then
+            idle = idle + 1
+        else
+            table.insert(dispatched, redis.call('LPOP', pending_key))
+            redis.call('SET', in_flight_key, in_flight + 1, 'EX', ttl)
+            total = total + 1
+            idle = 0
+        end
+    end
+    redis.call('SET', KEYS[2], total, 'EX', ttl)
+    redis.call('EXPIRE', KEYS[1], ttl)
+    return dispatched
+end
+"""
+
+# KEYS: ring, total in-flight counter
+# ARGV: prefix, job cap, total cap, ttl, job_id, task specs (JSON)...
+SUBMIT_SCRIPT = FILL_FUNCTION + """
+local pending_key = ARGV[1] .. ARGV[5] .. ':pending'
+for i = 6, #ARGV do
+    redis.call('RPUSH', pending_key, ARGV[i])
+end
+redis.call('EXPIRE', pending_key, ARGV[4])
+redis.call('LREM', KEYS[1], 0, ARGV[5])
+-- The tail is served next: a new submission gets the next free slot
+redis.call('RPUSH', KEYS[1], ARGV[5])
+return fill(ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4])
+"""
+
+# KEYS: ring, total in-flight counter
+# ARGV: prefix, job cap, total cap, ttl, job_id of the finished task
+RELEASE_SCRIPT = FILL_FUNCTION + """
+local in_flight_key = ARGV[1] .. ARGV[5] .. ':in_flight'
+local in_flight = tonumber(redis.call('GET', in_flight_key) or '0')
+if in_flight > 0 then
+    redis.call('SET', in_flight_key, in_flight - 1, 'EX', ARGV[4])
+    local total = tonumber(redis.call('GET', KEYS[2]) or '0')
+    if total > 0 then
+        redis.call('SET', KEYS[2], total - 1, 'EX', ARGV[4])
+    end
+end
+return fill(ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4])
+"""
+
+# Specs handed out by fill() but not sent (broker error) go back to the head of their job's
+# pending list and give their reserved slots back, so the cap does not shrink for good.
+# KEYS: ring, total in-flight counter
+# ARGV: prefix, ttl, then (job_id, task spec JSON) pairs, last spec first
+RESTORE_SCRIPT = """
+local total = tonumber(redis.call('GET', KEYS[2]) or '0')
+for i = 3, #ARGV, 2 do
+    local job = ARGV[i]
+    local pending_key = ARGV[1] .. job .. ':pending'
+    local in_flight_key = ARGV[1] .. job .. ':in_flight'
+    redis.call('LPUSH', pending_key, ARGV[i + 1])
+    redis.call('EXPIRE', pending_key, ARGV[2])
+    local in_flight = tonumber(redis.call('GET', in_flight_key) or '0')
+    if in_flight > 0 then
+        redis.call('SET', in_flight_key, in_flight - 1, 'EX', ARGV[2])
+    end
+    if total > 0 then
+        total = total - 1
+    end
+    redis.call('LREM', KEYS[1], 0, job)
+    redis.call('RPUSH', KEYS[1], job)
+end
+redis.call('SET', KEYS[2], total, 'EX', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return total
+"""
+
+
+class DispatchError(Exception):
+    """`send` failed for a spec; `sent_task_ids` lists the Celery task ids that did reach the broker."""
+
+    def __init__(self, message: str, sent_task_ids: List[str]):
+        super().__init__(message)
+        self.sent_task_ids = sent_task_ids
+
+
+class FairScheduler:
+    """
+    Round-robin dispatch of analysis tasks across concurrent submissions (jobs).
+
+    Instead of pushing all tasks of a submission at once (a 300-task paper would then sit
+    in front of everyone else in the FIFO queue), each job keeps its tasks pending here and
+    only `max_in_flight` tasks in total, at most `job_max_in_flight` per job, are dispatched.
+    Whenever one finishes, the freed slot goes to the next job in turn, so a teacher who
+    submits behind a large paper sees first results after a single task, not after the paper.
+
+    Celery tasks are kept in Redis and refilled by the worker that finished a task
+    (see celery_app); in-process tasks (desktop mode) are ordered the same way by local_runner.
+    """
+
+    def __init__(self, max_in_flight: int = None, job_max_in_flight: int = None, redis_getter=get_redis):
+        self.max_in_flight = settings.FAIR_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+        self.job_max_in_flight = settings.FAIR_JOB_MAX_IN_FLIGHT if job_max_in_flight is None else job_max_in_flight
+        self._redis_getter = redis_getter
+        self._scripts: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.counters = {"submitted": 0, "dispatched": 0, "released": 0, "discarded": 0, "restored": 0}
+
+    # --- Celery tasks (state in Redis, shared with the workers) ---
+
+    def submit(self, job_id: str, specs: List[Dict[str, Any]], send: Callable[[Dict[str, Any]], None]):
+        """
+        Queue Celery task specs ({"task", "args", "task_id"}) of one job and send the ones
+        that may start now. Without Redis everything is sent at once (no fairness).
+        If `send` fails, the specs it did not send stay pending here and DispatchError
+        tells the caller which task ids were sent (the others are not running).
+        """
+        self._count("submitted", len(specs))
+        if not specs:
+            return
+        ready = self._run_script(
+            "submit", SUBMIT_SCRIPT, [job_id] + [json.dumps(spec, ensure_ascii=False) for spec in specs]
+        )
+        self._send(specs if ready is None else ready, send, reserved=ready is not None)
+
+    def release(self, job_id: str, send: Callable[[Dict[str, Any]], None]):
+        """
+        A Celery task of `job_id` finished: free its slot and send whatever may start now.
+        Specs that cannot be sent are put back and go out with the next release or submission.
+        """
+        ready = self._run_script("release", RELEASE_SCRIPT, [job_id])
+        if ready is None:
+            return
+        self._count("released")
+        try:
+            self._send(ready, send, reserved=True)
+        except DispatchError as e:
+            logger.error(f"Fair scheduler could not send tasks after {job_id} finished: {e}")
+
+    def _run_script(self, name: str, source: str, args: List[str]) -> Optional[List[Dict[str, Any]]]:
+        client = self._redis_getter()
+        if client is None:
+            return None
+        try:
+            script = self._scripts.get(name)
+            if script is None:
+                script = self._scripts[name] = client.register_script(source)
+            raw = script(
+                keys=[RING_KEY, TOTAL_KEY],
+                args=[KEY_PREFIX, self.job_max_in_flight, self.max_in_flight, STATE_TTL] + args,
+                client=client,
+            )
+        except Exception as e:
+            logger.warning(f"Fair scheduler unavailable in Redis ({e}), dispatching without it.")
+            mark_redis_failed()
+            self._scripts.clear()
+            return None
+        return [json.loads(item) for item in raw]
+
+    def _send(self, specs: List[Dict[str, Any]], send: Callable[[Dict[str, Any]], None], reserved: bool):
+        """Send specs in order; on failure restore the unsent ones (if fill() reserved slots) and raise DispatchError."""
+        sent: List[str] = []
+        for index, spec in enumerate(specs):
+            try:
+                send(spec)
+            except Exception as e:
+                if reserved:
+                    self._restore(specs[index:])
+                raise DispatchError(str(e), sent) from e
+            sent.append(spec["task_id"])
+            self._count("dispatched")
+
+    def _restore(self, specs: List[Dict[str, Any]]):
+        args = []
+        for spec in reversed(specs):
+            args += [job_of(spec["args"]) or "", json.dumps(spec, ensure_ascii=False)]
+        client = self._redis_getter()
+        if client is None:
+            logger.error(f"Fair scheduler lost {len(specs)} unsent tasks: Redis unavailable.")
+            return
+        try:
+            client.eval(RESTORE_SCRIPT, 2, RING_KEY, TOTAL_KEY, KEY_PREFIX, STATE_TTL, *args)
+            self._count("restored", len(specs))
+        except Exception as e:
+            logger.error(f"Fair scheduler failed to restore {len(specs)} unsent tasks in Redis: {e}")
+            mark_redis_failed()
+
+    def discard(self, job_id: Optional[str] = None, task_ids: Optional[Iterable[str]] = None) -> int:
+        """
+        Drop tasks that were not dispatched yet: every task of `job_id`, or those reporting
+        only to the given task ids (a stopped submission). Returns how many were dropped.
+        """
+        stopped = set(task_ids or ())
+
+        def drop(covered: List[str]) -> bool:
+            return job_id is not None or (bool(covered) and stopped.issuperset(covered))
+
+        dropped = 0
+        client = self._redis_getter()
+        if client is not None:
+            try:
+                jobs = [job_id] if job_id is not None else [j.decode("utf-8") for j in client.lrange(RING_KEY, 0, -1)]
+                for j in jobs:
+                    pending_key = f"{KEY_PREFIX}{j}:pending"
+                    for raw in client.lrange(pending_key, 0, -1):
+                        if drop(covered_task_ids(json.loads(raw))):
+                            dropped += client.lrem(pending_key, 1, raw)
+            except Exception as e:
+                logger.warning(f"Failed to discard fair scheduler state in Redis: {e}")
+                mark_redis_failed()
+        self._count("discarded", dropped)
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+        stats["max_in_flight"] = self.max_in_flight
+        stats["job_max_in_flight"] = self.job_max_in_flight
+        client = self._redis_getter()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                pipe.llen(RING_KEY)
+                pipe.get(TOTAL_KEY)
+                jobs, total = pipe.execute()
+                stats["redis"] = {"jobs": jobs, "in_flight": int(total or 0)}
+            except Exception as e:
+                logger.warning(f"Failed to read fair scheduler state from Redis: {e}")
+                mark_redis_failed()
+        return stats
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+
+def covered_task_ids(spec: Dict[str, Any]) -> List[str]:
+    """Task ids a Celery spec reports to: its own, or those of the questions of a batch."""
+    return spec.get("task_ids") or [spec["task_id"]]
+
+
+def job_of(args) -> Optional[str]:
+    """job_id of an analysis task from its Celery args (question(s), config, ...)."""
+    if args and len(args) > 1 and isinstance(args[1], dict):
+        return args[1].get("job_id")
+    return None
+
+
+fair_scheduler = FairScheduler()
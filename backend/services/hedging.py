@@ -0,0 +1,187 @@
+from typing import Dict, Any, Optional, Callable, Awaitable, Tuple
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import asyncio
+import logging
+import threading
+import time
+
+from backend.config import settings
+from backend.services.io_steps import run_steps, run_steps_async
+
+logger = logging.getLogger(__name__)
+
+
+class StreamCancelled(RuntimeError):
+    """Raised inside an LLM stream that lost a hedged race."""
+
+
+def _is_valid(result: Optional[Dict[str, Any]]) -> bool:
+    return isinstance(result, dict) and "error" not in result
+
+
+class LatencyTracker:
+    """
+    Rolling window of recent LLM call durations per provider/model, used to decide
+    when a request is slow enough to be hedged.
+    """
+
+    def __init__(self, window: int = None):
+        self.window = window or settings.LLM_HEDGE_WINDOW
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = deque(maxlen=self.window)
+                self._samples[key] = samples
+            samples.append(seconds)
+
+    def percentile(self, key: str, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def count(self, key: str) -> int:
+        with self._lock:
+            return len(self._samples.get(key, ()))
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """Seconds to wait before sending the backup request, or None while still learning."""
+        if self.count(key) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return max(settings.LLM_HEDGE_MIN_DELAY, self.percentile(key, settings.LLM_HEDGE_PERCENTILE))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            keys = list(self._samples)
+        return {
+            key: {
+                "samples": self.count(key),
+                "p50": self.percentile(key, 50),
+                "p90": self.percentile(key, 90),
+                "hedge_delay": self.hedge_delay(key),
+            }
+            for key in keys
+        }
+
+
+class HedgeStats:
+    """Counters: how often a backup was sent and which side won."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "hedged": 0, "primary_wins": 0, "backup_wins": 0, "both_failed": 0}
+
+    def count(self, hedged: bool, winner: Optional[str]):
+        with self._lock:
+            self.counters["requests"] += 1
+            if hedged:
+                self.counters["hedged"] += 1
+                if winner is None:
+                    self.counters["both_failed"] += 1
+                else:
+                    self.counters[f"{winner}_wins"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+        stats["hedge_rate"] = round(stats["hedged"] / stats["requests"], 4) if stats["requests"] else 0.0
+        stats["backup_win_rate"] = round(stats["backup_wins"] / stats["hedged"], 4) if stats["hedged"] else 0.0
+        return stats
+
+
+latency_tracker = LatencyTracker()
+hedge_stats = HedgeStats()
+
+# Shared by all hedged calls of the process; a cancelled stream keeps its thread until its next chunk
+_executor = ThreadPoolExecutor(max_workers=settings.LLM_HEDGE_MAX_WORKERS, thread_name_prefix="llm-hedge")
+
+
+def _hedge_steps(delay: float, cancel: Callable[[Any], None]):
+    """
+    The hedging race as io steps (see io_steps), shared by run_hedged and run_hedged_async.
+    Yields ("start", side) -> a future/task running that side and ("wait", futures, timeout)
+    -> the finished ones; cancel(future) stops a stream that is no longer needed.
+    """
+    primary = yield "start", "primary"
+    pending = {primary}
+    try:
+        if (yield "wait", pending, delay):
+            hedge_stats.count(False, "primary")
+            return primary.result(), "primary"
+
+        logger.info(f"Primary LLM request still running after {delay:.1f}s, sending hedge request")
+        backup = yield "start", "backup"
+        sides = {primary: "primary", backup: "backup"}
+        pending.add(backup)
+        results: Dict[str, Dict[str, Any]] = {}
+        while pending:
+            done = yield "wait", pending, None
+            pending -= done
+            for future in done:
+                side = sides[future]
+                try:
+                    results[side] = future.result()
+                except Exception as e:
+                    results[side] = {"error": str(e)}
+                if _is_valid(results[side]):
+                    hedge_stats.count(True, side)
+                    return results[side], side
+    finally:
+        for future in pending:
+            cancel(future)
+
+    hedge_stats.count(True, None)
+    return results["primary"], "primary"
+
+
+def run_hedged(
+    primary: Callable[[Callable[[], bool]], Dict[str, Any]],
+    backup: Callable[[Callable[[], bool]], Dict[str, Any]],
+    delay: float,
+) -> Tuple[Dict[str, Any], str]:
+    """
+    Run primary; if it has not produced a result after `delay` seconds, also run backup.
+    Each callable receives a should_cancel() function it must poll while streaming.
+    Returns (result, winner) with winner "primary" or "backup"; the first valid result
+    wins and the other stream is cancelled. If both fail, the primary's result is returned.
+    """
+    calls = {"primary": primary, "backup": backup}
+    cancel: Dict[Future, threading.Event] = {}
+
+    def perform(request: tuple):
+        if request[0] == "start":
+            event = threading.Event()
+            future = _executor.submit(calls[request[1]], event.is_set)
+            cancel[future] = event
+            return future
+        done, _ = wait(request[1], timeout=request[2], return_when=FIRST_COMPLETED)
+        return done
+
+    return run_steps(_hedge_steps(delay, lambda future: cancel[future].set()), perform)
+
+
+async def run_hedged_async(
+    primary: Callable[[], Awaitable[Dict[str, Any]]],
+    backup: Callable[[], Awaitable[Dict[str, Any]]],
+    delay: float,
+) -> Tuple[Dict[str, Any], str]:
+    """
+    Asyncio variant of run_hedged: the losing coroutine is cancelled directly, which
+    closes its HTTP stream.
+    """
+    calls = {"primary": primary, "backup": backup}
+
+    async def perform(request: tuple):
+        if request[0] == "start":
+            return asyncio.ensure_future(calls[request[1]]())
+        done, _ = await asyncio.wait(request[1], timeout=request[2], return_when=asyncio.FIRST_COMPLETED)
+        return done
+
+    return await run_steps_async(_hedge_steps(delay, lambda task: task.cancel()), perform)
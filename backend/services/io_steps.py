@@ -0,0 +1,42 @@
+from typing import Any, Awaitable, Callable, Generator
+
+# Logic shared by a blocking (Celery thread) and an asyncio (desktop) code path is written once
+# as a generator: it yields each I/O request and receives its reply, or has the exception the
+# request raised thrown back in at the yield. Only the drivers below differ between the paths.
+Steps = Generator[Any, Any, Any]
+
+
+def run_steps(steps: Steps, call: Callable[[Any], Any]) -> Any:
+    """Answer every request yielded by `steps` with call(request); returns what `steps` returns."""
+    try:
+        request = next(steps)
+        while True:
+            try:
+                reply = call(request)
+            except Exception as e:
+                request = steps.throw(e)
+            else:
+                request = steps.send(reply)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def run_steps_async(steps: Steps, call: Callable[[Any], Awaitable[Any]]) -> Any:
+    """
+    run_steps with `call` returning an awaitable. asyncio.CancelledError is not thrown in:
+    the steps are closed, so their finally blocks run, and the cancellation propagates.
+    """
+    try:
+        request = next(steps)
+        while True:
+            try:
+                reply = await call(request)
+            except Exception as e:
+                request = steps.throw(e)
+            except BaseException:
+                steps.close()
+                raise
+            else:
+                request = steps.send(reply)
+    except StopIteration as stop:
+        return stop.value
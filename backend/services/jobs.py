@@ -0,0 +1,167 @@
+from typing import Dict, Any, Optional, List
+import json
+import threading
+import time
+
+from backend.services.redis_client import get_redis, redis_call
+from backend.services.token_budget import project_completion
+
+JOB_KEY_PREFIX = "job:"
+DONE_KEY_SUFFIX = ":done"
+RESULTS_KEY_SUFFIX = ":results"
+JOB_TTL = 24 * 3600
+
+# Jobs remembered by the in-process store (desktop mode / Redis down)
+MAX_LOCAL_JOBS = 200
+
+FAILED_STATUSES = {"FAILURE", "REVOKED"}
+
+# KEYS: job hash, done hash, results list
+# ARGV: task_id, counter field, result entry (JSON), ttl
+# Each task is counted once, however often it reports (batch retries, Celery redelivery)
+RECORD_SCRIPT = """
+if redis.call('HSETNX', KEYS[2], ARGV[1], 1) == 0 then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], ARGV[2], 1)
+redis.call('RPUSH', KEYS[3], ARGV[3])
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[4])
+end
+return 1
+"""
+
+
+def _counter(status: str) -> str:
+    return "failed" if status in FAILED_STATUSES else "completed"
+
+
+class JobStore:
+    """
+    Progress counters and finished results of one analysis submission (job).
+
+    Tasks append their result when they finish, so GET /api/jobs/{id} costs one round trip
+    however many tasks the job has: the counters give the progress, and the results list is
+    read from a client-supplied cursor so each poll only transfers what is new.
+    Stored in Redis (shared by the API and Celery workers) or in process in desktop mode.
+    """
+
+    def __init__(self, redis_getter=get_redis):
+        self._redis_getter = redis_getter
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._script = None
+
+    # --- In-process backend ---
+
+    def _local_job(self, job_id: str) -> Dict[str, Any]:
+        # Caller holds the lock
+        job = self._jobs.get(job_id)
+        if job is None:
+            job = {"total": 0, "completed": 0, "failed": 0, "created_at": None, "done": set(), "results": []}
+            self._jobs[job_id] = job
+            while len(self._jobs) > MAX_LOCAL_JOBS:
+                self._jobs.pop(next(iter(self._jobs)))
+        return job
+
+    # --- Public API ---
+
+    def create(self, job_id: str, total: int, questions: int = 0, estimate: Optional[Dict[str, Any]] = None):
+        """estimate: expected tokens/requests per limiter key (token_budget.submission_estimate)."""
+        created_at = round(time.time(), 3)
+
+        def save(client):
+            key = JOB_KEY_PREFIX + job_id
+            pipe = client.pipeline()
+            # Tasks may already have reported: only set the static fields
+            fields = {"total": total, "questions": questions, "created_at": created_at}
+            if estimate:
+                fields["estimate"] = json.dumps(estimate)
+            pipe.hset(key, mapping=fields)
+            pipe.expire(key, JOB_TTL)
+            pipe.execute()
+
+        if redis_call(self._redis_getter, save, f"create job {job_id}")[0]:
+            return
+        with self._lock:
+            job = self._local_job(job_id)
+            job.update(total=total, questions=questions, created_at=created_at, estimate=estimate)
+
+    def record(self, job_id: str, task_id: str, status: str, entry: Dict[str, Any]) -> bool:
+        """Add one finished task. Returns False if the task was already counted."""
+        entry = dict(entry, task_id=task_id, status=status, finished_at=round(time.time(), 3))
+
+        def save(client):
+            if self._script is None:
+                self._script = client.register_script(RECORD_SCRIPT)
+            key = JOB_KEY_PREFIX + job_id
+            return self._script(
+                keys=[key, key + DONE_KEY_SUFFIX, key + RESULTS_KEY_SUFFIX],
+                args=[task_id, _counter(status), json.dumps(entry, ensure_ascii=False), JOB_TTL],
+                client=client,
+            )
+
+        saved, counted = redis_call(self._redis_getter, save, f"record task {task_id} of job {job_id}")
+        if saved:
+            return bool(counted)
+        # Registered again on the next Redis connection
+        self._script = None
+        with self._lock:
+            job = self._local_job(job_id)
+            if task_id in job["done"]:
+                return False
+            job["done"].add(task_id)
+            job[_counter(status)] += 1
+            job["results"].append(entry)
+            return True
+
+    def get(self, job_id: str, cursor: int = 0) -> Optional[Dict[str, Any]]:
+        """Progress plus the results finished since `cursor`; None for an unknown job."""
+        cursor = max(0, cursor)
+
+        def load(client):
+            key = JOB_KEY_PREFIX + job_id
+            pipe = client.pipeline(transaction=False)
+            pipe.hgetall(key)
+            pipe.lrange(key + RESULTS_KEY_SUFFIX, cursor, -1)
+            raw, raw_results = pipe.execute()
+            if not raw:
+                return None
+            fields = {k.decode("utf-8"): v.decode("utf-8") for k, v in raw.items()}
+            job = {name: int(fields.get(name, 0)) for name in ("total", "questions", "completed", "failed")}
+            job["created_at"] = float(fields["created_at"]) if "created_at" in fields else None
+            job["estimate"] = json.loads(fields["estimate"]) if "estimate" in fields else None
+            return self._summary(job_id, job, [json.loads(r) for r in raw_results], cursor)
+
+        found, summary = redis_call(self._redis_getter, load, f"read job {job_id}")
+        if found:
+            return summary
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return self._summary(job_id, job, list(job["results"][cursor:]), cursor)
+
+    @staticmethod
+    def _summary(job_id: str, job: Dict[str, Any], results: List[Dict[str, Any]], cursor: int) -> Dict[str, Any]:
+        total = job.get("total", 0)
+        finished = job.get("completed", 0) + job.get("failed", 0)
+        pending = max(total - finished, 0)
+        return {
+            "job_id": job_id,
+            "created_at": job.get("created_at"),
+            "questions": job.get("questions", 0),
+            "total": total,
+            "completed": job.get("completed", 0),
+            "failed": job.get("failed", 0),
+            "pending": pending,
+            "progress": round(finished / total, 4) if total else 0.0,
+            "done": bool(total) and finished >= total,
+            # Earliest finish of the pending tasks at the providers' TPM/RPM budgets (None without budgets)
+            "projection": project_completion(job.get("estimate"), pending, total) if pending else None,
+            "results": results,
+            "cursor": cursor + len(results),
+        }
+
+
+job_store = JobStore()
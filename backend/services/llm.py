@@ -1,15 +1,55 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional, List
 import json
 import json_repair
 import logging
 import datetime
 import re
-from openai import OpenAI
+import asyncio
+import random
+import time
+from openai import OpenAI, APIConnectionError
+from backend.config import settings
+from backend.services.client_pool import client_registry, get_async_semaphore, DEFAULT_MAX_RETRIES
+from backend.services.prompts import prompt_registry
+from backend.services.rate_limiter import rate_limiter, is_overload_error
+from backend.services.token_budget import token_estimator
+from backend.services.task_queues import DEFAULT_PRIORITY
+from backend.services.stream_parser import StreamingJSONParser, MalformedStreamError, TextCollector, stitch_continuation
+from backend.services.hedging import StreamCancelled
+from backend.services.cancellation import TaskCancelled
+from backend.services.telemetry import telemetry, timed
+from backend.services.io_steps import run_steps, run_steps_async
 
 logger = logging.getLogger(__name__)
 
 import os
 
+# Providers whose OpenAI-compatible streaming API returns a usage chunk with stream_options.include_usage
+USAGE_STREAM_PROVIDERS = ["deepseek", "qwen", "doubao", "mock"]
+
+# Output budget for batched selection questions
+BATCH_TOKENS_PER_QUESTION = 1500
+BATCH_MAX_TOKENS = 8000
+
+
+def _close_stream(stream):
+    close = getattr(stream, "close", None)
+    if close:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+async def _close_stream_async(stream):
+    close = getattr(stream, "close", None)
+    if close:
+        try:
+            await close()
+        except Exception:
+            pass
+
+
 class LLMService:
     def __init__(self, provider: str, api_key: str, base_url: str = None, model_name: str = None, temperature: float = 0.3, timeout: float = 1800.0):
         self.provider = provider
@@ -18,39 +58,27 @@ class LLMService:
         self.model_name = model_name
         self.temperature = temperature
         self.timeout = timeout
+        # Optional callback(path, value) fired while streaming, e.g. as soon as
+        # comprehensive_rating.final_level is complete
+        self.on_partial = None
+        # Optional callback(chunks_so_far) fired for every streamed content chunk
+        self.on_progress = None
+        # Optional callable polled while streaming; True aborts the stream (lost hedge race)
+        self.should_cancel = None
+        # Wait order for limiter / semaphore slots (task_queues: lower is served first)
+        self.priority = DEFAULT_PRIORITY
+        # Optional callable polled before and while streaming; True means the user stopped
+        # the task: the stream is closed and TaskCancelled raised (see cancellation)
+        self.is_cancelled = None
         self.client = self._get_client()
 
     def _get_client(self) -> OpenAI:
-        # Default Base URLs
-        base_urls = {
-            "deepseek": "https://api.deepseek.com/v1",
-            "doubao": "https://ark.cn-beijing.volces.com/api/v3",
-            "qwen": "https://dashscope.aliyuncs.com/compatible-mode/v1",
-            "kimi": "https://api.moonshot.cn/v1",
-            "zhipu": "https://open.bigmodel.cn/api/paas/v4",
-        }
-        
-        # Use provided base_url if available, otherwise fallback to map
-        final_base_url = self.base_url if self.base_url else base_urls.get(self.provider)
-        
-        if not final_base_url:
-             # Default or fallback
-             final_base_url = "https://api.deepseek.com/v1"
-
-        # Sanitize Base URL: Remove /chat/completions if present
-        # This allows users to paste the full endpoint URL without breaking the OpenAI client
-        if final_base_url.endswith("/chat/completions"):
-            final_base_url = final_base_url.replace("/chat/completions", "")
-        
-        # Configure retries
-        # User requirement: 3 retries for Doubao (and likely others)
-        max_retries = 3
-
-        return OpenAI(
-            api_key=self.api_key, 
-            base_url=final_base_url, 
-            timeout=self.timeout,
-            max_retries=max_retries
+        # Reuse a pooled client so repeated calls keep their TLS connections open
+        return client_registry.get_client(
+            provider=self.provider,
+            api_key=self.api_key,
+            base_url=self.base_url,
+            timeout=self.timeout
         )
 
     def _get_model_name(self) -> str:
@@ -65,6 +93,7 @@ class LLMService:
             "qwen": "qwen-plus", # Qwen Plus Latest
             "kimi": "kimi-k2-0905-preview",
             "zhipu": "GLM-4.5-X",
+            "mock": "mock-chemistry", # Local stub server, see services/mock_llm.py
         }
         return models.get(self.provider, "deepseek-chat")
 
@@ -306,197 +335,597 @@ class LLMService:
              
         return md
 
-    def analyze_question(self, question_content: str, mode: str = "question_analysis") -> Dict[str, Any]:
-        prompt = self._build_prompt(question_content, mode)
+    def _build_request_kwargs(self, question_content: str, mode: str = "question_analysis", messages: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+        """
+        Build the chat.completions.create arguments shared by the sync and async paths.
+        """
+        # Static rubric goes into a byte-stable system message (provider prefix cache friendly)
+        if messages is None:
+            messages = prompt_registry.build_messages(question_content, mode)
         
         # Resolve model name to check for specific model types (e.g. deepseek-reasoner, glm-4.5)
         resolved_model = self.model_name or self._get_model_name()
         
-        start_time = datetime.datetime.now()
-        logger.info(f"Starting LLM analysis with provider={self.provider}, model={resolved_model}, timeout={self.timeout}s")
+        # Prepare request arguments
+        create_kwargs = {
+            "model": resolved_model,
+            "messages": messages,
+            "temperature": self.temperature,
+            "max_tokens": 4000, 
+            "timeout": self.timeout,
+            "stream": True  # Enable streaming globally to prevent gateway timeouts
+        }
         
-        try:
-            # Prepare request arguments
-            create_kwargs = {
-                "model": resolved_model,
-                "messages": [
-                    {"role": "system", "content": "你是一位精通高中化学的教研专家。"},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": self.temperature,
-                "max_tokens": 4000, 
-                "timeout": self.timeout,
-                "stream": True  # Enable streaming globally to prevent gateway timeouts
-            }
-            
-            # Conditionally add response_format
-            # 1. Doubao/Kimi: Known compatibility issues with strict JSON mode in some versions
-            # 2. deepseek-reasoner: Does NOT support response_format parameter
-            # 3. Zhipu (GLM-4): Supports json_object, but GLM-4.5's thinking mode might be safer without it initially
-            #    We enable it for Zhipu by default unless it's a specific conflicting model
-            if self.provider not in ["doubao", "kimi"] and "deepseek-reasoner" not in resolved_model:
-                create_kwargs["response_format"] = { "type": "json_object" }
-
-            # --- Model Specific Configurations ---
-            
-            # Doubao (Volcengine)
-            if self.provider == "doubao":
-                 create_kwargs["max_tokens"] = 32000
-                 create_kwargs["extra_body"] = { "reasoning_effort": "medium" }
-            
-            # DeepSeek Reasoner
-            if "deepseek-reasoner" in resolved_model:
-                 create_kwargs["max_tokens"] = 8000 # Reasoning models need more output space
-
-            # Zhipu AI (GLM)
-            if self.provider == "zhipu":
-                 # GLM-4.5 supports "thinking" parameter. 
-                 # "thinking": {"type": "enabled"} is default for GLM-4.5 but can be explicit.
-                 # We can add it if using GLM-4.5 specifically.
-                 if "glm-4.5" in resolved_model.lower():
-                     create_kwargs["extra_body"] = { "thinking": { "type": "enabled" } }
-
-            # Execute streaming request
-            stream = self.client.chat.completions.create(**create_kwargs)
-            
-            result_chunks = []
-            for chunk in stream:
-                # We collect the standard content. 
-                # Note: DeepSeek Reasoner & GLM-4.5's "thinking process" might be in separate fields
-                # We currently skip explicit reasoning/thinking content to ensure clean JSON parsing of the final answer.
-                if chunk.choices and chunk.choices[0].delta.content:
-                    result_chunks.append(chunk.choices[0].delta.content)
-            
-            result_text = "".join(result_chunks)
-            
-            duration = (datetime.datetime.now() - start_time).total_seconds()
-            logger.info(f"LLM request completed in {duration:.2f}s. Response length: {len(result_text)}")
+        # Conditionally add response_format
+        # 1. Doubao/Kimi: Known compatibility issues with strict JSON mode in some versions
+        # 2. deepseek-reasoner: Does NOT support response_format parameter
+        # 3. Zhipu (GLM-4): Supports json_object, but GLM-4.5's thinking mode might be safer without it initially
+        #    We enable it for Zhipu by default unless it's a specific conflicting model
+        if self.provider not in ["doubao", "kimi"] and "deepseek-reasoner" not in resolved_model:
+            create_kwargs["response_format"] = { "type": "json_object" }
 
-            if not result_text:
-                raise ValueError("LLM returned empty response")
+        # --- Model Specific Configurations ---
+        
+        # Doubao (Volcengine)
+        if self.provider == "doubao":
+             create_kwargs["max_tokens"] = 32000
+             create_kwargs["extra_body"] = { "reasoning_effort": "medium" }
+        
+        # DeepSeek Reasoner
+        if "deepseek-reasoner" in resolved_model:
+             create_kwargs["max_tokens"] = 8000 # Reasoning models need more output space
 
-            # Log raw response for debugging if needed
-            # logger.debug(f"Raw LLM Response: {result_text}")
-            
-            cleaned_text = self._clean_json_response(result_text)
-            
+        # Zhipu AI (GLM)
+        if self.provider == "zhipu":
+             # GLM-4.5 supports "thinking" parameter. 
+             # "thinking": {"type": "enabled"} is default for GLM-4.5 but can be explicit.
+             # We can add it if using GLM-4.5 specifically.
+             if "glm-4.5" in resolved_model.lower():
+                 create_kwargs["extra_body"] = { "thinking": { "type": "enabled" } }
+
+        # Ask for token usage (incl. cached prompt tokens) in the final stream chunk
+        if self.provider in USAGE_STREAM_PROVIDERS:
+            create_kwargs["stream_options"] = { "include_usage": True }
+
+        return create_kwargs
+
+    @staticmethod
+    def _extract_usage(usage: Any) -> Dict[str, int]:
+        """
+        Normalize the usage block of a stream chunk.
+        Cached prompt tokens are reported as prompt_tokens_details.cached_tokens (OpenAI style, Qwen, Doubao)
+        or prompt_cache_hit_tokens (DeepSeek).
+        """
+        def field(obj, name):
+            if obj is None:
+                return None
+            if isinstance(obj, dict):
+                return obj.get(name)
+            return getattr(obj, name, None)
+
+        cached = field(field(usage, "prompt_tokens_details"), "cached_tokens")
+        if cached is None:
+            cached = field(usage, "prompt_cache_hit_tokens")
+        return {
+            "prompt_tokens": field(usage, "prompt_tokens") or 0,
+            "completion_tokens": field(usage, "completion_tokens") or 0,
+            "cached_tokens": cached or 0,
+        }
+
+    def _attach_usage(self, data: Dict[str, Any], usage: Optional[Dict[str, int]], mode: str) -> Dict[str, Any]:
+        if usage:
+            prompt_registry.record_usage(mode, usage)
+            logger.info(f"Token usage ({self.provider}): prompt={usage['prompt_tokens']}, cached={usage['cached_tokens']}, completion={usage['completion_tokens']}")
+            if isinstance(data, dict):
+                data["token_usage"] = usage
+        return data
+
+    def _parse_response(self, result_text: str, mode: str = "question_analysis", parser: Optional[StreamingJSONParser] = None) -> Dict[str, Any]:
+        """
+        Parse the collected LLM output and apply mode specific validation / post-processing.
+        When the streaming parser already located a complete document, it is parsed directly.
+        """
+        if not result_text:
+            raise ValueError("LLM returned empty response")
+
+        # Log raw response for debugging if needed
+        # logger.debug(f"Raw LLM Response: {result_text}")
+        
+        model = self._get_model_name()
+        with timed("llm_parse_seconds", self.provider, model):
+            data = self._load_json(result_text, parser)
+        with timed("llm_grading_validation_seconds", self.provider, model):
+            return self._postprocess_data(data, mode)
+
+    def _load_json(self, result_text: str, parser: Optional[StreamingJSONParser] = None) -> Any:
+        if parser is not None and parser.complete:
             try:
-                # First try standard JSON parsing with strict=False
-                data = json.loads(cleaned_text, strict=False)
+                return parser.loads()
             except json.JSONDecodeError as e:
-                logger.warning(f"Standard JSON parse failed, trying json_repair. Error: {e}")
-                try:
-                    # Fallback to json_repair for robust parsing
-                    data = json_repair.loads(cleaned_text)
-                except Exception as repair_error:
-                    logger.error(f"JSON Parse Error: {e}. Repair failed: {repair_error}. Raw text: {result_text[:500]}...")
-                    # If "Unterminated string", it's likely truncation despite max_tokens
-                    snippet = result_text[:100] if result_text else "EMPTY"
-                    raise ValueError(f"Failed to parse JSON response: {str(e)}. Raw snippet: {snippet}...")
-            
-            # Validation
-            if mode in ["question_analysis", "single_analysis", "multiple_analysis"]:
-                # Robust field extraction: try to find required fields even if misnamed or nested differently
-                if "comprehensive_rating" not in data:
-                    # Look for alternative names or top-level fields
-                    alt_rating = data.get("rating") or data.get("comprehensive") or data.get("assessment")
-                    if isinstance(alt_rating, dict):
-                        data["comprehensive_rating"] = alt_rating
-                    else:
-                        # Synthesize from top-level fields if they exist
-                        synth_rating = {}
-                        if "final_level" in data: synth_rating["final_level"] = data["final_level"]
-                        if "average_score" in data: synth_rating["average_score"] = data["average_score"]
-                        if "downgrade_reason" in data: synth_rating["downgrade_reason"] = data["downgrade_reason"]
-                        
-                        if synth_rating:
-                            data["comprehensive_rating"] = synth_rating
-                        else:
-                            # Last resort: default values to avoid crash
-                            logger.warning(f"Missing 'comprehensive_rating' in {mode} response, providing defaults.")
-                            data["comprehensive_rating"] = {
-                                "final_level": data.get("level", "L1"),
-                                "average_score": data.get("score", 1.0),
-                                "downgrade_reason": ""
-                            }
+                logger.warning(f"Streamed JSON document did not parse, falling back to full cleanup. Error: {e}")
+        
+        if parser is not None and parser.truncated:
+            # No closing bracket: the reply was cut off, json_repair is the only option
+            logger.warning(f"LLM reply truncated after {len(result_text)} characters, trying json_repair")
+            cleaned_text = parser.json_text()
+        else:
+            cleaned_text = self._clean_json_response(result_text)
+        
+        try:
+            # First try standard JSON parsing with strict=False
+            return json.loads(cleaned_text, strict=False)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Standard JSON parse failed, trying json_repair. Error: {e}")
+            try:
+                # Fallback to json_repair for robust parsing
+                return json_repair.loads(cleaned_text)
+            except Exception as repair_error:
+                logger.error(f"JSON Parse Error: {e}. Repair failed: {repair_error}. Raw text: {result_text[:500]}...")
+                # If "Unterminated string", it's likely truncation despite max_tokens
+                snippet = result_text[:100] if result_text else "EMPTY"
+                raise ValueError(f"Failed to parse JSON response: {str(e)}. Raw snippet: {snippet}...")
 
-                if "markdown_report" not in data:
-                    # Look for alternative names
-                    alt_report = data.get("report") or data.get("analysis") or data.get("content")
-                    if isinstance(alt_report, str) and alt_report.strip():
-                        data["markdown_report"] = alt_report
+    def _postprocess_data(self, data: Any, mode: str = "question_analysis") -> Dict[str, Any]:
+        """
+        Mode specific validation / post-processing of one parsed result.
+        """
+        # Validation
+        if mode in ["question_analysis", "single_analysis", "multiple_analysis"]:
+            # Robust field extraction: try to find required fields even if misnamed or nested differently
+            if "comprehensive_rating" not in data:
+                # Look for alternative names or top-level fields
+                alt_rating = data.get("rating") or data.get("comprehensive") or data.get("assessment")
+                if isinstance(alt_rating, dict):
+                    data["comprehensive_rating"] = alt_rating
+                else:
+                    # Synthesize from top-level fields if they exist
+                    synth_rating = {}
+                    if "final_level" in data: synth_rating["final_level"] = data["final_level"]
+                    if "average_score" in data: synth_rating["average_score"] = data["average_score"]
+                    if "downgrade_reason" in data: synth_rating["downgrade_reason"] = data["downgrade_reason"]
+                    
+                    if synth_rating:
+                        data["comprehensive_rating"] = synth_rating
                     else:
-                        logger.warning(f"Missing 'markdown_report' in {mode} response, generating fallback.")
-                        data["markdown_report"] = self._construct_markdown_from_data(data)
-
-                # Now that we've tried to fix it, ensure basic types are correct
-                if not isinstance(data.get("comprehensive_rating"), dict):
-                    data["comprehensive_rating"] = {"final_level": "L1", "average_score": 1.0, "downgrade_reason": ""}
-                
-                if not isinstance(data.get("markdown_report"), str):
-                    data["markdown_report"] = self._construct_markdown_from_data(data)
+                        # Last resort: default values to avoid crash
+                        logger.warning(f"Missing 'comprehensive_rating' in {mode} response, providing defaults.")
+                        data["comprehensive_rating"] = {
+                            "final_level": data.get("level", "L1"),
+                            "average_score": data.get("score", 1.0),
+                            "downgrade_reason": ""
+                        }
 
-                # Deep validation
-                if not data["markdown_report"].strip():
+            if "markdown_report" not in data:
+                # Look for alternative names
+                alt_report = data.get("report") or data.get("analysis") or data.get("content")
+                if isinstance(alt_report, str) and alt_report.strip():
+                    data["markdown_report"] = alt_report
+                else:
+                    logger.warning(f"Missing 'markdown_report' in {mode} response, generating fallback.")
                     data["markdown_report"] = self._construct_markdown_from_data(data)
-                
-                # Check if markdown_report is lazily just a JSON code block
-                report_strip = data["markdown_report"].strip()
-                is_json_code_block = (report_strip.startswith("```json") or report_strip.startswith("```")) and report_strip.endswith("```")
-                is_raw_json = report_strip.startswith("{") and report_strip.endswith("}")
-                
-                if is_json_code_block or is_raw_json:
-                     logger.info("Detected JSON content in markdown_report. Replacing with friendly format.")
-                     data["markdown_report"] = self._construct_markdown_from_data(data)
-
-                # Apply strict grading logic validation (only for question analysis)
-                if mode == "question_analysis":
-                    data = self._validate_and_correct_grading(data)
-
-                # Backwards compatibility for frontend
-                if "final_level" not in data and "comprehensive_rating" in data:
-                    data["final_level"] = data["comprehensive_rating"].get("final_level")
-            elif mode == "variant_generation":
-                # Validation for variant generation
-                required_fields = ["question", "options", "answer", "explanation"]
-                for field in required_fields:
-                    if field not in data:
-                        raise ValueError(f"Missing required field for variant: {field}")
-            else:
-                 # Basic validation for analysis modes
-                 if not isinstance(data, dict):
-                     raise ValueError("Response must be a JSON object")
-                
-
-                
-                 # Ensure markdown_report exists for multiple/single analysis modes
-                 # This fixes the issue where reports sometimes show as raw JSON
-                 if "markdown_report" not in data or not isinstance(data["markdown_report"], str) or not data["markdown_report"].strip():
-                     logger.warning(f"Missing or empty markdown_report in {mode}, generating fallback.")
-                     data["markdown_report"] = self._construct_markdown_from_data(data)
+
+            # Now that we've tried to fix it, ensure basic types are correct
+            if not isinstance(data.get("comprehensive_rating"), dict):
+                data["comprehensive_rating"] = {"final_level": "L1", "average_score": 1.0, "downgrade_reason": ""}
             
-            return data
-        except Exception as e:
-            logger.error(f"LLM Call Error ({self.provider}): {e}")
+            if not isinstance(data.get("markdown_report"), str):
+                data["markdown_report"] = self._construct_markdown_from_data(data)
+
+            # Deep validation
+            if not data["markdown_report"].strip():
+                data["markdown_report"] = self._construct_markdown_from_data(data)
+            
+            # Check if markdown_report is lazily just a JSON code block
+            report_strip = data["markdown_report"].strip()
+            is_json_code_block = (report_strip.startswith("```json") or report_strip.startswith("```")) and report_strip.endswith("```")
+            is_raw_json = report_strip.startswith("{") and report_strip.endswith("}")
+            
+            if is_json_code_block or is_raw_json:
+                 logger.info("Detected JSON content in markdown_report. Replacing with friendly format.")
+                 data["markdown_report"] = self._construct_markdown_from_data(data)
+
+            # Apply strict grading logic validation (only for question analysis)
+            if mode == "question_analysis":
+                data = self._validate_and_correct_grading(data)
+
+            # Backwards compatibility for frontend
+            if "final_level" not in data and "comprehensive_rating" in data:
+                data["final_level"] = data["comprehensive_rating"].get("final_level")
+        elif mode == "variant_generation":
+            # Validation for variant generation
+            required_fields = ["question", "options", "answer", "explanation"]
+            for field in required_fields:
+                if field not in data:
+                    raise ValueError(f"Missing required field for variant: {field}")
+        else:
+             # Basic validation for analysis modes
+             if not isinstance(data, dict):
+                 raise ValueError("Response must be a JSON object")
             
-            error_msg = str(e)
-            # Add specific hints for common errors
-            if self.provider == "doubao" and "InternalServiceError" in error_msg:
-                error_msg += "\n\n(提示：对于豆包/火山引擎，'Model Name' 必须填写您在控制台创建的 Endpoint ID，通常以 'ep-' 开头，且必须与您的 API Key 对应。请检查 Endpoint ID 是否正确且状态为'运行中'。)"
+
             
-            # Return a mock error structure or re-raise
-            return {
-                "error": error_msg,
-                "level": "Error",
+             # Ensure markdown_report exists for multiple/single analysis modes
+             # This fixes the issue where reports sometimes show as raw JSON
+             if "markdown_report" not in data or not isinstance(data["markdown_report"], str) or not data["markdown_report"].strip():
+                 logger.warning(f"Missing or empty markdown_report in {mode}, generating fallback.")
+                 data["markdown_report"] = self._construct_markdown_from_data(data)
+        
+        return data
+
+    def _build_error_result(self, e: Exception) -> Dict[str, Any]:
+        logger.error(f"LLM Call Error ({self.provider}): {e}")
+        
+        error_msg = str(e)
+        # Add specific hints for common errors
+        if self.provider == "doubao" and "InternalServiceError" in error_msg:
+            error_msg += "\n\n(提示：对于豆包/火山引擎，'Model Name' 必须填写您在控制台创建的 Endpoint ID，通常以 'ep-' 开头，且必须与您的 API Key 对应。请检查 Endpoint ID 是否正确且状态为'运行中'。)"
+        
+        # Return a mock error structure or re-raise
+        return {
+            "error": error_msg,
+            "level": "Error",
+            "final_level": "Error",
+            "comprehensive_rating": {
                 "final_level": "Error",
-                "comprehensive_rating": {
-                    "final_level": "Error",
-                    "average_score": 0,
-                    "downgrade_reason": error_msg
-                },
-                "scores": [0, 0, 0],
-                "markdown_report": f"**分析失败**\n\n发生错误：{error_msg}\n\n请检查 API Key 和配置是否正确，或稍后重试。"
-            }
+                "average_score": 0,
+                "downgrade_reason": error_msg
+            },
+            "scores": [0, 0, 0],
+            "markdown_report": f"**分析失败**\n\n发生错误：{error_msg}\n\n请检查 API Key 和配置是否正确，或稍后重试。"
+        }
+
+    def _max_attempts(self) -> int:
+        # With the limiter on, the OpenAI client does not retry by itself: 429/5xx must reach
+        # the limiter so it can shrink the window, and the retry happens here after re-acquiring.
+        return DEFAULT_MAX_RETRIES + 1 if settings.LLM_LIMITER_ENABLED else 1
+
+    @staticmethod
+    def _should_retry(e: Exception) -> bool:
+        return is_overload_error(e) or isinstance(e, (APIConnectionError, MalformedStreamError))
+
+    @staticmethod
+    def _retry_delay(e: Exception, attempt: int) -> float:
+        """Honour Retry-After when the provider sends it, otherwise exponential backoff with jitter."""
+        headers = getattr(getattr(e, "response", None), "headers", None) or {}
+        try:
+            retry_after = float(headers.get("retry-after"))
+            if 0 < retry_after <= 60:
+                return retry_after
+        except (TypeError, ValueError):
+            pass
+        return min(2 ** attempt, 8) * (0.5 + random.random() / 2)
+
+    def _new_parser(self) -> StreamingJSONParser:
+        start_time = datetime.datetime.now()
+
+        def on_value(path, value):
+            elapsed = (datetime.datetime.now() - start_time).total_seconds()
+            logger.info(f"{'.'.join(path)}={value} available after {elapsed:.2f}s ({self.provider})")
+            if self.on_partial:
+                self.on_partial(path, value)
+
+        return StreamingJSONParser(on_value=on_value)
+
+    def _stop_requested(self) -> bool:
+        """The stream must stop: lost a hedged race (should_cancel) or stopped by the user (is_cancelled)."""
+        return bool((self.should_cancel and self.should_cancel()) or (self.is_cancelled and self.is_cancelled()))
+
+    def _raise_stopped(self):
+        # The stream is closed first
+        self.raise_if_cancelled()
+        raise StreamCancelled(f"{self.provider} stream cancelled")
+
+    def _start_stream(self, continuation: bool):
+        parser = TextCollector() if continuation else self._new_parser()
+        parser.request_started_at = time.time()
+        return parser
+
+    def _feed_chunk(self, parser, chunk, usage: Optional[Dict[str, int]]) -> Optional[Dict[str, int]]:
+        """Feed one stream chunk to the parser; returns the usage reported so far."""
+        # We collect the standard content.
+        # Note: DeepSeek Reasoner & GLM-4.5's "thinking process" might be in separate fields
+        # We currently skip explicit reasoning/thinking content to ensure clean JSON parsing of the final answer.
+        if chunk.choices and chunk.choices[0].delta.content:
+            parser.feed(chunk.choices[0].delta.content)
+            if self.on_progress:
+                self.on_progress(parser.chunk_count)
+            if parser.error:
+                return usage
+        if chunk.choices and getattr(chunk.choices[0], "finish_reason", None):
+            parser.finish_reason = chunk.choices[0].finish_reason
+        if getattr(chunk, "usage", None):
+            usage = self._extract_usage(chunk.usage)
+        return usage
+
+    def _consume_stream(self, create_kwargs: Dict[str, Any], continuation: bool = False):
+        parser = self._start_stream(continuation)
+        stream = self.client.chat.completions.create(**create_kwargs)
+
+        usage = None
+        for chunk in stream:
+            if self._stop_requested():
+                _close_stream(stream)
+                self._raise_stopped()
+            usage = self._feed_chunk(parser, chunk, usage)
+            if parser.error:
+                # Stop paying for a generation that can no longer be parsed
+                _close_stream(stream)
+                raise MalformedStreamError(parser.error)
+        return parser, usage
+
+    async def _consume_stream_async(self, client, create_kwargs: Dict[str, Any], continuation: bool = False):
+        parser = self._start_stream(continuation)
+        stream = await client.chat.completions.create(**create_kwargs)
+
+        usage = None
+        async for chunk in stream:
+            if self._stop_requested():
+                await _close_stream_async(stream)
+                self._raise_stopped()
+            usage = self._feed_chunk(parser, chunk, usage)
+            if parser.error:
+                await _close_stream_async(stream)
+                raise MalformedStreamError(parser.error)
+        return parser, usage
+
+    def _request_tokens(self, create_kwargs: Dict[str, Any], continuation: bool, mode: str):
+        """(mode, tokens) a streaming request is charged with against the provider's TPM budget."""
+        mode = "continuation" if continuation else mode
+        return mode, token_estimator.estimate_request(self.provider, mode, create_kwargs)
+
+    def _attempt_failed(self, lease, e: Exception, attempt: int, create_kwargs: Dict[str, Any]) -> float:
+        """Give back the slot of a failed attempt; re-raises unless it is retried, else returns the backoff delay."""
+        rate_limiter.release(lease, overloaded=is_overload_error(e))
+        if attempt + 1 >= self._max_attempts() or not self._should_retry(e):
+            telemetry.count_error(self.provider, create_kwargs.get("model"))
+            raise e
+        delay = self._retry_delay(e, attempt)
+        logger.warning(f"LLM request to {self.provider} failed ({e}), retrying in {delay:.1f}s")
+        return delay
+
+    def _stream_completion(self, create_kwargs: Dict[str, Any], continuation: bool = False, mode: str = "question_analysis"):
+        """
+        Execute a streaming request, feeding chunks to an incremental JSON parser
+        (or a plain TextCollector for a continuation round).
+        Returns (parser, usage); parser.text() is the full reply.
+        Each attempt holds a slot of the per-(provider, api_key) adaptive rate limiter,
+        charged with the request's estimated tokens against the provider's TPM budget.
+        """
+        mode, tokens = self._request_tokens(create_kwargs, continuation, mode)
+        for attempt in range(self._max_attempts()):
+            wait_start = time.time()
+            self.raise_if_cancelled()
+            lease = rate_limiter.acquire(self.provider, self.api_key, priority=self.priority, tokens=tokens)
+            try:
+                # Stopped while waiting for a slot: give it back without sending the request
+                self.raise_if_cancelled()
+                result = self._consume_stream(create_kwargs, continuation)
+            except StreamCancelled:
+                # Lost a hedged race or stopped by the user: neither a success nor an error
+                rate_limiter.release(lease, cancelled=True)
+                raise
+            except Exception as e:
+                time.sleep(self._attempt_failed(lease, e, attempt, create_kwargs))
+                continue
+            rate_limiter.release(lease, tokens=self._observe_stream(create_kwargs, result, wait_start, mode))
+            return result
+
+    async def _stream_completion_async(self, create_kwargs: Dict[str, Any], continuation: bool = False, mode: str = "question_analysis"):
+        """
+        Async counterpart of _stream_completion, bounded by the per-loop semaphore
+        and the adaptive rate limiter.
+        """
+        mode, tokens = self._request_tokens(create_kwargs, continuation, mode)
+        client = client_registry.get_async_client(
+            provider=self.provider,
+            api_key=self.api_key,
+            base_url=self.base_url,
+            timeout=self.timeout
+        )
+        for attempt in range(self._max_attempts()):
+            wait_start = time.time()
+            # Wait for the limiter before taking a semaphore slot, so queued requests do not hold one
+            self.raise_if_cancelled()
+            lease = await rate_limiter.acquire_async(self.provider, self.api_key, priority=self.priority, tokens=tokens)
+            try:
+                async with get_async_semaphore().slot(self.priority):
+                    self.raise_if_cancelled()
+                    result = await self._consume_stream_async(client, create_kwargs, continuation)
+            except (asyncio.CancelledError, StreamCancelled):
+                rate_limiter.release(lease, cancelled=True)
+                raise
+            except Exception as e:
+                await asyncio.sleep(self._attempt_failed(lease, e, attempt, create_kwargs))
+                continue
+            rate_limiter.release(lease, tokens=self._observe_stream(create_kwargs, result, wait_start, mode))
+            return result
+
+    def _observe_stream(self, create_kwargs: Dict[str, Any], result, wait_start: float, mode: str) -> int:
+        """Record telemetry and token history of a finished request; returns the tokens it used."""
+        parser, usage = result
+        telemetry.observe_stream(
+            self.provider, create_kwargs.get("model"), parser, usage,
+            queue_wait=parser.request_started_at - wait_start
+        )
+        prompt_chars = sum(len(m.get("content") or "") for m in create_kwargs.get("messages") or [])
+        return token_estimator.observe(self.provider, mode, prompt_chars, usage, len(parser.text()))
+
+    def raise_if_cancelled(self):
+        if self.is_cancelled and self.is_cancelled():
+            raise TaskCancelled(f"{self.provider} request stopped by the user")
+
+    # --- Request logic shared by the sync and async paths (see io_steps) ---
+
+    def _run(self, steps) -> Any:
+        return run_steps(steps, lambda request: self._stream_completion(request[0], **request[1]))
+
+    async def _run_async(self, steps) -> Any:
+        return await run_steps_async(steps, lambda request: self._stream_completion_async(request[0], **request[1]))
+
+    @staticmethod
+    def _needs_continuation(parser: StreamingJSONParser, rounds: int) -> bool:
+        return parser.finish_reason == "length" and parser.truncated and rounds < settings.LLM_MAX_CONTINUATIONS
+
+    def _continuation_kwargs(self, create_kwargs: Dict[str, Any], partial: str) -> Dict[str, Any]:
+        kwargs = dict(create_kwargs)
+        kwargs["messages"] = prompt_registry.build_continuation_messages(create_kwargs["messages"], partial)
+        # JSON mode would make the model open a new document instead of continuing this one
+        kwargs.pop("response_format", None)
+        return kwargs
+
+    def _stitch(self, parser: StreamingJSONParser, collector: TextCollector, usage, more_usage) -> bool:
+        """Append one continuation round to the reply; False when it cannot be used."""
+        appended = stitch_continuation(parser.text(), collector.text())
+        if not appended:
+            return False
+        parser.feed(appended)
+        parser.finish_reason = collector.finish_reason
+        if usage and more_usage:
+            for key in usage:
+                usage[key] += more_usage.get(key, 0)
+        return True
+
+    def _finish_continuation(self, create_kwargs: Dict[str, Any], parser: StreamingJSONParser, rounds: int, outcome: Optional[str] = None):
+        if not rounds:
+            return
+        if outcome is None:
+            outcome = "completed" if parser.complete else "truncated"
+        logger.info(f"Reply of {self.provider} continued in {rounds} extra round(s): {outcome}")
+        telemetry.count_continuation(self.provider, create_kwargs.get("model"), outcome)
+
+    def _completion_steps(self, create_kwargs: Dict[str, Any], mode: str):
+        """
+        Stream the reply, then continue it while it is cut off by max_tokens: the partial
+        output goes back as an assistant message and the remainder is stitched on, for at most
+        LLM_MAX_CONTINUATIONS rounds. Whatever is still missing afterwards is left to json_repair.
+        Yields (create_kwargs, _stream_completion options) per request; returns (parser, usage).
+        """
+        parser, usage = yield create_kwargs, {"mode": mode}
+        rounds = 0
+        while self._needs_continuation(parser, rounds):
+            rounds += 1
+            logger.warning(f"LLM reply cut off by max_tokens after {len(parser.text())} characters, continuing (round {rounds})")
+            try:
+                collector, more_usage = yield self._continuation_kwargs(create_kwargs, parser.text()), {"continuation": True}
+            except TaskCancelled:
+                raise
+            except Exception as e:
+                logger.warning(f"Continuation request to {self.provider} failed: {e}")
+                self._finish_continuation(create_kwargs, parser, rounds, "failed")
+                return parser, usage
+            if not self._stitch(parser, collector, usage, more_usage):
+                self._finish_continuation(create_kwargs, parser, rounds, "rejected")
+                return parser, usage
+        self._finish_continuation(create_kwargs, parser, rounds)
+        return parser, usage
+
+    def _analysis_steps(self, question_content: str, mode: str):
+        start_time = datetime.datetime.now()
+        try:
+            create_kwargs = self._build_request_kwargs(question_content, mode)
+            logger.info(f"Starting LLM analysis with provider={self.provider}, model={create_kwargs['model']}, timeout={self.timeout}s")
+
+            parser, usage = yield from self._completion_steps(create_kwargs, mode)
+
+            duration = (datetime.datetime.now() - start_time).total_seconds()
+            logger.info(f"LLM request completed in {duration:.2f}s. Response length: {len(parser.text())}")
+
+            return self._attach_usage(self._parse_response(parser.text(), mode, parser), usage, mode)
+        except TaskCancelled:
+            raise
+        except Exception as e:
+            return self._build_error_result(e)
+
+    def analyze_question(self, question_content: str, mode: str = "question_analysis") -> Dict[str, Any]:
+        return self._run(self._analysis_steps(question_content, mode))
+
+    async def analyze_question_async(self, question_content: str, mode: str = "question_analysis") -> Dict[str, Any]:
+        """
+        Native asyncio version of analyze_question: same prompt and post-processing, but the
+        stream is consumed on the event loop instead of occupying an executor thread.
+        Concurrency is bounded by a per-loop semaphore (LLM_ASYNC_CONCURRENCY).
+        """
+        return await self._run_async(self._analysis_steps(question_content, mode))
+
+    def _build_batch_kwargs(self, questions: List[Dict[str, Any]]) -> Dict[str, Any]:
+        messages = prompt_registry.build_batch_messages(questions)
+        create_kwargs = self._build_request_kwargs("", "question_analysis", messages=messages)
+        # One report per question: scale the output budget with the batch size
+        create_kwargs["max_tokens"] = max(create_kwargs["max_tokens"], min(BATCH_TOKENS_PER_QUESTION * len(questions), BATCH_MAX_TOKENS))
+        return create_kwargs
+
+    def _parse_batch_response(self, result_text: str, questions: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Split a batched reply back into per-question results.
+        Each item goes through the same post-processing (incl. _validate_and_correct_grading)
+        as a single-question reply. Questions missing from the reply are simply absent.
+        """
+        if not result_text:
+            raise ValueError("LLM returned empty response")
+
+        try:
+            data = json.loads(self._clean_json_response(result_text), strict=False)
+        except json.JSONDecodeError:
+            # Truncated or slightly malformed replies: recover whatever items are complete
+            data = json_repair.loads(result_text)
+
+        # Accept {"results": [...]}, a bare list, or an object keyed by question id
+        if isinstance(data, dict) and isinstance(data.get("results"), list):
+            items = data["results"]
+        elif isinstance(data, list):
+            items = data
+        elif isinstance(data, dict):
+            items = [dict(v, question_id=k) for k, v in data.items() if isinstance(v, dict)]
+        else:
+            items = []
+
+        expected_ids = {str(q.get("id")) for q in questions}
+        results = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            qid = str(item.pop("question_id", item.get("id", "")))
+            if qid not in expected_ids or qid in results:
+                continue
+            # A truncated item has no usable rating; let the caller retry it on its own
+            if not isinstance(item.get("comprehensive_rating"), dict):
+                continue
+            try:
+                results[qid] = self._postprocess_data(item, "question_analysis")
+            except Exception as e:
+                logger.warning(f"Batch item {qid} rejected: {e}")
+        return results
+
+    def _batch_steps(self, questions: List[Dict[str, Any]]):
+        start_time = datetime.datetime.now()
+        try:
+            create_kwargs = self._build_batch_kwargs(questions)
+            logger.info(f"Starting batched LLM analysis of {len(questions)} questions with provider={self.provider}, model={create_kwargs['model']}")
+            parser, usage = yield from self._completion_steps(create_kwargs, "question_analysis_batch")
+            result_text = parser.text()
+            duration = (datetime.datetime.now() - start_time).total_seconds()
+            logger.info(f"Batched LLM request completed in {duration:.2f}s. Response length: {len(result_text)}")
+            if usage:
+                prompt_registry.record_usage("question_analysis_batch", usage)
+            return self._parse_batch_response(result_text, questions)
+        except TaskCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Batched LLM Call Error ({self.provider}): {e}")
+            return {}
+
+    def analyze_questions_batch(self, questions: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Analyze several short (selection) questions in one request sharing a single rubric prefix.
+        Returns {question_id: result} for the questions found in the reply; callers retry the rest.
+        """
+        return self._run(self._batch_steps(questions))
+
+    async def analyze_questions_batch_async(self, questions: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Async counterpart of analyze_questions_batch.
+        """
+        return await self._run_async(self._batch_steps(questions))
 
     def generate_variant_question(self, original_question: str, topic: str, abilities: str) -> Dict[str, Any]:
         """
@@ -635,63 +1064,3 @@ class LLMService:
         except Exception as e:
             logger.error(f"Error in grading validation: {e}")
             return data
-
-    def _build_prompt(self, question: str, mode: str = "question_analysis") -> str:
-        # In a real app, we might cache this content
-        try:
-            # Determine project root based on runtime environment
-            import sys
-            if getattr(sys, 'frozen', False):
-                # Running as PyInstaller bundle (frozen)
-                # sys._MEIPASS points to the bundle directory where datas are extracted/located
-                project_root = getattr(sys, "_MEIPASS", os.path.dirname(sys.executable))
-            else:
-                # Running as script (dev)
-                # Use absolute path to ensure file is found regardless of CWD
-                project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-            
-            if mode == "multiple_analysis":
-                file_name = "multiple_analysis_API.md"
-            elif mode == "single_analysis":
-                file_name = "single_analysis_API.md"
-            else:
-                file_name = "for_API.md"
-                
-            file_path = os.path.join(project_root, file_name)
-            
-            with open(file_path, "r", encoding="utf-8") as f:
-                standards = f.read()
-            logger.info(f"Loaded standards from {file_path}, length: {len(standards)}")
-        except FileNotFoundError:
-            logger.error(f"Standard file not found at: {file_path}")
-            standards = "Standard file not found."
-
-        if mode == "question_analysis":
-            return f"""
-            {standards}
-
-            请根据上述标准（特别是第四步的输出格式），对以下化学题目进行分析：
-            
-            **题目内容：**
-            {question}
-
-            **注意：** 
-            1. 必须返回合法的JSON格式。
-            2. 确保包含 "markdown_report" 字段，其中包含完整的Markdown分析报告。
-            3. 确保 "comprehensive_rating" 中包含 "final_level"。
-            """
-        elif mode == "variant_generation":
-            # For variant generation, the input 'question' is already the full prompt constructed by the caller
-            return question
-        else:
-            # For other analysis modes, 'question' parameter actually contains the data JSON string
-            return f"""
-            {standards}
-            
-            **输入数据：**
-            {question}
-            
-            **注意：**
-            1. 必须严格按照上述【输出要求】返回JSON格式。
-            2. 确保包含所有必需字段。
-            """
@@ -0,0 +1,248 @@
+from typing import Dict, Any, Optional, List, Callable, Awaitable, Tuple, Iterable
+from collections import deque
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+
+from backend.config import settings
+from backend.services.task_queues import DEFAULT_PRIORITY, QUEUE_PRIORITIES
+
+logger = logging.getLogger(__name__)
+
+# Smoothing of the task duration average used for the wait estimate
+DURATION_ALPHA = 0.2
+
+
+class QueueFull(Exception):
+    """The in-process queue cannot take the submission; retry after `retry_after` seconds."""
+
+    def __init__(self, message: str, depth: int, retry_after: int):
+        super().__init__(message)
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+def default_worker_count() -> int:
+    """
+    Streams are I/O bound: a few per core, but never more than the event loop semaphore
+    (LLM_ASYNC_CONCURRENCY) or the adaptive limiter window of one provider allow.
+    """
+    cpus = os.cpu_count() or 2
+    return max(2, min(cpus * 4, settings.LLM_ASYNC_CONCURRENCY, int(settings.LLM_LIMITER_MAX_CONCURRENCY)))
+
+
+class LocalJobRunner:
+    """
+    Bounded in-process job runner (desktop mode / Celery unavailable).
+
+    At most `workers` tasks run at once, at most `job_max_in_flight` of one submission (job).
+    Waiting tasks are ordered by priority (interactive retries, then score analysis, then
+    bulk analysis) and, within a priority, round-robin across jobs as in the fair scheduler.
+    The queue holds at most `max_queue` tasks: a submission that does not fit is rejected
+    as a whole with QueueFull instead of piling up. shutdown() stops starting tasks and
+    waits for running ones; tasks still queued stay PENDING in the task store and are
+    re-queued by TaskStore.restore() on the next start.
+    """
+
+    def __init__(self, workers: int = None, max_queue: int = None, job_max_in_flight: int = None):
+        self.workers = workers or settings.LOCAL_WORKERS or default_worker_count()
+        self.max_queue = settings.LOCAL_QUEUE_MAX_SIZE if max_queue is None else max_queue
+        self.job_max_in_flight = settings.FAIR_JOB_MAX_IN_FLIGHT if job_max_in_flight is None else job_max_in_flight
+        self._lock = threading.Lock()
+        # priority -> ring of job ids; (priority, job_id) -> waiting (task_ids, factory) items
+        self._rings: Dict[int, deque] = {}
+        self._pending: Dict[Tuple[int, str], deque] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._total = 0
+        self._depth = 0
+        self._closing = False
+        self._avg_duration: Optional[float] = None
+        # References to running asyncio tasks (the loop only keeps weak ones)
+        self._running: set = set()
+        self.counters = {"submitted": 0, "started": 0, "finished": 0, "failed": 0, "rejected": 0, "discarded": 0}
+
+    def submit(
+        self,
+        job_id: str,
+        items: List[Tuple[List[str], Callable[[], Awaitable[Any]]]],
+        priority: int = DEFAULT_PRIORITY,
+        bounded: bool = True,
+    ):
+        """
+        Queue (task_ids, coroutine factory) items of one job and start the ones that may run
+        now (inside the event loop; started tasks only run once the caller yields).
+        task_ids are the task ids an item reports to, used by discard.
+        Raises QueueFull, taking none of the items, if they do not fit (bounded) or while shutting down.
+        """
+        if not items:
+            return
+        with self._lock:
+            # Items that start right away on a free worker do not count against the queue
+            free = max(0, self.workers - self._total)
+            if self._closing or (bounded and 0 < self.max_queue < self._depth + len(items) - free):
+                self.counters["rejected"] += len(items)
+                depth = self._depth
+                reason = "shutting down" if self._closing else f"{depth} tasks waiting, limit {self.max_queue}"
+                raise QueueFull(f"In-process queue is full ({reason})", depth, self._retry_after(depth, len(items)))
+            key = (priority, job_id)
+            self._pending.setdefault(key, deque()).extend(items)
+            self._in_flight.setdefault(job_id, 0)
+            ring = self._rings.setdefault(priority, deque())
+            if job_id in ring:
+                ring.remove(job_id)
+            # The tail is served next: a new submission gets the next free slot
+            ring.append(job_id)
+            self._depth += len(items)
+            self.counters["submitted"] += len(items)
+            ready = self._fill()
+        self._start(ready)
+
+    def _fill(self) -> List[tuple]:
+        # Caller holds the lock; within a priority, same walk as the fair scheduler's FILL_FUNCTION
+        ready = []
+        if self._closing:
+            return ready
+        for priority in sorted(self._rings):
+            ring = self._rings[priority]
+            idle = 0
+            while self._total < self.workers and idle < len(ring):
+                ring.rotate(1)
+                job_id = ring[0]
+                pending = self._pending.get((priority, job_id))
+                if not pending:
+                    ring.popleft()
+                    self._pending.pop((priority, job_id), None)
+                elif 0 < self.job_max_in_flight <= self._in_flight.get(job_id, 0):
+                    idle += 1
+                else:
+                    ready.append((job_id, pending.popleft()))
+                    self._in_flight[job_id] = self._in_flight.get(job_id, 0) + 1
+                    self._total += 1
+                    self._depth -= 1
+                    idle = 0
+            if self._total >= self.workers:
+                break
+        return ready
+
+    def _start(self, ready: List[tuple]):
+        if ready:
+            self._count("started", len(ready))
+        for job_id, item in ready:
+            task = asyncio.ensure_future(self._run(job_id, item[1]))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, job_id: str, factory: Callable[[], Awaitable[Any]]):
+        started_at = time.monotonic()
+        failed = False
+        try:
+            await factory()
+        except Exception as e:
+            failed = True
+            logger.error(f"In-process task of job {job_id} failed: {e}")
+        finally:
+            with self._lock:
+                duration = time.monotonic() - started_at
+                self._avg_duration = duration if self._avg_duration is None else \
+                    self._avg_duration + DURATION_ALPHA * (duration - self._avg_duration)
+                self.counters["failed" if failed else "finished"] += 1
+                self._in_flight[job_id] = self._in_flight.get(job_id, 1) - 1
+                if self._in_flight[job_id] <= 0 and not any(job_id in ring for ring in self._rings.values()):
+                    self._in_flight.pop(job_id, None)
+                self._total -= 1
+                ready = self._fill()
+            self._start(ready)
+
+    def discard(self, job_id: Optional[str] = None, task_ids: Optional[Iterable[str]] = None) -> int:
+        """
+        Drop tasks that were not started yet: every task of `job_id`, or those reporting
+        only to the given task ids (a stopped submission). Returns how many were dropped.
+        """
+        stopped = set(task_ids or ())
+
+        def drop(covered: List[str]) -> bool:
+            return job_id is not None or (bool(covered) and stopped.issuperset(covered))
+
+        with self._lock:
+            dropped = 0
+            for (priority, j), pending in self._pending.items():
+                if job_id is not None and j != job_id:
+                    continue
+                kept = deque(item for item in pending if not drop(item[0]))
+                dropped += len(pending) - len(kept)
+                self._pending[(priority, j)] = kept
+            self._depth -= dropped
+            self.counters["discarded"] += dropped
+        return dropped
+
+    def estimated_wait(self, depth: Optional[int] = None) -> Optional[float]:
+        """Seconds until a task queued behind `depth` others (default: the whole queue) starts; None before the first task finished."""
+        with self._lock:
+            if self._avg_duration is None:
+                return None
+            depth = self._depth if depth is None else depth
+            return math.ceil(depth / self.workers) * self._avg_duration
+
+    def _retry_after(self, depth: int, needed: int) -> int:
+        # Caller holds the lock: time until the workers have taken enough tasks for `needed` to fit
+        average = self._avg_duration or 10.0
+        excess = max(1, depth + needed - self.max_queue - max(0, self.workers - self._total))
+        return max(1, int(math.ceil(excess / self.workers) * average))
+
+    def queue_info(self) -> Dict[str, Any]:
+        """Depth and estimated wait, returned to submitters so the UI can show how long it takes to start."""
+        wait = self.estimated_wait()
+        with self._lock:
+            depth = self._depth
+        return {"depth": depth, "estimated_wait_seconds": None if wait is None else round(wait, 1)}
+
+    async def shutdown(self, timeout: float = None) -> int:
+        """
+        Stop starting tasks and wait up to `timeout` seconds for running ones. Tasks still
+        running afterwards are cancelled (re-queued from the task store on the next start).
+        Returns the number of tasks that were cancelled.
+        """
+        timeout = settings.LOCAL_SHUTDOWN_TIMEOUT if timeout is None else timeout
+        with self._lock:
+            self._closing = True
+            depth = self._depth
+        running = list(self._running)
+        logger.info(f"Local runner shutting down: draining {len(running)} running tasks, {depth} stay queued")
+        if not running:
+            return 0
+        _, still_running = await asyncio.wait(running, timeout=timeout)
+        for task in still_running:
+            task.cancel()
+        if still_running:
+            logger.warning(f"Cancelled {len(still_running)} tasks still running after {timeout}s")
+            await asyncio.gather(*still_running, return_exceptions=True)
+        return len(still_running)
+
+    def stats(self) -> Dict[str, Any]:
+        wait = self.estimated_wait()
+        with self._lock:
+            stats = dict(self.counters)
+            stats["workers"] = self.workers
+            stats["max_queue"] = self.max_queue
+            stats["job_max_in_flight"] = self.job_max_in_flight
+            stats["running"] = self._total
+            stats["queued"] = self._depth
+            stats["queued_by_priority"] = {
+                name: sum(len(p) for (priority, _), p in self._pending.items() if priority == value)
+                for name, value in QUEUE_PRIORITIES.items()
+            }
+            stats["jobs"] = sum(len(ring) for ring in self._rings.values())
+            stats["avg_task_seconds"] = None if self._avg_duration is None else round(self._avg_duration, 2)
+            stats["closing"] = self._closing
+        stats["estimated_wait_seconds"] = None if wait is None else round(wait, 1)
+        return stats
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+
+local_runner = LocalJobRunner()
@@ -0,0 +1,253 @@
+"""
+Local OpenAI-compatible stub for offline load and latency testing.
+
+Streams rubric-shaped JSON (deterministic per question) with configurable time to first
+token, tokens per second and fault injection (5xx errors, 429 rate limits, truncation).
+Use provider "mock" with any API key; the base URL is MOCK_LLM_BASE_URL.
+
+    python -m backend.services.mock_llm --port 8900 --ttft 0.5 --tps 60 --rate-limit-rate 0.05
+"""
+from typing import Dict, Any, List, Optional
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Roughly how many characters one mock "token" is
+CHARS_PER_TOKEN = 4
+# Emit a chunk at most this often, however high the token rate
+MAX_CHUNKS_PER_SECOND = 50
+
+LEVEL_BOUNDS = [(1.5, "L1"), (2.5, "L2"), (3.5, "L3"), (4.5, "L4"), (99, "L5")]
+ABILITY_ELEMENTS = ["A1辨识记忆", "A2概括关联", "B1分析解释", "B2推论预测", "C1复杂推理"]
+TOPICS = ["氧化还原反应", "化学反应速率与平衡", "电化学", "有机化学基础", "物质结构与性质"]
+
+
+class MockBehaviour:
+    """Latency / fault knobs of the stub. Defaults come from MOCK_LLM_* env vars."""
+
+    FIELDS = ("ttft", "tps", "error_rate", "rate_limit_rate", "truncate_rate", "seed")
+
+    def __init__(self):
+        self.ttft = float(os.getenv("MOCK_LLM_TTFT", "0.5"))
+        self.tps = float(os.getenv("MOCK_LLM_TPS", "60"))
+        self.error_rate = float(os.getenv("MOCK_LLM_ERROR_RATE", "0"))
+        self.rate_limit_rate = float(os.getenv("MOCK_LLM_RATE_LIMIT_RATE", "0"))
+        self.truncate_rate = float(os.getenv("MOCK_LLM_TRUNCATE_RATE", "0"))
+        self.seed: Optional[int] = int(os.environ["MOCK_LLM_SEED"]) if os.getenv("MOCK_LLM_SEED") else None
+        self.random = random.Random(self.seed)
+
+    def update(self, values: Dict[str, Any]):
+        for field in self.FIELDS:
+            if field in values:
+                setattr(self, field, values[field])
+        if "seed" in values:
+            self.random = random.Random(self.seed)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+def _question_seed(text: str) -> random.Random:
+    return random.Random(int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:12], 16))
+
+
+def _level(average: float) -> str:
+    return next(level for bound, level in LEVEL_BOUNDS if average <= bound)
+
+
+def build_question_result(question: str) -> Dict[str, Any]:
+    """A valid question analysis in the for_API.md output format, stable per question text."""
+    rnd = _question_seed(question)
+    scores = [rnd.randint(1, 5) for _ in range(3)]
+    average = round(sum(scores) / 3, 2)
+    level = _level(average)
+    topic = rnd.choice(TOPICS)
+    return {
+        "meta": {
+            "framework_topic": topic,
+            "knowledge_topic": topic,
+            "ability_elements": rnd.sample(ABILITY_ELEMENTS, 2),
+            "cognition_mode": "模拟数据",
+            "context_type": rnd.choice(["熟悉", "近变", "陌生"]),
+        },
+        "dimensions": {
+            "activity_level": {"score": scores[0], "reason": "模拟评分"},
+            "cognition_complexity": {"score": scores[1], "reason": "模拟评分"},
+            "context_processing": {"score": scores[2], "reason": "模拟评分"},
+        },
+        "comprehensive_rating": {
+            "average_score": average,
+            "final_level": level,
+            "downgrade_reason": "",
+            "student_level": f"水平{level[1]}",
+        },
+        "teaching_guide": {"positioning": "模拟", "target_student": "模拟", "suggestions": "模拟"},
+        "markdown_report": f"**题目：{question[:40]}**\n\n**综合评级：{level}**（平均分 {average}）\n\n" + "模拟分析内容。" * 40,
+    }
+
+
+def build_reply(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Pick the reply shape from the prompt built by PromptRegistry."""
+    user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    if not isinstance(user, str):
+        user = json.dumps(user, ensure_ascii=False)
+
+    batch_ids = re.findall(r"### question_id: (\S+)\n", user)
+    if batch_ids:
+        parts = re.split(r"### question_id: \S+\n", user)[1:]
+        return {"results": [dict(build_question_result(part), question_id=qid) for qid, part in zip(batch_ids, parts)]}
+
+    match = re.search(r"\*\*题目内容：\*\*\n(.*?)\n\n\*\*注意", user, re.DOTALL)
+    if match:
+        return build_question_result(match.group(1))
+
+    # Score analysis / other modes: a generic report
+    return {
+        "summary": "模拟学情分析",
+        "markdown_report": "# 智能学情分析报告\n\n## 整体评估\n\n" + "模拟分析内容。" * 60,
+    }
+
+
+def reply_text(messages: List[Dict[str, Any]]) -> str:
+    """
+    Full reply text. A continuation request (original messages, the partial assistant reply,
+    then an instruction) gets the rest of the original reply.
+    """
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].get("role") == "assistant":
+            full = json.dumps(build_reply(messages[:index]), ensure_ascii=False)
+            partial = messages[index].get("content") or ""
+            return full[len(partial):] if full.startswith(partial) else full
+    return json.dumps(build_reply(messages), ensure_ascii=False)
+
+
+def _chunk(completion_id: str, model: str, content: Optional[str], finish_reason: Optional[str] = None) -> str:
+    delta = {"content": content} if content is not None else {}
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def create_app(behaviour: Optional[MockBehaviour] = None) -> FastAPI:
+    behaviour = behaviour or MockBehaviour()
+    app = FastAPI(title="Mock LLM provider")
+    app.state.behaviour = behaviour
+    app.state.requests = 0
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "mock-chemistry", "object": "model"}]}
+
+    @app.get("/v1/mock/config")
+    async def get_config():
+        return dict(behaviour.as_dict(), requests=app.state.requests)
+
+    @app.post("/v1/mock/config")
+    async def set_config(request: Request):
+        behaviour.update(await request.json())
+        return behaviour.as_dict()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+        model = body.get("model", "mock-chemistry")
+
+        roll = behaviour.random.random()
+        if roll < behaviour.rate_limit_rate:
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+                status_code=429, headers={"Retry-After": "1"}
+            )
+        if roll < behaviour.rate_limit_rate + behaviour.error_rate:
+            return JSONResponse({"error": {"message": "Internal error (mock)", "type": "server_error"}}, status_code=500)
+        truncate = behaviour.random.random() < behaviour.truncate_rate
+
+        text = reply_text(body.get("messages", []))
+        completion_tokens = max(1, len(text) // CHARS_PER_TOKEN)
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in body.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_chars // 2,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_chars // 2 + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+        if truncate:
+            text = text[:len(text) // 2]
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+
+        if not body.get("stream"):
+            await asyncio.sleep(behaviour.ttft + completion_tokens / max(behaviour.tps, 0.001))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "length" if truncate else "stop"}],
+                "usage": usage,
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+        async def stream():
+            await asyncio.sleep(behaviour.ttft)
+            tps = max(behaviour.tps, 0.001)
+            tokens_per_chunk = max(1, int(tps / MAX_CHUNKS_PER_SECOND))
+            chunk_chars = tokens_per_chunk * CHARS_PER_TOKEN
+            started = time.perf_counter()
+            sent_tokens = 0
+            for i in range(0, len(text), chunk_chars):
+                yield _chunk(completion_id, model, text[i:i + chunk_chars])
+                sent_tokens += tokens_per_chunk
+                # Pace against the wall clock so sleep overhead does not accumulate
+                delay = sent_tokens / tps - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield _chunk(completion_id, model, None, "length" if truncate else "stop")
+            if include_usage:
+                payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                           "model": model, "choices": [], "usage": usage}
+                yield f"data: {json.dumps(payload)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the mock OpenAI-compatible LLM provider")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--ttft", type=float, help="seconds before the first token")
+    parser.add_argument("--tps", type=float, help="tokens per second")
+    parser.add_argument("--error-rate", type=float, help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, help="fraction of requests answered with HTTP 429")
+    parser.add_argument("--truncate-rate", type=float, help="fraction of replies cut off halfway")
+    parser.add_argument("--seed", type=int, help="random seed for fault injection")
+    args = parser.parse_args()
+
+    behaviour = MockBehaviour()
+    behaviour.update({k: v for k, v in vars(args).items() if k in MockBehaviour.FIELDS and v is not None})
+
+    import uvicorn
+    uvicorn.run(create_app(behaviour), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
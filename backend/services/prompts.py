@@ -0,0 +1,198 @@
+from typing import Dict, Any, List, Optional
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PERSONA = "你是一位精通高中化学的教研专家。"
+
+CONTINUATION_INSTRUCTION = (
+    "你上一条回复因长度限制被截断。请从截断处的下一个字符开始继续输出，"
+    "不要重复已输出的内容，不要添加任何解释或代码块标记，直到JSON结束。"
+)
+
+# Standards file per analysis mode
+STANDARDS_FILES = {
+    "question_analysis": "for_API.md",
+    "single_analysis": "single_analysis_API.md",
+    "multiple_analysis": "multiple_analysis_API.md",
+}
+
+# Only re-stat the standards files at most this often
+MTIME_CHECK_INTERVAL = 1.0
+
+
+def get_standards_path(mode: str = "question_analysis") -> str:
+    """
+    Resolve the standards (rubric) file used for a given analysis mode.
+    """
+    # Determine project root based on runtime environment
+    if getattr(sys, 'frozen', False):
+        # Running as PyInstaller bundle (frozen)
+        # sys._MEIPASS points to the bundle directory where datas are extracted/located
+        project_root = getattr(sys, "_MEIPASS", os.path.dirname(sys.executable))
+    else:
+        # Running as script (dev)
+        # Use absolute path to ensure file is found regardless of CWD
+        project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    file_name = STANDARDS_FILES.get(mode, "for_API.md")
+    return os.path.join(project_root, file_name)
+
+
+class PromptTemplate:
+    """A loaded standards file plus the byte-stable system message built from it."""
+
+    def __init__(self, path: str, standards: str, mtime: float):
+        self.path = path
+        self.standards = standards
+        self.mtime = mtime
+        self.version = hashlib.sha256(standards.encode("utf-8")).hexdigest()[:16]
+        # The rubric is the long, repeated part of every request: keep it at the very start
+        # of the conversation and never interpolate per-question data into it, so providers
+        # with prefix/context caching (e.g. DeepSeek disk cache) can reuse it.
+        self.system_message = f"{SYSTEM_PERSONA}\n\n{standards.strip()}\n"
+        self.checked_at = time.time()
+
+
+class PromptRegistry:
+    """
+    Loads each standards file once and keeps it in memory, reloading only when the
+    file's mtime changes. Also tracks the prompt/cached token counts reported by providers.
+    """
+
+    def __init__(self):
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._lock = threading.Lock()
+        self._usage: Dict[str, Dict[str, int]] = {}
+
+    def get(self, mode: str = "question_analysis") -> Optional[PromptTemplate]:
+        path = get_standards_path(mode)
+        template = self._templates.get(path)
+        now = time.time()
+        if template is not None and now - template.checked_at < MTIME_CHECK_INTERVAL:
+            return template
+
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            logger.error(f"Standard file not found at: {path}")
+            return None
+
+        if template is not None and template.mtime == mtime:
+            template.checked_at = now
+            return template
+
+        with self._lock:
+            template = self._templates.get(path)
+            if template is None or template.mtime != mtime:
+                with open(path, "r", encoding="utf-8") as f:
+                    standards = f.read()
+                template = PromptTemplate(path, standards, mtime)
+                self._templates[path] = template
+                logger.info(f"Loaded standards from {path}, length: {len(standards)}, version: {template.version}")
+            return template
+
+    def version(self, mode: str = "question_analysis") -> str:
+        template = self.get(mode)
+        return template.version if template else "missing"
+
+    def build_messages(self, question: str, mode: str = "question_analysis") -> List[Dict[str, str]]:
+        """
+        Build chat messages: static rubric in the system message, per-question data in the user message.
+        """
+        if mode == "variant_generation":
+            # For variant generation, the input 'question' is already the full prompt constructed by the caller
+            return [
+                {"role": "system", "content": SYSTEM_PERSONA},
+                {"role": "user", "content": question}
+            ]
+
+        template = self.get(mode)
+        system_message = template.system_message if template else f"{SYSTEM_PERSONA}\n\nStandard file not found.\n"
+
+        if mode == "question_analysis":
+            user_message = (
+                "请根据上述标准（特别是第四步的输出格式），对以下化学题目进行分析：\n\n"
+                f"**题目内容：**\n{question}\n\n"
+                "**注意：**\n"
+                "1. 必须返回合法的JSON格式。\n"
+                "2. 确保包含 \"markdown_report\" 字段，其中包含完整的Markdown分析报告。\n"
+                "3. 确保 \"comprehensive_rating\" 中包含 \"final_level\"。"
+            )
+        else:
+            # For other analysis modes, 'question' parameter actually contains the data JSON string
+            user_message = (
+                f"**输入数据：**\n{question}\n\n"
+                "**注意：**\n"
+                "1. 必须严格按照上述【输出要求】返回JSON格式。\n"
+                "2. 确保包含所有必需字段。"
+            )
+
+        return [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_message}
+        ]
+
+    def build_batch_messages(self, questions: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """
+        Pack several questions into one request. The system message is the same as for a
+        single question, so the rubric prefix is shared (and cacheable) across batches.
+        """
+        template = self.get("question_analysis")
+        system_message = template.system_message if template else f"{SYSTEM_PERSONA}\n\nStandard file not found.\n"
+
+        parts = []
+        for q in questions:
+            parts.append(f"### question_id: {q.get('id')}\n{q.get('content', '')}")
+        question_block = "\n\n".join(parts)
+
+        user_message = (
+            f"请根据上述标准（特别是第四步的输出格式），分别对以下 {len(questions)} 道化学选择题逐题独立分析：\n\n"
+            f"{question_block}\n\n"
+            "**注意：**\n"
+            "1. 必须返回合法的JSON对象，格式为 {\"results\": [ ... ]}，数组中每道题一个元素。\n"
+            "2. 每个元素必须包含 \"question_id\" 字段（与上面给出的 question_id 完全一致），其余字段与单题分析的输出格式相同。\n"
+            "3. 每个元素都必须包含 \"markdown_report\" 字段，且 \"comprehensive_rating\" 中包含 \"final_level\"。\n"
+            "4. 各题之间相互独立，不要合并或省略任何一道题。"
+        )
+
+        return [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_message}
+        ]
+
+    def build_continuation_messages(self, messages: List[Dict[str, str]], partial: str) -> List[Dict[str, str]]:
+        """
+        Ask the model to continue a reply cut off by max_tokens. The original messages are
+        kept unchanged in front, so the rubric prefix stays cacheable.
+        """
+        return list(messages) + [
+            {"role": "assistant", "content": partial},
+            {"role": "user", "content": CONTINUATION_INSTRUCTION},
+        ]
+
+    def record_usage(self, mode: str, usage: Dict[str, Any]):
+        with self._lock:
+            totals = self._usage.setdefault(mode, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+            totals["requests"] += 1
+            totals["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
+            totals["cached_tokens"] += int(usage.get("cached_tokens") or 0)
+            totals["completion_tokens"] += int(usage.get("completion_tokens") or 0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            usage = {}
+            for mode, totals in self._usage.items():
+                entry = dict(totals)
+                entry["cached_ratio"] = round(totals["cached_tokens"] / totals["prompt_tokens"], 4) if totals["prompt_tokens"] else 0.0
+                usage[mode] = entry
+            versions = {t.path: t.version for t in self._templates.values()}
+        return {"versions": versions, "usage": usage}
+
+
+prompt_registry = PromptRegistry()
@@ -0,0 +1,429 @@
+from typing import Dict, Any, Optional, Callable
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import uuid
+
+from backend.config import settings, parse_provider_map
+from backend.services.redis_client import get_redis, mark_redis_failed
+from backend.services.io_steps import run_steps, run_steps_async
+from backend.services.task_queues import DEFAULT_PRIORITY
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "llm-limiter:"
+
+# Polling interval while waiting for a free slot (grows up to the max)
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.5
+
+# Status codes that mean "slow down" rather than "bad request"
+OVERLOAD_STATUS_CODES = {429, 500, 502, 503, 504, 529}
+
+
+class RateLimiterTimeout(RuntimeError):
+    """Raised when no slot became free within LLM_LIMITER_ACQUIRE_TIMEOUT."""
+
+
+def limiter_key(provider: str, api_key: str) -> str:
+    """Limiter identity for (provider, api_key). Only a hash of the key is kept."""
+    digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+    return f"{provider}:{digest}"
+
+
+def is_overload_error(e: Exception) -> bool:
+    """True for 429 / 5xx style errors that should shrink the concurrency window."""
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    return status in OVERLOAD_STATUS_CODES
+
+
+# Sliding window of the tokens-per-minute budget
+TPM_WINDOW = 60
+
+# KEYS: leases zset, state hash, rpm counter, tpm zset (lease -> time), tpm hash (lease -> tokens)
+# ARGV: now, lease_id, lease_ttl, initial_window, rpm_limit, tpm_limit, tokens
+# Returns 1 (granted), 0 (window full), -1 (RPM used up), -2 (TPM used up)
+ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[3]))
+local window = tonumber(redis.call('HGET', KEYS[2], 'window') or ARGV[4])
+if redis.call('ZCARD', KEYS[1]) >= math.floor(window) then
+  return 0
+end
+local rpm = tonumber(ARGV[5])
+if rpm > 0 and tonumber(redis.call('GET', KEYS[3]) or '0') >= rpm then
+  return -1
+end
+local tpm = tonumber(ARGV[6])
+if tpm > 0 then
+  local expired = redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', tonumber(ARGV[1]) - """ + str(TPM_WINDOW) + """)
+  for _, lease in ipairs(expired) do
+    redis.call('ZREM', KEYS[4], lease)
+    redis.call('HDEL', KEYS[5], lease)
+  end
+  local used = 0
+  for _, tokens in ipairs(redis.call('HVALS', KEYS[5])) do
+    used = used + tonumber(tokens)
+  end
+  -- A request larger than the whole budget still runs, alone
+  if used > 0 and used + tonumber(ARGV[7]) > tpm then
+    return -2
+  end
+  redis.call('ZADD', KEYS[4], ARGV[1], ARGV[2])
+  redis.call('HSET', KEYS[5], ARGV[2], ARGV[7])
+  redis.call('EXPIRE', KEYS[4], 120)
+  redis.call('EXPIRE', KEYS[5], 120)
+end
+if rpm > 0 then
+  redis.call('INCR', KEYS[3])
+  redis.call('EXPIRE', KEYS[3], 120)
+end
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# KEYS: tpm zset, tpm hash
+# ARGV: lease_id, tokens actually used
+# Replaces the estimate charged at acquire time, while the request is still inside the window
+USAGE_SCRIPT = """
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+  redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+end
+return 1
+"""
+
+# KEYS: leases zset, state hash
+# ARGV: lease_id, outcome ('1' overloaded, '0' success, '' cancelled: only frees the slot), now, initial, min, max, cooldown
+RELEASE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+local window = tonumber(redis.call('HGET', KEYS[2], 'window') or ARGV[4])
+if ARGV[2] == '1' then
+  local last = tonumber(redis.call('HGET', KEYS[2], 'decreased_at') or '0')
+  if tonumber(ARGV[3]) - last >= tonumber(ARGV[7]) then
+    window = math.max(tonumber(ARGV[5]), window / 2)
+    redis.call('HSET', KEYS[2], 'decreased_at', ARGV[3])
+  end
+elseif ARGV[2] == '0' then
+  window = math.min(tonumber(ARGV[6]), window + 1 / window)
+end
+redis.call('HSET', KEYS[2], 'window', tostring(window))
+redis.call('EXPIRE', KEYS[2], 86400)
+return tostring(window)
+"""
+
+
+class _LocalBackend:
+    """In-process AIMD state, used in desktop mode or when Redis is down."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> {"window", "leases": {lease_id: acquired_at}, "decreased_at", "rpm_bucket", "rpm_used", "tpm_log"}
+        self._state: Dict[str, Dict[str, Any]] = {}
+
+    def _get_state(self, key: str) -> Dict[str, Any]:
+        state = self._state.get(key)
+        if state is None:
+            state = {
+                "window": settings.LLM_LIMITER_INITIAL_CONCURRENCY,
+                "leases": {},
+                "decreased_at": 0.0,
+                "rpm_bucket": 0,
+                "rpm_used": 0,
+                # lease_id -> [acquired_at, tokens] within the last TPM_WINDOW seconds
+                "tpm_log": {},
+            }
+            self._state[key] = state
+        return state
+
+    def try_acquire(self, key: str, lease_id: str, now: float, rpm: int, tpm: int = 0, tokens: int = 0) -> int:
+        with self._lock:
+            state = self._get_state(key)
+            stale_before = now - settings.LLM_LIMITER_LEASE_TTL
+            for old_id in [l for l, t in state["leases"].items() if t < stale_before]:
+                del state["leases"][old_id]
+            if len(state["leases"]) >= int(state["window"]):
+                return 0
+            if rpm > 0:
+                bucket = int(now // 60)
+                if state["rpm_bucket"] != bucket:
+                    state["rpm_bucket"] = bucket
+                    state["rpm_used"] = 0
+                if state["rpm_used"] >= rpm:
+                    return -1
+            if tpm > 0:
+                used = self._tpm_used(state, now)
+                # A request larger than the whole budget still runs, alone
+                if used > 0 and used + tokens > tpm:
+                    return -2
+                state["tpm_log"][lease_id] = [now, tokens]
+            if rpm > 0:
+                state["rpm_used"] += 1
+            state["leases"][lease_id] = now
+            return 1
+
+    @staticmethod
+    def _tpm_used(state: Dict[str, Any], now: float) -> int:
+        # Caller holds the lock
+        log = state["tpm_log"]
+        for old_id in [l for l, (t, _) in log.items() if t <= now - TPM_WINDOW]:
+            del log[old_id]
+        return sum(tokens for _, tokens in log.values())
+
+    def record_tokens(self, key: str, lease_id: str, tokens: int):
+        with self._lock:
+            entry = self._get_state(key)["tpm_log"].get(lease_id)
+            if entry is not None:
+                entry[1] = tokens
+
+    def release(self, key: str, lease_id: str, overloaded: bool, now: float, cancelled: bool = False) -> float:
+        with self._lock:
+            state = self._get_state(key)
+            state["leases"].pop(lease_id, None)
+            if overloaded:
+                if now - state["decreased_at"] >= settings.LLM_LIMITER_DECREASE_COOLDOWN:
+                    state["window"] = max(settings.LLM_LIMITER_MIN_CONCURRENCY, state["window"] / 2)
+                    state["decreased_at"] = now
+            elif not cancelled:
+                state["window"] = min(settings.LLM_LIMITER_MAX_CONCURRENCY, state["window"] + 1 / state["window"])
+            return state["window"]
+
+    def snapshot(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            state = self._get_state(key)
+            return {"window": round(state["window"], 2), "in_flight": len(state["leases"]),
+                    "tokens_last_minute": self._tpm_used(state, time.time())}
+
+
+class _RedisBackend:
+    """AIMD state shared by the API process and all Celery workers."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def _keys(self, key: str, now: float = 0):
+        base = REDIS_KEY_PREFIX + key
+        return [f"{base}:leases", f"{base}:state", f"{base}:rpm:{int(now // 60)}", f"{base}:tpm", f"{base}:tpm-tokens"]
+
+    def try_acquire(self, key: str, lease_id: str, now: float, rpm: int, tpm: int = 0, tokens: int = 0) -> int:
+        return int(self.client.eval(
+            ACQUIRE_SCRIPT, 5, *self._keys(key, now),
+            now, lease_id, settings.LLM_LIMITER_LEASE_TTL, settings.LLM_LIMITER_INITIAL_CONCURRENCY, rpm, tpm, tokens
+        ))
+
+    def record_tokens(self, key: str, lease_id: str, tokens: int):
+        self.client.eval(USAGE_SCRIPT, 2, *self._keys(key)[3:], lease_id, tokens)
+
+    def release(self, key: str, lease_id: str, overloaded: bool, now: float, cancelled: bool = False) -> float:
+        window = self.client.eval(
+            RELEASE_SCRIPT, 2, *self._keys(key)[:2],
+            lease_id, "1" if overloaded else ("" if cancelled else "0"), now,
+            settings.LLM_LIMITER_INITIAL_CONCURRENCY, settings.LLM_LIMITER_MIN_CONCURRENCY,
+            settings.LLM_LIMITER_MAX_CONCURRENCY, settings.LLM_LIMITER_DECREASE_COOLDOWN
+        )
+        return float(window)
+
+    def snapshot(self, key: str) -> Dict[str, Any]:
+        leases_key, state_key, _, tpm_key, tokens_key = self._keys(key)
+        pipe = self.client.pipeline()
+        pipe.hget(state_key, "window")
+        pipe.zcount(leases_key, time.time() - settings.LLM_LIMITER_LEASE_TTL, "+inf")
+        pipe.zrangebyscore(tpm_key, time.time() - TPM_WINDOW, "+inf")
+        window, in_flight, recent = pipe.execute()
+        window = float(window) if window is not None else settings.LLM_LIMITER_INITIAL_CONCURRENCY
+        tokens = self.client.hmget(tokens_key, recent) if recent else []
+        return {"window": round(window, 2), "in_flight": int(in_flight),
+                "tokens_last_minute": sum(int(t) for t in tokens if t is not None)}
+
+
+class Lease:
+    """A granted slot; must be passed back to AdaptiveRateLimiter.release."""
+
+    def __init__(self, key: str, lease_id: str, backend, tokens: int = 0):
+        self.key = key
+        self.lease_id = lease_id
+        self.backend = backend
+        # Estimate charged against the TPM budget (0 when no budget applies)
+        self.tokens = tokens
+
+
+class AdaptiveRateLimiter:
+    """
+    Per-(provider, api_key) concurrency + requests/tokens-per-minute limiter with AIMD control:
+    the concurrency window grows by 1/window on every success (about +1 per window of
+    requests) and is halved on 429 / overload responses. State lives in Redis so all
+    workers share it; an in-process backend takes over when Redis is unavailable.
+    Waiters carry a priority (see task_queues): while a more urgent request of this process
+    waits for the same key, less urgent ones do not compete for the freed slots.
+    With a TPM budget, each request is admitted with its estimated token cost (see
+    token_budget) only while the last minute's tokens leave room for it; the estimate is
+    replaced by the reported usage on release, so the budget is used fully but not exceeded.
+    """
+
+    def __init__(self, redis_getter: Callable = get_redis):
+        self._redis_getter = redis_getter
+        self._local = _LocalBackend()
+        self._lock = threading.Lock()
+        # Per-process wait / outcome counters, keyed by limiter_key
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        # limiter_key -> {priority: number of requests of this process waiting}
+        self._waiters: Dict[str, Dict[int, int]] = {}
+
+    def _backend(self):
+        client = self._redis_getter()
+        return _RedisBackend(client) if client is not None else self._local
+
+    def _metric(self, key: str) -> Dict[str, Any]:
+        # Caller must hold self._lock
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = {"acquired": 0, "waiting": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+                      "rpm_throttled": 0, "tpm_throttled": 0, "successes": 0, "overloads": 0, "cancelled": 0, "timeouts": 0,
+                      "estimated_tokens": 0, "used_tokens": 0}
+            self._metrics[key] = metric
+        return metric
+
+    def _try_acquire(self, key: str, lease_id: str, rpm: int, tpm: int, tokens: int):
+        backend = self._backend()
+        try:
+            return backend.try_acquire(key, lease_id, time.time(), rpm, tpm, tokens), backend
+        except Exception as e:
+            if backend is self._local:
+                raise
+            logger.warning(f"Redis limiter unavailable ({e}), using in-process fallback.")
+            mark_redis_failed()
+            return self._local.try_acquire(key, lease_id, time.time(), rpm, tpm, tokens), self._local
+
+    def _begin_wait(self, key: str, priority: int):
+        with self._lock:
+            self._metric(key)["waiting"] += 1
+            waiters = self._waiters.setdefault(key, {})
+            waiters[priority] = waiters.get(priority, 0) + 1
+
+    def _outranked(self, key: str, priority: int) -> bool:
+        """A more urgent request is waiting for the same key: leave the next free slot to it."""
+        with self._lock:
+            return any(p < priority and n > 0 for p, n in self._waiters.get(key, {}).items())
+
+    def _end_wait(self, key: str, priority: int, waited: float, granted: bool, throttled: Dict[int, int]):
+        with self._lock:
+            metric = self._metric(key)
+            metric["waiting"] -= 1
+            waiters = self._waiters[key]
+            waiters[priority] -= 1
+            if not waiters[priority]:
+                del waiters[priority]
+            metric["rpm_throttled"] += throttled.get(-1, 0)
+            metric["tpm_throttled"] += throttled.get(-2, 0)
+            if granted:
+                metric["acquired"] += 1
+                metric["wait_seconds"] += waited
+                metric["max_wait_seconds"] = max(metric["max_wait_seconds"], waited)
+            else:
+                metric["timeouts"] += 1
+
+    def _acquire_steps(self, provider: str, api_key: str, timeout: Optional[float], priority: int, tokens: int):
+        """Retry / backoff loop of acquire, as io steps: yields ("sleep", seconds) between attempts."""
+        if not settings.LLM_LIMITER_ENABLED:
+            return None
+        key = limiter_key(provider, api_key)
+        rpm = parse_provider_map(settings.LLM_LIMITER_RPM).get(provider, 0)
+        tpm = parse_provider_map(settings.LLM_LIMITER_TPM).get(provider, 0)
+        tokens = max(int(tokens), 0) if tpm else 0
+        timeout = settings.LLM_LIMITER_ACQUIRE_TIMEOUT if timeout is None else timeout
+        lease_id = uuid.uuid4().hex
+        start = time.time()
+        interval = POLL_INTERVAL
+        throttled: Dict[int, int] = {}
+
+        self._begin_wait(key, priority)
+        try:
+            while True:
+                if self._outranked(key, priority):
+                    granted, backend = 0, None
+                else:
+                    granted, backend = self._try_acquire(key, lease_id, rpm, tpm, tokens)
+                if granted == 1:
+                    self._end_wait(key, priority, time.time() - start, True, throttled)
+                    return Lease(key, lease_id, backend, tokens)
+                throttled[granted] = throttled.get(granted, 0) + 1
+                if time.time() - start >= timeout:
+                    self._end_wait(key, priority, time.time() - start, False, throttled)
+                    raise RateLimiterTimeout(f"No free LLM slot for {provider} within {timeout:.0f}s")
+                yield "sleep", interval
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+        except RateLimiterTimeout:
+            raise
+        except BaseException:
+            # Includes the steps being closed when the waiting coroutine is cancelled
+            self._end_wait(key, priority, time.time() - start, False, throttled)
+            raise
+
+    def acquire(self, provider: str, api_key: str, timeout: float = None, priority: int = DEFAULT_PRIORITY,
+                tokens: int = 0) -> Optional[Lease]:
+        """
+        Block until a slot is free (and, with a TPM budget, `tokens` fit in it).
+        Returns None when the limiter is disabled.
+        """
+        steps = self._acquire_steps(provider, api_key, timeout, priority, tokens)
+        return run_steps(steps, lambda request: time.sleep(request[1]))
+
+    async def acquire_async(self, provider: str, api_key: str, timeout: float = None, priority: int = DEFAULT_PRIORITY,
+                            tokens: int = 0) -> Optional[Lease]:
+        """Asyncio variant of acquire: waits with asyncio.sleep so the event loop stays free."""
+        steps = self._acquire_steps(provider, api_key, timeout, priority, tokens)
+        return await run_steps_async(steps, lambda request: asyncio.sleep(request[1]))
+
+    def release(self, lease: Optional[Lease], overloaded: bool = False, tokens: Optional[int] = None, cancelled: bool = False):
+        """
+        Return a slot and feed the outcome into the AIMD window. `tokens` (prompt + completion
+        actually used) replaces the estimate charged against the TPM budget. A cancelled
+        request (hedge loser, stopped by the user) only frees its slot: it says nothing
+        about the provider's capacity, so the window is left as it is.
+        """
+        if lease is None:
+            return
+        with self._lock:
+            metric = self._metric(lease.key)
+            metric["overloads" if overloaded else "cancelled" if cancelled else "successes"] += 1
+            if lease.tokens:
+                metric["estimated_tokens"] += lease.tokens
+                metric["used_tokens"] += lease.tokens if tokens is None else int(tokens)
+        try:
+            if lease.tokens and tokens is not None:
+                lease.backend.record_tokens(lease.key, lease.lease_id, int(tokens))
+            window = lease.backend.release(lease.key, lease.lease_id, overloaded, time.time(), cancelled)
+        except Exception as e:
+            logger.warning(f"Limiter release failed: {e}")
+            mark_redis_failed()
+            return
+        if overloaded:
+            logger.warning(f"Provider overloaded ({lease.key}), concurrency window now {window:.2f}")
+
+    def stats(self) -> Dict[str, Any]:
+        backend = self._backend()
+        with self._lock:
+            metrics = {key: dict(m) for key, m in self._metrics.items()}
+        result = {}
+        for key, metric in metrics.items():
+            try:
+                snapshot = backend.snapshot(key)
+            except Exception as e:
+                logger.warning(f"Limiter snapshot failed: {e}")
+                snapshot = self._local.snapshot(key)
+            metric["avg_wait_seconds"] = round(metric["wait_seconds"] / metric["acquired"], 3) if metric["acquired"] else 0.0
+            metric["wait_seconds"] = round(metric["wait_seconds"], 3)
+            metric["max_wait_seconds"] = round(metric["max_wait_seconds"], 3)
+            metric.update(snapshot)
+            result[key] = metric
+        return {
+            "enabled": settings.LLM_LIMITER_ENABLED,
+            "backend": "redis" if isinstance(backend, _RedisBackend) else "local",
+            "limiters": result,
+        }
+
+
+rate_limiter = AdaptiveRateLimiter()
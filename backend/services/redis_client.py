@@ -0,0 +1,71 @@
+from typing import Any, Callable, Optional, Tuple
+import logging
+import threading
+import time
+
+import redis
+
+from backend.config import settings, is_desktop_mode
+
+logger = logging.getLogger(__name__)
+
+# Do not hammer a Redis that is down: re-check at most once per interval
+RETRY_INTERVAL = 30.0
+
+_client: Optional[redis.Redis] = None
+_last_failure = 0.0
+_lock = threading.Lock()
+
+
+def get_redis() -> Optional[redis.Redis]:
+    """
+    Shared Redis client for caches, limiters and progress tracking.
+    Returns None in desktop mode or when Redis is unreachable, so callers
+    can fall back to their in-process implementation.
+    """
+    global _client, _last_failure
+
+    if is_desktop_mode() or not settings.REDIS_URL:
+        return None
+    if _client is not None:
+        return _client
+    if time.time() - _last_failure < RETRY_INTERVAL:
+        return None
+
+    with _lock:
+        if _client is not None:
+            return _client
+        try:
+            client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=2, socket_connect_timeout=1)
+            client.ping()
+            _client = client
+        except Exception as e:
+            logger.warning(f"Redis unavailable ({e}), using in-process fallback.")
+            _last_failure = time.time()
+            return None
+    return _client
+
+
+def mark_redis_failed():
+    """Called when an operation on the shared client fails, forcing a reconnect check later."""
+    global _client, _last_failure
+    with _lock:
+        _client = None
+        _last_failure = time.time()
+
+
+def redis_call(redis_getter: Callable[[], Optional[redis.Redis]], operation: Callable[[redis.Redis], Any],
+               action: str) -> Tuple[bool, Any]:
+    """
+    operation(client) on the client from redis_getter: (True, result), or (False, None) without
+    Redis or when the call fails (logged as `action`), so the caller falls back to its next tier.
+    """
+    client = redis_getter()
+    if client is None:
+        return False, None
+    try:
+        return True, operation(client)
+    except Exception as e:
+        logger.warning(f"Failed to {action} in Redis: {e}")
+        mark_redis_failed()
+        return False, None
@@ -0,0 +1,72 @@
+from typing import Any
+import json
+import logging
+import zlib
+
+from kombu.serialization import register
+from kombu.utils import json as kombu_json
+
+from backend.config import settings
+
+try:
+    import orjson
+except ImportError:  # optional: the standard library encoder produces the same compact JSON
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+SERIALIZER_NAME = "compact-json"
+CONTENT_TYPE = "application/x-compact-json"
+
+# First byte of a compressed payload; JSON text never starts with it
+ZLIB_MARKER = b"\x01"
+
+_kombu_encoder = kombu_json.JSONEncoder()
+# kombu wraps datetimes, bytes, UUIDs... as {"__type__": ..., "__value__": ...}
+TYPE_MARKER = b'"__type__"'
+
+
+def _dumps_json(value: Any) -> bytes:
+    if orjson is not None:
+        try:
+            # Types orjson does not know natively get kombu's tagged encoding, so they decode back alike
+            return orjson.dumps(
+                value,
+                default=_kombu_encoder.default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits
+    return kombu_json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Compact UTF-8 JSON (no whitespace, no \\u escapes for Chinese text); payloads of at least
+    CELERY_COMPRESSION_THRESHOLD bytes are zlib-compressed behind a one-byte marker.
+    """
+    data = _dumps_json(value)
+    threshold = settings.CELERY_COMPRESSION_THRESHOLD
+    if 0 < threshold <= len(data):
+        compressed = zlib.compress(data, settings.CELERY_COMPRESSION_LEVEL)
+        if len(compressed) + 1 < len(data):
+            return ZLIB_MARKER + compressed
+    return data
+
+
+def loads(data: Any) -> Any:
+    """Inverse of dumps; plain JSON (messages and results written before the switch) is read as is."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    elif isinstance(data, (memoryview, bytearray)):
+        data = bytes(data)
+    if data[:1] == ZLIB_MARKER:
+        data = zlib.decompress(data[1:])
+    if orjson is not None and TYPE_MARKER not in data:
+        return orjson.loads(data)
+    return json.loads(data.decode("utf-8"), object_hook=kombu_json.object_hook)
+
+
+def register_compact_serializer():
+    """Make "compact-json" available to kombu (task messages) and Celery result backends."""
+    register(SERIALIZER_NAME, dumps, loads, content_type=CONTENT_TYPE, content_encoding="binary")
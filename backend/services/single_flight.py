@@ -0,0 +1,314 @@
+from typing import Dict, Any, Optional, Callable, Awaitable, Tuple
+import asyncio
+import copy
+import json
+import logging
+import threading
+import time
+import uuid
+
+from backend.config import settings
+from backend.services.redis_client import get_redis, mark_redis_failed
+from backend.services.io_steps import run_steps, run_steps_async
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "single-flight:"
+
+# Followers only need the result long enough to pick it up; the analysis cache keeps it longer
+RESULT_TTL = 60
+
+# KEYS: lock  ARGV: token, ttl (ms)
+REFRESH_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS: lock  ARGV: token
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class _Call:
+    """One in-flight call of Celery worker threads in this process; followers wait on `done`."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+
+    def finish(self, result: Optional[Dict[str, Any]]):
+        self.result = result
+        self.done.set()
+
+
+class _AsyncCall:
+    """One in-flight call on an event loop; followers on that loop await `future`."""
+
+    def __init__(self):
+        self.future = asyncio.get_running_loop().create_future()
+
+    @property
+    def result(self) -> Optional[Dict[str, Any]]:
+        return self.future.result()
+
+    def finish(self, result: Optional[Dict[str, Any]]):
+        self.future.set_result(result)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical LLM calls (same prompt hash) into one.
+
+    The first caller of a key becomes the leader and calls the provider; callers arriving
+    while it is in flight wait and receive a copy of its result. Inside one process the
+    followers wait on the leader directly (threads of a Celery worker, coroutines of the
+    desktop event loop). Across Celery workers the leader holds a Redis lock, kept alive by
+    a heartbeat, and hands its result over under a key tied to that lock; followers poll it.
+
+    Only results accepted by `shareable` are handed over. When the leader fails, is stopped
+    or dies, the lock goes away without a result and one of the followers takes over, so a
+    bad key or a cancelled task never fails anyone else's analysis.
+    """
+
+    def __init__(
+        self,
+        lock_ttl: float = None,
+        wait_timeout: float = None,
+        poll_interval: float = None,
+        redis_getter: Callable = get_redis,
+    ):
+        self.lock_ttl = lock_ttl or settings.SINGLE_FLIGHT_LOCK_TTL
+        self.wait_timeout = wait_timeout or settings.SINGLE_FLIGHT_WAIT_TIMEOUT
+        self.poll_interval = poll_interval or settings.SINGLE_FLIGHT_POLL_INTERVAL
+        self._redis_getter = redis_getter
+        self._lock = threading.Lock()
+        # (key, event loop or None for threads) -> _Call / _AsyncCall
+        self._calls: Dict[tuple, Any] = {}
+        self._scripts: Dict[str, Any] = {}
+        self.counters = {"leaders": 0, "shared_local": 0, "shared_redis": 0, "takeovers": 0, "timeouts": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _script(self, client, name: str, source: str, key: str, args: list):
+        script = self._scripts.get(name)
+        if script is None:
+            script = self._scripts[name] = client.register_script(source)
+        return script(keys=[self._lock_key(key)], args=args, client=client)
+
+    # ---- Redis lock / handoff ----
+
+    def _lock_key(self, key: str) -> str:
+        return f"{REDIS_KEY_PREFIX}lock:{key}"
+
+    def _result_key(self, key: str, token: str) -> str:
+        return f"{REDIS_KEY_PREFIX}result:{key}:{token}"
+
+    def _try_lead(self, client, key: str, token: str) -> Optional[str]:
+        """None when this caller got the lock, else the token of the current leader ("" if it just left)."""
+        lock_key = self._lock_key(key)
+        if client.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000)):
+            return None
+        current = client.get(lock_key)
+        return current.decode("utf-8") if isinstance(current, bytes) else (current or "")
+
+    def _poll(self, client, key: str, leader: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """(still_waiting, result). The leader writes its result before releasing the lock."""
+        payload, current = client.mget(self._result_key(key, leader), self._lock_key(key))
+        if payload is not None:
+            return False, json.loads(payload)
+        if isinstance(current, bytes):
+            current = current.decode("utf-8")
+        return current == leader, None
+
+    def _publish(self, client, key: str, token: str, result: Dict[str, Any]):
+        client.set(self._result_key(key, token), json.dumps(result, ensure_ascii=False), ex=RESULT_TTL)
+
+    def _refresh(self, client, key: str, token: str):
+        self._script(client, "refresh", REFRESH_SCRIPT, key, [token, int(self.lock_ttl * 1000)])
+
+    def _release(self, client, key: str, token: str):
+        try:
+            self._script(client, "release", RELEASE_SCRIPT, key, [token])
+        except Exception as e:
+            # The lock expires on its own after lock_ttl
+            logger.warning(f"Single-flight lock release failed: {e}")
+            mark_redis_failed()
+
+    def _coordination_failed(self, e: Exception):
+        logger.warning(f"Single-flight coordination failed ({e}), calling the provider directly.")
+        mark_redis_failed()
+
+    # ---- Coalescing, shared by the sync and async paths (see io_steps) ----
+
+    def _steps(self, key: str, scope: Optional[asyncio.AbstractEventLoop], new_call: Callable[[], Any],
+               shareable: Callable[[Dict[str, Any]], bool], on_wait: Optional[Callable[[], None]]):
+        """
+        Yields ("call",) -> fn(), ("wait", call) -> whether the local leader finished within
+        poll_interval, ("sleep",) between Redis polls and ("beat", client, key, token) -> a
+        function stopping the lock heartbeat. Returns (result, shared).
+        Local followers are those of the same `scope` (one event loop, or the worker's threads).
+        """
+        if not settings.SINGLE_FLIGHT_ENABLED:
+            return (yield "call",), False
+        deadline = time.time() + self.wait_timeout
+        while True:
+            with self._lock:
+                call = self._calls.get((key, scope))
+                leader = call is None
+                if leader:
+                    call = self._calls[(key, scope)] = new_call()
+            if leader:
+                break
+            while not (yield "wait", call):
+                if on_wait:
+                    on_wait()
+                if time.time() > deadline:
+                    self._count("timeouts")
+                    return (yield "call",), False
+            if call.result is not None:
+                self._count("shared_local")
+                return copy.deepcopy(call.result), True
+            self._count("takeovers")
+
+        shared_result = None
+        try:
+            result, shared = yield from self._distributed_steps(key, shareable, on_wait, deadline)
+            if shareable(result):
+                shared_result = copy.deepcopy(result)
+            return result, shared
+        finally:
+            with self._lock:
+                if self._calls.get((key, scope)) is call:
+                    del self._calls[(key, scope)]
+            call.finish(shared_result)
+
+    def _distributed_steps(self, key, shareable, on_wait, deadline):
+        client = self._redis_getter()
+        if client is None:
+            self._count("leaders")
+            return (yield "call",), False
+        token = uuid.uuid4().hex
+        while True:
+            try:
+                leader = self._try_lead(client, key, token)
+            except Exception as e:
+                self._coordination_failed(e)
+                return (yield "call",), False
+            if leader is None:
+                break
+            waiting = bool(leader)
+            while waiting:
+                if on_wait:
+                    on_wait()
+                if time.time() > deadline:
+                    self._count("timeouts")
+                    return (yield "call",), False
+                yield "sleep",
+                try:
+                    waiting, result = self._poll(client, key, leader)
+                except Exception as e:
+                    self._coordination_failed(e)
+                    return (yield "call",), False
+                if result is not None:
+                    self._count("shared_redis")
+                    return result, True
+            if leader:
+                self._count("takeovers")
+
+        self._count("leaders")
+        stop_heartbeat = yield "beat", client, key, token
+        try:
+            result = yield "call",
+            if shareable(result):
+                try:
+                    self._publish(client, key, token, result)
+                except Exception as e:
+                    logger.warning(f"Single-flight result handoff failed: {e}")
+            return result, False
+        finally:
+            stop_heartbeat()
+            self._release(client, key, token)
+
+    # ---- sync (Celery worker threads) ----
+
+    def run(self, key: str, fn: Callable[[], Dict[str, Any]], shareable: Callable[[Dict[str, Any]], bool] = lambda r: True,
+            on_wait: Optional[Callable[[], None]] = None) -> Tuple[Dict[str, Any], bool]:
+        """
+        Return (result, shared): fn() for the leader, a copy of the leader's result for followers.
+        on_wait is called between polls and may raise to stop waiting (e.g. TaskCancelled).
+        """
+        return run_steps(self._steps(key, None, _Call, shareable, on_wait), lambda request: self._perform(request, fn))
+
+    def _perform(self, request: tuple, fn: Callable[[], Dict[str, Any]]) -> Any:
+        kind = request[0]
+        if kind == "wait":
+            return request[1].done.wait(self.poll_interval)
+        if kind == "sleep":
+            time.sleep(self.poll_interval)
+            return None
+        if kind == "beat":
+            return self._heartbeat(*request[1:])
+        return fn()
+
+    def _heartbeat(self, client, key: str, token: str) -> Callable[[], None]:
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.lock_ttl / 3):
+                try:
+                    self._refresh(client, key, token)
+                except Exception:
+                    return
+
+        threading.Thread(target=heartbeat, name="single-flight-heartbeat", daemon=True).start()
+        return stop.set
+
+    # ---- asyncio (desktop mode) ----
+
+    async def run_async(self, key: str, fn: Callable[[], Awaitable[Dict[str, Any]]],
+                        shareable: Callable[[Dict[str, Any]], bool] = lambda r: True,
+                        on_wait: Optional[Callable[[], None]] = None) -> Tuple[Dict[str, Any], bool]:
+        """Asyncio version of run(); followers on the same event loop await the leader's future."""
+        steps = self._steps(key, asyncio.get_running_loop(), _AsyncCall, shareable, on_wait)
+        return await run_steps_async(steps, lambda request: self._perform_async(request, fn))
+
+    async def _perform_async(self, request: tuple, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Any:
+        kind = request[0]
+        if kind == "wait":
+            done, _ = await asyncio.wait({request[1].future}, timeout=self.poll_interval)
+            return bool(done)
+        if kind == "sleep":
+            await asyncio.sleep(self.poll_interval)
+            return None
+        if kind == "beat":
+            return self._heartbeat_async(*request[1:])
+        return await fn()
+
+    def _heartbeat_async(self, client, key: str, token: str) -> Callable[[], None]:
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(self.lock_ttl / 3)
+                try:
+                    self._refresh(client, key, token)
+                except Exception:
+                    return
+
+        return asyncio.ensure_future(heartbeat()).cancel
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = len(self._calls)
+        stats["enabled"] = settings.SINGLE_FLIGHT_ENABLED
+        return stats
+
+
+single_flight = SingleFlight()
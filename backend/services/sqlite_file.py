@@ -0,0 +1,82 @@
+from typing import Any, Callable, Iterable, Optional, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+
+from backend.config import settings, is_desktop_mode
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Writes issued on an event loop run here, one at a time and in order (see run_off_loop)
+write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store-writes")
+
+
+def run_off_loop(write: Callable[[], Any]):
+    """
+    write() on write_executor when called on a running event loop, so a slow disk does not
+    stall every request and stream; called inline from threads (Celery workers, executors).
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        write()
+    else:
+        loop.run_in_executor(write_executor, write)
+
+
+class SQLiteFile:
+    """
+    On-disk SQLite tier shared by the stores (analysis cache, task store, checkpoints).
+
+    The directory and the schema are created on first use. Every call runs on its own
+    short-lived connection under one lock per file and is committed; a failure is logged
+    and returns `default`, so the caller carries on with its other tiers.
+    """
+
+    def __init__(self, path: str, schema: Iterable[str], label: str):
+        self.path = path
+        self.schema = list(schema)
+        self.label = label
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # Caller holds the lock
+        if not self._ready:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._ready:
+            for statement in self.schema:
+                conn.execute(statement)
+            conn.commit()
+            self._ready = True
+        return conn
+
+    def run(self, operation: Callable[[sqlite3.Connection], T], default: Any = None, action: str = "write") -> T:
+        """operation(conn) in a committed transaction; `default` if SQLite fails."""
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    result = operation(conn)
+                    conn.commit()
+                    return result
+                finally:
+                    conn.close()
+        except Exception as e:
+            logger.warning(f"{self.label} SQLite {action} failed: {e}")
+            return default
+
+
+def default_sqlite_path(configured: Optional[str], *parts: str) -> Optional[str]:
+    """The configured path, else data/<parts> under BASE_DIR in desktop mode, else None (no SQLite tier)."""
+    if configured:
+        return configured
+    if is_desktop_mode():
+        return os.path.join(settings.BASE_DIR, "data", *parts)
+    return None
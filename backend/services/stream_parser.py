@@ -0,0 +1,294 @@
+from typing import Dict, Any, Optional, Callable, List, Tuple
+import json
+import re
+import time
+
+# Give up if this much text arrives before the JSON document starts
+MAX_PREAMBLE_CHARS = 4000
+
+# Shortest repeated tail that counts as overlap when stitching a continuation
+MIN_CONTINUATION_OVERLAP = 8
+# Only this much of the reply's tail is compared against the continuation's head
+MAX_CONTINUATION_OVERLAP = 400
+
+_LEADING_FENCE = re.compile(r"^\s*```(?:json)?[ \t]*\n?")
+
+# Fields reported as soon as their value is complete
+DEFAULT_WATCHED_PATHS = (
+    ("comprehensive_rating", "final_level"),
+    ("comprehensive_rating", "average_score"),
+)
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR_END = set(',:{}[] \t\r\n"')
+
+
+class MalformedStreamError(ValueError):
+    """The streamed reply can no longer become valid JSON; the request should be aborted."""
+
+
+class _Frame:
+    __slots__ = ("kind", "key", "after_colon")
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.key: Optional[str] = None
+        self.after_colon = False
+
+
+class StreamingJSONParser:
+    """
+    Incremental scanner for a streamed LLM reply that should contain one JSON document.
+
+    Each chunk is scanned exactly once. The parser tracks string/escape state and the
+    container stack, so it knows where the document starts and ends (no regex / rfind
+    over the whole reply afterwards), reports watched fields such as
+    comprehensive_rating.final_level as soon as they are complete, and flags structural
+    breakage (mismatched brackets, no JSON at all) while the model is still generating.
+    Lenient by design: anything json_repair could still fix is not reported as an error.
+    """
+
+    def __init__(self, watched_paths=DEFAULT_WATCHED_PATHS, on_value: Optional[Callable[[Tuple[str, ...], Any], None]] = None):
+        self.watched_paths = {tuple(p) for p in watched_paths}
+        self.on_value = on_value
+        self.values: Dict[Tuple[str, ...], Any] = {}
+        self.error: Optional[str] = None
+        # Number of content chunks received (roughly the number of generated tokens)
+        self.chunk_count = 0
+        # Wall-clock timings for telemetry (request_started_at is set by the stream consumer)
+        self.request_started_at: Optional[float] = None
+        self.first_chunk_at: Optional[float] = None
+        self.last_chunk_at: Optional[float] = None
+        # finish_reason of the last stream fed into the parser ("length" means cut off by max_tokens)
+        self.finish_reason: Optional[str] = None
+
+        self._chunks: List[str] = []
+        self._text: Optional[str] = None
+        self._offset = 0          # absolute position of the next unscanned character
+        self._start = -1          # absolute position of the root '{' / '['
+        self._end = -1            # absolute position just after the root closer
+        self._stack: List[_Frame] = []
+
+        self._in_string = False
+        self._escape = False
+        self._capture: Optional[List[str]] = None   # pieces of the string being captured
+        self._last_string: Optional[str] = None     # last complete string (candidate key)
+        self._scalar: Optional[List[str]] = None    # pieces of a number / literal
+
+    # --- Public API ---
+
+    @property
+    def started(self) -> bool:
+        return self._start != -1
+
+    @property
+    def complete(self) -> bool:
+        return self._end != -1
+
+    @property
+    def truncated(self) -> bool:
+        """The document started but the stream ended before it was closed."""
+        return self.started and not self.complete
+
+    def feed(self, chunk: str):
+        if not chunk:
+            return
+        self._chunks.append(chunk)
+        self.chunk_count += 1
+        self.last_chunk_at = time.time()
+        if self.first_chunk_at is None:
+            self.first_chunk_at = self.last_chunk_at
+        self._text = None
+        if self.error is None and not self.complete:
+            self._scan(chunk)
+        self._offset += len(chunk)
+        if self.error is None and not self.started and self._offset > MAX_PREAMBLE_CHARS:
+            self.error = f"No JSON document in the first {MAX_PREAMBLE_CHARS} characters"
+
+    def text(self) -> str:
+        """The full reply (joined once and cached)."""
+        if self._text is None:
+            self._text = "".join(self._chunks)
+            self._chunks = [self._text] if self._text else []
+        return self._text
+
+    def json_text(self) -> Optional[str]:
+        """The JSON document itself: complete, or everything from its start if truncated."""
+        if not self.started:
+            return None
+        text = self.text()
+        return text[self._start:self._end] if self.complete else text[self._start:]
+
+    def loads(self) -> Any:
+        """Parse the completed document (same leniency as json.loads(strict=False))."""
+        return json.loads(self.json_text(), strict=False)
+
+    # --- Scanner ---
+
+    def _path(self) -> Tuple[str, ...]:
+        return tuple(f.key for f in self._stack if f.kind == "{" and f.key is not None)
+
+    def _watching(self) -> bool:
+        frame = self._stack[-1] if self._stack else None
+        if frame is None:
+            return False
+        if frame.kind == "{" and not frame.after_colon:
+            return True  # keys are always captured
+        return frame.kind == "{" and self._path() in self.watched_paths
+
+    def _emit(self, value: Any):
+        path = self._path()
+        if path in self.watched_paths and path not in self.values:
+            self.values[path] = value
+            if self.on_value:
+                self.on_value(path, value)
+
+    def _finish_scalar(self):
+        token = "".join(self._scalar).strip()
+        self._scalar = None
+        frame = self._stack[-1] if self._stack else None
+        if not token or frame is None or frame.kind != "{" or not frame.after_colon:
+            return
+        try:
+            value = json.loads(token)
+        except ValueError:
+            value = token
+        self._emit(value)
+
+    def _scan(self, chunk: str):
+        i = 0
+        n = len(chunk)
+        while i < n:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    if self._capture is not None:
+                        self._capture.append(chunk[i])
+                    i += 1
+                    continue
+                match = _STRING_SPECIAL.search(chunk, i)
+                if match is None:
+                    if self._capture is not None:
+                        self._capture.append(chunk[i:])
+                    return
+                j = match.start()
+                if self._capture is not None:
+                    self._capture.append(chunk[i:j])
+                if chunk[j] == "\\":
+                    self._escape = True
+                    if self._capture is not None:
+                        self._capture.append("\\")
+                    i = j + 1
+                    continue
+                # Closing quote
+                self._in_string = False
+                i = j + 1
+                if self._capture is not None:
+                    raw = "".join(self._capture)
+                    self._capture = None
+                    try:
+                        value = json.loads(f'"{raw}"', strict=False)
+                    except ValueError:
+                        value = raw
+                    frame = self._stack[-1]
+                    if frame.kind == "{" and frame.after_colon:
+                        self._emit(value)
+                    else:
+                        self._last_string = value
+                continue
+
+            ch = chunk[i]
+
+            if not self.started:
+                if ch == "{" or ch == "[":
+                    self._start = self._offset + i
+                    self._stack.append(_Frame(ch))
+                i += 1
+                continue
+
+            if self._scalar is not None:
+                if ch not in _SCALAR_END:
+                    self._scalar.append(ch)
+                    i += 1
+                    continue
+                self._finish_scalar()
+
+            if ch == '"':
+                self._in_string = True
+                self._capture = [] if self._watching() else None
+            elif ch == "{" or ch == "[":
+                self._stack.append(_Frame(ch))
+            elif ch == "}" or ch == "]":
+                opener = "{" if ch == "}" else "["
+                if self._stack[-1].kind != opener:
+                    self.error = f"Mismatched '{ch}' at position {self._offset + i}"
+                    return
+                self._stack.pop()
+                if not self._stack:
+                    self._end = self._offset + i + 1
+                    return
+            elif ch == ":":
+                frame = self._stack[-1]
+                if frame.kind == "{":
+                    frame.key = self._last_string
+                    frame.after_colon = True
+            elif ch == ",":
+                frame = self._stack[-1]
+                if frame.kind == "{":
+                    frame.key = None
+                    frame.after_colon = False
+                self._last_string = None
+            elif not ch.isspace():
+                self._scalar = [ch]
+            i += 1
+
+
+class TextCollector:
+    """
+    Plain collector for a continuation stream: the text is not JSON on its own, so it is
+    only gathered (with the same timing fields as the parser) and stitched on afterwards.
+    """
+
+    def __init__(self):
+        self.error: Optional[str] = None
+        self.chunk_count = 0
+        self.request_started_at: Optional[float] = None
+        self.first_chunk_at: Optional[float] = None
+        self.last_chunk_at: Optional[float] = None
+        self.finish_reason: Optional[str] = None
+        self._chunks: List[str] = []
+
+    def feed(self, chunk: str):
+        if not chunk:
+            return
+        self._chunks.append(chunk)
+        self.chunk_count += 1
+        self.last_chunk_at = time.time()
+        if self.first_chunk_at is None:
+            self.first_chunk_at = self.last_chunk_at
+
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+
+def stitch_continuation(reply: str, continuation: str) -> Optional[str]:
+    """
+    The part of a continuation to append to a truncated reply.
+    Models sometimes wrap the continuation in a code fence or repeat the last few
+    characters they already sent; both are dropped. Returns None when the model
+    started the document over instead of continuing it.
+    """
+    continuation = _LEADING_FENCE.sub("", continuation, count=1)
+    if not continuation:
+        return ""
+
+    tail = reply[-MAX_CONTINUATION_OVERLAP:]
+    for size in range(min(len(tail), len(continuation)), MIN_CONTINUATION_OVERLAP - 1, -1):
+        if tail.endswith(continuation[:size]):
+            return continuation[size:]
+
+    head = continuation.lstrip()
+    document = reply[reply.find("{"):] if "{" in reply else ""
+    if head.startswith("{") and document and head[:MIN_CONTINUATION_OVERLAP] == document[:MIN_CONTINUATION_OVERLAP]:
+        return None
+    return continuation
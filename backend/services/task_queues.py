@@ -0,0 +1,23 @@
+from typing import Dict, Any, Optional
+
+# Celery queues, most urgent first. Interactive: a teacher waiting on one retried question;
+# score: class / student score analysis; bulk: whole-paper analysis submissions.
+QUEUE_INTERACTIVE = "interactive"
+QUEUE_SCORE = "score"
+QUEUE_BULK = "bulk"
+
+QUEUE_ORDER = (QUEUE_INTERACTIVE, QUEUE_SCORE, QUEUE_BULK)
+
+# Lower value = served first (Celery's Redis transport and asyncio both use this convention)
+QUEUE_PRIORITIES: Dict[str, int] = {queue: index for index, queue in enumerate(QUEUE_ORDER)}
+
+DEFAULT_PRIORITY = QUEUE_PRIORITIES[QUEUE_BULK]
+
+
+def queue_priority(queue: Optional[str]) -> int:
+    return QUEUE_PRIORITIES.get(queue, DEFAULT_PRIORITY)
+
+
+def config_priority(config: Dict[str, Any], default_queue: str = QUEUE_BULK) -> int:
+    """Priority of an in-process task, from the queue its config was marked with (config["queue"])."""
+    return queue_priority(config.get("queue") or default_queue)
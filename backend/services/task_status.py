@@ -0,0 +1,122 @@
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import time
+
+from celery import states
+from celery.result import AsyncResult
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Coalescing cache entries kept at most (one per distinct id list being polled)
+MAX_CACHED_LOOKUPS = 256
+
+
+def _format_status(task_id: str, status: str, result: Any = None) -> Dict[str, Any]:
+    """Response entry in the shape of the per-task protocol."""
+    res = {"task_id": task_id, "status": status}
+    if status in states.READY_STATES:
+        if status == states.SUCCESS:
+            res["result"] = result
+        else:
+            res["result"] = None
+            res["error"] = str(result)
+    return res
+
+
+def _lookup_one(app, task_id: str) -> Dict[str, Any]:
+    try:
+        task_result = AsyncResult(task_id, app=app)
+        return _format_status(task_id, task_result.status, task_result.result if task_result.ready() else None)
+    except Exception as e:
+        logger.error(f"Error checking task {task_id}: {e}")
+        return {"task_id": task_id, "status": states.PENDING}
+
+
+def bulk_task_status(app, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Status of many Celery tasks with one MGET of their celery-task-meta-* keys instead of
+    one AsyncResult round trip per id. Unknown ids are PENDING, as with AsyncResult.
+    Falls back to the per-id lookup for result backends without mget.
+    """
+    if not task_ids:
+        return {}
+    backend = app.backend
+    if not hasattr(backend, "mget") or not hasattr(backend, "get_key_for_task"):
+        return {tid: _lookup_one(app, tid) for tid in task_ids}
+
+    try:
+        values = backend.mget([backend.get_key_for_task(tid) for tid in task_ids])
+    except Exception as e:
+        logger.error(f"Bulk task status lookup failed: {e}")
+        return {tid: {"task_id": tid, "status": states.PENDING} for tid in task_ids}
+
+    results = {}
+    for tid, value in zip(task_ids, values):
+        if value is None:
+            results[tid] = {"task_id": tid, "status": states.PENDING}
+            continue
+        try:
+            meta = backend.decode_result(value)
+            results[tid] = _format_status(tid, meta["status"], meta.get("result"))
+        except Exception as e:
+            logger.error(f"Error decoding status of task {tid}: {e}")
+            results[tid] = {"task_id": tid, "status": states.PENDING}
+    return results
+
+
+class StatusCoalescer:
+    """
+    Short-lived cache in front of bulk_task_status: polls for the same id list (every open
+    browser tab of one exam) within `ttl` seconds share one lookup, and a poll arriving
+    while that lookup is still running awaits it instead of starting another one.
+    """
+
+    def __init__(self, ttl: float = None):
+        self.ttl = settings.TASK_STATUS_CACHE_TTL if ttl is None else ttl
+        # key -> (expires_at, future); futures belong to the event loop that created them
+        self._entries: Dict[Tuple[Any, str], Tuple[float, asyncio.Future]] = {}
+        self.lookups = 0
+        self.hits = 0
+
+    @staticmethod
+    def _key(task_ids: List[str]) -> str:
+        return hashlib.sha256("\n".join(sorted(task_ids)).encode("utf-8")).hexdigest()
+
+    def _evict(self, now: float):
+        for key in [k for k, (expires_at, future) in self._entries.items() if expires_at <= now and future.done()]:
+            del self._entries[key]
+        while len(self._entries) > MAX_CACHED_LOOKUPS:
+            del self._entries[next(iter(self._entries))]
+
+    async def get(self, app, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        if self.ttl <= 0:
+            self.lookups += 1
+            return await asyncio.get_running_loop().run_in_executor(None, bulk_task_status, app, task_ids)
+
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        key = (id(loop), self._key(task_ids))
+        entry = self._entries.get(key)
+        if entry is not None and (entry[0] > now or not entry[1].done()):
+            self.hits += 1
+            return dict(await asyncio.shield(entry[1]))
+
+        self.lookups += 1
+        future = loop.run_in_executor(None, bulk_task_status, app, task_ids)
+        self._entries[key] = (now + self.ttl, future)
+        self._evict(now)
+        try:
+            return dict(await asyncio.shield(future))
+        except Exception:
+            self._entries.pop(key, None)
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {"ttl": self.ttl, "lookups": self.lookups, "hits": self.hits, "entries": len(self._entries)}
+
+
+status_coalescer = StatusCoalescer()
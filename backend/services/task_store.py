@@ -0,0 +1,287 @@
+from typing import Dict, Any, Optional, List, Callable, Awaitable
+from collections import OrderedDict
+import asyncio
+import functools
+import json
+import logging
+import threading
+import time
+
+from backend.config import settings
+from backend.services.sqlite_file import SQLiteFile, default_sqlite_path, run_off_loop
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = {"SUCCESS", "FAILURE", "REVOKED"}
+
+SECRET_FIELDS = {"api_key"}
+
+INTERRUPTED_ERROR = "程序重启导致任务中断，请重新分析"
+
+SQLITE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS tasks ("
+    "task_id TEXT PRIMARY KEY, status TEXT NOT NULL, kind TEXT, args TEXT, "
+    "requeueable INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT, updated_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks(updated_at)",
+]
+
+
+def strip_secrets(value: Any) -> Any:
+    """Copy of a task spec without API keys (also inside nested configs such as hedge_config)."""
+    if isinstance(value, dict):
+        return {k: strip_secrets(v) for k, v in value.items() if k not in SECRET_FIELDS}
+    if isinstance(value, (list, tuple)):
+        return [strip_secrets(v) for v in value]
+    return value
+
+
+def _payload_size(value: Any) -> int:
+    if value is None:
+        return 0
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+    except (TypeError, ValueError):
+        return 0
+
+
+class TaskStore:
+    """
+    Status and results of tasks run in process (desktop mode / Celery unavailable).
+
+    Thread-safe; bounded by entry count and result bytes. Finished tasks are evicted after
+    `ttl` seconds or, oldest first, when a limit is exceeded; unfinished tasks are never
+    evicted. With a SQLite path, task specs and results are also written to disk (off the
+    event loop, in order), so tasks finished before a restart stay retrievable and
+    unfinished ones can be re-queued.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = None,
+        max_bytes: int = None,
+        ttl: int = None,
+        sqlite_path: Optional[str] = None,
+        sqlite_ttl: int = None,
+        persist_api_keys: bool = None,
+    ):
+        self.max_entries = max_entries or settings.TASK_STORE_MAX_ENTRIES
+        self.max_bytes = max_bytes or settings.TASK_STORE_MAX_BYTES
+        self.ttl = ttl or settings.TASK_STORE_TTL
+        self.sqlite_path = sqlite_path
+        self.sqlite_ttl = sqlite_ttl or settings.TASK_STORE_SQLITE_TTL
+        self.persist_api_keys = settings.TASK_STORE_PERSIST_API_KEYS if persist_api_keys is None else persist_api_keys
+
+        # task_id -> {"status", "result", "error", "kind", "args", "size", "updated_at"}
+        self._tasks: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._sqlite = SQLiteFile(sqlite_path, SQLITE_SCHEMA, "Task store") if sqlite_path else None
+        # Finished tasks only on disk (evicted from memory, or from before a restart)
+        self._persisted_ids: set = set()
+        self._runners: Dict[str, Callable[..., Awaitable[Any]]] = {}
+        self.counters = {"created": 0, "finished": 0, "evictions": 0, "sqlite_hits": 0, "requeued": 0, "interrupted": 0}
+
+    # --- Public API ---
+
+    def register_runner(self, kind: str, runner: Callable[..., Awaitable[Any]]):
+        """Coroutine function re-run as runner(task_id, *args) for unfinished tasks after a restart."""
+        self._runners[kind] = runner
+
+    def create(self, task_id: str, kind: Optional[str] = None, args: Optional[List[Any]] = None):
+        """Register a PENDING task. kind/args describe how to re-run it (see register_runner)."""
+        with self._lock:
+            self._tasks[task_id] = {"status": "PENDING", "kind": kind, "args": args, "size": 0, "updated_at": time.time()}
+            self.counters["created"] += 1
+        self._sqlite_save(task_id, "PENDING", kind=kind, args=args)
+
+    def __contains__(self, task_id: str) -> bool:
+        with self._lock:
+            return task_id in self._tasks or task_id in self._persisted_ids
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """{"status", "result"?, "error"?} or None for an unknown task."""
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is not None:
+                return {k: entry[k] for k in ("status", "result", "error") if k in entry}
+            on_disk = task_id in self._persisted_ids
+        if not on_disk:
+            return None
+        row = self._sqlite_load(task_id)
+        if row is None:
+            with self._lock:
+                self._persisted_ids.discard(task_id)
+            return None
+        self._count("sqlite_hits")
+        return row
+
+    def set_status(self, task_id: str, status: str) -> bool:
+        """Update a running task; False if the task is unknown (evicted) or already finished (e.g. stopped)."""
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is None or entry["status"] in FINISHED_STATUSES:
+                return False
+            entry["status"] = status
+            entry["updated_at"] = time.time()
+            return True
+
+    def finish(self, task_id: str, result: Any) -> bool:
+        return self._complete(task_id, "SUCCESS", result=result)
+
+    def fail(self, task_id: str, error: str) -> bool:
+        return self._complete(task_id, "FAILURE", error=error)
+
+    def revoke(self, task_id: str, error: str) -> bool:
+        return self._complete(task_id, "REVOKED", error=error)
+
+    def stop(self, task_ids: List[str], error: str) -> int:
+        """Mark the given PENDING/PROCESSING tasks as REVOKED; returns how many were stopped."""
+        with self._lock:
+            task_ids = [tid for tid in task_ids if tid in self._tasks and self._tasks[tid]["status"] not in FINISHED_STATUSES]
+        return sum(1 for tid in task_ids if self.revoke(tid, error))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._tasks)
+            stats["bytes"] = self._bytes
+            stats["unfinished"] = sum(1 for e in self._tasks.values() if e["status"] not in FINISHED_STATUSES)
+            stats["persisted"] = len(self._persisted_ids)
+        stats["sqlite_enabled"] = bool(self.sqlite_path)
+        return stats
+
+    # --- Restart recovery ---
+
+    def restore(self, dispatch: Optional[Callable[[str, Callable[[], Awaitable[Any]]], None]] = None) -> int:
+        """
+        Load task ids from the SQLite file after a restart and re-queue unfinished tasks
+        (must run inside the event loop) through dispatch(task_id, coroutine factory),
+        by default started right away. Returns the number of re-queued tasks.
+        Tasks stored without their API keys (the default, see TASK_STORE_PERSIST_API_KEYS)
+        end as interrupted; the client continues them through the submission's resume
+        endpoint, sending the keys again.
+        """
+        if not self.sqlite_path:
+            return 0
+        rows = self._sqlite_restore()
+        requeued = 0
+        for task_id, status, kind, args, requeueable in rows:
+            if status in FINISHED_STATUSES:
+                with self._lock:
+                    self._persisted_ids.add(task_id)
+                continue
+            runner = self._runners.get(kind)
+            if runner is None or not requeueable:
+                self.create(task_id, kind, args)
+                self.fail(task_id, INTERRUPTED_ERROR)
+                self._count("interrupted")
+                continue
+            self.create(task_id, kind, args)
+            factory = functools.partial(runner, task_id, *args)
+            if dispatch is None:
+                asyncio.ensure_future(factory())
+            else:
+                dispatch(task_id, factory)
+            requeued += 1
+        with self._lock:
+            self.counters["requeued"] += requeued
+        if rows:
+            logger.info(f"Task store restored {len(rows)} tasks from {self.sqlite_path}, re-queued {requeued}")
+        return requeued
+
+    # --- Internals ---
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _complete(self, task_id: str, status: str, result: Any = None, error: str = None) -> bool:
+        size = _payload_size(result)
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is None:
+                return False
+            self._bytes += size - entry["size"]
+            # The spec is only needed to re-run an unfinished task
+            entry.update(status=status, size=size, updated_at=time.time(), args=None)
+            if result is not None:
+                entry["result"] = result
+            if error is not None:
+                entry["error"] = error
+            # Finished tasks queue up for eviction in completion order
+            self._tasks.move_to_end(task_id)
+            self.counters["finished"] += 1
+            self._evict()
+        self._sqlite_save(task_id, status, result=result, error=error)
+        return True
+
+    def _evict(self):
+        # Caller holds the lock
+        now = time.time()
+        entries, size = len(self._tasks), self._bytes
+        evicted = []
+        for task_id, entry in self._tasks.items():
+            if entry["status"] not in FINISHED_STATUSES:
+                continue
+            over_limit = entries > self.max_entries or size > self.max_bytes
+            if entry["updated_at"] + self.ttl >= now and not over_limit:
+                # Finished entries are in completion order: the rest is newer
+                break
+            evicted.append(task_id)
+            entries -= 1
+            size -= entry["size"]
+        for task_id in evicted:
+            self._bytes -= self._tasks.pop(task_id)["size"]
+            self.counters["evictions"] += 1
+            if self.sqlite_path:
+                self._persisted_ids.add(task_id)
+
+    # --- SQLite persistence ---
+
+    def _sqlite_save(self, task_id: str, status: str, kind: str = None, args: Any = None, result: Any = None, error: str = None):
+        if not self._sqlite:
+            return
+
+        def save(conn):
+            now = time.time()
+            if status == "PENDING":
+                spec = args if self.persist_api_keys else strip_secrets(args)
+                conn.execute(
+                    "INSERT OR REPLACE INTO tasks (task_id, status, kind, args, requeueable, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (task_id, status, kind, json.dumps(spec, ensure_ascii=False, default=str), int(self.persist_api_keys), now)
+                )
+            else:
+                # The spec is not needed any more once the task finished
+                conn.execute(
+                    "UPDATE tasks SET status = ?, args = NULL, result = ?, error = ?, updated_at = ? WHERE task_id = ?",
+                    (status, json.dumps(result, ensure_ascii=False, default=str) if result is not None else None, error, now, task_id)
+                )
+            conn.execute("DELETE FROM tasks WHERE updated_at < ?", (now - self.sqlite_ttl,))
+
+        # Called from the in-process tasks and endpoints on the event loop: write through off it
+        run_off_loop(functools.partial(self._sqlite.run, save))
+
+    def _sqlite_load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self._sqlite.run(lambda conn: conn.execute(
+            "SELECT status, result, error FROM tasks WHERE task_id = ? AND updated_at >= ?",
+            (task_id, time.time() - self.sqlite_ttl)
+        ).fetchone(), action="read")
+        if row is None:
+            return None
+        entry = {"status": row[0]}
+        if row[1] is not None:
+            entry["result"] = json.loads(row[1])
+        if row[2] is not None:
+            entry["error"] = row[2]
+        return entry
+
+    def _sqlite_restore(self) -> List[tuple]:
+        def restore(conn):
+            conn.execute("DELETE FROM tasks WHERE updated_at < ?", (time.time() - self.sqlite_ttl,))
+            return conn.execute("SELECT task_id, status, kind, args, requeueable FROM tasks ORDER BY updated_at").fetchall()
+
+        rows = self._sqlite.run(restore, default=[], action="restore")
+        return [(tid, status, kind, json.loads(args) if args else [], bool(requeueable)) for tid, status, kind, args, requeueable in rows]
+
+
+task_store = TaskStore(sqlite_path=default_sqlite_path(settings.TASK_STORE_SQLITE_PATH, "tasks", "tasks.sqlite3"))
@@ -0,0 +1,184 @@
+from typing import Dict, Any, Optional, Callable, List, Tuple
+import logging
+import threading
+import time
+
+from backend.services.redis_client import get_redis, mark_redis_failed
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "llm-telemetry:"
+
+# Histogram definitions: name -> (help text, bucket upper bounds)
+SECONDS_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+HISTOGRAMS = {
+    "llm_queue_wait_seconds": ("Time spent waiting for a rate limiter / concurrency slot", SECONDS_BUCKETS),
+    "llm_time_to_first_token_seconds": ("Time from sending the request to the first content chunk", SECONDS_BUCKETS),
+    "llm_generation_seconds": ("Time from the first to the last content chunk", SECONDS_BUCKETS),
+    "llm_output_tokens_per_second": ("Completion tokens per second of generation", (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 400)),
+    "llm_parse_seconds": ("JSON parse / repair time of a reply", SECONDS_BUCKETS),
+    "llm_grading_validation_seconds": ("Post-processing and grading validation time of a reply", SECONDS_BUCKETS),
+}
+COUNTERS = {
+    "llm_requests_total": "LLM requests by outcome",
+    "llm_tokens_total": "Prompt / completion / cached tokens reported by providers",
+    "llm_continuations_total": "Replies cut off by max_tokens that were continued, by outcome",
+}
+
+
+def _bucket_label(bound: float) -> str:
+    return f"{bound:g}"
+
+
+class Telemetry:
+    """
+    Per-provider/model histograms and counters for LLM calls.
+
+    Every observation updates an in-process copy and, when Redis is available, the shared
+    Redis hashes (one pipeline per call), so /api/metrics on the API process also reflects
+    the Celery workers.
+    """
+
+    def __init__(self, redis_getter: Callable = get_redis):
+        self._redis_getter = redis_getter
+        self._lock = threading.Lock()
+        # (metric, field) -> value, field is "provider|model|suffix"
+        self._values: Dict[Tuple[str, str], float] = {}
+
+    # --- Recording ---
+
+    def _histogram_fields(self, name: str, provider: str, model: str, value: float) -> List[Tuple[str, str, float]]:
+        base = f"{provider}|{model}"
+        fields = [(name, f"{base}|sum", value), (name, f"{base}|count", 1)]
+        for bound in HISTOGRAMS[name][1]:
+            if value <= bound:
+                fields.append((name, f"{base}|le={_bucket_label(bound)}", 1))
+        return fields
+
+    def _apply(self, updates: List[Tuple[str, str, float]]):
+        if not updates:
+            return
+        with self._lock:
+            for metric, field, amount in updates:
+                self._values[(metric, field)] = self._values.get((metric, field), 0) + amount
+
+        client = self._redis_getter()
+        if client is None:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for metric, field, amount in updates:
+                pipe.hincrbyfloat(REDIS_KEY_PREFIX + metric, field, amount)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Telemetry write to Redis failed: {e}")
+            mark_redis_failed()
+
+    def observe(self, name: str, provider: str, model: str, value: Optional[float]):
+        if value is None or value < 0:
+            return
+        self._apply(self._histogram_fields(name, provider, model, value))
+
+    def observe_stream(self, provider: str, model: str, parser, usage: Optional[Dict[str, int]], queue_wait: Optional[float]):
+        """Record one completed streaming call (timings come from the stream parser)."""
+        updates = [("llm_requests_total", f"{provider}|{model}|success", 1)]
+        if queue_wait is not None:
+            updates += self._histogram_fields("llm_queue_wait_seconds", provider, model, max(queue_wait, 0))
+
+        started = getattr(parser, "request_started_at", None)
+        first, last = parser.first_chunk_at, parser.last_chunk_at
+        if started and first:
+            updates += self._histogram_fields("llm_time_to_first_token_seconds", provider, model, first - started)
+        generation = (last - first) if first and last else None
+        if generation is not None:
+            updates += self._histogram_fields("llm_generation_seconds", provider, model, generation)
+
+        # Providers without usage chunks: the number of content chunks is a close estimate
+        completion_tokens = (usage or {}).get("completion_tokens") or parser.chunk_count
+        if generation and completion_tokens:
+            updates += self._histogram_fields("llm_output_tokens_per_second", provider, model, completion_tokens / generation)
+
+        if usage:
+            for kind in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                if usage.get(kind):
+                    updates.append(("llm_tokens_total", f"{provider}|{model}|{kind.replace('_tokens', '')}", usage[kind]))
+        self._apply(updates)
+
+    def count_error(self, provider: str, model: str):
+        self._apply([("llm_requests_total", f"{provider}|{model}|error", 1)])
+
+    def count_continuation(self, provider: str, model: str, outcome: str):
+        self._apply([("llm_continuations_total", f"{provider}|{model}|{outcome}", 1)])
+
+    # --- Exposition ---
+
+    def _read_values(self) -> Dict[Tuple[str, str], float]:
+        client = self._redis_getter()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                names = list(HISTOGRAMS) + list(COUNTERS)
+                for name in names:
+                    pipe.hgetall(REDIS_KEY_PREFIX + name)
+                values = {}
+                for name, raw in zip(names, pipe.execute()):
+                    for field, amount in raw.items():
+                        values[(name, field.decode("utf-8"))] = float(amount)
+                return values
+            except Exception as e:
+                logger.warning(f"Telemetry read from Redis failed: {e}")
+                mark_redis_failed()
+        with self._lock:
+            return dict(self._values)
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        values = self._read_values()
+        lines = []
+
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            series = sorted({field.rsplit("|", 1)[0] for metric, field in values if metric == name})
+            for base in series:
+                provider, model = base.split("|", 1)
+                labels = f'provider="{provider}",model="{model}"'
+                for bound in buckets:
+                    count = values.get((name, f"{base}|le={_bucket_label(bound)}"), 0)
+                    lines.append(f'{name}_bucket{{{labels},le="{_bucket_label(bound)}"}} {count:g}')
+                total = values.get((name, f"{base}|count"), 0)
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {total:g}')
+                lines.append(f"{name}_sum{{{labels}}} {values.get((name, f'{base}|sum'), 0):g}")
+                lines.append(f"{name}_count{{{labels}}} {total:g}")
+
+        label_names = {"llm_requests_total": "outcome", "llm_tokens_total": "type", "llm_continuations_total": "outcome"}
+        for name, help_text in COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (metric, field), amount in sorted(values.items()):
+                if metric != name:
+                    continue
+                provider, model, kind = field.split("|", 2)
+                lines.append(f'{name}{{provider="{provider}",model="{model}",{label_names[name]}="{kind}"}} {amount:g}')
+
+        return "\n".join(lines) + "\n"
+
+
+telemetry = Telemetry()
+
+
+class timed:
+    """Context manager observing the duration of a block into a telemetry histogram."""
+
+    def __init__(self, name: str, provider: str, model: str):
+        self.name = name
+        self.provider = provider
+        self.model = model
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        telemetry.observe(self.name, self.provider, self.model, time.perf_counter() - self.start)
+        return False
@@ -0,0 +1,224 @@
+from typing import Dict, Any, Optional, List, Callable, Iterable, Tuple
+import json
+import logging
+import threading
+import time
+
+from backend.config import settings, parse_provider_map
+from backend.services.prompts import prompt_registry
+from backend.services.rate_limiter import limiter_key
+from backend.services.redis_client import get_redis, mark_redis_failed
+
+logger = logging.getLogger(__name__)
+
+HISTORY_KEY = "token-budget:history"
+
+# Characters per token before any usage has been reported (mostly Chinese text plus JSON markup)
+DEFAULT_CHARS_PER_TOKEN = 1.5
+
+# Completion tokens per mode before any reply has been observed
+DEFAULT_COMPLETION_TOKENS = {
+    "question_analysis": 1800,
+    "question_analysis_batch": 6000,
+    "variant_generation": 800,
+}
+FALLBACK_COMPLETION_TOKENS = 2500
+
+# Weight of the newest observation in the moving averages
+EWMA_ALPHA = 0.2
+# Completion estimate = average + DEVIATIONS x mean absolute deviation, so the budget is rarely overrun
+DEVIATIONS = 2.0
+
+# Shared history is re-read from Redis at most this often
+HISTORY_REFRESH_INTERVAL = 30.0
+
+
+def _message_chars(messages: List[Dict[str, Any]]) -> int:
+    return sum(len(m.get("content") or "") for m in messages or [])
+
+
+class TokenEstimator:
+    """
+    Estimates the prompt + completion tokens of an LLM request before it is sent, for the
+    TPM budget of the rate limiter and for projected completion times.
+
+    Prompt tokens come from the length of the messages (rubric + question content) and a
+    characters-per-token ratio learned per provider from reported usage. Completion tokens
+    are a moving average of the output sizes observed per mode, plus a margin for their
+    spread. The history is shared through Redis so the API process, which projects
+    completion times, learns from what the Celery workers observe.
+    """
+
+    def __init__(self, redis_getter: Callable = get_redis):
+        self._redis_getter = redis_getter
+        self._lock = threading.Lock()
+        # "cpt:<provider>" -> {"mean"}, "out:<mode>" -> {"mean", "dev"}; each with "samples"
+        self._history: Dict[str, Dict[str, float]] = {}
+        self._synced_at = 0.0
+
+    # --- Estimates ---
+
+    def chars_per_token(self, provider: str) -> float:
+        entry = self._entry(f"cpt:{provider}")
+        return entry["mean"] if entry else DEFAULT_CHARS_PER_TOKEN
+
+    def completion_tokens(self, mode: str, max_tokens: Optional[int] = None) -> int:
+        entry = self._entry(f"out:{mode}")
+        if entry:
+            tokens = entry["mean"] + DEVIATIONS * entry["dev"]
+        else:
+            tokens = DEFAULT_COMPLETION_TOKENS.get(mode, FALLBACK_COMPLETION_TOKENS)
+        if max_tokens:
+            tokens = min(tokens, max_tokens)
+        return int(tokens)
+
+    def prompt_tokens(self, provider: str, chars: int) -> int:
+        return int(chars / self.chars_per_token(provider)) + 1
+
+    def estimate_request(self, provider: str, mode: str, create_kwargs: Dict[str, Any]) -> int:
+        """Tokens a chat completion request is expected to use (prompt + completion)."""
+        return (self.prompt_tokens(provider, _message_chars(create_kwargs.get("messages")))
+                + self.completion_tokens(mode, create_kwargs.get("max_tokens")))
+
+    def estimate_task(self, provider: str, content: str, mode: str = "question_analysis") -> int:
+        """Tokens one analysis of `content` is expected to use, from the rubric and question length."""
+        chars = _message_chars(prompt_registry.build_messages(content or "", mode))
+        return self.prompt_tokens(provider, chars) + self.completion_tokens(mode)
+
+    # --- Learning ---
+
+    def observe(self, provider: str, mode: str, prompt_chars: int, usage: Optional[Dict[str, int]], output_chars: int) -> int:
+        """
+        Learn from a finished request and return the tokens it actually used. Without a usage
+        block (providers that do not report it) the counts are estimated from the text lengths.
+        """
+        prompt_tokens = int((usage or {}).get("prompt_tokens") or 0)
+        completion_tokens = int((usage or {}).get("completion_tokens") or 0)
+        updates = {}
+        if prompt_tokens > 0 and prompt_chars > 0:
+            updates[f"cpt:{provider}"] = prompt_chars / prompt_tokens
+        else:
+            prompt_tokens = self.prompt_tokens(provider, prompt_chars)
+        if completion_tokens <= 0:
+            completion_tokens = self.prompt_tokens(provider, output_chars)
+        updates[f"out:{mode}"] = completion_tokens
+
+        with self._lock:
+            changed = {name: self._update(name, value) for name, value in updates.items()}
+        self._push(changed)
+        return prompt_tokens + completion_tokens
+
+    def _update(self, name: str, value: float) -> Dict[str, float]:
+        # Caller holds the lock
+        entry = self._history.get(name)
+        if entry is None:
+            entry = {"mean": float(value), "dev": 0.0, "samples": 0}
+        else:
+            deviation = abs(value - entry["mean"])
+            entry["mean"] += EWMA_ALPHA * (value - entry["mean"])
+            entry["dev"] += EWMA_ALPHA * (deviation - entry["dev"])
+        entry["samples"] += 1
+        self._history[name] = entry
+        return dict(entry)
+
+    # --- Shared history ---
+
+    def _entry(self, name: str) -> Optional[Dict[str, float]]:
+        self._pull()
+        with self._lock:
+            entry = self._history.get(name)
+            return dict(entry) if entry else None
+
+    def _pull(self):
+        if time.time() - self._synced_at < HISTORY_REFRESH_INTERVAL:
+            return
+        self._synced_at = time.time()
+        client = self._redis_getter()
+        if client is None:
+            return
+        try:
+            raw = client.hgetall(HISTORY_KEY)
+        except Exception as e:
+            logger.warning(f"Failed to read token history from Redis: {e}")
+            mark_redis_failed()
+            return
+        with self._lock:
+            for name, value in raw.items():
+                name = name.decode("utf-8") if isinstance(name, bytes) else name
+                self._history[name] = json.loads(value)
+
+    def _push(self, entries: Dict[str, Dict[str, float]]):
+        client = self._redis_getter()
+        if client is None or not entries:
+            return
+        try:
+            # Last writer wins: every worker keeps a close enough moving average
+            client.hset(HISTORY_KEY, mapping={name: json.dumps(entry) for name, entry in entries.items()})
+        except Exception as e:
+            logger.warning(f"Failed to share token history through Redis: {e}")
+            mark_redis_failed()
+
+    def stats(self) -> Dict[str, Any]:
+        self._pull()
+        with self._lock:
+            history = {name: {k: round(v, 3) for k, v in entry.items()} for name, entry in self._history.items()}
+        return {
+            "tpm": parse_provider_map(settings.LLM_LIMITER_TPM),
+            "rpm": parse_provider_map(settings.LLM_LIMITER_RPM),
+            "history": history,
+        }
+
+
+def submission_estimate(tasks: Iterable[Tuple[str, str, str]], estimator: "TokenEstimator" = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Expected cost of a submission per limiter key, from (provider, api_key, content) per task:
+    {limiter_key: {"provider", "tokens", "requests"}}. Only key hashes are kept.
+    """
+    estimator = estimator or token_estimator
+    estimate: Dict[str, Dict[str, Any]] = {}
+    for provider, api_key, content in tasks:
+        entry = estimate.setdefault(limiter_key(provider, api_key), {"provider": provider, "tokens": 0, "requests": 0})
+        entry["tokens"] += estimator.estimate_task(provider, content)
+        entry["requests"] += 1
+    return estimate
+
+
+def project_completion(estimate: Optional[Dict[str, Dict[str, Any]]], pending: int, total: int,
+                       now: float = None) -> Optional[Dict[str, Any]]:
+    """
+    Earliest completion of the pending part of a submission at the configured TPM/RPM
+    budgets: each key needs max(tokens / TPM, requests / RPM) minutes for its share, and the
+    slowest key decides. Other submissions sharing a key only make it later.
+    None when no budget applies to any of the submission's providers.
+    """
+    if not estimate or not total:
+        return None
+    now = time.time() if now is None else now
+    share = max(pending, 0) / total
+    tpm_limits = parse_provider_map(settings.LLM_LIMITER_TPM)
+    rpm_limits = parse_provider_map(settings.LLM_LIMITER_RPM)
+    remaining_tokens = 0
+    eta, bottleneck = None, None
+    for entry in estimate.values():
+        provider = entry["provider"]
+        tokens = entry["tokens"] * share
+        remaining_tokens += tokens
+        minutes = [tokens / tpm_limits[provider]] if tpm_limits.get(provider) else []
+        if rpm_limits.get(provider):
+            minutes.append(entry["requests"] * share / rpm_limits[provider])
+        if not minutes:
+            continue
+        seconds = max(minutes) * 60
+        if eta is None or seconds > eta:
+            eta, bottleneck = seconds, provider
+    if eta is None:
+        return None
+    return {
+        "remaining_tokens": int(remaining_tokens),
+        "eta_seconds": round(eta, 1),
+        "projected_completion_at": round(now + eta, 3),
+        "bottleneck": bottleneck,
+    }
+
+
+token_estimator = TokenEstimator()
@@ -1,64 +1,180 @@
 import asyncio
-from celery import shared_task
-from typing import List, Dict, Any
+from celery import shared_task, states
+from celery.exceptions import Ignore
+from typing import List, Dict, Any, Optional
 import time
 from backend.services.llm import LLMService
+from backend.services.cache import analysis_cache, make_cache_key
+from backend.services.single_flight import single_flight
+from backend.services.prompts import prompt_registry
+from backend.services.events import task_emitter, TaskEventEmitter
+from backend.services.hedging import latency_tracker, hedge_stats, run_hedged, run_hedged_async
+from backend.services.task_queues import config_priority
+from backend.services.cancellation import cancellation, TaskCancelled, STOPPED_ERROR
+from backend.services.io_steps import run_steps, run_steps_async
+from backend.config import settings, parse_provider_map
 
 # API_KEYS are now passed in configs, but we can keep this as fallback or remove if not needed
 # For now, we rely on configs passed from frontend
 
-def perform_single_model_analysis(question_data: Dict[str, Any], config: Dict[str, Any]) -> Dict[str, Any]:
+def _build_llm_service(config: Dict[str, Any]) -> LLMService:
+    # Config structure: provider, api_key, base_url, model_name, temperature, name_label
+    llm_service = LLMService(
+        provider=config.get("provider"), 
+        api_key=config.get("api_key"),
+        base_url=config.get("base_url"),
+        model_name=config.get("model_name"),
+        temperature=config.get("temperature", 0.3)
+    )
+    # Retries are marked config["queue"] = "interactive" and overtake bulk analysis in process too
+    llm_service.priority = config_priority(config)
+    return llm_service
+
+def _attach_emitter(llm_service: LLMService, emitter: Optional[TaskEventEmitter]):
+    # Stream token counts and early fields (final_level) to the job's event channel
+    if emitter is not None:
+        llm_service.on_progress = emitter.progress
+        llm_service.on_partial = emitter.partial
+
+def _attach_cancellation(llm_service: LLMService, task_ids: List[Optional[str]]):
+    # /api/tasks/stop flags the task ids; the stream stops between two chunks
+    task_ids = [tid for tid in task_ids if tid]
+    if task_ids:
+        llm_service.is_cancelled = cancellation.checker(task_ids)
+
+def _latency_key(llm_service: LLMService) -> str:
+    return f"{llm_service.provider}:{llm_service._get_model_name()}"
+
+def _hedge_plan(llm_service: LLMService, config: Dict[str, Any]):
     """
-    Synchronous function to perform analysis for a SINGLE model.
+    (backup_service, delay) when this request may be hedged, otherwise None.
+    config["hedge_config"] is the backup model config designated by ModelConfig.hedge_with.
     """
-    content = question_data.get("content")
-    
-    # Config structure: provider, api_key, base_url, model_name, temperature, name_label
-    provider = config.get("provider")
-    api_key = config.get("api_key")
-    base_url = config.get("base_url")
-    model_name = config.get("model_name")
-    temperature = config.get("temperature", 0.3)
-    label = config.get("name_label") or provider 
-    is_retry = config.get("is_retry", False)
-
-    result_data = {}
-
-    if not api_key:
-        result_data = {
-            "error": "API Key not provided",
-            "level": "Error",
-            "final_level": "Error",
-            "scores": [0, 0, 0],
-            "markdown_report": "**分析失败**\n\n未提供 API Key，无法进行分析。"
+    hedge_config = config.get("hedge_config")
+    if not settings.LLM_HEDGE_ENABLED or not hedge_config or not hedge_config.get("api_key"):
+        return None
+    delay = latency_tracker.hedge_delay(_latency_key(llm_service))
+    if delay is None:
+        # Still learning this provider's latency distribution
+        hedge_stats.count(False, "primary")
+        return None
+    backup_service = _build_llm_service(hedge_config)
+    backup_service.priority = llm_service.priority
+    backup_service.is_cancelled = llm_service.is_cancelled
+    return backup_service, delay
+
+def _record_hedge_outcome(llm_service: LLMService, backup_service: Optional[LLMService], result: Dict[str, Any], winner: str, elapsed: float):
+    # A cancelled primary still contributes its (censored) duration, so the tail stays visible
+    if "error" not in result or winner == "backup":
+        latency_tracker.record(_latency_key(llm_service), elapsed)
+    if winner == "backup":
+        result["hedged_by"] = {
+            "provider": backup_service.provider,
+            "model_name": backup_service._get_model_name(),
         }
+
+def _analyze_with_hedge(llm_service: LLMService, content: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    start_time = time.time()
+    plan = _hedge_plan(llm_service, config)
+    if plan is None:
+        result, backup_service, winner = llm_service.analyze_question(content), None, "primary"
     else:
-        try:
-            start_time = time.time()
-            llm_service = LLMService(
-                provider=provider, 
-                api_key=api_key,
-                base_url=base_url,
-                model_name=model_name,
-                temperature=temperature
-            )
-            analysis_result = llm_service.analyze_question(content)
-            end_time = time.time()
-            
-            # Add elapsed time
-            analysis_result["elapsed_time"] = round(end_time - start_time, 2)
-            result_data = analysis_result
-        except Exception as e:
-            result_data = {
-                "error": str(e),
-                "level": "Error",
-                "final_level": "Error",
-                "scores": [0, 0, 0],
-                "markdown_report": f"**分析失败**\n\n发生错误：{str(e)}"
-            }
-    
+        backup_service, delay = plan
+
+        def primary(should_cancel):
+            llm_service.should_cancel = should_cancel
+            return llm_service.analyze_question(content)
+
+        def backup(should_cancel):
+            backup_service.should_cancel = should_cancel
+            return backup_service.analyze_question(content)
+
+        result, winner = run_hedged(primary, backup, delay)
+        # The hedge runner reports exceptions as error results
+        llm_service.raise_if_cancelled()
+    _record_hedge_outcome(llm_service, backup_service, result, winner, time.time() - start_time)
+    return result
+
+async def _analyze_with_hedge_async(llm_service: LLMService, content: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    start_time = time.time()
+    plan = _hedge_plan(llm_service, config)
+    if plan is None:
+        result, backup_service, winner = await llm_service.analyze_question_async(content), None, "primary"
+    else:
+        backup_service, delay = plan
+        result, winner = await run_hedged_async(
+            lambda: llm_service.analyze_question_async(content),
+            lambda: backup_service.analyze_question_async(content),
+            delay
+        )
+        llm_service.raise_if_cancelled()
+    _record_hedge_outcome(llm_service, backup_service, result, winner, time.time() - start_time)
+    return result
+
+def _cacheable(analysis_result: Dict[str, Any]) -> bool:
+    # A result produced by the hedge backup model does not belong under the primary's key
+    return "error" not in analysis_result and "hedged_by" not in analysis_result
+
+def _analysis_cache_key(llm_service: LLMService, content: str) -> str:
+    return make_cache_key(
+        content,
+        "question_analysis",
+        prompt_registry.version("question_analysis"),
+        llm_service.provider,
+        llm_service._get_model_name(),
+        llm_service.temperature
+    )
+
+def _analyze_coalesced(llm_service: LLMService, content: str, config: Dict[str, Any], cache_key: str) -> Dict[str, Any]:
+    # Identical analyses in flight at the same time share one provider call (manual retries always make their own)
+    if config.get("is_retry", False):
+        return _analyze_with_hedge(llm_service, content, config)
+    result, shared = single_flight.run(
+        cache_key, lambda: _analyze_with_hedge(llm_service, content, config),
+        shareable=_cacheable, on_wait=llm_service.raise_if_cancelled
+    )
+    if shared:
+        result["coalesced"] = True
+    return result
+
+async def _analyze_coalesced_async(llm_service: LLMService, content: str, config: Dict[str, Any], cache_key: str) -> Dict[str, Any]:
+    if config.get("is_retry", False):
+        return await _analyze_with_hedge_async(llm_service, content, config)
+    result, shared = await single_flight.run_async(
+        cache_key, lambda: _analyze_with_hedge_async(llm_service, content, config),
+        shareable=_cacheable, on_wait=llm_service.raise_if_cancelled
+    )
+    if shared:
+        result["coalesced"] = True
+    return result
+
+def _should_bypass_cache(config: Dict[str, Any]) -> bool:
+    # Manual retries always ask the provider again, but still refresh the cache
+    return config.get("bypass_cache", False) or config.get("is_retry", False) or not settings.ANALYSIS_CACHE_ENABLED
+
+def _missing_key_result() -> Dict[str, Any]:
+    return {
+        "error": "API Key not provided",
+        "level": "Error",
+        "final_level": "Error",
+        "scores": [0, 0, 0],
+        "markdown_report": "**分析失败**\n\n未提供 API Key，无法进行分析。"
+    }
+
+def _exception_result(e: Exception) -> Dict[str, Any]:
+    return {
+        "error": str(e),
+        "level": "Error",
+        "final_level": "Error",
+        "scores": [0, 0, 0],
+        "markdown_report": f"**分析失败**\n\n发生错误：{str(e)}"
+    }
+
+def _wrap_single_model_result(config: Dict[str, Any], result_data: Dict[str, Any]) -> Dict[str, Any]:
+    label = config.get("name_label") or config.get("provider")
+
     # Inject retry metadata if applicable
-    if is_retry:
+    if config.get("is_retry", False):
         result_data["meta"] = result_data.get("meta", {})
         if not isinstance(result_data["meta"], dict):
              result_data["meta"] = {}
@@ -70,6 +186,214 @@ def perform_single_model_analysis(question_data: Dict[str, Any], config: Dict[st
         "result": result_data
     }
 
+def _finish_task(emitter: Optional[TaskEventEmitter], result: Dict[str, Any]) -> Dict[str, Any]:
+    if emitter is not None:
+        emitter.state("SUCCESS", result=result)
+    return result
+
+def _single_model_steps(question_data: Dict[str, Any], config: Dict[str, Any], task_id: Optional[str]):
+    """
+    Analysis of one question by one model, shared by the sync and async paths (see io_steps):
+    yields ("analyze", llm_service, content, config, cache_key) for the provider call and
+    ("cache_get", keys) / ("cache_set", [(key, value)]) for the analysis cache.
+    """
+    content = question_data.get("content")
+    emitter = task_emitter(config, task_id, question_data.get("id"))
+
+    if not config.get("api_key"):
+        return _finish_task(emitter, _wrap_single_model_result(config, _missing_key_result()))
+
+    if emitter:
+        emitter.state("PROCESSING")
+    try:
+        start_time = time.time()
+        llm_service = _build_llm_service(config)
+        _attach_emitter(llm_service, emitter)
+        _attach_cancellation(llm_service, [task_id])
+        cache_key = _analysis_cache_key(llm_service, content)
+        analysis_result = None if _should_bypass_cache(config) else (yield "cache_get", [cache_key])[0]
+        if analysis_result is not None:
+            analysis_result["cache_hit"] = True
+        else:
+            analysis_result = yield "analyze", llm_service, content, config, cache_key
+            if _cacheable(analysis_result) and not analysis_result.get("coalesced"):
+                yield "cache_set", [(cache_key, analysis_result)]
+        end_time = time.time()
+        
+        # Add elapsed time
+        analysis_result["elapsed_time"] = round(end_time - start_time, 2)
+        result_data = analysis_result
+    except TaskCancelled:
+        if emitter:
+            emitter.state("REVOKED", error=STOPPED_ERROR)
+        raise
+    except Exception as e:
+        result_data = _exception_result(e)
+
+    return _finish_task(emitter, _wrap_single_model_result(config, result_data))
+
+def perform_single_model_analysis(question_data: Dict[str, Any], config: Dict[str, Any], task_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Synchronous function to perform analysis for a SINGLE model.
+    With config["job_id"] and task_id set, state/progress events are published for the job.
+    """
+    return run_steps(_single_model_steps(question_data, config, task_id), _perform)
+
+async def perform_single_model_analysis_async(question_data: Dict[str, Any], config: Dict[str, Any], task_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Asyncio version of perform_single_model_analysis, used by desktop mode so that
+    LLM streams run on the event loop instead of in executor threads.
+    """
+    return await run_steps_async(_single_model_steps(question_data, config, task_id), _perform_async)
+
+def resolve_batch_size(config: Dict[str, Any]) -> int:
+    """
+    Number of selection questions packed into one request for this config.
+    ModelConfig.batch_size overrides the per-provider LLM_BATCH_SIZES setting.
+    """
+    if config.get("batch_size"):
+        return max(1, int(config["batch_size"]))
+    return max(1, parse_provider_map(settings.LLM_BATCH_SIZES).get(config.get("provider"), 1))
+
+def _lookup_batch_cache(llm_service: LLMService, questions: List[Dict[str, Any]], config: Dict[str, Any], results: Dict[str, Any], start_time: float):
+    # Steps: serve cached questions directly, return (question, cache_key) pairs still to analyse
+    keys = [_analysis_cache_key(llm_service, q.get("content")) for q in questions]
+    hits = [None] * len(keys) if _should_bypass_cache(config) else (yield "cache_get", keys)
+    pending = []
+    for q, cache_key, cached in zip(questions, keys, hits):
+        if cached is not None:
+            cached["cache_hit"] = True
+            cached["elapsed_time"] = round(time.time() - start_time, 2)
+            results[str(q.get("id"))] = _wrap_single_model_result(config, cached)
+        else:
+            pending.append((q, cache_key))
+    return pending
+
+def _collect_batch_results(batch: Dict[str, Any], pending: List[tuple], config: Dict[str, Any], results: Dict[str, Any], start_time: float):
+    # Steps: wrap the batched reply per question and store the cacheable analyses
+    elapsed = round(time.time() - start_time, 2)
+    cacheable = []
+    for q, cache_key in pending:
+        qid = str(q.get("id"))
+        analysis_result = batch.get(qid)
+        if analysis_result is None:
+            continue
+        if _cacheable(analysis_result):
+            cacheable.append((cache_key, dict(analysis_result)))
+        analysis_result["elapsed_time"] = elapsed
+        analysis_result["batched"] = True
+        results[qid] = _wrap_single_model_result(config, analysis_result)
+    if cacheable:
+        yield "cache_set", cacheable
+
+def _batch_emitters(questions: List[Dict[str, Any]], config: Dict[str, Any], task_ids: Optional[Dict[str, str]]) -> Dict[str, TaskEventEmitter]:
+    emitters = {}
+    for q in questions:
+        qid = str(q.get("id"))
+        emitter = task_emitter(config, (task_ids or {}).get(qid), q.get("id"))
+        if emitter is not None:
+            emitter.state("PROCESSING")
+            emitters[qid] = emitter
+    return emitters
+
+def _revoke_emitters(emitters: Dict[str, TaskEventEmitter]):
+    for emitter in emitters.values():
+        emitter.state("REVOKED", error=STOPPED_ERROR)
+
+def _batch_steps(questions: List[Dict[str, Any]], config: Dict[str, Any], task_ids: Optional[Dict[str, str]]):
+    """
+    Batched analysis shared by the sync and async paths (see io_steps): yields
+    ("batch", llm_service, questions) for the batched request, ("individually", questions,
+    config, task_ids) for the questions missing from its reply and the cache steps.
+    """
+    if not config.get("api_key"):
+        return {str(q.get("id")): _wrap_single_model_result(config, _missing_key_result()) for q in questions}
+
+    start_time = time.time()
+    results = {}
+    task_ids = task_ids or {}
+    emitters = _batch_emitters(questions, config, task_ids)
+    llm_service = _build_llm_service(config)
+    _attach_cancellation(llm_service, list(task_ids.values()))
+    pending = yield from _lookup_batch_cache(llm_service, questions, config, results, start_time)
+
+    if len(pending) > 1:
+        try:
+            batch = yield "batch", llm_service, [q for q, _ in pending]
+        except TaskCancelled:
+            _revoke_emitters(emitters)
+            raise
+        yield from _collect_batch_results(batch, pending, config, results, start_time)
+
+    for qid, emitter in emitters.items():
+        if qid in results:
+            emitter.state("SUCCESS", result=results[qid])
+
+    # Retry anything missing from the reply on its own
+    missing = [q for q, _ in pending if str(q.get("id")) not in results]
+    if missing:
+        retried = yield "individually", missing, config, task_ids
+        for q, res in zip(missing, retried):
+            if isinstance(res, TaskCancelled):
+                continue
+            if isinstance(res, BaseException):
+                raise res
+            results[str(q.get("id"))] = res
+
+    return results
+
+def perform_batch_analysis(questions: List[Dict[str, Any]], config: Dict[str, Any], task_ids: Optional[Dict[str, str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Analyze several selection questions with ONE model in a single request.
+    Returns {question_id: {"model_label", "result"}}; questions missing from the batched
+    reply are retried individually, so every question gets a result unless its task was
+    stopped by the user (TaskCancelled if the whole batch was stopped).
+    """
+    return run_steps(_batch_steps(questions, config, task_ids), _perform)
+
+async def perform_batch_analysis_async(questions: List[Dict[str, Any]], config: Dict[str, Any], task_ids: Optional[Dict[str, str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Asyncio version of perform_batch_analysis (desktop mode); missing questions are retried concurrently.
+    """
+    return await run_steps_async(_batch_steps(questions, config, task_ids), _perform_async)
+
+def _perform(request: tuple) -> Any:
+    """Blocking I/O requested by the analysis steps (Celery threads)."""
+    kind = request[0]
+    if kind == "cache_get":
+        return [analysis_cache.get(key) for key in request[1]]
+    if kind == "cache_set":
+        for key, value in request[1]:
+            analysis_cache.set(key, value)
+        return None
+    if kind == "analyze":
+        return _analyze_coalesced(*request[1:])
+    if kind == "batch":
+        return request[1].analyze_questions_batch(request[2])
+    _, questions, config, task_ids = request
+    results = []
+    for q in questions:
+        try:
+            results.append(perform_single_model_analysis(q, config, task_ids.get(str(q.get("id")))))
+        except TaskCancelled as e:
+            results.append(e)
+    return results
+
+async def _perform_async(request: tuple) -> Any:
+    """Asyncio counterpart of _perform (desktop mode)."""
+    kind = request[0]
+    if kind in ("cache_get", "cache_set"):
+        # The cache may read and write its SQLite tier: keep that off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, _perform, request)
+    if kind == "analyze":
+        return await _analyze_coalesced_async(*request[1:])
+    if kind == "batch":
+        return await request[1].analyze_questions_batch_async(request[2])
+    _, questions, config, task_ids = request
+    return await asyncio.gather(*(
+        perform_single_model_analysis_async(q, config, task_ids.get(str(q.get("id")))) for q in questions
+    ), return_exceptions=True)
+
 def perform_analysis_sync(question_data: Dict[str, Any], configs: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Legacy synchronous function to perform analysis logic for multiple configs.
@@ -94,7 +418,11 @@ def analyze_single_model_task(self, question_data: Dict[str, Any], config: Dict[
     Async task to analyze a chemistry question using a SINGLE LLM config.
     """
     try:
-        return perform_single_model_analysis(question_data, config)
+        return perform_single_model_analysis(question_data, config, self.request.id)
+    except TaskCancelled:
+        # Stopped by the user: end as REVOKED, without retrying
+        self.backend.mark_as_revoked(self.request.id, reason=STOPPED_ERROR)
+        raise Ignore()
     except Exception as e:
         self.retry(exc=e, countdown=5)
 
@@ -108,3 +436,35 @@ def analyze_question_task(self, question_data: Dict[str, Any], configs: List[Dic
     except Exception as e:
         # Retry on failure
         self.retry(exc=e, countdown=5)
+
+@shared_task(name="backend.tasks.analysis.analyze_batch_task", bind=True, acks_late=True)
+def analyze_batch_task(self, questions: List[Dict[str, Any]], config: Dict[str, Any], task_ids: Dict[str, str]):
+    """
+    Async task analysing a batch of selection questions with one model.
+    Each question keeps its own task id (pre-assigned by the API); its result is stored
+    under that id so the per-task status protocol is unchanged for the frontend.
+    """
+    for tid in task_ids.values():
+        self.backend.store_result(tid, None, states.STARTED)
+
+    error = None
+    try:
+        results = perform_batch_analysis(questions, config, task_ids)
+    except TaskCancelled:
+        results = {}
+    except Exception as e:
+        # Not retried as a whole: every question would be marked STARTED forever otherwise
+        results, error = {}, e
+    question_ids = {str(q.get("id")): q.get("id") for q in questions}
+    for qid, tid in task_ids.items():
+        if qid in results:
+            self.backend.store_result(tid, results[qid], states.SUCCESS)
+        elif error is not None:
+            self.backend.mark_as_failure(tid, error)
+            emitter = task_emitter(config, tid, question_ids.get(qid, qid))
+            if emitter:
+                emitter.state("FAILURE", error=str(error))
+        else:
+            # Questions without a result were stopped by the user
+            self.backend.mark_as_revoked(tid, reason=STOPPED_ERROR)
+    return {qid: task_ids.get(qid) for qid in results}
@@ -1,6 +1,10 @@
-from typing import Dict, Any, List, Union
+from typing import Dict, Any, List, Union, Optional
 from celery import shared_task
+from celery.exceptions import Ignore
+import asyncio
 from backend.services.llm import LLMService
+from backend.services.task_queues import config_priority, QUEUE_SCORE
+from backend.services.cancellation import cancellation, TaskCancelled, STOPPED_ERROR
 import logging
 import json
 
@@ -479,9 +483,9 @@ def correct_result(result: Dict[str, Any], stats: Dict[str, Any], q_map: Dict[st
 
     return result
 
-def perform_score_analysis_sync(score_data: Union[List, Dict], question_data: List[Dict], mode: str, config: Dict[str, Any]) -> Dict[str, Any]:
+def _prepare_score_context(score_data: Union[List, Dict], question_data: List[Dict], mode: str) -> Dict[str, Any]:
     """
-    Synchronous score analysis using LLMService.
+    Statistics that are computed independently of the LLM (shared by the sync and async paths).
     """
     # 1. Prepare Data & Stats (Calculate independently of LLM)
     q_map = {str(q['question_id']): q for q in question_data}
@@ -617,114 +621,195 @@ def perform_score_analysis_sync(score_data: Union[List, Dict], question_data: Li
         # If stats calc fails, we can't do much correction, but proceed to try LLM? 
         # Or just fail? Usually this shouldn't fail if data is valid.
     
-    result = {}
-    
+    return {
+        "q_map": q_map,
+        "stats": stats,
+        "student_topic_stats": student_topic_stats,
+        "student_ability_stats": student_ability_stats,
+        "groups": groups,
+        "main_group_name": main_group_name,
+        "comparative_context": comparative_context,
+    }
+
+def _build_score_llm_requests(ctx: Dict[str, Any], score_data: Union[List, Dict], question_data: List[Dict], mode: str) -> List[Dict[str, Any]]:
+    """
+    Build one LLM request per analysed unit: each group in class mode, the student in student mode.
+    """
+    q_map = ctx["q_map"]
+    groups = ctx["groups"]
+    main_group_name = ctx["main_group_name"]
+
+    # Construct Input String
+    q_context = json.dumps(question_data, ensure_ascii=False)
+    requests = []
+
+    if mode == 'class':
+        # Multi-Group Analysis (Grade + Classes)
+        # We will generate a separate report for EACH group
+        
+        # 1. Identify Groups
+        # Ensure 'Grade' or main group is first
+        group_names = sorted(groups.keys(), key=natural_sort_key)
+        if main_group_name in group_names:
+            group_names.remove(main_group_name)
+            group_names.insert(0, main_group_name)
+        
+        for g_name in group_names:
+            g_data = groups[g_name]
+            g_stats = calculate_class_stats(g_data, q_map)
+            stats_summary = json.dumps(g_stats, ensure_ascii=False)
+            score_context = json.dumps(g_data, ensure_ascii=False)
+            
+            # Construct Prompt for Single Group Analysis (using Collective Prompt structure)
+            # We treat each group as a "Collective Unit"
+            input_data = f"题目难度数据：\n{q_context}\n\n当前分析对象（{g_name}）得分率数据：\n{score_context}\n\n(参考统计 - {g_name}：{stats_summary})\n\n请对该对象进行【集体学情分析】。请忽略提示词中关于'全年级'和'各班'对比的要求，专注于分析当前提供的这份数据。"
+            
+            # Use 'multiple_analysis' mode but guide it to focus on single group
+            requests.append({"group": g_name, "input_data": input_data, "llm_mode": "multiple_analysis", "stats": g_stats})
+    else:
+        # Student Mode (Single Analysis)
+        score_context = json.dumps(score_data, ensure_ascii=False)
+        input_data = f"题目难度数据：\n{q_context}\n\n学生个人数据：\n{score_context}"
+        
+        # Map mode to LLMService mode
+        requests.append({"group": None, "input_data": input_data, "llm_mode": "single_analysis", "stats": ctx["stats"]})
+
+    return requests
+
+def _correct_score_response(ctx: Dict[str, Any], mode: str, request: Dict[str, Any], res: Dict[str, Any]) -> Dict[str, Any]:
+    # Post-correction
+    if mode == 'class':
+        return correct_result(res, request["stats"], ctx["q_map"], mode, None, None)
+    return correct_result(
+        res, 
+        ctx["stats"], 
+        ctx["q_map"], 
+        mode, 
+        ctx["student_topic_stats"],
+        ctx["student_ability_stats"]
+    )
+
+def _group_failure_result(g_name: str, e: Exception) -> Dict[str, Any]:
+    logger.error(f"Analysis failed for group {g_name}: {e}")
+    return {
+        "总体分析": {"各等级得分率分析": {}, "综合评价": f"分析失败: {str(e)}"},
+        "能力短板诊断": [],
+        "markdown_report": f"# {g_name} 分析失败\n\n{str(e)}"
+    }
+
+def _score_fallback_result(ctx: Dict[str, Any], mode: str, e: Exception) -> Dict[str, Any]:
+    logger.error(f"Score analysis LLM failed: {e}")
+    # Construct Fallback Result
+    if mode == 'class':
+        result = {
+            "总体分析": {"各等级得分率分析": {}, "综合评价": f"AI分析服务暂时不可用 ({str(e)})，仅显示统计数据。"},
+            "薄弱点智能诊断与训练建议": []
+        }
+    else:
+        result = {
+            "知识主题掌握情况": [],
+            "能力要素分析": {},
+            "错题分析": [],
+            "个性化提升建议": f"AI分析服务暂时不可用 ({str(e)})，仅显示统计数据。"
+        }
+
+    # 3. Post-correction (Always run this to ensure stats are applied)
     try:
-        # Initialize LLM Service
-        llm = LLMService(
-            provider=config.get("provider", "deepseek"),
-            api_key=config.get("api_key"),
-            base_url=config.get("base_url"),
-            model_name=config.get("model_name"),
-            temperature=config.get("temperature", 0.3)
+        result = correct_result(
+            result, 
+            ctx["stats"], 
+            ctx["q_map"], 
+            mode, 
+            ctx["student_topic_stats"] if mode == 'student' else None,
+            ctx["student_ability_stats"] if mode == 'student' else None
         )
+    except Exception as e:
+        logger.error(f"Result correction failed: {e}")
         
-        # Construct Input String
-        q_context = json.dumps(question_data, ensure_ascii=False)
+    return result
+
+def _build_score_llm(config: Dict[str, Any], task_id: Optional[str] = None) -> LLMService:
+    # Initialize LLM Service
+    llm = LLMService(
+        provider=config.get("provider", "deepseek"),
+        api_key=config.get("api_key"),
+        base_url=config.get("base_url"),
+        model_name=config.get("model_name"),
+        temperature=config.get("temperature", 0.3)
+    )
+    llm.priority = config_priority(config, QUEUE_SCORE)
+    if task_id:
+        # Stopped by /api/tasks/stop between two stream chunks
+        llm.is_cancelled = cancellation.checker([task_id])
+    return llm
+
+def perform_score_analysis_sync(score_data: Union[List, Dict], question_data: List[Dict], mode: str, config: Dict[str, Any], task_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Synchronous score analysis using LLMService.
+    Raises TaskCancelled if task_id was stopped by the user.
+    """
+    ctx = _prepare_score_context(score_data, question_data, mode)
+    
+    try:
+        llm = _build_score_llm(config, task_id)
+        requests = _build_score_llm_requests(ctx, score_data, question_data, mode)
         
         if mode == 'class':
-            # Multi-Group Analysis (Grade + Classes)
-            # We will generate a separate report for EACH group
             final_results = {}
-            
-            # 1. Identify Groups
-            # Ensure 'Grade' or main group is first
-            group_names = sorted(groups.keys(), key=natural_sort_key)
-            if main_group_name in group_names:
-                group_names.remove(main_group_name)
-                group_names.insert(0, main_group_name)
-            
-            for g_name in group_names:
-                g_data = groups[g_name]
-                g_stats = calculate_class_stats(g_data, q_map)
-                stats_summary = json.dumps(g_stats, ensure_ascii=False)
-                score_context = json.dumps(g_data, ensure_ascii=False)
-                
-                # Construct Prompt for Single Group Analysis (using Collective Prompt structure)
-                # We treat each group as a "Collective Unit"
-                input_data = f"题目难度数据：\n{q_context}\n\n当前分析对象（{g_name}）得分率数据：\n{score_context}\n\n(参考统计 - {g_name}：{stats_summary})\n\n请对该对象进行【集体学情分析】。请忽略提示词中关于'全年级'和'各班'对比的要求，专注于分析当前提供的这份数据。"
-                
+            for request in requests:
                 try:
-                    # Use 'multiple_analysis' mode but guide it to focus on single group
-                    res = llm.analyze_question(input_data, mode="multiple_analysis")
-                    
-                    # Post-correction for this group
-                    res = correct_result(res, g_stats, q_map, mode, None, None)
-                    
-                    final_results[g_name] = res
+                    res = llm.analyze_question(request["input_data"], mode=request["llm_mode"])
+                    final_results[request["group"]] = _correct_score_response(ctx, mode, request, res)
+                except TaskCancelled:
+                    raise
                 except Exception as e:
-                    logger.error(f"Analysis failed for group {g_name}: {e}")
-                    final_results[g_name] = {
-                        "总体分析": {"各等级得分率分析": {}, "综合评价": f"分析失败: {str(e)}"},
-                        "能力短板诊断": [],
-                        "markdown_report": f"# {g_name} 分析失败\n\n{str(e)}"
-                    }
+                    final_results[request["group"]] = _group_failure_result(request["group"], e)
             
             # Return the map of results
             return final_results
 
-        else:
-            # Student Mode (Single Analysis)
-            score_context = json.dumps(score_data, ensure_ascii=False)
-            input_data = f"题目难度数据：\n{q_context}\n\n学生个人数据：\n{score_context}"
-            
-            # Map mode to LLMService mode
-            llm_mode = "single_analysis"
-            
-            # Call LLM
-            result = llm.analyze_question(input_data, mode=llm_mode)
-            
-            # Post-correction
-            result = correct_result(
-                result, 
-                stats, 
-                q_map, 
-                mode, 
-                student_topic_stats,
-                student_ability_stats
-            )
-            return result
+        # Call LLM
+        request = requests[0]
+        result = llm.analyze_question(request["input_data"], mode=request["llm_mode"])
+        return _correct_score_response(ctx, mode, request, result)
         
+    except TaskCancelled:
+        raise
     except Exception as e:
-        logger.error(f"Score analysis LLM failed: {e}")
-        # Construct Fallback Result
-        if mode == 'class':
-            result = {
-                "总体分析": {"各等级得分率分析": {}, "综合评价": f"AI分析服务暂时不可用 ({str(e)})，仅显示统计数据。"},
-                "薄弱点智能诊断与训练建议": []
-            }
-        else:
-            result = {
-                "知识主题掌握情况": [],
-                "能力要素分析": {},
-                "错题分析": [],
-                "个性化提升建议": f"AI分析服务暂时不可用 ({str(e)})，仅显示统计数据。"
-            }
+        return _score_fallback_result(ctx, mode, e)
 
-    # 3. Post-correction (Always run this to ensure stats are applied)
+async def perform_score_analysis_async(score_data: Union[List, Dict], question_data: List[Dict], mode: str, config: Dict[str, Any], task_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Asyncio version of perform_score_analysis_sync (desktop mode, no executor thread).
+    Groups in class mode are analysed concurrently.
+    """
+    ctx = _prepare_score_context(score_data, question_data, mode)
+    
     try:
-        result = correct_result(
-            result, 
-            stats, 
-            q_map, 
-            mode, 
-            student_topic_stats if mode == 'student' else None,
-            student_ability_stats if mode == 'student' else None
-        )
-    except Exception as e:
-        logger.error(f"Result correction failed: {e}")
+        llm = _build_score_llm(config, task_id)
+        requests = _build_score_llm_requests(ctx, score_data, question_data, mode)
         
-    return result
+        if mode == 'class':
+            async def run_group(request):
+                try:
+                    res = await llm.analyze_question_async(request["input_data"], mode=request["llm_mode"])
+                    return _correct_score_response(ctx, mode, request, res)
+                except TaskCancelled:
+                    raise
+                except Exception as e:
+                    return _group_failure_result(request["group"], e)
+
+            results = await asyncio.gather(*(run_group(r) for r in requests))
+            return {r["group"]: res for r, res in zip(requests, results)}
+
+        request = requests[0]
+        result = await llm.analyze_question_async(request["input_data"], mode=request["llm_mode"])
+        return _correct_score_response(ctx, mode, request, result)
+        
+    except TaskCancelled:
+        raise
+    except Exception as e:
+        return _score_fallback_result(ctx, mode, e)
 
 def natural_sort_key(s):
     """
@@ -738,4 +823,8 @@ def analyze_score_task(self, score_data: Union[List, Dict], question_data: List[
     """
     Celery task for score analysis.
     """
-    return perform_score_analysis_sync(score_data, question_data, mode, config)
+    try:
+        return perform_score_analysis_sync(score_data, question_data, mode, config, self.request.id)
+    except TaskCancelled:
+        self.backend.mark_as_revoked(self.request.id, reason=STOPPED_ERROR)
+        raise Ignore()
@@ -0,0 +1,25 @@
+from types import SimpleNamespace
+
+
+def make_chunk(text, **fields):
+    """One streamed chat completion chunk carrying `text`; extra fields (e.g. usage) go on the chunk."""
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], **fields)
+
+
+class FakeStream:
+    """Sync stream of chunks that stops once closed, counting the chunks it sent."""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.sent = 0
+        self.closed = False
+
+    def __iter__(self):
+        for piece in self.pieces:
+            if self.closed:
+                return
+            self.sent += 1
+            yield make_chunk(piece)
+
+    def close(self):
+        self.closed = True
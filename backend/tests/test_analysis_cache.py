@@ -0,0 +1,111 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch, AsyncMock
+
+from backend.services.cache import AnalysisCache, make_cache_key
+from backend.tasks.analysis import perform_single_model_analysis, perform_single_model_analysis_async
+
+
+class TestAnalysisCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.sqlite_path = os.path.join(self.tmpdir.name, "cache.sqlite3")
+        self.cache = AnalysisCache(
+            max_entries=2,
+            max_bytes=1024 * 1024,
+            ttl=60,
+            sqlite_path=self.sqlite_path,
+            redis_getter=lambda: None
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_key_normalizes_whitespace(self):
+        k1 = make_cache_key("1. 下列说法 正确的是", "question_analysis", "h", "deepseek", "deepseek-chat", 0.3)
+        k2 = make_cache_key("  1. 下列说法\n正确的是 ", "question_analysis", "h", "deepseek", "deepseek-chat", 0.3)
+        k3 = make_cache_key("1. 下列说法 正确的是", "question_analysis", "h", "deepseek", "deepseek-chat", 0.7)
+        self.assertEqual(k1, k2)
+        self.assertNotEqual(k1, k3)
+
+    def test_hit_and_miss_counters(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", {"final_level": "L3"})
+        self.assertEqual(self.cache.get("a")["final_level"], "L3")
+        stats = self.cache.stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["memory_hits"], 1)
+
+    def test_lru_eviction_falls_back_to_sqlite(self):
+        self.cache.set("a", {"v": 1})
+        self.cache.set("b", {"v": 2})
+        self.cache.set("c", {"v": 3})
+        self.assertEqual(self.cache.stats()["memory_entries"], 2)
+        # "a" was evicted from memory but is still on disk
+        self.assertEqual(self.cache.get("a"), {"v": 1})
+        self.assertEqual(self.cache.stats()["sqlite_hits"], 1)
+
+    def test_ttl_expiry(self):
+        self.cache.set("a", {"v": 1}, ttl=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get("a"))
+
+
+class TestCachedAnalysis(unittest.TestCase):
+    def test_second_call_served_from_cache(self):
+        cache = AnalysisCache(ttl=60, redis_getter=lambda: None)
+        question = {"id": "1", "content": "What is H2O?"}
+        config = {"provider": "deepseek", "api_key": "k", "name_label": "DS"}
+
+        with patch("backend.tasks.analysis.analysis_cache", cache), \
+             patch("backend.tasks.analysis.LLMService.analyze_question") as mock_analyze:
+            mock_analyze.return_value = {"final_level": "L2", "markdown_report": "ok"}
+            first = perform_single_model_analysis(question, config)
+            second = perform_single_model_analysis(question, config)
+            bypassed = perform_single_model_analysis(question, dict(config, bypass_cache=True))
+
+        self.assertEqual(mock_analyze.call_count, 2)
+        self.assertNotIn("cache_hit", first["result"])
+        self.assertTrue(second["result"]["cache_hit"])
+        self.assertEqual(second["result"]["final_level"], "L2")
+        self.assertNotIn("cache_hit", bypassed["result"])
+
+    def test_async_path_uses_the_cache_off_the_event_loop(self):
+        cache = AnalysisCache(ttl=60, redis_getter=lambda: None)
+        question = {"id": "1", "content": "What is H2O?"}
+        config = {"provider": "deepseek", "api_key": "k", "name_label": "DS"}
+        threads = []
+        get, put = cache.get, cache.set
+
+        def tracked_get(*args):
+            threads.append(threading.current_thread())
+            return get(*args)
+
+        def tracked_set(*args):
+            threads.append(threading.current_thread())
+            put(*args)
+
+        async def analyze_twice():
+            first = await perform_single_model_analysis_async(question, config)
+            second = await perform_single_model_analysis_async(question, config)
+            return first, second, threading.current_thread()
+
+        with patch("backend.tasks.analysis.analysis_cache", cache), \
+             patch.object(cache, "get", tracked_get), patch.object(cache, "set", tracked_set), \
+             patch("backend.tasks.analysis.LLMService.analyze_question_async", new_callable=AsyncMock) as mock_analyze:
+            mock_analyze.return_value = {"final_level": "L2", "markdown_report": "ok"}
+            first, second, loop_thread = asyncio.run(analyze_twice())
+
+        self.assertEqual(mock_analyze.call_count, 1)
+        self.assertTrue(second["result"]["cache_hit"])
+        # get, set, then the hit
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(loop_thread, threads)
+
+
+if __name__ == '__main__':
+    unittest.main()
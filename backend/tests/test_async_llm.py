@@ -0,0 +1,108 @@
+import asyncio
+import json
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from backend.services.llm import LLMService
+from backend.tasks.analysis import perform_single_model_analysis_async, perform_batch_analysis_async
+from backend.tests.helpers import make_chunk
+
+
+RESPONSE = {
+    "meta": {"knowledge_topic": "Test"},
+    "comprehensive_rating": {"final_level": "L3", "average_score": 3.0},
+    "markdown_report": "**Test Report**",
+}
+
+
+class FakeAsyncStream:
+    def __init__(self, text, tracker):
+        self.pieces = [text[i:i + 16] for i in range(0, len(text), 16)]
+        self.tracker = tracker
+
+    def __aiter__(self):
+        return self._gen()
+
+    async def _gen(self):
+        self.tracker["active"] += 1
+        self.tracker["peak"] = max(self.tracker["peak"], self.tracker["active"])
+        try:
+            barrier = self.tracker.get("barrier")
+            if barrier is not None:
+                # Hold every stream open until `streams` of them are in flight at once
+                if self.tracker["active"] >= self.tracker["streams"]:
+                    barrier.set()
+                await barrier.wait()
+            for piece in self.pieces:
+                await asyncio.sleep(0.001)
+                yield make_chunk(piece)
+        finally:
+            self.tracker["active"] -= 1
+
+
+class FakeAsyncClient:
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        self.tracker["calls"] += 1
+        return FakeAsyncStream(json.dumps(RESPONSE), self.tracker)
+
+
+class TestAsyncLLM(unittest.TestCase):
+    def setUp(self):
+        self.tracker = {"calls": 0, "active": 0, "peak": 0}
+        self.patcher = patch(
+            "backend.services.llm.client_registry.get_async_client",
+            return_value=FakeAsyncClient(self.tracker)
+        )
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_analyze_question_async(self):
+        service = LLMService("deepseek", "dummy_key")
+        result = asyncio.run(service.analyze_question_async("Test Question"))
+        self.assertEqual(result["final_level"], "L3")
+        self.assertEqual(result["markdown_report"], "**Test Report**")
+
+    def test_lost_hedge_race_stops_the_async_stream(self):
+        # Same checks between two chunks as the sync consumer: should_cancel as well as is_cancelled
+        service = LLMService("deepseek", "dummy_key")
+        service.should_cancel = lambda: True
+        result = asyncio.run(service.analyze_question_async("Test Question"))
+        self.assertIn("stream cancelled", result["error"])
+
+    def test_batch_analysis_async_retries_missing_questions(self):
+        questions = [{"id": "1", "content": "Q1", "type": "selection"}, {"id": "2", "content": "Q2", "type": "selection"}]
+        config = {"provider": "deepseek", "api_key": "k", "bypass_cache": True, "batch_size": 2}
+        # The batched reply is not a results list: both questions are analysed on their own
+        results = asyncio.run(perform_batch_analysis_async(questions, config))
+        self.assertEqual(self.tracker["calls"], 3)
+        self.assertEqual({qid: r["result"]["final_level"] for qid, r in results.items()}, {"1": "L3", "2": "L3"})
+
+    def test_many_streams_share_one_loop(self):
+        config = {"provider": "deepseek", "api_key": "k", "bypass_cache": True}
+        # Far more than the 10 executor threads used previously
+        self.tracker["streams"] = 20
+
+        async def run_all():
+            self.tracker["barrier"] = asyncio.Event()
+            # Only released once 20 streams are open together; times out if they are serialized
+            return await asyncio.wait_for(asyncio.gather(*[
+                perform_single_model_analysis_async({"id": str(i), "content": f"Q{i}"}, config)
+                for i in range(50)
+            ]), timeout=10)
+
+        # The adaptive limiter window (not under test here) starts below 20 streams
+        with patch("backend.services.rate_limiter.settings.LLM_LIMITER_ENABLED", False):
+            results = asyncio.run(run_all())
+        self.assertEqual(self.tracker["calls"], 50)
+        self.assertTrue(all(r["result"]["final_level"] == "L3" for r in results))
+        self.assertGreaterEqual(self.tracker["peak"], 20)
+
+if __name__ == '__main__':
+    unittest.main()
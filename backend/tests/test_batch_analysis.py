@@ -0,0 +1,100 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+from backend.services.llm import LLMService
+from backend.services.stream_parser import StreamingJSONParser
+from backend.services.io_steps import run_steps
+from backend.tasks.analysis import perform_batch_analysis, resolve_batch_size, analyze_batch_task, _collect_batch_results, _perform
+
+
+def make_item(qid, level="L3", score=3.0):
+    return {
+        "question_id": qid,
+        "meta": {"knowledge_topic": "Test"},
+        "comprehensive_rating": {"final_level": level, "average_score": score},
+        "markdown_report": f"**Report {qid}**",
+    }
+
+
+QUESTIONS = [{"id": str(i), "content": f"选择题 {i}", "type": "selection"} for i in range(3)]
+SINGLE = json.dumps(make_item("x"))
+
+
+class TestBatchParsing(unittest.TestCase):
+    def setUp(self):
+        self.service = LLMService("deepseek", "dummy_key")
+
+    def test_results_split_per_question(self):
+        text = json.dumps({"results": [make_item("0"), make_item("1", "L2", 2.0), make_item("2")]})
+        results = self.service._parse_batch_response(text, QUESTIONS)
+        self.assertEqual(set(results), {"0", "1", "2"})
+        self.assertEqual(results["1"]["final_level"], "L2")
+        self.assertEqual(results["0"]["markdown_report"], "**Report 0**")
+
+    def test_grading_is_validated_per_item(self):
+        text = json.dumps({"results": [make_item("0", "L5", 2.0)]})
+        results = self.service._parse_batch_response(text, QUESTIONS)
+        self.assertEqual(results["0"]["final_level"], "L2")
+
+    def test_unknown_and_incomplete_items_dropped(self):
+        incomplete = {"question_id": "1", "meta": {}}
+        text = json.dumps([make_item("0"), incomplete, make_item("99")])
+        results = self.service._parse_batch_response(text, QUESTIONS)
+        self.assertEqual(set(results), {"0"})
+
+
+class TestBatchAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.config = {"provider": "deepseek", "api_key": "k", "bypass_cache": True, "batch_size": 3}
+
+    def test_missing_questions_retried_individually(self):
+        batch_reply = json.dumps({"results": [make_item("0"), make_item("2")]})
+        calls = []
+
+        def fake_stream(self_, create_kwargs, **kwargs):
+            calls.append(create_kwargs)
+            text = batch_reply if len(calls) == 1 else SINGLE
+            parser = StreamingJSONParser()
+            parser.feed(text)
+            return parser, None
+
+        with patch.object(LLMService, "_stream_completion", fake_stream):
+            results = perform_batch_analysis(QUESTIONS, self.config)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(set(results), {"0", "1", "2"})
+        self.assertTrue(results["0"]["result"]["batched"])
+        self.assertNotIn("batched", results["1"]["result"])
+        self.assertEqual(results["1"]["model_label"], "deepseek")
+
+    def test_error_items_are_not_cached(self):
+        results = {}
+        pending = [(QUESTIONS[0], "key-0"), (QUESTIONS[1], "key-1")]
+        batch = {"0": {"final_level": "L3"}, "1": {"error": "quota exceeded"}}
+        with patch("backend.tasks.analysis.analysis_cache") as cache:
+            run_steps(_collect_batch_results(batch, pending, self.config, results, 0), _perform)
+        # Stored as the provider returned it, without the per-request fields
+        cache.set.assert_called_once_with("key-0", {"final_level": "L3"})
+        self.assertEqual(set(results), {"0", "1"})
+
+    def test_batch_task_failure_ends_every_question(self):
+        backend = MagicMock()
+        task_ids = {"0": "t0", "1": "t1"}
+        task = SimpleNamespace(backend=backend)
+        with patch("backend.tasks.analysis.perform_batch_analysis", side_effect=RuntimeError("boom")):
+            self.assertEqual(analyze_batch_task.run.__func__(task, QUESTIONS[:2], self.config, task_ids), {})
+        failed = {call.args[0]: str(call.args[1]) for call in backend.mark_as_failure.call_args_list}
+        self.assertEqual(failed, {"t0": "boom", "t1": "boom"})
+        backend.mark_as_revoked.assert_not_called()
+
+    def test_batch_size_resolution(self):
+        self.assertEqual(resolve_batch_size({"provider": "deepseek", "batch_size": 4}), 4)
+        with patch("backend.tasks.analysis.settings.LLM_BATCH_SIZES", "qwen:2, deepseek:5"):
+            self.assertEqual(resolve_batch_size({"provider": "deepseek"}), 5)
+            self.assertEqual(resolve_batch_size({"provider": "kimi"}), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
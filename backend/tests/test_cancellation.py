@@ -0,0 +1,120 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+
+from fastapi.testclient import TestClient
+
+from backend.main import app
+from backend.services import events, sqlite_file
+from backend.services.cancellation import CancellationRegistry, TaskCancelled, STOPPED_ERROR
+from backend.services.llm import LLMService
+from backend.services.task_store import task_store
+from backend.tests.helpers import FakeStream
+
+
+class TestCancellationRegistry(unittest.TestCase):
+    def test_batch_is_cancelled_only_when_all_its_tasks_are(self):
+        registry = CancellationRegistry(redis_getter=lambda: None)
+        registry.cancel(["a", "b"])
+        self.assertTrue(registry.is_cancelled(["a"]))
+        self.assertTrue(registry.is_cancelled(["a", "b"]))
+        self.assertFalse(registry.is_cancelled(["a", "c"]))
+        self.assertFalse(registry.is_cancelled([None]))
+
+    def test_flags_are_shared_through_redis(self):
+        client = MagicMock()
+        client.exists.return_value = 1
+        registry = CancellationRegistry(redis_getter=lambda: client)
+        self.assertTrue(registry.is_cancelled(["set-by-another-process"]))
+        client.exists.assert_called_once_with("cancel:set-by-another-process")
+
+    def test_checker_throttles_lookups(self):
+        registry = CancellationRegistry(redis_getter=lambda: None)
+        with patch.object(registry, "is_cancelled", wraps=registry.is_cancelled) as lookup:
+            check = registry.checker(["t"], interval=60)
+            self.assertFalse(check())
+            registry.cancel(["t"])
+            self.assertFalse(check())
+            self.assertEqual(lookup.call_count, 1)
+            self.assertTrue(registry.checker(["t"], interval=60)())
+
+
+class TestCooperativeCancellation(unittest.TestCase):
+    def test_stream_is_closed_and_slot_returned(self):
+        text = json.dumps({"comprehensive_rating": {"final_level": "L2"}, "markdown_report": "x" * 200})
+        stream = FakeStream([text[i:i + 10] for i in range(0, len(text), 10)])
+        service = LLMService("deepseek", "dummy_key")
+        service.client = MagicMock()
+        service.client.chat.completions.create.return_value = stream
+        service.is_cancelled = lambda: stream.sent >= 3
+
+        with patch("backend.services.llm.rate_limiter") as limiter, \
+             patch("backend.services.llm.settings.LLM_LIMITER_ENABLED", True):
+            with self.assertRaises(TaskCancelled):
+                service.analyze_question("Q")
+
+        self.assertTrue(stream.closed)
+        self.assertEqual(stream.sent, 3)
+        # Not retried and not counted as an overload
+        self.assertEqual(service.client.chat.completions.create.call_count, 1)
+        limiter.release.assert_called_once_with(limiter.acquire.return_value, cancelled=True)
+
+    def test_queued_task_stops_without_calling_the_model(self):
+        from backend.tasks.analysis import perform_single_model_analysis_async
+
+        client = MagicMock()
+        with patch("backend.services.llm.client_registry.get_async_client", return_value=client), \
+             patch("backend.tasks.analysis.cancellation", CancellationRegistry(redis_getter=lambda: None)) as registry:
+            registry.cancel(["t1"])
+            with self.assertRaises(TaskCancelled):
+                asyncio.run(perform_single_model_analysis_async(
+                    {"id": "q1", "content": "Q"}, {"provider": "deepseek", "api_key": "k", "bypass_cache": True}, "t1"
+                ))
+        client.chat.completions.create.assert_not_called()
+
+
+class TestStopEndpoint(unittest.TestCase):
+    def test_only_the_callers_tasks_are_stopped(self):
+        for tid in ("mine-1", "mine-2", "theirs"):
+            task_store.create(tid)
+        control = MagicMock()
+        with patch("backend.api.endpoints.analysis.celery_app.control", control), \
+             patch("backend.api.endpoints.analysis.cancellation", CancellationRegistry(redis_getter=lambda: None)):
+            response = TestClient(app).post("/api/tasks/stop", json=["mine-1", "mine-2", "celery-1"])
+
+        self.assertEqual(response.json()["stopped"], 3)
+        self.assertEqual(task_store.get("mine-1"), {"status": "REVOKED", "error": STOPPED_ERROR})
+        self.assertEqual(task_store.get("theirs"), {"status": "PENDING"})
+        control.revoke.assert_called_once_with(["celery-1"])
+        control.purge.assert_not_called()
+
+    def test_task_stopped_before_it_started_finishes_the_job(self):
+        with patch("backend.services.redis_client.settings.REDIS_URL", ""), \
+             patch.dict("os.environ", {"RUNNING_DESKTOP": "false"}), \
+             patch("backend.api.endpoints.analysis.send_task_spec"), \
+             patch("backend.api.endpoints.analysis.celery_app.control"), \
+             patch("backend.api.endpoints.analysis.cancellation", CancellationRegistry(redis_getter=lambda: None)):
+            client = TestClient(app)
+            submitted = client.post("/api/analyze", json={
+                "questions": [{"id": "q1", "content": "Q"}],
+                "configs": [{"provider": "deepseek", "api_key": "k", "name_label": "A"}],
+            }).json()
+            job_id, task_id = submitted["job_id"], submitted["tasks"][0]["model_tasks"]["A"]
+            # Queued with the broker, never taken by a worker
+            client.post("/api/tasks/stop", json=[task_id])
+            sqlite_file.write_executor.submit(lambda: None).result()
+
+            job = client.get(f"/api/jobs/{job_id}").json()
+            with client.stream("GET", f"/api/analyze/{job_id}/events") as response:
+                body = "".join(response.iter_text())
+            checkpoint = events.checkpoint_store.load(job_id)
+
+        self.assertTrue(job["done"])
+        self.assertEqual((job["failed"], job["results"][0]["status"]), (1, "REVOKED"))
+        self.assertIn("event: complete", body)
+        self.assertEqual(checkpoint["results"][("q1", "A")]["status"], "REVOKED")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch, AsyncMock
+
+from fastapi.testclient import TestClient
+
+from backend.main import app
+from backend.services import events, sqlite_file
+from backend.services.checkpoints import CheckpointStore
+from backend.services.events import TaskEventEmitter
+from backend.services.task_store import TaskStore, INTERRUPTED_ERROR
+
+QUESTIONS = [{"id": 1, "content": "第一题", "type": "sub_question"}, {"id": 2, "content": "第二题", "type": "sub_question"}]
+CONFIGS = [
+    {"provider": "deepseek", "api_key": "sk-secret", "name_label": "A", "job_id": "job-1", "hedge_with": "B",
+     "hedge_config": {"provider": "qwen", "api_key": "sk-backup", "name_label": "B"}},
+    {"provider": "qwen", "api_key": "sk-backup", "name_label": "B", "job_id": "job-1"},
+]
+TASKS = [{"question_id": 1, "model_tasks": {"A": "t1a", "B": "t1b"}}, {"question_id": 2, "model_tasks": {"A": "t2a", "B": "t2b"}}]
+
+
+def ok(level):
+    return {"model_label": "A", "result": {"final_level": level}}
+
+
+class TestCheckpointStore(unittest.TestCase):
+    def test_spec_is_stored_without_api_keys(self):
+        store = CheckpointStore(redis_getter=lambda: None)
+        store.save_spec("job-1", QUESTIONS, CONFIGS, TASKS)
+        spec = store.load("job-1")["spec"]
+        self.assertNotIn("sk-", str(spec))
+        self.assertEqual(spec["configs"][0]["hedge_config"]["name_label"], "B")
+        self.assertIsNone(store.load("unknown"))
+
+    def test_success_is_never_overwritten_by_a_failure(self):
+        store = CheckpointStore(redis_getter=lambda: None)
+        store.save_spec("job-1", QUESTIONS, CONFIGS, TASKS)
+        store.record("job-1", 1, "A", "t1a", "SUCCESS", ok("L2"))
+        store.record("job-1", 1, "A", "t1a-redelivered", "FAILURE", error="worker lost")
+        store.record("job-1", 2, "A", "t2a", "SUCCESS", {"result": {"error": "401 invalid key"}})
+        store.record("job-1", 2, "A", "t2a-retry", "SUCCESS", ok("L3"))
+        store.record("job-1", 1, "B", "t1b", "REVOKED", error="stopped")
+        results = store.load("job-1")["results"]
+
+        self.assertEqual(results[("1", "A")]["result"], ok("L2"))
+        # An error analysis is a failure and is replaced by the later success
+        self.assertEqual(results[("2", "A")]["task_id"], "t2a-retry")
+        self.assertEqual(results[("1", "B")]["status"], "REVOKED")
+
+    def test_sqlite_checkpoint_survives_a_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "checkpoints.sqlite3")
+            before = CheckpointStore(sqlite_path=path, redis_getter=lambda: None)
+            before.save_spec("job-1", QUESTIONS, CONFIGS, TASKS)
+            before.record("job-1", 1, "A", "t1a", "SUCCESS", ok("L1"))
+            before.record("job-1", 1, "A", "t1a", "FAILURE", error="late")
+
+            after = CheckpointStore(sqlite_path=path, redis_getter=lambda: None)
+            checkpoint = after.load("job-1")
+        self.assertEqual(checkpoint["spec"]["questions"], QUESTIONS)
+        self.assertEqual(checkpoint["results"], {("1", "A"): {
+            "status": "SUCCESS", "task_id": "t1a", "finished_at": checkpoint["results"][("1", "A")]["finished_at"],
+            "result": ok("L1"),
+        }})
+
+    def test_emitter_checkpoints_under_the_original_submission(self):
+        store = CheckpointStore(redis_getter=lambda: None)
+        store.save_spec("job-1", QUESTIONS, CONFIGS, TASKS)
+        with patch("backend.services.events.checkpoint_store", store):
+            TaskEventEmitter("resume-run", "t9", 2, "B", checkpoint_id="job-1").state("SUCCESS", result=ok("L4"))
+            TaskEventEmitter("resume-run", "t8", 2, "A", checkpoint_id="job-1").progress(10)
+        self.assertEqual(list(store.load("job-1")["results"]), [("2", "B")])
+
+    def test_emitter_records_off_the_event_loop(self):
+        store = CheckpointStore(redis_getter=lambda: None)
+        store.save_spec("job-1", QUESTIONS, CONFIGS, TASKS)
+        threads = []
+        record = store.record
+
+        def tracked_record(*args, **kwargs):
+            threads.append(threading.current_thread())
+            record(*args, **kwargs)
+
+        async def finish():
+            TaskEventEmitter("job-1", "t1a", 1, "A").state("SUCCESS", result=ok("L2"))
+            # Wait for the recording thread to catch up
+            await asyncio.get_running_loop().run_in_executor(sqlite_file.write_executor, lambda: None)
+            return threading.current_thread()
+
+        with patch("backend.services.events.checkpoint_store", store), patch.object(store, "record", tracked_record):
+            loop_thread = asyncio.run(finish())
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], loop_thread)
+        self.assertEqual(store.load("job-1")["results"][("1", "A")]["result"], ok("L2"))
+
+
+class TestResumeEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.store = CheckpointStore(redis_getter=lambda: None)
+        self.store.save_spec("job-1", QUESTIONS, CONFIGS, TASKS)
+        self.store.record("job-1", 1, "A", "t1a", "SUCCESS", ok("L2"))
+        self.store.record("job-1", 2, "B", "t2b", "FAILURE", error="interrupted")
+        self.dispatched = []
+        patches = [
+            patch("backend.api.endpoints.analysis.checkpoint_store", self.store),
+            patch("backend.api.endpoints.analysis._dispatch_job",
+                  side_effect=lambda job_id, tasks, batches, singles, questions: self.dispatched.extend(singles) or {}),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.client = TestClient(app)
+
+    def test_only_missing_and_failed_pairs_are_dispatched(self):
+        response = self.client.post("/api/analyze/job-1/resume", json={"api_keys": {"A": "sk-a", "B": "sk-b"}})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+
+        pairs = sorted((q["id"], c["name_label"]) for q, c, _ in self.dispatched)
+        self.assertEqual(pairs, [(1, "B"), (2, "A"), (2, "B")])
+        config = next(c for q, c, _ in self.dispatched if c["name_label"] == "A")
+        self.assertEqual((config["api_key"], config["checkpoint_id"], config["job_id"]), ("sk-a", "job-1", body["job_id"]))
+        self.assertEqual(config["hedge_config"]["api_key"], "sk-b")
+        self.assertEqual(body["results"], [{"question_id": "1", "model_label": "A", "task_id": "t1a", "result": ok("L2")}])
+        # The checkpoint now points at the re-dispatched tasks, still without keys
+        spec = self.store.load("job-1")["spec"]
+        self.assertEqual(spec["tasks"][1]["model_tasks"], body["tasks"][1]["model_tasks"])
+        self.assertNotIn("sk-", str(spec))
+
+    def test_api_keys_must_be_supplied_again(self):
+        response = self.client.post("/api/analyze/job-1/resume", json={"api_keys": {"A": "sk-a"}})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("B", response.json()["detail"])
+        self.assertEqual(self.client.post("/api/analyze/nope/resume", json={"api_keys": {}}).status_code, 404)
+        self.assertEqual(self.dispatched, [])
+
+
+class TestResumeAfterRestart(unittest.TestCase):
+    def test_interrupted_tasks_continue_with_resupplied_keys(self):
+        checkpoints = CheckpointStore(redis_getter=lambda: None)
+        checkpoints.save_spec("job-1", QUESTIONS, CONFIGS, TASKS)
+        checkpoints.record("job-1", 1, "A", "t1a", "SUCCESS", ok("L2"))
+        dispatched = []
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tasks.sqlite3")
+            # Default settings: task specs are persisted without API keys
+            before = TaskStore(sqlite_path=path)
+            self.assertFalse(before.persist_api_keys)
+            for q, (label, tid) in [(QUESTIONS[0], ("B", "t1b")), (QUESTIONS[1], ("A", "t2a")), (QUESTIONS[1], ("B", "t2b"))]:
+                before.create(tid, "analysis_single", [q, next(c for c in CONFIGS if c["name_label"] == label)])
+
+            after = TaskStore(sqlite_path=path)
+            runner = AsyncMock()
+            after.register_runner("analysis_single", runner)
+
+            async def restart():
+                return after.restore()
+
+            requeued = asyncio.run(restart())
+            sqlite_file.write_executor.submit(lambda: None).result()
+            with patch("backend.api.endpoints.analysis.task_store", after), \
+                 patch("backend.api.endpoints.analysis.checkpoint_store", checkpoints), \
+                 patch("backend.api.endpoints.analysis._dispatch_job",
+                       side_effect=lambda job_id, tasks, batches, singles, questions: dispatched.extend(singles) or {}):
+                response = TestClient(app).post("/api/analyze/job-1/resume", json={"api_keys": {"A": "sk-a", "B": "sk-b"}})
+
+        self.assertEqual(requeued, 0)
+        runner.assert_not_called()
+        self.assertEqual(after.get("t2a"), {"status": "FAILURE", "error": INTERRUPTED_ERROR})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted((q["id"], c["name_label"], c["api_key"]) for q, c, _ in dispatched),
+                         [(1, "B", "sk-b"), (2, "A", "sk-a"), (2, "B", "sk-b")])
+
+
+if __name__ == '__main__':
+    unittest.main()
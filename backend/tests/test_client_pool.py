@@ -0,0 +1,68 @@
+import unittest
+
+import httpx
+
+from backend.services.client_pool import LLMClientRegistry, resolve_base_url
+from backend.services.llm import LLMService
+
+
+class TestClientPool(unittest.TestCase):
+    def setUp(self):
+        self.registry = LLMClientRegistry(max_clients=2)
+
+    def tearDown(self):
+        self.registry.reset()
+
+    def test_resolve_base_url(self):
+        self.assertEqual(resolve_base_url("qwen"), "https://dashscope.aliyuncs.com/compatible-mode/v1")
+        self.assertEqual(resolve_base_url("unknown"), "https://api.deepseek.com/v1")
+        self.assertEqual(
+            resolve_base_url("deepseek", "https://example.com/v1/chat/completions"),
+            "https://example.com/v1"
+        )
+
+    def test_same_key_reuses_client(self):
+        c1 = self.registry.get_client("deepseek", "key1")
+        c2 = self.registry.get_client("deepseek", "key1")
+        self.assertIs(c1, c2)
+        self.assertEqual(self.registry.stats()["hits"], 1)
+        self.assertEqual(self.registry.stats()["misses"], 1)
+
+    def test_different_keys_share_http_pool(self):
+        c1 = self.registry.get_client("deepseek", "key1")
+        c2 = self.registry.get_client("deepseek", "key2")
+        self.assertIsNot(c1, c2)
+        self.assertIs(c1._client, c2._client)
+        self.assertEqual(self.registry.stats()["pools"], 1)
+
+    def test_lru_eviction(self):
+        c1 = self.registry.get_client("deepseek", "key1")
+        self.registry.get_client("qwen", "key2")
+        self.registry.get_client("kimi", "key3")
+        stats = self.registry.stats()
+        self.assertEqual(stats["clients"], 2)
+        self.assertEqual(stats["pools"], 3)
+        c1_again = self.registry.get_client("deepseek", "key1")
+        self.assertIsNot(c1_again, c1)
+        # A new client for the same base_url reuses the pool that was kept open
+        self.assertIs(c1_again._client, c1._client)
+
+    def test_evicted_client_in_use_keeps_working(self):
+        # A client another thread is still streaming with must not lose its connection pool
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"object": "list", "data": []}))
+        self.registry._build_http_pool = lambda: httpx.Client(transport=transport)
+        in_use = self.registry.get_client("deepseek", "key1")
+        self.registry.get_client("qwen", "key2")
+        self.registry.get_client("kimi", "key3")
+        self.registry.get_client("zhipu", "key4")
+        self.assertEqual(self.registry.stats()["clients"], 2)
+        self.assertEqual(list(in_use.models.list()), [])
+
+    def test_llm_service_uses_registry(self):
+        s1 = LLMService("deepseek", "shared_key")
+        s2 = LLMService("deepseek", "shared_key")
+        self.assertIs(s1.client, s2.client)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+
+from backend.api.endpoints import analysis
+from backend.services.fair_scheduler import FairScheduler, DispatchError, job_of
+
+
+class TestCeleryFairScheduler(unittest.TestCase):
+    def test_without_redis_everything_is_sent_at_once(self):
+        scheduler = FairScheduler(max_in_flight=1, job_max_in_flight=1, redis_getter=lambda: None)
+        sent = []
+        scheduler.submit("job", [{"task": "t", "args": [], "task_id": str(i)} for i in range(3)], sent.append)
+        self.assertEqual([s["task_id"] for s in sent], ["0", "1", "2"])
+
+    def test_redis_script_decides_what_is_sent(self):
+        client = MagicMock()
+        script = MagicMock(return_value=[b'{"task": "t", "args": [1], "task_id": "a"}'])
+        client.register_script.return_value = script
+        scheduler = FairScheduler(max_in_flight=4, job_max_in_flight=2, redis_getter=lambda: client)
+        sent = []
+        scheduler.submit("job", [{"task": "t", "args": [1], "task_id": "a"}, {"task": "t", "args": [2], "task_id": "b"}], sent.append)
+        self.assertEqual(sent, [{"task": "t", "args": [1], "task_id": "a"}])
+        args = script.call_args.kwargs["args"]
+        self.assertEqual(args[1:3], [2, 4])
+        self.assertEqual(args[4], "job")
+
+        script.return_value = []
+        scheduler.release("job", sent.append)
+        self.assertEqual(len(sent), 1)
+
+    def test_redis_error_falls_back_to_sending_everything(self):
+        client = MagicMock()
+        client.register_script.return_value = MagicMock(side_effect=ConnectionError("down"))
+        scheduler = FairScheduler(redis_getter=lambda: client)
+        sent = []
+        with patch("backend.services.fair_scheduler.mark_redis_failed") as failed:
+            scheduler.submit("job", [{"task": "t", "args": [], "task_id": "a"}], sent.append)
+        failed.assert_called_once()
+        self.assertEqual(len(sent), 1)
+
+    def test_unsent_specs_are_put_back_with_their_slots(self):
+        specs = [{"task": "t", "args": [{"id": n}, {"job_id": job}], "task_id": n} for n, job in (("a", "job"), ("b", "other"), ("c", "job"))]
+        client = MagicMock()
+        client.register_script.return_value = MagicMock(return_value=[json.dumps(spec).encode() for spec in specs])
+        scheduler = FairScheduler(redis_getter=lambda: client)
+        sent = []
+
+        def send(spec):
+            if spec["task_id"] == "b":
+                raise ConnectionError("broker down")
+            sent.append(spec["task_id"])
+
+        with self.assertRaises(DispatchError) as raised:
+            scheduler.submit("job", specs[:1], send)
+        self.assertEqual(raised.exception.sent_task_ids, ["a"])
+        # Last unsent spec first, so LPUSH restores the original order
+        args = client.eval.call_args.args
+        self.assertEqual(args[1:4], (2, "fair:ring", "fair:in_flight"))
+        self.assertEqual([json.loads(a)["task_id"] if i % 2 else a for i, a in enumerate(args[6:])], ["job", "c", "other", "b"])
+        self.assertEqual(scheduler.stats()["restored"], 2)
+
+        # From task_postrun: the failure is logged, the specs wait for the next release
+        client.eval.reset_mock()
+        scheduler.release("job", send)
+        self.assertEqual(client.eval.call_count, 1)
+
+    def test_send_failure_without_redis_reports_what_was_sent(self):
+        scheduler = FairScheduler(redis_getter=lambda: None)
+        sent = []
+        specs = [{"task": "t", "args": [], "task_id": str(i)} for i in range(3)]
+        with self.assertRaises(DispatchError) as raised:
+            scheduler.submit("job", specs, lambda spec: sent.append(spec) if spec["task_id"] != "1" else 1 / 0)
+        self.assertEqual(raised.exception.sent_task_ids, ["0"])
+
+    def test_discard_drops_held_specs_of_stopped_tasks_only(self):
+        held = [
+            b'{"task": "t", "args": [], "task_id": "mine"}',
+            b'{"task": "t", "args": [], "task_id": "other"}',
+            b'{"task": "b", "args": [], "task_id": "batch", "task_ids": ["mine-2", "mine-3"]}',
+        ]
+        client = MagicMock()
+        client.lrange.side_effect = lambda key, start, end: [b"job"] if key == "fair:ring" else held
+        client.lrem.return_value = 1
+        scheduler = FairScheduler(redis_getter=lambda: client)
+        self.assertEqual(scheduler.discard(task_ids=["mine", "mine-2", "mine-3"]), 2)
+        removed = [call.args[2] for call in client.lrem.call_args_list]
+        self.assertEqual(removed, [held[0], held[2]])
+
+    def test_job_of_reads_the_config_argument(self):
+        self.assertEqual(job_of([{"id": "q1"}, {"job_id": "j1"}]), "j1")
+        self.assertEqual(job_of([[{"id": "q1"}], {"job_id": "j2"}, {"q1": "t"}]), "j2")
+        self.assertIsNone(job_of([{"id": "q1"}, {"provider": "deepseek"}]))
+        self.assertIsNone(job_of(None))
+
+
+class TestCeleryDispatchFallback(unittest.TestCase):
+    def test_only_unsent_tasks_run_in_process(self):
+        singles = [({"id": n}, {"job_id": "job"}, f"task-{n}") for n in (1, 2, 3)]
+        with patch.object(analysis.fair_scheduler, "submit", side_effect=DispatchError("down", ["task-1"])), \
+             patch.object(analysis.fair_scheduler, "discard") as discard:
+            batches, local = analysis._dispatch_celery("job", [], singles)
+        discard.assert_called_once_with("job")
+        self.assertEqual((batches, [t for _, _, t in local]), ([], ["task-2", "task-3"]))
+
+        with patch.object(analysis.fair_scheduler, "submit"):
+            self.assertEqual(analysis._dispatch_celery("job", [], singles), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
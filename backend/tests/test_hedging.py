@@ -0,0 +1,139 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from backend.config import settings
+from backend.services import hedging
+from backend.services.hedging import LatencyTracker, HedgeStats, run_hedged, run_hedged_async, hedge_stats, latency_tracker
+from backend.services.llm import LLMService
+from backend.tasks.analysis import perform_single_model_analysis
+from backend.tests.helpers import make_chunk
+
+
+def reply(level):
+    return json.dumps({"comprehensive_rating": {"final_level": level, "average_score": float(level[1])}, "markdown_report": level})
+
+
+class TestLatencyTracker(unittest.TestCase):
+    def test_delay_only_after_enough_samples(self):
+        tracker = LatencyTracker(window=100)
+        with patch("backend.services.hedging.settings.LLM_HEDGE_MIN_SAMPLES", 10), \
+             patch("backend.services.hedging.settings.LLM_HEDGE_PERCENTILE", 90), \
+             patch("backend.services.hedging.settings.LLM_HEDGE_MIN_DELAY", 1):
+            for i in range(9):
+                tracker.record("doubao:x", 10 + i)
+            self.assertIsNone(tracker.hedge_delay("doubao:x"))
+            tracker.record("doubao:x", 100)
+            self.assertEqual(tracker.hedge_delay("doubao:x"), 18)
+
+    def test_stats_rates(self):
+        stats = HedgeStats()
+        stats.count(False, "primary")
+        stats.count(True, "backup")
+        self.assertEqual(stats.stats()["hedge_rate"], 0.5)
+        self.assertEqual(stats.stats()["backup_win_rate"], 1.0)
+
+
+class TestRunHedged(unittest.TestCase):
+    def test_fast_primary_is_not_hedged(self):
+        backup = MagicMock()
+        result, winner = run_hedged(lambda c: {"ok": 1}, backup, delay=1)
+        self.assertEqual(winner, "primary")
+        backup.assert_not_called()
+
+    def test_slow_primary_is_cancelled(self):
+        cancelled = []
+
+        def primary(should_cancel):
+            for _ in range(100):
+                if should_cancel():
+                    cancelled.append(True)
+                    return {"error": "cancelled"}
+                time.sleep(0.01)
+            return {"ok": "primary"}
+
+        result, winner = run_hedged(primary, lambda c: {"ok": "backup"}, delay=0.05)
+        self.assertEqual((result, winner), ({"ok": "backup"}, "backup"))
+        time.sleep(0.05)
+        self.assertEqual(cancelled, [True])
+
+    def test_failed_backup_waits_for_primary(self):
+        def primary(should_cancel):
+            time.sleep(0.1)
+            return {"ok": "primary"}
+
+        result, winner = run_hedged(primary, lambda c: {"error": "x"}, delay=0.01)
+        self.assertEqual(winner, "primary")
+
+    def test_calls_share_one_bounded_executor(self):
+        threads = set()
+
+        def primary(should_cancel):
+            threads.add(threading.current_thread().name)
+            return {"ok": 1}
+
+        with patch("backend.services.hedging.ThreadPoolExecutor", side_effect=AssertionError("new executor")):
+            for _ in range(5):
+                run_hedged(primary, lambda c: {"ok": 2}, delay=1)
+        self.assertTrue(all(name.startswith("llm-hedge") for name in threads))
+        self.assertEqual(hedging._executor._max_workers, settings.LLM_HEDGE_MAX_WORKERS)
+
+    def test_async_loser_is_cancelled(self):
+        state = {}
+
+        async def primary():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+
+        async def backup():
+            return {"ok": "backup"}
+
+        async def run():
+            outcome = await run_hedged_async(primary, backup, delay=0.01)
+            await asyncio.sleep(0)
+            return outcome
+
+        self.assertEqual(asyncio.run(run())[1], "backup")
+        self.assertTrue(state["cancelled"])
+
+
+class TestHedgedAnalysis(unittest.TestCase):
+    def test_backup_result_is_used_and_not_cached(self):
+        def slow_stream():
+            text = reply("L2")
+            for i in range(0, len(text), 5):
+                time.sleep(0.02)
+                yield make_chunk(text[i:i + 5])
+
+        def client_for(provider, **kwargs):
+            client = MagicMock()
+            if provider == "doubao":
+                client.chat.completions.create.side_effect = lambda **kw: slow_stream()
+            else:
+                client.chat.completions.create.side_effect = lambda **kw: iter([make_chunk(reply("L3"))])
+            return client
+
+        config = {
+            "provider": "doubao", "api_key": "k", "bypass_cache": True,
+            "hedge_config": {"provider": "deepseek", "api_key": "k2"},
+        }
+        with patch("backend.services.llm.client_registry.get_client", side_effect=lambda provider, **kw: client_for(provider)), \
+             patch("backend.tasks.analysis.settings.LLM_HEDGE_ENABLED", True), \
+             patch.object(latency_tracker, "hedge_delay", return_value=0.05), \
+             patch("backend.tasks.analysis.analysis_cache") as cache:
+            result = perform_single_model_analysis({"id": "1", "content": "Q"}, config)
+
+        self.assertEqual(result["model_label"], "doubao")
+        self.assertEqual(result["result"]["final_level"], "L3")
+        self.assertEqual(result["result"]["hedged_by"]["provider"], "deepseek")
+        cache.set.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import asyncio
+import unittest
+
+from backend.services.io_steps import run_steps, run_steps_async
+
+
+def steps():
+    first = yield 1
+    try:
+        second = yield first + 1
+    except ValueError as e:
+        return f"recovered from {e}"
+    return first + second
+
+
+def double(request):
+    if request == 4:
+        raise ValueError("boom")
+    return request * 2
+
+
+async def double_async(request):
+    await asyncio.sleep(0)
+    return double(request)
+
+
+class TestIOSteps(unittest.TestCase):
+    def test_sync_and_async_drivers_give_the_same_result(self):
+        # 1 -> 2, then 3 -> 6: 2 + 6
+        self.assertEqual(run_steps(steps(), double), 8)
+        self.assertEqual(asyncio.run(run_steps_async(steps(), double_async)), 8)
+
+    def test_request_errors_are_thrown_into_the_steps(self):
+        calls = []
+
+        def failing(request):
+            calls.append(request)
+            if request == 2:
+                raise ValueError("boom")
+            return request
+
+        self.assertEqual(run_steps(steps(), failing), "recovered from boom")
+        self.assertEqual(calls, [1, 2])
+
+    def test_unhandled_errors_propagate(self):
+        def no_recovery():
+            yield 4
+
+        with self.assertRaises(ValueError):
+            run_steps(no_recovery(), double)
+        with self.assertRaises(ValueError):
+            asyncio.run(run_steps_async(no_recovery(), double_async))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+from fastapi.testclient import TestClient
+
+from backend.main import app
+from backend.services import events
+from backend.services.llm import LLMService
+from backend.tasks.analysis import perform_single_model_analysis
+from backend.tests.helpers import make_chunk
+
+
+REPLY = json.dumps({
+    "comprehensive_rating": {"final_level": "L3", "average_score": 3.0},
+    "markdown_report": "**Report**",
+})
+
+
+class TestJobEvents(unittest.TestCase):
+    def setUp(self):
+        # In-process broadcaster only (desktop mode / no Redis)
+        self.patcher = patch("backend.services.events.get_redis", return_value=None)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_task_publishes_state_partial_and_result(self):
+        received = []
+
+        async def run():
+            queue = events.broadcaster.subscribe("job-1")
+            client = MagicMock()
+            client.chat.completions.create.return_value = iter(make_chunk(REPLY[i:i + 10]) for i in range(0, len(REPLY), 10))
+            config = {"provider": "deepseek", "api_key": "k", "bypass_cache": True, "job_id": "job-1"}
+            with patch.object(LLMService, "_get_client", return_value=client):
+                await asyncio.get_running_loop().run_in_executor(None, perform_single_model_analysis, {"id": "q1", "content": "Q"}, config, "task-1")
+            await asyncio.sleep(0)
+            while not queue.empty():
+                received.append(queue.get_nowait())
+            events.broadcaster.unsubscribe("job-1", queue)
+
+        asyncio.run(run())
+        types = [e["type"] for e in received]
+        self.assertEqual(received[0]["status"], "PROCESSING")
+        partial = next(e for e in received if e["type"] == "partial" and e["field"] == "comprehensive_rating.final_level")
+        self.assertEqual(partial["value"], "L3")
+        self.assertLess(types.index("partial"), len(types) - 1)
+        self.assertEqual(received[-1]["status"], "SUCCESS")
+        self.assertEqual(received[-1]["result"]["result"]["final_level"], "L3")
+        self.assertEqual(events.job_snapshot("job-1")["task-1"]["status"], "SUCCESS")
+
+    def test_sse_endpoint_replays_snapshot_and_completes(self):
+        events.register_job("job-2", ["t1", "t2"])
+        events.TaskEventEmitter("job-2", "t1", "q1", "deepseek").state("SUCCESS", result={"model_label": "deepseek", "result": {}})
+        events.TaskEventEmitter("job-2", "t2", "q2", "deepseek").state("FAILURE", error="boom")
+
+        client = TestClient(app)
+        with client.stream("GET", "/api/analyze/job-2/events") as response:
+            self.assertEqual(response.status_code, 200)
+            body = "".join(response.iter_text())
+        self.assertIn("event: state", body)
+        self.assertIn("event: complete", body)
+
+    def test_unknown_job(self):
+        client = TestClient(app)
+        self.assertEqual(client.get("/api/analyze/nope/events").status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
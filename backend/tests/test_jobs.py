@@ -0,0 +1,73 @@
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from backend.main import app
+from backend.services.events import TaskEventEmitter
+from backend.services.jobs import JobStore
+
+
+class TestJobStore(unittest.TestCase):
+    def setUp(self):
+        self.store = JobStore(redis_getter=lambda: None)
+
+    def test_progress_and_cursor(self):
+        self.store.create("job-1", total=3, questions=1)
+        self.store.record("job-1", "t1", "SUCCESS", {"question_id": "q1", "result": {"final_level": "L2"}})
+
+        job = self.store.get("job-1")
+        self.assertEqual((job["completed"], job["failed"], job["pending"]), (1, 0, 2))
+        self.assertEqual(job["results"][0]["task_id"], "t1")
+        self.assertFalse(job["done"])
+
+        self.store.record("job-1", "t2", "FAILURE", {"question_id": "q1", "error": "boom"})
+        self.store.record("job-1", "t3", "SUCCESS", {"question_id": "q1"})
+        job = self.store.get("job-1", cursor=job["cursor"])
+        self.assertEqual([r["task_id"] for r in job["results"]], ["t2", "t3"])
+        self.assertEqual(job["cursor"], 3)
+        self.assertEqual(job["progress"], 1.0)
+        self.assertTrue(job["done"])
+
+        self.assertEqual(self.store.get("job-1", cursor=3)["results"], [])
+
+    def test_task_is_counted_once(self):
+        self.store.create("job-2", total=2)
+        self.assertTrue(self.store.record("job-2", "t1", "SUCCESS", {}))
+        self.assertFalse(self.store.record("job-2", "t1", "SUCCESS", {}))
+        self.assertEqual(self.store.get("job-2")["completed"], 1)
+
+    def test_results_recorded_before_create_are_kept(self):
+        self.store.record("job-3", "t1", "SUCCESS", {})
+        self.store.create("job-3", total=1)
+        job = self.store.get("job-3")
+        self.assertEqual(job["completed"], 1)
+        self.assertTrue(job["done"])
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.store.get("missing"))
+
+
+class TestJobEndpoint(unittest.TestCase):
+    def test_terminal_task_events_feed_the_job(self):
+        store = JobStore(redis_getter=lambda: None)
+        with patch("backend.services.events.job_store", store), \
+             patch("backend.services.events.get_redis", return_value=None), \
+             patch("backend.api.endpoints.analysis.job_store", store):
+            store.create("job-4", total=2, questions=2)
+            emitter = TaskEventEmitter("job-4", "t1", "q1", "DeepSeek")
+            emitter.state("PROCESSING")
+            emitter.state("SUCCESS", result={"model_label": "DeepSeek", "result": {"final_level": "L3"}})
+
+            client = TestClient(app)
+            job = client.get("/api/jobs/job-4").json()
+            self.assertEqual((job["completed"], job["pending"]), (1, 1))
+            self.assertEqual(job["results"][0]["question_id"], "q1")
+            self.assertEqual(job["results"][0]["result"]["result"]["final_level"], "L3")
+
+            self.assertEqual(client.get("/api/jobs/job-4", params={"cursor": job["cursor"]}).json()["results"], [])
+            self.assertEqual(client.get("/api/jobs/unknown").status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
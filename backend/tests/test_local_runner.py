@@ -0,0 +1,165 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from backend.main import app
+from backend.services.local_runner import LocalJobRunner, QueueFull
+
+
+class TestLocalJobRunner(unittest.TestCase):
+    def run_jobs(self, runner, jobs):
+        """Submit (job_id, count[, priority]) in order; tasks finish one at a time. Returns the start order."""
+        async def scenario():
+            started = []
+            gates = {}
+
+            def factory(name):
+                async def run():
+                    started.append(name)
+                    gates[name] = asyncio.Event()
+                    await gates[name].wait()
+                return run
+
+            for job_id, count, *priority in jobs:
+                items = [([f"{job_id}{i}"], factory(f"{job_id}{i}")) for i in range(1, count + 1)]
+                runner.submit(job_id, items, *priority)
+            await asyncio.sleep(0)
+            while len(gates) > sum(1 for g in gates.values() if g.is_set()):
+                running = [name for name in started if not gates[name].is_set()]
+                gates[running[0]].set()
+                for _ in range(3):
+                    await asyncio.sleep(0)
+            return started
+
+        return asyncio.run(scenario())
+
+    def test_slots_rotate_across_submissions(self):
+        runner = LocalJobRunner(workers=2, max_queue=0, job_max_in_flight=0)
+        started = self.run_jobs(runner, [("A", 5), ("B", 2)])
+        # B does not wait for the rest of A: every freed slot goes to the next submission in turn
+        self.assertEqual(started, ["A1", "A2", "B1", "A3", "B2", "A4", "A5"])
+        stats = runner.stats()
+        self.assertEqual((stats["started"], stats["finished"], stats["running"], stats["queued"]), (7, 7, 0, 0))
+
+    def test_higher_priority_overtakes_queued_bulk_work(self):
+        runner = LocalJobRunner(workers=1, max_queue=0, job_max_in_flight=0)
+        started = self.run_jobs(runner, [("bulk", 3, 2), ("score", 1, 1), ("retry", 1, 0)])
+        self.assertEqual(started, ["bulk1", "retry1", "score1", "bulk2", "bulk3"])
+
+    def test_job_cap_and_discard(self):
+        runner = LocalJobRunner(workers=10, max_queue=0, job_max_in_flight=2)
+
+        async def scenario():
+            gate = asyncio.Event()
+            started = []
+
+            def factory(name):
+                async def run():
+                    started.append(name)
+                    await gate.wait()
+                return run
+
+            runner.submit("A", [([f"A{i}"], factory(f"A{i}")) for i in range(5)])
+            runner.submit("B", [([f"B{i}"], factory(f"B{i}")) for i in range(5)])
+            await asyncio.sleep(0)
+            snapshot = sorted(started)
+            self.assertEqual(runner.stats()["queued"], 6)
+            # Stopping some tasks of A (and a running one) drops only those that are still queued
+            self.assertEqual(runner.discard(task_ids=["A0", "A2", "A3"]), 2)
+            self.assertEqual(runner.stats()["queued"], 4)
+            gate.set()
+            for _ in range(5):
+                await asyncio.sleep(0)
+            return snapshot, sorted(started)
+
+        before, after = asyncio.run(scenario())
+        self.assertEqual(before, ["A0", "A1", "B0", "B1"])
+        self.assertEqual(after, ["A0", "A1", "A4", "B0", "B1", "B2", "B3", "B4"])
+
+    def test_full_queue_rejects_the_whole_submission(self):
+        runner = LocalJobRunner(workers=1, max_queue=3, job_max_in_flight=0)
+
+        async def scenario():
+            gate = asyncio.Event()
+
+            async def run():
+                await gate.wait()
+
+            runner.submit("A", [([f"A{i}"], run) for i in range(4)])
+            with self.assertRaises(QueueFull) as ctx:
+                runner.submit("B", [([f"B{i}"], run) for i in range(2)])
+            # Restored tasks are not subject to the limit
+            runner.submit("restored", [(["R"], run)], bounded=False)
+            stats = runner.stats()
+            gate.set()
+            await asyncio.gather(*list(runner._running))
+            return ctx.exception, stats
+
+        error, stats = asyncio.run(scenario())
+        self.assertEqual(error.depth, 3)
+        self.assertGreaterEqual(error.retry_after, 1)
+        self.assertEqual((stats["queued"], stats["rejected"]), (4, 2))
+
+    def test_failing_task_still_frees_its_slot(self):
+        runner = LocalJobRunner(workers=1, max_queue=0, job_max_in_flight=0)
+        done = []
+
+        async def boom():
+            raise RuntimeError("boom")
+
+        async def ok():
+            done.append(True)
+
+        async def scenario():
+            runner.submit("A", [(["a"], boom), (["b"], ok)])
+            for _ in range(5):
+                await asyncio.sleep(0)
+
+        asyncio.run(scenario())
+        self.assertEqual(done, [True])
+        self.assertEqual(runner.stats()["failed"], 1)
+        self.assertIsNotNone(runner.estimated_wait())
+
+    def test_shutdown_drains_running_and_keeps_queued(self):
+        runner = LocalJobRunner(workers=1, max_queue=0, job_max_in_flight=0)
+        done = []
+
+        async def work(name, delay):
+            await asyncio.sleep(delay)
+            done.append(name)
+
+        async def scenario():
+            runner.submit("A", [(["quick"], lambda: work("quick", 0.01)), (["next"], lambda: work("next", 0))])
+            await asyncio.sleep(0)
+            cancelled = await runner.shutdown(timeout=1)
+            with self.assertRaises(QueueFull):
+                runner.submit("B", [(["late"], lambda: work("late", 0))])
+            slow = LocalJobRunner(workers=1, max_queue=0, job_max_in_flight=0)
+            slow.submit("C", [(["slow"], lambda: work("slow", 10))])
+            await asyncio.sleep(0)
+            return cancelled, await slow.shutdown(timeout=0.01)
+
+        self.assertEqual(asyncio.run(scenario()), (0, 1))
+        # The queued task was not started: it stays PENDING in the task store for the next start
+        self.assertEqual(done, ["quick"])
+        self.assertEqual(runner.stats()["queued"], 1)
+
+
+class TestDesktopSubmission(unittest.TestCase):
+    def test_full_queue_answers_503_with_retry_after(self):
+        runner = LocalJobRunner(workers=1, max_queue=1, job_max_in_flight=0)
+        with patch("backend.api.endpoints.analysis.local_runner", runner), \
+             patch.dict("os.environ", {"RUNNING_DESKTOP": "true"}):
+            response = TestClient(app).post("/api/analyze", json={
+                "questions": [{"id": f"q{i}", "content": "x"} for i in range(3)],
+                "configs": [{"provider": "deepseek", "api_key": "k"}],
+            })
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        self.assertEqual(runner.stats()["submitted"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import json
+import socket
+import threading
+import time
+import unittest
+
+import uvicorn
+from fastapi.testclient import TestClient
+
+from backend.services.client_pool import LLMClientRegistry
+from backend.services.llm import LLMService
+from backend.services.mock_llm import MockBehaviour, create_app, build_question_result
+
+
+def read_stream(response):
+    content = []
+    usage = None
+    for line in response.iter_lines():
+        if not line.startswith("data: ") or line == "data: [DONE]":
+            continue
+        payload = json.loads(line[len("data: "):])
+        if payload.get("usage"):
+            usage = payload["usage"]
+        for choice in payload["choices"]:
+            content.append(choice["delta"].get("content") or "")
+    return "".join(content), usage
+
+
+class TestMockServer(unittest.TestCase):
+    def setUp(self):
+        self.behaviour = MockBehaviour()
+        self.behaviour.update({"ttft": 0, "tps": 100000, "error_rate": 0, "rate_limit_rate": 0, "truncate_rate": 0})
+        self.client = TestClient(create_app(self.behaviour))
+        self.body = {
+            "model": "mock-chemistry",
+            "stream": True,
+            "stream_options": {"include_usage": True},
+            "messages": [{"role": "user", "content": "**题目内容：**\n下列说法正确的是\n\n**注意：**\n1."}],
+        }
+
+    def test_streams_rubric_shaped_json(self):
+        with self.client.stream("POST", "/v1/chat/completions", json=self.body) as response:
+            text, usage = read_stream(response)
+        data = json.loads(text)
+        self.assertEqual(data, build_question_result("下列说法正确的是"))
+        self.assertIn(data["comprehensive_rating"]["final_level"], ["L1", "L2", "L3", "L4", "L5"])
+        self.assertGreater(usage["completion_tokens"], 0)
+
+    def test_fault_injection(self):
+        self.behaviour.update({"rate_limit_rate": 1.0})
+        response = self.client.post("/v1/chat/completions", json=self.body)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["retry-after"], "1")
+
+        self.behaviour.update({"rate_limit_rate": 0, "truncate_rate": 1.0})
+        with self.client.stream("POST", "/v1/chat/completions", json=self.body) as response:
+            text, _ = read_stream(response)
+        with self.assertRaises(ValueError):
+            json.loads(text)
+
+    def test_continuation_returns_the_rest_of_the_reply(self):
+        full = json.dumps(build_question_result("下列说法正确的是"), ensure_ascii=False)
+        self.body["stream"] = False
+        self.body["messages"] += [
+            {"role": "assistant", "content": full[:100]},
+            {"role": "user", "content": "继续"},
+        ]
+        text = self.client.post("/v1/chat/completions", json=self.body).json()["choices"][0]["message"]["content"]
+        self.assertEqual(full[:100] + text, full)
+
+    def test_batch_reply_keeps_question_ids(self):
+        self.body["messages"][0]["content"] = "### question_id: 7\n题一\n\n### question_id: 8\n题二\n\n**注意：**"
+        self.body["stream"] = False
+        data = json.loads(self.client.post("/v1/chat/completions", json=self.body).json()["choices"][0]["message"]["content"])
+        self.assertEqual([r["question_id"] for r in data["results"]], ["7", "8"])
+
+
+class TestMockProvider(unittest.TestCase):
+    def test_llm_service_against_live_stub(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        behaviour = MockBehaviour()
+        behaviour.update({"ttft": 0.05, "tps": 5000, "error_rate": 0, "rate_limit_rate": 0, "truncate_rate": 0})
+        server = uvicorn.Server(uvicorn.Config(create_app(behaviour), host="127.0.0.1", port=port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        try:
+            for _ in range(100):
+                if server.started:
+                    break
+                time.sleep(0.05)
+            registry = LLMClientRegistry()
+            service = LLMService("mock", "any-key", base_url=f"http://127.0.0.1:{port}/v1")
+            service.client = registry.get_client("mock", "any-key", base_url=f"http://127.0.0.1:{port}/v1", timeout=10)
+            result = service.analyze_question("下列说法正确的是")
+            self.assertNotIn("error", result)
+            self.assertEqual(result["final_level"], build_question_result("下列说法正确的是")["comprehensive_rating"]["final_level"])
+            self.assertGreater(result["token_usage"]["completion_tokens"], 0)
+        finally:
+            server.should_exit = True
+            thread.join(timeout=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
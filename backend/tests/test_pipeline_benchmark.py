@@ -0,0 +1,28 @@
+import io
+import os
+import unittest
+
+from backend.benchmarks.pipeline_benchmark import build_paper, percentile, peak_rss_mb
+from backend.services.parser import DocumentParser
+
+
+class TestPipelineBenchmark(unittest.TestCase):
+    def test_synthetic_paper_splits_into_expected_questions(self):
+        paper = build_paper(selection=4, big=2, sub_questions=3)
+        questions = DocumentParser._parse_docx(io.BytesIO(paper), "sub_question")
+        # Selection questions stay whole, big questions split into their sub-questions
+        self.assertEqual(len(questions), 4 + 2 * 3)
+
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 51.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertIsNone(percentile([], 95))
+
+    @unittest.skipUnless(os.path.isdir("/proc"), "needs /proc")
+    def test_peak_rss_of_own_process(self):
+        self.assertGreater(peak_rss_mb(os.getpid()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
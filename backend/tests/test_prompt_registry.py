@@ -0,0 +1,69 @@
+import os
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from backend.services import prompts
+from backend.services.prompts import PromptRegistry
+from backend.services.llm import LLMService
+
+
+class TestPromptRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "for_API.md")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("  评分标准 v1\n")
+        self.patcher = patch("backend.services.prompts.get_standards_path", return_value=self.path)
+        self.patcher.start()
+        self.registry = PromptRegistry()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tmpdir.cleanup()
+
+    def test_system_message_is_byte_stable(self):
+        m1 = self.registry.build_messages("题目一", "question_analysis")
+        m2 = self.registry.build_messages("   另一道很长的题目\n", "question_analysis")
+        self.assertEqual(m1[0]["content"], m2[0]["content"])
+        self.assertIn("评分标准 v1", m1[0]["content"])
+        self.assertNotIn("题目一", m1[0]["content"])
+        self.assertIn("题目一", m1[1]["content"])
+
+    def test_file_read_once_and_reloaded_on_mtime_change(self):
+        v1 = self.registry.version("question_analysis")
+        with patch("builtins.open", side_effect=AssertionError("should not re-read")):
+            self.assertEqual(self.registry.version("question_analysis"), v1)
+
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("评分标准 v2\n")
+        os.utime(self.path, (time.time() + 10, time.time() + 10))
+        with patch.object(prompts, "MTIME_CHECK_INTERVAL", 0):
+            v2 = self.registry.version("question_analysis")
+        self.assertNotEqual(v1, v2)
+
+    def test_usage_totals(self):
+        self.registry.record_usage("question_analysis", {"prompt_tokens": 100, "cached_tokens": 80, "completion_tokens": 10})
+        stats = self.registry.stats()["usage"]["question_analysis"]
+        self.assertEqual(stats["cached_ratio"], 0.8)
+
+
+class TestUsageExtraction(unittest.TestCase):
+    def test_openai_style(self):
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5, prompt_tokens_details=SimpleNamespace(cached_tokens=8))
+        self.assertEqual(LLMService._extract_usage(usage)["cached_tokens"], 8)
+
+    def test_deepseek_style(self):
+        usage = {"prompt_tokens": 10, "completion_tokens": 5, "prompt_cache_hit_tokens": 6}
+        self.assertEqual(LLMService._extract_usage(usage)["cached_tokens"], 6)
+
+    def test_stream_options_requested(self):
+        kwargs = LLMService("deepseek", "k")._build_request_kwargs("Q")
+        self.assertEqual(kwargs["stream_options"], {"include_usage": True})
+        self.assertEqual(kwargs["messages"][0]["role"], "system")
+
+
+if __name__ == '__main__':
+    unittest.main()
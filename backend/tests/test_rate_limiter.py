@@ -0,0 +1,142 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from backend.services.llm import LLMService
+from backend.services.rate_limiter import AdaptiveRateLimiter, RateLimiterTimeout, limiter_key, is_overload_error
+from backend.tests.helpers import make_chunk
+
+
+class FakeStatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def limiter_settings(**overrides):
+    values = {
+        "LLM_LIMITER_ENABLED": True,
+        "LLM_LIMITER_INITIAL_CONCURRENCY": 4,
+        "LLM_LIMITER_MIN_CONCURRENCY": 1,
+        "LLM_LIMITER_MAX_CONCURRENCY": 8,
+        "LLM_LIMITER_RPM": "",
+        "LLM_LIMITER_TPM": "",
+        "LLM_LIMITER_LEASE_TTL": 1900,
+        "LLM_LIMITER_ACQUIRE_TIMEOUT": 5,
+        "LLM_LIMITER_DECREASE_COOLDOWN": 0,
+    }
+    values.update(overrides)
+    return [patch(f"backend.services.rate_limiter.settings.{k}", v) for k, v in values.items()]
+
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.patchers = limiter_settings()
+        for p in self.patchers:
+            p.start()
+        self.limiter = AdaptiveRateLimiter(redis_getter=lambda: None)
+        self.key = limiter_key("deepseek", "k")
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+
+    def window(self):
+        return self.limiter.stats()["limiters"][self.key]["window"]
+
+    def test_key_hash_hides_api_key(self):
+        self.assertNotIn("secret", limiter_key("deepseek", "secret"))
+
+    def test_window_bounds_concurrency(self):
+        leases = [self.limiter.acquire("deepseek", "k") for _ in range(4)]
+        with self.assertRaises(RateLimiterTimeout):
+            self.limiter.acquire("deepseek", "k", timeout=0.1)
+        self.limiter.release(leases[0])
+        self.assertIsNotNone(self.limiter.acquire("deepseek", "k", timeout=0.1))
+
+    def test_aimd_halves_on_overload_and_grows_on_success(self):
+        self.limiter.release(self.limiter.acquire("deepseek", "k"), overloaded=True)
+        self.assertEqual(self.window(), 2)
+        self.limiter.release(self.limiter.acquire("deepseek", "k"), overloaded=True)
+        self.limiter.release(self.limiter.acquire("deepseek", "k"), overloaded=True)
+        self.assertEqual(self.window(), 1)
+        for _ in range(3):
+            self.limiter.release(self.limiter.acquire("deepseek", "k"))
+        self.assertGreater(self.window(), 2)
+
+    def test_cancelled_requests_leave_the_window_alone(self):
+        for _ in range(3):
+            self.limiter.release(self.limiter.acquire("deepseek", "k"), cancelled=True)
+        self.assertEqual(self.window(), 4)
+        stats = self.limiter.stats()["limiters"][self.key]
+        self.assertEqual((stats["cancelled"], stats["successes"], stats["in_flight"]), (3, 0, 0))
+
+    def test_waiter_resumes_after_release(self):
+        with patch("backend.services.rate_limiter.settings.LLM_LIMITER_INITIAL_CONCURRENCY", 1):
+            limiter = AdaptiveRateLimiter(redis_getter=lambda: None)
+            lease = limiter.acquire("qwen", "k")
+            threading.Timer(0.2, limiter.release, args=(lease,)).start()
+            self.assertIsNotNone(limiter.acquire("qwen", "k", timeout=2))
+            stats = limiter.stats()["limiters"][limiter_key("qwen", "k")]
+            self.assertGreater(stats["max_wait_seconds"], 0.1)
+
+    def test_rpm_limit(self):
+        with patch("backend.services.rate_limiter.settings.LLM_LIMITER_RPM", "deepseek:2"):
+            for _ in range(2):
+                self.limiter.release(self.limiter.acquire("deepseek", "k"))
+            with self.assertRaises(RateLimiterTimeout):
+                self.limiter.acquire("deepseek", "k", timeout=0.1)
+        self.assertGreater(self.limiter.stats()["limiters"][self.key]["rpm_throttled"], 0)
+
+    def test_async_acquire(self):
+        async def run():
+            lease = await self.limiter.acquire_async("deepseek", "k")
+            self.limiter.release(lease)
+        asyncio.run(run())
+        self.assertEqual(self.limiter.stats()["limiters"][self.key]["successes"], 1)
+
+
+class TestLLMServiceRetry(unittest.TestCase):
+    def test_429_is_retried_and_reported(self):
+        text = json.dumps({"comprehensive_rating": {"final_level": "L2", "average_score": 2.0}, "markdown_report": "ok"})
+        chunk = make_chunk(text)
+        service = LLMService("deepseek", "dummy_key")
+        service.client = MagicMock()
+        service.client.chat.completions.create.side_effect = [FakeStatusError(429), iter([chunk])]
+
+        with patch("backend.services.llm.rate_limiter") as limiter, \
+             patch("backend.services.llm.settings.LLM_LIMITER_ENABLED", True), \
+             patch("backend.services.llm.time.sleep"):
+            result = service.analyze_question("Q")
+
+        self.assertEqual(result["final_level"], "L2")
+        self.assertEqual(limiter.acquire.call_count, 2)
+        self.assertTrue(limiter.release.call_args_list[0].kwargs["overloaded"])
+
+    def test_hedge_loser_is_neither_a_success_nor_an_error(self):
+        chunk = make_chunk("{")
+        service = LLMService("deepseek", "dummy_key")
+        service.client = MagicMock()
+        service.client.chat.completions.create.return_value = iter([chunk, chunk])
+        service.should_cancel = lambda: True
+
+        with patch("backend.services.llm.rate_limiter") as limiter, \
+             patch("backend.services.llm.telemetry") as telemetry, \
+             patch("backend.services.llm.settings.LLM_LIMITER_ENABLED", True):
+            service.analyze_question("Q")
+
+        limiter.release.assert_called_once_with(limiter.acquire.return_value, cancelled=True)
+        telemetry.count_error.assert_not_called()
+        self.assertEqual(service.client.chat.completions.create.call_count, 1)
+
+    def test_overload_detection(self):
+        self.assertTrue(is_overload_error(FakeStatusError(503)))
+        self.assertFalse(is_overload_error(FakeStatusError(401)))
+        self.assertFalse(is_overload_error(ValueError("x")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import datetime
+import json
+import unittest
+from unittest.mock import patch
+
+from kombu.serialization import dumps as kombu_dumps, loads as kombu_loads, prepare_accept_content
+
+from backend.celery_app import celery_app
+from backend.services import serialization
+from backend.services.serialization import SERIALIZER_NAME, CONTENT_TYPE, ZLIB_MARKER, dumps, loads
+
+
+REPORT = {"final_level": "L3", "markdown_report": "**综合评级：L3**\n\n" + "模拟分析内容。" * 200}
+
+
+class TestCompactSerializer(unittest.TestCase):
+    def test_small_payload_is_plain_compact_json(self):
+        data = dumps({"status": "SUCCESS", "level": "水平3"})
+        self.assertEqual(data, '{"status":"SUCCESS","level":"水平3"}'.encode("utf-8"))
+        self.assertEqual(json.loads(data), {"status": "SUCCESS", "level": "水平3"})
+
+    def test_large_payload_is_compressed(self):
+        data = dumps(REPORT)
+        self.assertTrue(data.startswith(ZLIB_MARKER))
+        self.assertLess(len(data), len(json.dumps(REPORT)) / 5)
+        self.assertEqual(loads(data), REPORT)
+
+    def test_kombu_types_survive_a_round_trip(self):
+        value = {"date_done": datetime.datetime(2024, 5, 1, 8, 30), "raw": b"\x00\x01", 1: "int key"}
+        self.assertEqual(loads(dumps(value)), {"date_done": value["date_done"], "raw": b"\x00\x01", "1": "int key"})
+
+    def test_without_orjson(self):
+        with patch.object(serialization, "orjson", None):
+            data = dumps(REPORT)
+            self.assertEqual(loads(data), REPORT)
+        self.assertEqual(loads(data), REPORT)
+
+    def test_threshold_setting(self):
+        with patch("backend.services.serialization.settings.CELERY_COMPRESSION_THRESHOLD", 0):
+            self.assertFalse(dumps(REPORT).startswith(ZLIB_MARKER))
+
+
+class TestCeleryIntegration(unittest.TestCase):
+    def test_messages_and_results_use_the_compact_serializer(self):
+        conf = celery_app.conf
+        self.assertEqual((conf.task_serializer, conf.result_serializer), (SERIALIZER_NAME, SERIALIZER_NAME))
+        self.assertIn("json", conf.accept_content)
+        content_type, encoding, body = kombu_dumps([[{"id": "q1"}, {"provider": "deepseek"}], {}, {}], serializer=SERIALIZER_NAME)
+        self.assertEqual((content_type, encoding), (CONTENT_TYPE, "binary"))
+        self.assertEqual(kombu_loads(body, content_type, encoding, accept=prepare_accept_content(conf.accept_content))[0][0]["id"], "q1")
+
+    def test_result_backend_reads_results_stored_as_json(self):
+        backend = celery_app.backend
+        meta = {"status": "SUCCESS", "result": REPORT, "task_id": "t1"}
+        self.assertEqual(backend.decode_result(backend.encode(meta))["result"], REPORT)
+        legacy = json.dumps(meta).encode("utf-8")
+        self.assertEqual(backend.decode_result(legacy)["result"], REPORT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from backend.services.llm import TaskCancelled
+from backend.services.single_flight import SingleFlight, REFRESH_SCRIPT, RELEASE_SCRIPT
+
+
+class FakeRedis:
+    """The few commands the single-flight lock uses, shared between "workers"."""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def set(self, key, value, nx=False, px=None, ex=None):
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value.encode("utf-8") if isinstance(value, str) else value
+            return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, *keys):
+        with self.lock:
+            return [self.data.get(k) for k in keys]
+
+    def register_script(self, source):
+        def run(keys, args, client=None):
+            with self.lock:
+                if self.data.get(keys[0]) != str(args[0]).encode("utf-8"):
+                    return 0
+                if source == RELEASE_SCRIPT:
+                    del self.data[keys[0]]
+                return 1
+        assert source in (REFRESH_SCRIPT, RELEASE_SCRIPT)
+        return run
+
+
+def slow_call(calls, result, delay=0.2):
+    def fn():
+        calls.append(1)
+        time.sleep(delay)
+        return dict(result() if callable(result) else result)
+    return fn
+
+
+def run_threads(targets):
+    outputs = [None] * len(targets)
+
+    def runner(i, target):
+        outputs[i] = target()
+
+    threads = [threading.Thread(target=runner, args=(i, t)) for i, t in enumerate(targets)]
+    for i, t in enumerate(threads):
+        t.start()
+        if i == 0:
+            time.sleep(0.05)  # let the first caller become the leader
+    for t in threads:
+        t.join()
+    return outputs
+
+
+class TestLocalCoalescing(unittest.TestCase):
+    def test_concurrent_duplicates_share_one_call(self):
+        flight = SingleFlight(poll_interval=0.01, redis_getter=lambda: None)
+        calls = []
+        fn = slow_call(calls, {"final_level": "L2"})
+        outputs = run_threads([lambda: flight.run("k", fn)] * 5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in outputs), [False, True, True, True, True])
+        # Every caller gets its own copy
+        outputs[1][0]["elapsed_time"] = 1
+        self.assertNotIn("elapsed_time", outputs[2][0])
+        self.assertEqual((flight.counters["leaders"], flight.counters["shared_local"]), (1, 4))
+
+    def test_failed_leader_is_replaced_by_a_follower(self):
+        flight = SingleFlight(poll_interval=0.01, redis_getter=lambda: None)
+        calls = []
+        results = iter([{"error": "invalid key"}, {"final_level": "L3"}])
+        fn = slow_call(calls, lambda: next(results))
+        outputs = run_threads([lambda: flight.run("k", fn, shareable=lambda r: "error" not in r)] * 3)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(outputs[0][0], {"error": "invalid key"})
+        self.assertEqual([o[0] for o in outputs[1:]], [{"final_level": "L3"}] * 2)
+        self.assertEqual(flight.counters["takeovers"], 2)
+
+    def test_asyncio_callers_share_one_call(self):
+        flight = SingleFlight(poll_interval=0.01, redis_getter=lambda: None)
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"final_level": "L1"}
+
+        async def scenario():
+            return await asyncio.gather(*(flight.run_async("k", fn) for _ in range(4)))
+
+        outputs = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([shared for _, shared in outputs], [False, True, True, True])
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+
+class TestRedisHandoff(unittest.TestCase):
+    def test_result_is_handed_to_another_worker(self):
+        client = FakeRedis()
+        worker_a = SingleFlight(poll_interval=0.01, redis_getter=lambda: client)
+        worker_b = SingleFlight(poll_interval=0.01, redis_getter=lambda: client)
+        calls = []
+        fn = slow_call(calls, {"final_level": "L2"})
+        outputs = run_threads([lambda: worker_a.run("k", fn), lambda: worker_b.run("k", fn)])
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outputs, [({"final_level": "L2"}, False), ({"final_level": "L2"}, True)])
+        self.assertEqual(worker_b.counters["shared_redis"], 1)
+        # Lock released; the handoff key stays only for RESULT_TTL
+        self.assertFalse([k for k in client.data if ":lock:" in k])
+
+    def test_waiting_follower_can_be_stopped(self):
+        client = FakeRedis()
+        client.set("single-flight:lock:k", "other-worker")
+        flight = SingleFlight(poll_interval=0.01, redis_getter=lambda: client)
+        stopped = iter([False, False, True])
+
+        def on_wait():
+            if next(stopped):
+                raise TaskCancelled("stopped")
+
+        calls = []
+        with self.assertRaises(TaskCancelled):
+            flight.run("k", slow_call(calls, {}), on_wait=on_wait)
+        self.assertEqual(calls, [])
+
+    def test_redis_error_calls_the_provider_directly(self):
+        class Broken(FakeRedis):
+            def set(self, *args, **kwargs):
+                raise ConnectionError("down")
+
+        flight = SingleFlight(redis_getter=lambda: Broken())
+        with patch("backend.services.single_flight.mark_redis_failed") as failed:
+            self.assertEqual(flight.run("k", lambda: {"final_level": "L1"}), ({"final_level": "L1"}, False))
+        failed.assert_called_once()
+
+
+class TestAnalysisIntegration(unittest.TestCase):
+    def test_duplicate_questions_call_the_model_once(self):
+        from backend.tasks import analysis
+
+        calls = []
+
+        async def fake_analyze(llm_service, content, config):
+            calls.append(content)
+            await asyncio.sleep(0.05)
+            return {"final_level": "L2", "markdown_report": "ok"}
+
+        config = {"provider": "deepseek", "api_key": "k", "bypass_cache": True}
+
+        async def scenario():
+            return await asyncio.gather(*(
+                analysis.perform_single_model_analysis_async({"id": f"q{i}", "content": "同一道题"}, config)
+                for i in range(3)
+            ))
+
+        with patch.object(analysis, "_analyze_with_hedge_async", fake_analyze), \
+             patch.object(analysis, "single_flight", SingleFlight(poll_interval=0.01, redis_getter=lambda: None)):
+            results = asyncio.run(scenario())
+        self.assertEqual(calls, ["同一道题"])
+        self.assertEqual([bool(r["result"].get("coalesced")) for r in results], [False, True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
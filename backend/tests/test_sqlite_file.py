@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+
+from backend.services.sqlite_file import SQLiteFile, default_sqlite_path
+
+SCHEMA = ["CREATE TABLE IF NOT EXISTS items (key TEXT PRIMARY KEY, value TEXT NOT NULL)"]
+
+
+class TestSQLiteFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "nested", "items.sqlite3")
+
+    def test_directory_and_schema_created_on_first_use(self):
+        db = SQLiteFile(self.path, SCHEMA, "Test")
+        self.assertFalse(os.path.exists(self.path))
+        db.run(lambda conn: conn.execute("INSERT INTO items VALUES (?, ?)", ("a", "1")))
+        # Committed: visible to a new instance (as after a restart)
+        reopened = SQLiteFile(self.path, SCHEMA, "Test")
+        self.assertEqual(reopened.run(lambda conn: conn.execute("SELECT value FROM items").fetchall(), action="read"), [("1",)])
+
+    def test_failure_returns_the_default(self):
+        db = SQLiteFile(self.path, SCHEMA, "Test")
+        with self.assertLogs("backend.services.sqlite_file", level="WARNING") as logs:
+            self.assertEqual(db.run(lambda conn: conn.execute("SELECT * FROM missing"), default=[], action="read"), [])
+        self.assertIn("Test SQLite read failed", logs.output[0])
+
+    def test_default_path(self):
+        self.assertEqual(default_sqlite_path("/tmp/x.sqlite3", "cache", "c.sqlite3"), "/tmp/x.sqlite3")
+
+
+if __name__ == '__main__':
+    unittest.main()
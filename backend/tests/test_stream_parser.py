@@ -0,0 +1,141 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from backend.services.llm import LLMService
+from backend.services.stream_parser import StreamingJSONParser, MAX_PREAMBLE_CHARS, stitch_continuation
+
+
+DOCUMENT = {
+    "meta": {"knowledge_topic": "氧化还原", "notes": "含 \"引号\" 和 {括号}"},
+    "dimensions": [{"name": "A", "score": 3}, {"name": "B", "score": 4}],
+    "comprehensive_rating": {"average_score": 3.4, "final_level": "L3"},
+    "markdown_report": "**报告**\n第二行",
+}
+
+
+def feed_in_pieces(parser, text, size=7):
+    for i in range(0, len(text), size):
+        parser.feed(text[i:i + size])
+
+
+class TestStreamingJSONParser(unittest.TestCase):
+    def test_document_located_inside_code_fence(self):
+        text = "好的，分析如下：\n```json\n" + json.dumps(DOCUMENT, ensure_ascii=False) + "\n```\n"
+        parser = StreamingJSONParser()
+        feed_in_pieces(parser, text)
+        self.assertTrue(parser.complete)
+        self.assertEqual(parser.loads(), DOCUMENT)
+
+    def test_final_level_reported_before_stream_ends(self):
+        seen = []
+        parser = StreamingJSONParser(on_value=lambda path, value: seen.append((path, value, parser.complete)))
+        text = json.dumps(DOCUMENT, ensure_ascii=False)
+        feed_in_pieces(parser, text, size=3)
+        self.assertIn((("comprehensive_rating", "final_level"), "L3", False), seen)
+        self.assertEqual(parser.values[("comprehensive_rating", "average_score")], 3.4)
+
+    def test_truncated_reply(self):
+        text = json.dumps(DOCUMENT, ensure_ascii=False)
+        parser = StreamingJSONParser()
+        feed_in_pieces(parser, text[:-20])
+        self.assertTrue(parser.truncated)
+        self.assertTrue(parser.json_text().startswith("{"))
+
+    def test_mismatched_bracket_is_an_error(self):
+        parser = StreamingJSONParser()
+        parser.feed('{"a": [1, 2}')
+        self.assertIsNotNone(parser.error)
+
+    def test_reply_without_json(self):
+        parser = StreamingJSONParser()
+        parser.feed("抱歉，" * MAX_PREAMBLE_CHARS)
+        self.assertIsNotNone(parser.error)
+
+    def test_literal_newlines_in_strings(self):
+        parser = StreamingJSONParser()
+        parser.feed('{"comprehensive_rating": {"final_level": "L2"}, "markdown_report": "第一行\n第二行"}')
+        self.assertEqual(parser.loads()["markdown_report"], "第一行\n第二行")
+
+
+class TestMalformedStreamAbort(unittest.TestCase):
+    def make_chunk(self, text):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+    def test_broken_stream_is_aborted_and_retried(self):
+        good = json.dumps(DOCUMENT, ensure_ascii=False)
+        consumed = []
+
+        def broken():
+            for piece in ['{"meta": [1, 2}', "never", "read"]:
+                consumed.append(piece)
+                yield self.make_chunk(piece)
+
+        service = LLMService("deepseek", "dummy_key")
+        service.client = MagicMock()
+        service.client.chat.completions.create.side_effect = [broken(), iter([self.make_chunk(good)])]
+
+        with patch("backend.services.llm.settings.LLM_LIMITER_ENABLED", True), \
+             patch("backend.services.llm.time.sleep"):
+            result = service.analyze_question("Q")
+
+        self.assertEqual(consumed, ['{"meta": [1, 2}'])
+        self.assertEqual(result["final_level"], "L3")
+
+
+class TestContinuation(unittest.TestCase):
+    def make_chunk(self, text, finish_reason=None):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text), finish_reason=finish_reason)])
+
+    def test_stitch_drops_fence_and_repeated_tail(self):
+        reply = '{"markdown_report": "第一段内容，第二段'
+        self.assertEqual(stitch_continuation(reply, '内容"}'), '内容"}')
+        self.assertEqual(stitch_continuation(reply, '```json\n内容"}'), '内容"}')
+        self.assertEqual(stitch_continuation(reply, '第一段内容，第二段内容"}'), '内容"}')
+
+    def test_stitch_rejects_restarted_document(self):
+        reply = '{"meta": {"knowledge_topic": "氧化还原", "notes": "较长的说明'
+        self.assertIsNone(stitch_continuation(reply, '{"meta": {"knowledge_topic": "电化学"}}'))
+        # Repeating the whole reply before going on is overlap, not a restart
+        self.assertEqual(stitch_continuation(reply, reply + '"}}'), '"}}')
+
+    def test_length_cut_reply_is_continued_not_regenerated(self):
+        good = json.dumps(DOCUMENT, ensure_ascii=False)
+        cut = len(good) // 2
+        service = LLMService("deepseek", "dummy_key")
+        service.client = MagicMock()
+        service.client.chat.completions.create.side_effect = [
+            iter([self.make_chunk(good[:cut]), self.make_chunk(None, "length")]),
+            iter([self.make_chunk(good[cut - 10:]), self.make_chunk(None, "stop")]),
+        ]
+
+        with patch("backend.services.llm.telemetry.count_continuation") as count:
+            result = service.analyze_question("Q")
+
+        self.assertEqual(result["final_level"], "L3")
+        self.assertEqual(result["markdown_report"], DOCUMENT["markdown_report"])
+        continuation = service.client.chat.completions.create.call_args_list[1].kwargs
+        self.assertEqual(continuation["messages"][-2], {"role": "assistant", "content": good[:cut]})
+        self.assertNotIn("response_format", continuation)
+        count.assert_called_once_with("deepseek", "deepseek-chat", "completed")
+
+    def test_continuation_rounds_are_bounded(self):
+        good = json.dumps(DOCUMENT, ensure_ascii=False)
+        service = LLMService("deepseek", "dummy_key")
+        service.client = MagicMock()
+        service.client.chat.completions.create.side_effect = [
+            iter([self.make_chunk(good[:40]), self.make_chunk(None, "length")]),
+            iter([self.make_chunk(good[40:60]), self.make_chunk(None, "length")]),
+        ]
+
+        with patch("backend.services.llm.settings.LLM_MAX_CONTINUATIONS", 1), \
+             patch("backend.services.llm.telemetry.count_continuation") as count:
+            service.analyze_question("Q")
+
+        self.assertEqual(service.client.chat.completions.create.call_count, 2)
+        count.assert_called_once_with("deepseek", "deepseek-chat", "truncated")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import asyncio
+import unittest
+from unittest.mock import patch, MagicMock
+
+from fastapi.testclient import TestClient
+
+from backend.celery_app import celery_app
+from backend.main import app
+from backend.services.client_pool import PrioritySemaphore
+from backend.services.rate_limiter import AdaptiveRateLimiter
+from backend.services.task_queues import (
+    QUEUE_INTERACTIVE, QUEUE_SCORE, QUEUE_BULK, QUEUE_PRIORITIES, config_priority,
+)
+from backend.tasks.analysis import _build_llm_service
+from backend.tasks.score import _build_score_llm
+
+
+class TestCeleryRouting(unittest.TestCase):
+    def route(self, name, **options):
+        route = celery_app.amqp.router.route(options, name, args=(), kwargs={})
+        return route["queue"].name, route["queue"].routing_key, route["priority"]
+
+    def test_bulk_and_score_tasks_get_their_own_queues(self):
+        self.assertEqual(self.route("backend.tasks.analysis.analyze_single_model_task"), (QUEUE_BULK, QUEUE_BULK, 2))
+        self.assertEqual(self.route("backend.tasks.analysis.analyze_batch_task"), (QUEUE_BULK, QUEUE_BULK, 2))
+        self.assertEqual(self.route("backend.tasks.score.analyze_score_task"), (QUEUE_SCORE, QUEUE_SCORE, 1))
+
+    def test_explicit_interactive_queue_wins(self):
+        route = self.route("backend.tasks.analysis.analyze_single_model_task",
+                           queue=QUEUE_INTERACTIVE, priority=QUEUE_PRIORITIES[QUEUE_INTERACTIVE])
+        self.assertEqual(route, (QUEUE_INTERACTIVE, QUEUE_INTERACTIVE, 0))
+
+    def test_retry_endpoint_dispatches_to_interactive_queue(self):
+        celery_task = MagicMock()
+        celery_task.apply_async.return_value = MagicMock(id="celery-1")
+        with patch("backend.api.endpoints.analysis.analyze_single_model_task", celery_task), \
+             patch.dict("os.environ", {"RUNNING_DESKTOP": "false"}):
+            response = TestClient(app).post("/api/analyze/retry", json={
+                "question": {"id": "q1", "content": "x"},
+                "config": {"provider": "deepseek", "api_key": "k"},
+            })
+        self.assertEqual(response.json()["task_id"], "celery-1")
+        kwargs = celery_task.apply_async.call_args.kwargs
+        self.assertEqual((kwargs["queue"], kwargs["priority"]), (QUEUE_INTERACTIVE, 0))
+        self.assertEqual(kwargs["args"][1]["queue"], QUEUE_INTERACTIVE)
+
+
+class TestInProcessPriority(unittest.TestCase):
+    def test_services_take_priority_from_config(self):
+        self.assertEqual(_build_llm_service({"provider": "deepseek", "api_key": "k"}).priority, QUEUE_PRIORITIES[QUEUE_BULK])
+        retry = _build_llm_service({"provider": "deepseek", "api_key": "k", "queue": QUEUE_INTERACTIVE})
+        self.assertEqual(retry.priority, QUEUE_PRIORITIES[QUEUE_INTERACTIVE])
+        self.assertEqual(_build_score_llm({"api_key": "k"}).priority, QUEUE_PRIORITIES[QUEUE_SCORE])
+        self.assertEqual(config_priority({"queue": "unknown"}), QUEUE_PRIORITIES[QUEUE_BULK])
+
+    def test_semaphore_wakes_most_urgent_waiter_first(self):
+        async def scenario():
+            sem = PrioritySemaphore(1)
+            order = []
+            await sem.acquire()
+
+            async def worker(name, priority):
+                async with sem.slot(priority):
+                    order.append(name)
+
+            tasks = [asyncio.ensure_future(worker(name, p)) for name, p in
+                     (("bulk-1", 2), ("bulk-2", 2), ("score", 1), ("retry", 0))]
+            await asyncio.sleep(0)
+            self.assertEqual(sem.waiting, 4)
+            sem.release()
+            await asyncio.gather(*tasks)
+            return order
+
+        self.assertEqual(asyncio.run(scenario()), ["retry", "score", "bulk-1", "bulk-2"])
+
+    def test_cancelled_waiter_does_not_leak_a_slot(self):
+        async def scenario():
+            sem = PrioritySemaphore(1)
+            await sem.acquire()
+            waiter = asyncio.ensure_future(sem.acquire(0))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            sem.release()
+            return sem.waiting, sem.locked()
+
+        self.assertEqual(asyncio.run(scenario()), (0, False))
+
+    def test_release_between_cancel_and_wake_up(self):
+        async def scenario():
+            sem = PrioritySemaphore(1)
+            await sem.acquire()
+            waiter = asyncio.ensure_future(sem.acquire(0))
+            await asyncio.sleep(0)
+            # The entry is popped (and skipped) by release() before the waiter handles its cancellation
+            waiter.cancel()
+            sem.release()
+            results = await asyncio.gather(waiter, return_exceptions=True)
+            return type(results[0]), sem.waiting, sem.locked()
+
+        self.assertEqual(asyncio.run(scenario()), (asyncio.CancelledError, 0, False))
+
+    def test_slot_granted_before_the_cancellation_is_passed_on(self):
+        async def scenario():
+            sem = PrioritySemaphore(1)
+            await sem.acquire()
+            waiter = asyncio.ensure_future(sem.acquire(0))
+            await asyncio.sleep(0)
+            sem.release()
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            return waiter.cancelled(), sem.locked()
+
+        self.assertEqual(asyncio.run(scenario()), (True, False))
+
+    def test_limiter_leaves_free_slots_to_more_urgent_waiters(self):
+        patchers = [patch(f"backend.services.rate_limiter.settings.{k}", v) for k, v in {
+            "LLM_LIMITER_ENABLED": True, "LLM_LIMITER_INITIAL_CONCURRENCY": 1, "LLM_LIMITER_MIN_CONCURRENCY": 1,
+            "LLM_LIMITER_MAX_CONCURRENCY": 1, "LLM_LIMITER_RPM": "", "LLM_LIMITER_LEASE_TTL": 1900,
+            "LLM_LIMITER_ACQUIRE_TIMEOUT": 5, "LLM_LIMITER_DECREASE_COOLDOWN": 0,
+        }.items()]
+        for p in patchers:
+            p.start()
+        self.addCleanup(lambda: [p.stop() for p in patchers])
+        limiter = AdaptiveRateLimiter(redis_getter=lambda: None)
+
+        async def scenario():
+            order = []
+            held = await limiter.acquire_async("deepseek", "k")
+
+            async def request(name, priority):
+                lease = await limiter.acquire_async("deepseek", "k", priority=priority)
+                order.append(name)
+                await asyncio.sleep(0.01)
+                limiter.release(lease)
+
+            bulk = asyncio.ensure_future(request("bulk", 2))
+            await asyncio.sleep(0.02)
+            retry = asyncio.ensure_future(request("retry", 0))
+            await asyncio.sleep(0.02)
+            limiter.release(held)
+            await asyncio.gather(bulk, retry)
+            return order
+
+        self.assertEqual(asyncio.run(scenario()), ["retry", "bulk"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+
+from celery import states
+
+from backend.services.task_status import bulk_task_status, StatusCoalescer
+
+
+class FakeBackend:
+    """Key-value result backend returning already encoded metadata."""
+
+    def __init__(self, metas):
+        self.metas = metas
+        self.mget_calls = []
+
+    def get_key_for_task(self, task_id):
+        return f"celery-task-meta-{task_id}".encode()
+
+    def mget(self, keys):
+        self.mget_calls.append(keys)
+        return [self.metas.get(k.decode()[len("celery-task-meta-"):]) for k in keys]
+
+    def decode_result(self, payload):
+        return payload
+
+
+class TestBulkTaskStatus(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeBackend({
+            "t1": {"status": states.SUCCESS, "result": {"model_label": "A", "result": {"final_level": "L2"}}},
+            "t2": {"status": states.STARTED, "result": None},
+            "t3": {"status": states.FAILURE, "result": ValueError("boom")},
+        })
+        self.app = MagicMock(backend=self.backend)
+
+    def test_one_mget_for_all_ids(self):
+        results = bulk_task_status(self.app, ["t1", "t2", "t3", "t4"])
+        self.assertEqual(len(self.backend.mget_calls), 1)
+        self.assertEqual(results["t1"]["result"]["result"]["final_level"], "L2")
+        self.assertEqual(results["t2"], {"task_id": "t2", "status": states.STARTED})
+        self.assertEqual(results["t3"]["status"], states.FAILURE)
+        self.assertEqual(results["t3"]["error"], "boom")
+        self.assertEqual(results["t4"], {"task_id": "t4", "status": states.PENDING})
+
+    def test_concurrent_identical_polls_share_one_lookup(self):
+        coalescer = StatusCoalescer(ttl=5)
+
+        async def run():
+            first = await asyncio.gather(*(coalescer.get(self.app, ["t2", "t1"]) for _ in range(5)))
+            again = await coalescer.get(self.app, ["t1", "t2"])
+            other = await coalescer.get(self.app, ["t3"])
+            return first, again, other
+
+        first, again, other = asyncio.run(run())
+        self.assertEqual(len(self.backend.mget_calls), 2)
+        self.assertEqual(first[0], again)
+        self.assertEqual(other["t3"]["status"], states.FAILURE)
+        self.assertEqual(coalescer.stats()["hits"], 5)
+
+    def test_zero_ttl_disables_the_cache(self):
+        coalescer = StatusCoalescer(ttl=0)
+
+        async def run():
+            await coalescer.get(self.app, ["t1"])
+            await coalescer.get(self.app, ["t1"])
+
+        asyncio.run(run())
+        self.assertEqual(len(self.backend.mget_calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from backend.services.sqlite_file import write_executor
+from backend.services.task_store import TaskStore, INTERRUPTED_ERROR, strip_secrets
+
+
+class TestTaskStore(unittest.TestCase):
+    def test_lifecycle(self):
+        store = TaskStore()
+        store.create("t1")
+        self.assertEqual(store.get("t1"), {"status": "PENDING"})
+        self.assertTrue(store.set_status("t1", "PROCESSING"))
+        self.assertTrue(store.finish("t1", {"final_level": "L2"}))
+        self.assertEqual(store.get("t1"), {"status": "SUCCESS", "result": {"final_level": "L2"}})
+        self.assertIsNone(store.get("missing"))
+        self.assertFalse(store.set_status("missing", "PROCESSING"))
+
+    def test_only_finished_tasks_are_evicted(self):
+        store = TaskStore(max_entries=3)
+        store.create("running")
+        for i in range(4):
+            store.create(f"t{i}")
+            store.finish(f"t{i}", {"i": i})
+        self.assertIn("running", store)
+        self.assertNotIn("t0", store)
+        self.assertNotIn("t1", store)
+        self.assertIn("t3", store)
+        self.assertEqual(store.stats()["evictions"], 2)
+
+    def test_byte_limit_and_ttl(self):
+        store = TaskStore(max_bytes=100)
+        for i in range(3):
+            store.create(f"t{i}")
+            store.finish(f"t{i}", {"report": "x" * 40})
+        self.assertNotIn("t0", store)
+        self.assertLessEqual(store.stats()["bytes"], 100)
+
+        store = TaskStore(ttl=1)
+        store.create("old")
+        store.finish("old", {})
+        store._tasks["old"]["updated_at"] -= 5
+        store.create("new")
+        store.finish("new", {})
+        self.assertNotIn("old", store)
+        self.assertIn("new", store)
+
+    def test_stop_only_given_unfinished_tasks(self):
+        store = TaskStore()
+        store.create("a")
+        store.create("b")
+        store.create("other-user")
+        store.finish("b", {})
+        self.assertEqual(store.stop(["a", "b", "unknown"], "User stopped analysis"), 1)
+        self.assertEqual(store.get("a"), {"status": "REVOKED", "error": "User stopped analysis"})
+        self.assertEqual(store.get("b")["status"], "SUCCESS")
+        self.assertEqual(store.get("other-user")["status"], "PENDING")
+        # A stopped task that is started afterwards is not run
+        self.assertFalse(store.set_status("a", "PROCESSING"))
+
+    def test_strip_secrets(self):
+        spec = [{"id": 1}, {"provider": "deepseek", "api_key": "sk", "hedge_config": {"api_key": "sk2", "provider": "qwen"}}]
+        self.assertEqual(strip_secrets(spec), [{"id": 1}, {"provider": "deepseek", "hedge_config": {"provider": "qwen"}}])
+
+
+class TestTaskStorePersistence(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "tasks.sqlite3")
+
+    def tearDown(self):
+        # Writes issued during restore() on the event loop may still be queued
+        write_executor.submit(lambda: None).result()
+        self.tmp.cleanup()
+
+    def test_finished_tasks_survive_restart_and_keys_are_not_written(self):
+        store = TaskStore(sqlite_path=self.path)
+        config = {"provider": "deepseek", "api_key": "sk-secret"}
+        store.create("done", "analysis_single", [{"id": 1}, config])
+        store.finish("done", {"model_label": "deepseek", "result": {"final_level": "L3"}})
+        store.create("running", "analysis_single", [{"id": 2}, config])
+
+        conn = sqlite3.connect(self.path)
+        dump = "\n".join(str(row) for row in conn.execute("SELECT * FROM tasks"))
+        conn.close()
+        self.assertNotIn("sk-secret", dump)
+
+        restarted = TaskStore(sqlite_path=self.path)
+        calls = []
+
+        async def runner(task_id, question, cfg):
+            calls.append(task_id)
+
+        restarted.register_runner("analysis_single", runner)
+
+        async def restore():
+            return restarted.restore()
+
+        self.assertEqual(asyncio.run(restore()), 0)
+        self.assertEqual(restarted.get("done")["result"]["result"]["final_level"], "L3")
+        # Without a persisted key the task cannot run again: reported so the user can retry
+        self.assertEqual(restarted.get("running"), {"status": "FAILURE", "error": INTERRUPTED_ERROR})
+        self.assertEqual(calls, [])
+
+    def test_unfinished_tasks_are_requeued_when_keys_are_persisted(self):
+        store = TaskStore(sqlite_path=self.path, persist_api_keys=True)
+        store.create("running", "analysis_single", [{"id": 2}, {"provider": "deepseek", "api_key": "sk"}])
+
+        restarted = TaskStore(sqlite_path=self.path, persist_api_keys=True)
+        calls = []
+
+        async def runner(task_id, question, config):
+            calls.append((task_id, question, config))
+            restarted.finish(task_id, {"ok": True})
+
+        restarted.register_runner("analysis_single", runner)
+
+        async def restore():
+            count = restarted.restore()
+            await asyncio.sleep(0)
+            return count
+
+        self.assertEqual(asyncio.run(restore()), 1)
+        self.assertEqual(calls, [("running", {"id": 2}, {"provider": "deepseek", "api_key": "sk"})])
+        self.assertEqual(restarted.get("running")["status"], "SUCCESS")
+
+    def test_evicted_tasks_are_read_back_from_disk(self):
+        store = TaskStore(max_entries=1, sqlite_path=self.path)
+        for i in range(3):
+            store.create(f"t{i}")
+            store.finish(f"t{i}", {"i": i})
+        self.assertEqual(store.get("t0")["result"], {"i": 0})
+        self.assertEqual(store.stats()["sqlite_hits"], 1)
+
+    def test_writes_on_the_event_loop_go_through_the_write_executor(self):
+        store = TaskStore(sqlite_path=self.path)
+        threads = []
+        run = store._sqlite.run
+
+        def tracked_run(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return run(*args, **kwargs)
+
+        async def finish():
+            store.create("t1")
+            store.finish("t1", {"final_level": "L2"})
+            await asyncio.get_running_loop().run_in_executor(write_executor, lambda: None)
+            return threading.current_thread()
+
+        with patch.object(store._sqlite, "run", tracked_run):
+            loop_thread = asyncio.run(finish())
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(loop_thread, threads)
+
+        restarted = TaskStore(sqlite_path=self.path)
+
+        async def restore():
+            return restarted.restore()
+
+        self.assertEqual(asyncio.run(restore()), 0)
+        self.assertEqual(restarted.get("t1")["result"], {"final_level": "L2"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+from fastapi.testclient import TestClient
+
+from backend.main import app
+from backend.services.llm import LLMService
+from backend.services.stream_parser import StreamingJSONParser
+from backend.services.telemetry import Telemetry
+from backend.tests.helpers import make_chunk
+
+
+class TestTelemetry(unittest.TestCase):
+    def setUp(self):
+        self.telemetry = Telemetry(redis_getter=lambda: None)
+
+    def test_stream_observation_rendered_as_histograms(self):
+        parser = StreamingJSONParser()
+        parser.request_started_at = 100.0
+        parser.first_chunk_at = 100.5
+        parser.last_chunk_at = 102.5
+        parser.chunk_count = 40
+        usage = {"prompt_tokens": 1000, "completion_tokens": 100, "cached_tokens": 800}
+
+        self.telemetry.observe_stream("deepseek", "deepseek-chat", parser, usage, queue_wait=0.2)
+        text = self.telemetry.render_prometheus()
+
+        labels = 'provider="deepseek",model="deepseek-chat"'
+        self.assertIn(f'llm_time_to_first_token_seconds_bucket{{{labels},le="0.5"}} 1', text)
+        self.assertIn(f'llm_time_to_first_token_seconds_bucket{{{labels},le="0.25"}} 0', text)
+        self.assertIn(f"llm_generation_seconds_sum{{{labels}}} 2", text)
+        # 100 completion tokens over 2 s
+        self.assertIn(f"llm_output_tokens_per_second_sum{{{labels}}} 50", text)
+        self.assertIn(f'llm_tokens_total{{{labels},type="cached"}} 800', text)
+        self.assertIn(f'llm_requests_total{{{labels},outcome="success"}} 1', text)
+        self.assertIn(f'llm_queue_wait_seconds_bucket{{{labels},le="+Inf"}} 1', text)
+
+
+class TestTelemetryIntegration(unittest.TestCase):
+    def test_analyze_question_records_timings(self):
+        text = json.dumps({"comprehensive_rating": {"final_level": "L2", "average_score": 2.0}, "markdown_report": "ok"})
+        chunk = make_chunk(text, usage=None)
+        service = LLMService("qwen", "dummy_key")
+        service.client = MagicMock()
+        service.client.chat.completions.create.return_value = iter([chunk])
+
+        local = Telemetry(redis_getter=lambda: None)
+        with patch("backend.services.llm.telemetry", local), \
+             patch("backend.services.telemetry.telemetry", local):
+            service.analyze_question("Q")
+        rendered = local.render_prometheus()
+        for name in ("llm_parse_seconds_count", "llm_grading_validation_seconds_count", "llm_time_to_first_token_seconds_count"):
+            self.assertIn(f'{name}{{provider="qwen",model="qwen-plus"}} 1', rendered)
+
+    def test_metrics_endpoint(self):
+        response = TestClient(app).get("/api/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("# TYPE llm_time_to_first_token_seconds histogram", response.text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import json
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+from backend.services.jobs import JobStore
+from backend.services.llm import LLMService
+from backend.services.rate_limiter import AdaptiveRateLimiter, RateLimiterTimeout, limiter_key
+from backend.services.token_budget import TokenEstimator, submission_estimate, project_completion
+from backend.tests.helpers import make_chunk
+from backend.tests.test_rate_limiter import limiter_settings
+
+
+class TestTpmBudget(unittest.TestCase):
+    def setUp(self):
+        self.patchers = limiter_settings(LLM_LIMITER_TPM="deepseek:1000")
+        for p in self.patchers:
+            p.start()
+        self.addCleanup(lambda: [p.stop() for p in self.patchers])
+        self.limiter = AdaptiveRateLimiter(redis_getter=lambda: None)
+        self.key = limiter_key("deepseek", "k")
+
+    def test_requests_wait_for_token_budget(self):
+        first = self.limiter.acquire("deepseek", "k", tokens=600)
+        with self.assertRaises(RateLimiterTimeout):
+            self.limiter.acquire("deepseek", "k", timeout=0.1, tokens=600)
+        # The reply was shorter than estimated: the difference is available again
+        self.limiter.release(first, tokens=300)
+        self.assertIsNotNone(self.limiter.acquire("deepseek", "k", timeout=0.1, tokens=600))
+
+        stats = self.limiter.stats()["limiters"][self.key]
+        self.assertGreater(stats["tpm_throttled"], 0)
+        self.assertEqual((stats["estimated_tokens"], stats["used_tokens"], stats["tokens_last_minute"]), (600, 300, 900))
+
+    def test_budget_slides_and_large_requests_run_alone(self):
+        with patch("backend.services.rate_limiter.TPM_WINDOW", 0.2):
+            self.limiter.acquire("deepseek", "k", tokens=5000)
+            with self.assertRaises(RateLimiterTimeout):
+                self.limiter.acquire("deepseek", "k", timeout=0.05, tokens=10)
+            time.sleep(0.25)
+            self.assertIsNotNone(self.limiter.acquire("deepseek", "k", timeout=0.1, tokens=900))
+
+    def test_other_providers_are_not_charged(self):
+        lease = self.limiter.acquire("qwen", "k", tokens=5000)
+        self.assertEqual(lease.tokens, 0)
+        self.assertIsNotNone(self.limiter.acquire("qwen", "k", timeout=0.1, tokens=5000))
+
+
+class TestTokenEstimator(unittest.TestCase):
+    def test_estimates_follow_content_and_history(self):
+        estimator = TokenEstimator(redis_getter=lambda: None)
+        short = estimator.estimate_task("deepseek", "1+1=?")
+        long = estimator.estimate_task("deepseek", "某工业流程" * 600)
+        self.assertGreater(long - short, 1500)
+
+        for completion in (1000, 1200, 1100):
+            used = estimator.observe("deepseek", "question_analysis", 3000, {"prompt_tokens": 1000, "completion_tokens": completion}, 0)
+        self.assertEqual(used, 2100)
+        self.assertEqual(estimator.chars_per_token("deepseek"), 3.0)
+        # Average plus a margin for the spread, capped by max_tokens
+        self.assertTrue(1100 < estimator.completion_tokens("question_analysis") < 1400)
+        self.assertEqual(estimator.completion_tokens("question_analysis", max_tokens=500), 500)
+
+    def test_usage_missing_is_estimated_from_text(self):
+        estimator = TokenEstimator(redis_getter=lambda: None)
+        self.assertEqual(estimator.observe("kimi", "question_analysis", 1500, None, 3000), 1001 + 2001)
+
+
+class TestProjection(unittest.TestCase):
+    def test_slowest_budget_decides(self):
+        estimate = {"a": {"provider": "deepseek", "tokens": 60000, "requests": 30},
+                    "b": {"provider": "qwen", "tokens": 10000, "requests": 30}}
+        with patch("backend.services.token_budget.settings.LLM_LIMITER_TPM", "deepseek:30000,qwen:100000"), \
+             patch("backend.services.token_budget.settings.LLM_LIMITER_RPM", "deepseek:10"):
+            full = project_completion(estimate, 60, 60, now=0)
+            half = project_completion(estimate, 30, 60, now=0)
+        # deepseek: max(60000 / 30000, 30 / 10) = 3 minutes
+        self.assertEqual(full, {"remaining_tokens": 70000, "eta_seconds": 180.0, "projected_completion_at": 180.0, "bottleneck": "deepseek"})
+        self.assertEqual(half["eta_seconds"], 90.0)
+        with patch("backend.services.token_budget.settings.LLM_LIMITER_TPM", ""):
+            self.assertIsNone(project_completion(estimate, 60, 60))
+
+    def test_job_reports_projection_without_keys(self):
+        store = JobStore(redis_getter=lambda: None)
+        estimator = TokenEstimator(redis_getter=lambda: None)
+        estimate = submission_estimate([("deepseek", "sk-secret", "题目"), ("deepseek", "sk-secret", "另一题")], estimator)
+        self.assertNotIn("sk-secret", json.dumps(estimate))
+        store.create("job", total=2, questions=2, estimate=estimate)
+        store.record("job", "t1", "SUCCESS", {"question_id": 1})
+        with patch("backend.services.token_budget.settings.LLM_LIMITER_TPM", "deepseek:1000"):
+            job = store.get("job")
+        self.assertEqual(job["projection"]["bottleneck"], "deepseek")
+        self.assertAlmostEqual(job["projection"]["remaining_tokens"], sum(e["tokens"] for e in estimate.values()) / 2, delta=1)
+
+
+class TestLLMServiceCharging(unittest.TestCase):
+    def test_estimate_is_charged_and_usage_reported(self):
+        text = json.dumps({"comprehensive_rating": {"final_level": "L2"}, "markdown_report": "ok"})
+        usage = SimpleNamespace(prompt_tokens=900, completion_tokens=400, prompt_tokens_details=None)
+        chunks = [make_chunk(text, usage=None),
+                  SimpleNamespace(choices=[], usage=usage)]
+        service = LLMService("deepseek", "dummy_key")
+        service.client = MagicMock()
+        service.client.chat.completions.create.return_value = iter(chunks)
+
+        with patch("backend.services.llm.rate_limiter") as limiter:
+            service.analyze_question("题目")
+        self.assertGreater(limiter.acquire.call_args.kwargs["tokens"], 1000)
+        limiter.release.assert_called_once_with(limiter.acquire.return_value, tokens=1300)
+
+
+if __name__ == '__main__':
+    unittest.main()
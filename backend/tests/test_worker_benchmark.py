@@ -0,0 +1,33 @@
+import unittest
+
+from backend.benchmarks.worker_benchmark import InFlight
+from backend.celery_app import celery_app
+from backend.config import settings
+
+
+class TestWorkerBenchmark(unittest.TestCase):
+    def test_in_flight_tracks_peak_and_durations(self):
+        tracker = InFlight()
+        tracker.start("a")
+        tracker.start("b")
+        tracker.finish("a")
+        tracker.start("c")
+        tracker.finish("b")
+        tracker.finish("c")
+        self.assertEqual((tracker.peak, tracker.active, len(tracker.durations)), (2, 0, 3))
+
+
+class TestIOWorkerConfig(unittest.TestCase):
+    def test_worker_runs_many_streams_and_acks_after_finishing(self):
+        conf = celery_app.conf
+        self.assertEqual(conf.worker_pool, "threads")
+        self.assertGreater(conf.worker_concurrency, 1)
+        self.assertEqual(conf.worker_prefetch_multiplier, 1)
+        self.assertTrue(conf.task_acks_late)
+        self.assertTrue(conf.task_reject_on_worker_lost)
+        # Re-delivery must not hit tasks that are still streaming
+        self.assertGreater(conf.broker_transport_options["visibility_timeout"], settings.LLM_LIMITER_LEASE_TTL)
+
+
+if __name__ == "__main__":
+    unittest.main()
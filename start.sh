@@ -4,8 +4,14 @@
 redis-server --daemonize yes
 
 # 2. 后台启动 Celery Worker (任务队列处理)
-# 使用 solo 模式以节省资源，适合云端小实例
-celery -A backend.celery_app worker --pool=solo --loglevel=info --concurrency=1 &
+# 分析任务几乎都在等待大模型的网络响应：使用线程池 (或 gevent) 让一个进程同时处理多路流式请求，
+# 而不是 solo 模式下一次只处理一道题。可通过 CELERY_WORKER_POOL / CELERY_WORKER_CONCURRENCY 调整
+POOL=${CELERY_WORKER_POOL:-threads}
+CONCURRENCY=${CELERY_WORKER_CONCURRENCY:-32}
+# 主 Worker 按 interactive > score > bulk 的顺序消费三个队列
+celery -A backend.celery_app worker --pool=$POOL --loglevel=info --concurrency=$CONCURRENCY -Q interactive,score,bulk -n main@%h &
+# 专用 Worker 只处理"重新分析"等交互任务，整卷分析排队时也能立即响应
+celery -A backend.celery_app worker --pool=$POOL --loglevel=info --concurrency=${CELERY_INTERACTIVE_CONCURRENCY:-4} -Q interactive -n interactive@%h &
 
 # 3. 启动 FastAPI 后端服务 (同时托管前端)
 # 监听所有 IP (0.0.0.0) 并使用指定端口